@@ -0,0 +1 @@
+# Servidor HTTP do Hubblet AI (alternativa ao app Streamlit para clientes concorrentes)
@@ -0,0 +1,414 @@
+# Servidor HTTP assíncrono em torno do grafo LangGraph
+#
+# Uso: python -m src.api.server [--host 0.0.0.0] [--port 8000]
+#      (ou uvicorn src.api.server:app)
+#
+# Rotas:
+#   POST /chat          pergunta -> resposta (grafo completo: memória, conhecimento, geração)
+#   POST /chat/stream   a mesma coisa em Server-Sent Events, pedaço a pedaço
+#   POST /search        busca na base de conhecimento global
+#   POST /upload        grava documentos em knowledge_sources/ e agenda a reindexação incremental
+#   GET  /upload/status andamento da reindexação
+#   GET  /health        requisições em andamento, rejeitadas e tamanho do índice
+#   GET  /metrics       latência por etapa no formato do Prometheus (com HUBBLET_TRACING=1)
+#
+# Autenticação: `Authorization: Bearer <token>`, com os tokens em
+# HUBBLET_API_KEYS ("token=usuario,token2=usuario2"). O user_id das memórias
+# vem do token, nunca do corpo da requisição. /upload e /upload/status mexem na
+# base de conhecimento global e exigem também o usuário em HUBBLET_ADMIN_USERS.
+# Sem tokens configurados, as rotas protegidas recusam tudo; /health e
+# /metrics ficam abertas (só contadores agregados).
+#
+# Cota: /chat e /chat/stream usam o mesmo medidor de tokens do app
+# (src/core/token_meter.py). Usuário com a cota esgotada recebe 402; o consumo
+# de cada resposta (usage da OpenAI, ou o tokenizer se o stream foi
+# interrompido) é somado ao usuário numa thread, fora do event loop.
+#
+# Tudo roda num único event loop: OpenAI e mem0 com os clientes assíncronos,
+# FAISS pelo micro-batcher. Um limite de requisições simultâneas protege o
+# processo (quem não consegue vaga a tempo recebe 503), cada requisição tem
+# um prazo (504 ao estourar) e, ao encerrar, o servidor para de aceitar
+# pedidos e espera os que estão em andamento terminarem.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set
+
+from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+
+from src.core import process_knowledge, tracing
+from src.core.embeddings import aembed_query
+from src.core.extraction import TAMANHO_MAX_DOCUMENTO, TAMANHO_MAX_TEXTO, extractor_for
+from src.core.langgraph.graph_builder import MODO_CHAT, MODO_CONFIGURACAO, arun_graph, astream_graph
+from src.core.memory_writer import get_memory_writer
+from src.core.resources import get_async_mem0_client, get_async_openai_client, mem0_configured
+from src.core.token_meter import get_token_meter
+from src.data_persistence.faiss.faiss_retriever import get_knowledge_retriever
+
+MAX_CONCORRENCIA = int(os.environ.get("HUBBLET_API_MAX_CONCURRENCY", "256")) # Conversas sendo atendidas ao mesmo tempo
+ESPERA_VAGA_S = float(os.environ.get("HUBBLET_API_QUEUE_TIMEOUT", "5"))      # Espera por vaga antes do 503
+TIMEOUT_REQUISICAO_S = float(os.environ.get("HUBBLET_API_TIMEOUT", "60"))
+ENCERRAMENTO_S = 30.0 # Prazo para as requisições em andamento terminarem ao desligar
+
+_RE_NOME_INSEGURO = re.compile(r"[^\w.\- ]")
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def parse_api_keys(texto: str) -> Dict[str, str]:
+    """Converte "token=usuario,..." em {sha256(token): usuario}. Só o hash do token fica em memória."""
+    chaves = {}
+    for item in texto.split(","):
+        token, _, usuario = item.strip().rpartition("=")
+        if token and usuario.strip():
+            chaves[_hash_token(token)] = usuario.strip()
+    return chaves
+
+
+CHAVES_API = parse_api_keys(os.environ.get("HUBBLET_API_KEYS", ""))
+ADMINS_API: Set[str] = {u.strip() for u in os.environ.get("HUBBLET_ADMIN_USERS", "").split(",") if u.strip()}
+_bearer = HTTPBearer(auto_error=False)
+
+
+async def usuario_autenticado(credenciais: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> str:
+    """Usuário dono do token da requisição (401 sem token ou com token desconhecido)."""
+    usuario = CHAVES_API.get(_hash_token(credenciais.credentials)) if credenciais else None
+    if usuario is None:
+        raise HTTPException(401, "Token de acesso ausente ou inválido", headers={"WWW-Authenticate": "Bearer"})
+    return usuario
+
+
+async def usuario_com_cota(usuario: str = Depends(usuario_autenticado)) -> str:
+    """Usuário autenticado que ainda tem tokens (402 com a cota esgotada, como o bloqueio do chat no app)."""
+    if not await asyncio.to_thread(get_token_meter().has_quota, usuario):
+        raise HTTPException(402, "Limite de tokens atingido. Adicione mais tokens para continuar.")
+    return usuario
+
+
+async def usuario_admin(usuario: str = Depends(usuario_autenticado)) -> str:
+    if usuario not in ADMINS_API:
+        raise HTTPException(403, "Rota restrita aos administradores (HUBBLET_ADMIN_USERS)")
+    return usuario
+
+
+class ChatRequest(BaseModel):
+    mensagem: str = Field(min_length=1)
+    agent_id: Optional[str] = None
+    modo: str = MODO_CHAT
+    historico: str = "" # Só no modo configuração
+
+
+class SearchRequest(BaseModel):
+    consulta: str = Field(min_length=1)
+    k: int = Field(default=5, ge=1, le=50)
+
+
+class Limitador:
+    """Vagas para requisições simultâneas, com espera limitada e drenagem no encerramento."""
+
+    def __init__(self, max_concorrencia: int = MAX_CONCORRENCIA, espera_s: float = ESPERA_VAGA_S):
+        self.espera_s = espera_s
+        self._semaforo = asyncio.Semaphore(max_concorrencia)
+        self.em_andamento = 0
+        self.atendidas = 0
+        self.rejeitadas = 0
+        self.encerrando = False
+        self._ociosa = asyncio.Event()
+        self._ociosa.set()
+
+    async def adquirir(self) -> Callable[[], None]:
+        """Ocupa uma vaga (ou levanta 503) e devolve a função que a libera; chamá-la de novo não tem efeito."""
+        if self.encerrando:
+            self.rejeitadas += 1
+            raise HTTPException(503, "Servidor encerrando")
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), self.espera_s)
+        except asyncio.TimeoutError:
+            self.rejeitadas += 1
+            raise HTTPException(503, "Servidor ocupado; tente novamente")
+        self.em_andamento += 1
+        self._ociosa.clear()
+        liberada = False
+
+        def liberar():
+            nonlocal liberada
+            if liberada:
+                return
+            liberada = True
+            self.em_andamento -= 1
+            self.atendidas += 1
+            self._semaforo.release()
+            if self.em_andamento == 0:
+                self._ociosa.set()
+        return liberar
+
+    @asynccontextmanager
+    async def vaga(self):
+        liberar = await self.adquirir()
+        try:
+            yield
+        finally:
+            liberar()
+
+    async def drenar(self, timeout_s: float) -> bool:
+        """Recusa novas requisições e espera as em andamento. False se o prazo acabou antes."""
+        self.encerrando = True
+        try:
+            await asyncio.wait_for(self._ociosa.wait(), timeout_s)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class ReindexadorConhecimento:
+    """Roda process_and_index_knowledge numa thread, uma execução por vez; uploads durante a execução geram mais uma."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rodando = False
+        self._pendente = False
+        self.execucoes = 0
+        self.ultima_conclusao: Optional[float] = None
+        self.ultimo_erro: Optional[str] = None
+
+    def agendar(self):
+        with self._lock:
+            if self._rodando:
+                self._pendente = True
+                return
+            self._rodando = True
+        threading.Thread(target=self._laco, name="reindexacao-conhecimento", daemon=True).start()
+
+    def _laco(self):
+        while True:
+            try:
+                process_knowledge.process_and_index_knowledge()
+                get_knowledge_retriever().reload() # Visível já na próxima busca, sem esperar o recarregamento periódico
+                self.ultimo_erro = None
+            except Exception as e:
+                self.ultimo_erro = f"{type(e).__name__}: {e}"
+                print(f"Erro na reindexação do conhecimento: {self.ultimo_erro}")
+            self.execucoes += 1
+            self.ultima_conclusao = time.time()
+            with self._lock:
+                if not self._pendente:
+                    self._rodando = False
+                    return
+                self._pendente = False
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"rodando": self._rodando, "pendente": self._pendente, "execucoes": self.execucoes,
+                    "ultima_conclusao": self.ultima_conclusao, "ultimo_erro": self.ultimo_erro}
+
+
+def _openai_api_key() -> str:
+    openai_api_key = os.environ.get("OPENAI_API_KEY", "")
+    if not openai_api_key:
+        raise HTTPException(500, "OPENAI_API_KEY não definido.")
+    return openai_api_key
+
+
+def _validar_modo(modo: str):
+    if modo not in (MODO_CHAT, MODO_CONFIGURACAO):
+        raise HTTPException(422, f"Modo desconhecido: {modo}")
+
+
+async def _enfileirar_memoria(pedido: ChatRequest, user_id: str, resposta: str):
+    """Mesma gravação write-behind do app: só um INSERT no spool local, fora do event loop."""
+    if pedido.modo != MODO_CHAT or not resposta or not mem0_configured():
+        return
+    mensagens = [{"role": "user", "content": pedido.mensagem}, {"role": "assistant", "content": resposta}]
+    try:
+        await asyncio.to_thread(get_memory_writer().enqueue, mensagens, user_id=user_id,
+                                agent_id=pedido.agent_id or None)
+    except Exception as e_spool:
+        print(f"Erro ao enfileirar memória para o mem0: {type(e_spool).__name__} - {e_spool}")
+
+
+def _cobrar_tokens(user_id: str):
+    """`registrar_uso` do grafo: soma o consumo ao usuário na thread de cobrança, sem bloquear o event loop.
+
+    É chamado pelo nó de geração mesmo se a requisição for cancelada no meio (timeout, cliente desconectado),
+    quando um `await` já não seria possível.
+    """
+    def registrar(prompt_tokens: int, completion_tokens: int, fonte: str):
+        app.state.cobranca.submit(_registrar_consumo, user_id, prompt_tokens, completion_tokens, fonte)
+    return registrar
+
+
+def _registrar_consumo(user_id: str, prompt_tokens: int, completion_tokens: int, fonte: str):
+    try:
+        get_token_meter().record_usage(user_id, prompt_tokens, completion_tokens, fonte, origem="api")
+    except Exception as e_uso:
+        print(f"Erro ao registrar o uso de tokens de '{user_id}': {type(e_uso).__name__} - {e_uso}")
+
+
+def _sse(evento: Optional[str], dados: dict) -> str:
+    linhas = f"event: {evento}\n" if evento else ""
+    return f"{linhas}data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.limitador = Limitador()
+    app.state.reindexador = ReindexadorConhecimento()
+    app.state.cobranca = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cobranca_tokens")
+    await asyncio.to_thread(get_knowledge_retriever().snapshot) # Primeira carga do índice fora do caminho das requisições
+    if not CHAVES_API:
+        print("AVISO: HUBBLET_API_KEYS vazio; /chat, /search e /upload vão recusar todas as requisições.")
+    writer = await asyncio.to_thread(get_memory_writer)
+    if mem0_configured():
+        try:
+            await get_async_mem0_client() # A criação valida a chave com uma chamada ao mem0 (~1s): melhor antes do 1º pedido
+        except Exception as e_mem0:
+            print(f"Erro ao criar o cliente do mem0: {e_mem0}. As buscas de memória serão ignoradas até ele responder.")
+    yield
+    if not await app.state.limitador.drenar(ENCERRAMENTO_S):
+        print(f"Encerrando com {app.state.limitador.em_andamento} requisição(ões) ainda em andamento.")
+    await asyncio.to_thread(writer.stop) # O que não foi enviado ao mem0 continua no spool
+    await asyncio.to_thread(app.state.cobranca.shutdown, True) # Nenhum consumo fica sem registro
+
+
+app = FastAPI(title="Hubblet AI", lifespan=lifespan)
+
+
+@app.post("/chat")
+async def chat(pedido: ChatRequest, user_id: str = Depends(usuario_com_cota)):
+    _validar_modo(pedido.modo)
+    _openai_api_key()
+    inicio = time.perf_counter()
+    async with app.state.limitador.vaga():
+        try:
+            resposta = await asyncio.wait_for(
+                arun_graph(pedido.mensagem, modo=pedido.modo, historico=pedido.historico, user_id=user_id,
+                           agent_id=pedido.agent_id, registrar_uso=_cobrar_tokens(user_id)), TIMEOUT_REQUISICAO_S)
+        except asyncio.TimeoutError:
+            raise HTTPException(504, f"Resposta não gerada em {TIMEOUT_REQUISICAO_S:.0f}s")
+    await _enfileirar_memoria(pedido, user_id, resposta)
+    return {"resposta": resposta, "duracao_s": time.perf_counter() - inicio}
+
+
+@app.post("/chat/stream")
+async def chat_stream(pedido: ChatRequest, user_id: str = Depends(usuario_com_cota)):
+    _validar_modo(pedido.modo)
+    _openai_api_key()
+    # A vaga (e o 503 se não houver) é decidida antes de abrir o stream. Ela é liberada no fim do gerador ou,
+    # se o cliente desconectar antes de o gerador começar, pela tarefa de fundo da resposta.
+    liberar = await app.state.limitador.adquirir()
+
+    async def eventos():
+        partes = []
+        try:
+            async with asyncio.timeout(TIMEOUT_REQUISICAO_S):
+                async for delta in astream_graph(pedido.mensagem, modo=pedido.modo, historico=pedido.historico,
+                                                 user_id=user_id, agent_id=pedido.agent_id,
+                                                 registrar_uso=_cobrar_tokens(user_id)):
+                    partes.append(delta)
+                    yield _sse(None, {"delta": delta})
+            resposta = "".join(partes).strip()
+            yield _sse("fim", {"resposta": resposta})
+        except TimeoutError:
+            yield _sse("erro", {"detail": f"Resposta não concluída em {TIMEOUT_REQUISICAO_S:.0f}s"})
+            return
+        except Exception as e:
+            yield _sse("erro", {"detail": f"{type(e).__name__}: {e}"})
+            return
+        finally:
+            liberar()
+        await _enfileirar_memoria(pedido, user_id, resposta)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream", background=BackgroundTask(liberar),
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/search", dependencies=[Depends(usuario_autenticado)])
+async def search(pedido: SearchRequest):
+    client = get_async_openai_client(_openai_api_key())
+    async with app.state.limitador.vaga():
+        try:
+            async with asyncio.timeout(TIMEOUT_REQUISICAO_S):
+                vetor = await aembed_query(pedido.consulta, client)
+                acertos = await get_knowledge_retriever().search_async(vetor, k=pedido.k)
+        except TimeoutError:
+            raise HTTPException(504, f"Busca não concluída em {TIMEOUT_REQUISICAO_S:.0f}s")
+    return {"resultados": [{"id": a.id, "distancia": a.distancia, "fonte": a.fonte, "texto": a.texto} for a in acertos]}
+
+
+@app.post("/upload", status_code=202, dependencies=[Depends(usuario_admin)])
+async def upload(arquivos: List[UploadFile] = File(...)):
+    aceitos, ignorados = [], []
+    os.makedirs(process_knowledge.SOURCES_DIR, exist_ok=True)
+    for arquivo in arquivos:
+        nome = _RE_NOME_INSEGURO.sub("_", os.path.basename(arquivo.filename or "")).strip()
+        extrator = extractor_for(nome)
+        if not nome or extrator is None:
+            ignorados.append({"arquivo": arquivo.filename, "motivo": "tipo não suportado"})
+            continue
+        tamanho_max = TAMANHO_MAX_DOCUMENTO if extrator == "docling" else TAMANHO_MAX_TEXTO
+        dados = await arquivo.read(tamanho_max + 1)
+        if not dados:
+            ignorados.append({"arquivo": arquivo.filename, "motivo": "vazio"})
+            continue
+        if len(dados) > tamanho_max:
+            ignorados.append({"arquivo": arquivo.filename, "motivo": f"excede {tamanho_max // (1024 * 1024)}MB"})
+            continue
+        destino = os.path.join(process_knowledge.SOURCES_DIR, nome)
+        tmp_path = f"{destino}.tmp"
+        await asyncio.to_thread(_gravar_arquivo, tmp_path, dados)
+        os.replace(tmp_path, destino) # O indexador nunca vê um arquivo pela metade
+        aceitos.append(nome)
+    if aceitos:
+        app.state.reindexador.agendar()
+    return {"aceitos": aceitos, "ignorados": ignorados, "indexacao": app.state.reindexador.status()}
+
+
+def _gravar_arquivo(caminho: str, dados: bytes):
+    with open(caminho, "wb") as f:
+        f.write(dados)
+
+
+@app.get("/upload/status", dependencies=[Depends(usuario_admin)])
+async def upload_status():
+    return app.state.reindexador.status()
+
+
+@app.get("/health")
+async def health():
+    limitador: Limitador = app.state.limitador
+    return {"em_andamento": limitador.em_andamento, "atendidas": limitador.atendidas,
+            "rejeitadas": limitador.rejeitadas, "encerrando": limitador.encerrando,
+            "vetores_conhecimento": get_knowledge_retriever().snapshot().index.ntotal}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(tracing.get_collector().render_prometheus(),
+                             media_type=tracing.TIPO_CONTEUDO_METRICAS)
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Servidor HTTP do Hubblet AI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, timeout_graceful_shutdown=int(ENCERRAMENTO_S))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Benchmark: recall@k x latência dos tipos de índice da index_factory
+#
+# Uso: python -m src.benchmarks.ann_recall [--vetores 50000] [--consultas 200] [--k 10]
+# Dados sintéticos em 1536 dimensões com estrutura de clusters (parecidos com
+# embeddings reais, que não são uniformes). A busca exata (Flat) é a verdade
+# de referência; os índices aproximados são medidos variando nprobe/efSearch.
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from src.data_persistence.faiss import index_factory
+
+
+def dados_sinteticos(n: int, n_consultas: int, dim: int, n_clusters: int = 200, seed: int = 0):
+    """Vetores agrupados em torno de centros aleatórios; as consultas vêm da mesma distribuição."""
+    rng = np.random.default_rng(seed)
+    centros = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+
+    def amostrar(m):
+        return centros[rng.integers(n_clusters, size=m)] + 0.35 * rng.standard_normal((m, dim)).astype(np.float32)
+
+    return amostrar(n), amostrar(n_consultas)
+
+
+def recall_at_k(encontrados: np.ndarray, verdade: np.ndarray) -> float:
+    k = verdade.shape[1]
+    acertos = sum(len(set(e[:k]) & set(v)) for e, v in zip(encontrados, verdade))
+    return acertos / (len(verdade) * k)
+
+
+def medir(index: faiss.Index, consultas: np.ndarray, k: int):
+    """Busca uma consulta por vez (como no chat); retorna ids e latência média em ms."""
+    ids = np.empty((len(consultas), k), dtype=np.int64)
+    t0 = time.perf_counter()
+    for i, q in enumerate(consultas):
+        ids[i] = index.search(q.reshape(1, -1), k)[1][0]
+    return ids, (time.perf_counter() - t0) * 1000 / len(consultas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k x latência dos índices FAISS")
+    parser.add_argument("--vetores", type=int, default=50_000)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"Gerando {args.vetores} vetores de dimensão {args.dim}...")
+    vetores, consultas = dados_sinteticos(args.vetores, args.consultas, args.dim)
+
+    flat = index_factory.build_index(vetores, "Flat")
+    verdade, ms_flat = medir(flat, consultas, args.k)
+    print(f"\n{'índice':<22} {'parâmetro':>12} {'recall@' + str(args.k):>10} {'ms/consulta':>12} {'construção s':>13}")
+    print(f"{'Flat':<22} {'-':>12} {1.0:>10.3f} {ms_flat:>12.3f} {'-':>13}")
+
+    nlist = index_factory._nlist_para(args.vetores)
+    m_pq = index_factory.choose_index_type(index_factory.LIMIAR_COMPRESSAO, args.dim, {"compressao": "PQ"}).split("PQ")[1]
+    rodadas = [
+        (f"IVF{nlist},Flat", "nprobe", (1, 4, 16, 64)),
+        (f"IVF{nlist},SQ8", "nprobe", (4, 16, 64)),
+        (f"IVF{nlist},PQ{m_pq}", "nprobe", (4, 16, 64)),
+        (f"HNSW{index_factory.HNSW_M},Flat", "ef_search", (16, 64, 256)),
+    ]
+    for descricao, parametro, valores in rodadas:
+        t0 = time.perf_counter()
+        index = index_factory.build_index(vetores, descricao)
+        construcao_s = time.perf_counter() - t0
+        for valor in valores:
+            index_factory.set_search_params(index, **{parametro: valor})
+            ids, ms = medir(index, consultas, args.k)
+            print(f"{descricao:<22} {f'{parametro}={valor}':>12} {recall_at_k(ids, verdade):>10.3f} {ms:>12.3f} {construcao_s:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Benchmark: conversas simultâneas atendidas pelo servidor HTTP (src.api.server)
+#
+# Uso: python -m src.benchmarks.api_server [--concorrencias 1,50,200] [--turnos 3]
+# Sobe os servidores falsos da OpenAI e do mem0 (src.devtools) com latência
+# de rede simulada, o servidor HTTP num thread e N clientes, cada um com uma
+# conversa de alguns turnos via POST /chat. Mede vazão e latência (p50/p99)
+# por nível de concorrência e o tempo até o primeiro pedaço em /chat/stream.
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _autorizacao(usuario: int) -> dict:
+    return {"Authorization": f"Bearer token-{usuario}"}
+
+
+async def _conversa(client, usuario: int, turnos: int, latencias: list, erros: list):
+    for turno in range(turnos):
+        t0 = time.perf_counter()
+        try:
+            resp = await client.post("/chat", json={"mensagem": f"Pergunta {turno} do usuário {usuario}?",
+                                                    "agent_id": "bench"}, headers=_autorizacao(usuario))
+            if resp.status_code != 200:
+                erros.append(resp.status_code)
+                continue
+        except Exception as e:
+            erros.append(type(e).__name__)
+            continue
+        latencias.append(time.perf_counter() - t0)
+
+
+async def _rodada(base_url: str, concorrencia: int, turnos: int):
+    import httpx
+    latencias, erros = [], []
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    async with httpx.AsyncClient(base_url=base_url, limits=limites, timeout=120) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(_conversa(client, u, turnos, latencias, erros) for u in range(concorrencia)))
+        dt = time.perf_counter() - t0
+    return latencias, erros, dt
+
+
+async def _primeiro_pedaco(base_url: str) -> float:
+    import httpx
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        t0 = time.perf_counter()
+        async with client.stream("POST", "/chat/stream", json={"mensagem": "Olá, tudo bem?"},
+                                 headers=_autorizacao(0)) as resp:
+            async for linha in resp.aiter_lines():
+                if linha.startswith("data:") and "delta" in json.loads(linha[5:]):
+                    return time.perf_counter() - t0
+    return float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversas simultâneas no servidor HTTP")
+    parser.add_argument("--concorrencias", default="1,50,200")
+    parser.add_argument("--turnos", type=int, default=3)
+    parser.add_argument("--latencia-openai", type=float, default=0.2, help="Latência de cada chamada à OpenAI falsa (s)")
+    parser.add_argument("--latencia-mem0", type=float, default=0.1, help="Latência de cada chamada ao mem0 falso (s)")
+    args = parser.parse_args()
+    concorrencias = [int(c) for c in args.concorrencias.split(",")]
+
+    from src.devtools.fake_mem0 import start_fake_mem0
+    from src.devtools.fake_openai import start_fake_openai
+    openai_srv, _ = start_fake_openai(latencia_s=args.latencia_openai)
+    mem0_srv, _ = start_fake_mem0(latencia_s=args.latencia_mem0)
+    pasta = tempfile.mkdtemp()
+    os.environ.update({
+        "OPENAI_API_KEY": "fake", "OPENAI_BASE_URL": openai_srv.base_url,
+        "MEM0_API_KEY": "fake", "HUBBLET_MEM0_HOST": mem0_srv.base_url, "MEM0_TELEMETRY": "False",
+        "HUBBLET_EMBEDDING_CACHE": os.path.join(pasta, "embeddings.db"),
+        "HUBBLET_MEM0_SPOOL": os.path.join(pasta, "mem0_spool.db"),
+        "HUBBLET_USAGE_DB": os.path.join(pasta, "token_usage.db"),
+        # Um token por conversa simulada: cada uma fala como um usuário diferente
+        "HUBBLET_API_KEYS": ",".join(f"token-{u}=usuario-{u}" for u in range(max(concorrencias))),
+    })
+    import uvicorn
+    from src.api.server import app
+
+    porta = _porta_livre()
+    servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=porta, log_level="warning"))
+    thread = threading.Thread(target=servidor.run, daemon=True)
+    thread.start()
+    while not servidor.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{porta}"
+
+    try:
+        print(f"Latência simulada: OpenAI {args.latencia_openai * 1000:.0f} ms, mem0 {args.latencia_mem0 * 1000:.0f} ms")
+        print(f"{'conversas':>10} {'turnos/s':>10} {'p50 (ms)':>10} {'p99 (ms)':>10} {'erros':>6}")
+        for concorrencia in concorrencias:
+            latencias, erros, dt = asyncio.run(_rodada(base_url, concorrencia, args.turnos))
+            p50, p99 = np.percentile(np.array(latencias) * 1000, [50, 99]) if latencias else (float("nan"),) * 2
+            print(f"{concorrencia:>10} {len(latencias) / dt:>10.1f} {p50:>10.0f} {p99:>10.0f} {len(erros):>6}")
+        ttfb = asyncio.run(_primeiro_pedaco(base_url))
+        print(f"/chat/stream: primeiro pedaço em {ttfb * 1000:.0f} ms")
+        print(f"Chamadas: OpenAI {openai_srv.requisicoes} (chat {openai_srv.chamadas_chat}), "
+              f"mem0 search {len(mem0_srv.cliente.chamadas_search)}")
+        from src.core.token_meter import get_token_meter
+        app.state.cobranca.submit(lambda: None).result() # Espera as cobranças pendentes
+        cobrados = sum(get_token_meter().balance(f"usuario-{u}").usados for u in range(max(concorrencias)))
+        print(f"Tokens cobrados dos usuários: {cobrados:,}")
+    finally:
+        servidor.should_exit = True
+        thread.join(timeout=35)
+        openai_srv.shutdown()
+        mem0_srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Benchmark: consultas/segundo no FAISS, uma a uma x em lote x micro-batcher
+#
+# Uso: python -m src.benchmarks.batch_search [--vetores 100000] [--consultas 512] [--sessoes 16]
+# "uma a uma" é o laço antigo (um index.search por pergunta); "em lote" faz
+# uma única chamada com a matriz de consultas; "micro-batcher" simula
+# `--sessoes` threads buscando ao mesmo tempo pelo MicroBatcher.
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+from src.data_persistence.faiss.batch_search import MicroBatcher, search_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão da busca no FAISS, uma a uma x em lote")
+    parser.add_argument("--vetores", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--consultas", type=int, default=512)
+    parser.add_argument("--sessoes", type=int, default=16)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--janela-ms", type=float, default=3.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatL2(args.dim)
+    index.add(rng.standard_normal((args.vetores, args.dim), dtype=np.float32))
+    consultas = rng.standard_normal((args.consultas, args.dim), dtype=np.float32)
+    print(f"{args.vetores} vetores, {args.consultas} consultas, {faiss.omp_get_max_threads()} threads OpenMP")
+    print(f"{'modo':<26} {'segundos':>9} {'consultas/s':>12}")
+
+    t0 = time.perf_counter()
+    ids_um_a_um = np.stack([index.search(q.reshape(1, -1), args.k)[1][0] for q in consultas])
+    dt = time.perf_counter() - t0
+    print(f"{'uma a uma':<26} {dt:>9.3f} {args.consultas / dt:>12,.0f}")
+
+    t0 = time.perf_counter()
+    _, ids_lote = search_batch(index, consultas, args.k)
+    dt = time.perf_counter() - t0
+    print(f"{'em lote':<26} {dt:>9.3f} {args.consultas / dt:>12,.0f}")
+
+    batcher = MicroBatcher(janela_s=args.janela_ms / 1000)
+    with ThreadPoolExecutor(max_workers=args.sessoes) as pool:
+        t0 = time.perf_counter()
+        respostas = list(pool.map(lambda q: batcher.search(index, q, args.k), consultas))
+        dt = time.perf_counter() - t0
+    ids_batcher = np.stack([ids for _, ids in respostas])
+    nome = f"micro-batcher ({args.sessoes} sessões)"
+    print(f"{nome:<26} {dt:>9.3f} {args.consultas / dt:>12,.0f}   lote médio: {batcher.consultas / max(1, batcher.lotes):.1f}")
+
+    iguais = (ids_um_a_um == ids_lote).all() and (ids_um_a_um == ids_batcher).all()
+    print(f"Mesmos resultados nos três modos: {'sim' if iguais else 'NÃO'}")
+
+
+if __name__ == "__main__":
+    main()
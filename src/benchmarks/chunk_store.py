@@ -0,0 +1,58 @@
+# Benchmark: tamanho em disco e latência de leitura do armazenamento de trechos
+#
+# Uso: python -m src.benchmarks.chunk_store [--trechos 100000] [--leituras 20000]
+# Grava trechos sintéticos em dois salvamentos (como um assistente salvo e
+# depois ampliado), compara o tamanho com o texto bruto e mede a latência
+# (p50/p99) de leituras por posição aleatória, como as da busca no chat.
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.benchmarks.lexical_search import gerar_trechos
+from src.data_persistence.chunks import chunk_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamanho e latência do armazenamento de trechos")
+    parser.add_argument("--trechos", type=int, default=100_000)
+    parser.add_argument("--leituras", type=int, default=20_000)
+    args = parser.parse_args()
+
+    trechos, _ = gerar_trechos(args.trechos)
+    pasta = tempfile.mkdtemp()
+    base = os.path.join(pasta, "assistente_bench_chunks")
+    try:
+        t0 = time.perf_counter()
+        metade = len(trechos) // 2
+        chunk_store.save_chunks(base, trechos[:metade])
+        chunk_store.save_chunks(base, trechos)
+        dt = time.perf_counter() - t0
+        bruto = sum(len(t.encode("utf-8")) for t in trechos)
+        em_disco = os.path.getsize(chunk_store.data_file(base)) + os.path.getsize(chunk_store.index_file(base))
+        codec = "zstd" if chunk_store.zstandard is not None else "zlib"
+        print(f"Gravação: {args.trechos} trechos em {dt:.2f}s ({codec}); texto {bruto / 2**20:.1f} MB, "
+              f"em disco {em_disco / 2**20:.1f} MB ({bruto / em_disco:.1f}x)")
+
+        store = chunk_store.ChunkStore(base)
+        rng = random.Random(1)
+        tempos = []
+        for _ in range(args.leituras):
+            i = rng.randrange(len(store))
+            t0 = time.perf_counter()
+            store[i]
+            tempos.append(time.perf_counter() - t0)
+        p50, p99 = np.percentile(np.array(tempos) * 1e6, [50, 99])
+        print(f"Leitura por posição: p50 {p50:,.0f} µs, p99 {p99:,.0f} µs")
+        store.close()
+    finally:
+        shutil.rmtree(pasta)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Benchmark: vazão (MB/s) e pico de memória da divisão de documentos em trechos
+#
+# Uso: python -m src.benchmarks.chunking [--mb 300] [--alvo 350] [--sobreposicao 50]
+# Gera um corpus markdown sintético em arquivo temporário e compara o
+# pipeline em fluxo (src.core.chunking) com o antigo: ler o arquivo inteiro
+# e fatiar janelas fixas de 1500 caracteres. O pico de memória é medido com
+# tracemalloc numa segunda passada, para não distorcer a vazão.
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from src.core.chunking import chunk_buffer
+
+PALAVRAS = ("dados", "assistente", "conhecimento", "memória", "usuário", "índice", "busca", "trecho",
+            "resposta", "modelo", "configuração", "documento", "relatório", "análise", "processo", "ação")
+
+
+def gerar_corpus(caminho: str, megabytes: int, seed: int = 0):
+    """Markdown com títulos, parágrafos de tamanho variado e frases de 5 a 30 palavras."""
+    rng = random.Random(seed)
+    alvo = megabytes * 1024 * 1024
+    escritos = 0
+    with open(caminho, "w", encoding="utf-8") as f:
+        secao = 0
+        while escritos < alvo:
+            secao += 1
+            partes = [f"## Seção {secao}\n\n"]
+            for _ in range(rng.randint(2, 8)):
+                frases = (" ".join(rng.choices(PALAVRAS, k=rng.randint(5, 30))).capitalize() + "."
+                          for _ in range(rng.randint(1, 12)))
+                partes.append(" ".join(frases) + "\n\n")
+            bloco = "".join(partes)
+            f.write(bloco)
+            escritos += len(bloco.encode("utf-8"))
+
+
+def fatiar_antigo(caminho: str):
+    with open(caminho, "r", encoding="utf-8") as f:
+        texto = f.read()
+    return [texto[i:i + 1500] for i in range(0, len(texto), 1500)]
+
+
+def trechos_em_fluxo(caminho: str, alvo: int, sobreposicao: int):
+    n = 0
+    with open(caminho, "rb") as f:
+        for _ in chunk_buffer(f, alvo, sobreposicao):
+            n += 1
+    return n
+
+
+def medir(fn):
+    t0 = time.perf_counter()
+    resultado = fn()
+    dt = time.perf_counter() - t0
+    tracemalloc.start()
+    fn()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, dt, pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão e memória da divisão em trechos")
+    parser.add_argument("--mb", type=int, default=300)
+    parser.add_argument("--alvo", type=int, default=350, help="Tokens por trecho")
+    parser.add_argument("--sobreposicao", type=int, default=50, help="Tokens repetidos entre trechos vizinhos")
+    args = parser.parse_args()
+
+    fd, caminho = tempfile.mkstemp(suffix=".md")
+    os.close(fd)
+    try:
+        print(f"Gerando corpus de {args.mb} MB...")
+        gerar_corpus(caminho, args.mb)
+        tamanho_mb = os.path.getsize(caminho) / (1024 * 1024)
+
+        print(f"{'pipeline':<34} {'trechos':>9} {'MB/s':>8} {'pico MB':>9}")
+        trechos, dt, pico = medir(lambda: len(fatiar_antigo(caminho)))
+        print(f"{'janelas fixas de 1500 (antigo)':<34} {trechos:>9} {tamanho_mb / dt:>8.1f} {pico / 2**20:>9.1f}")
+        trechos, dt, pico = medir(lambda: trechos_em_fluxo(caminho, args.alvo, args.sobreposicao))
+        print(f"{f'em fluxo ({args.alvo} tokens, +{args.sobreposicao})':<34} {trechos:>9} {tamanho_mb / dt:>8.1f} {pico / 2**20:>9.1f}")
+    finally:
+        os.remove(caminho)
+
+
+if __name__ == "__main__":
+    main()
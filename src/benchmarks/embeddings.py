@@ -0,0 +1,45 @@
+# Benchmark: trechos/segundo do pipeline de embeddings por tamanho de lote e concorrência
+#
+# Uso: python -m src.benchmarks.embeddings [--trechos 2000] [--latencia 0.05]
+# Roda contra o servidor falso de src.devtools.fake_openai, sem chamadas reais.
+
+import argparse
+import time
+
+from openai import OpenAI
+
+from src.core.embeddings import embed_texts
+from src.devtools.fake_openai import start_fake_openai
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão do pipeline de embeddings")
+    parser.add_argument("--trechos", type=int, default=2000)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latência fixa por requisição (s)")
+    parser.add_argument("--latencia-item", type=float, default=0.0005, help="Latência adicional por entrada (s)")
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, _ = start_fake_openai(latencia_s=args.latencia, latencia_por_item_s=args.latencia_item,
+                                  taxa_erro_429=args.taxa_429)
+    client = OpenAI(api_key="fake", base_url=server.base_url, max_retries=0)
+    textos = [f"Trecho de documento número {i}. " * 40 for i in range(args.trechos)]
+
+    print(f"{'lote':>6} {'workers':>8} {'trechos/s':>12} {'requisições':>12} {'falhas':>7}")
+    try:
+        for lote in (1, 16, 64, 256):
+            for workers in (1, 4, 8):
+                if lote == 1 and workers > 4:
+                    continue  # Sem lote a rodada levaria minutos; 1x1 e 1x4 já mostram a tendência
+                antes = server.requisicoes
+                t0 = time.perf_counter()
+                resultado = embed_texts(textos, client, max_itens_por_lote=lote, max_workers=workers, usar_cache=False)
+                dt = time.perf_counter() - t0
+                falhas = sum(1 for r in resultado if r is None)
+                print(f"{lote:>6} {workers:>8} {len(textos) / dt:>12.1f} {server.requisicoes - antes:>12} {falhas:>7}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
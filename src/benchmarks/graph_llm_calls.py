@@ -0,0 +1,50 @@
+# Benchmark: chamadas ao LLM por execução do grafo LangGraph, por modo
+#
+# Uso: python -m src.benchmarks.graph_llm_calls [--perguntas 5]
+# Roda o grafo contra o servidor falso de src.devtools.fake_openai e conta as
+# chamadas a /chat/completions. Antes do roteador, toda pergunta de chat
+# passava também pela IA configuradora (duas chamadas); agora deve ser uma.
+# Sem MEM0_API_KEY ou base de conhecimento, os ramos de recuperação seguem
+# vazios, o que não muda a contagem.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chamadas ao LLM por pergunta no grafo")
+    parser.add_argument("--perguntas", type=int, default=5)
+    args = parser.parse_args()
+
+    from src.devtools.fake_openai import start_fake_openai
+    server, _ = start_fake_openai()
+    os.environ["OPENAI_API_KEY"] = "fake"
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("HUBBLET_EMBEDDING_CACHE", os.path.join(tempfile.mkdtemp(), "embeddings.db"))
+    from src.core.langgraph.graph_builder import MODO_CHAT, MODO_CONFIGURACAO, run_graph
+
+    esperado = {MODO_CHAT: 1, MODO_CONFIGURACAO: 1}
+    ok = True
+    print(f"{'modo':<14} {'chamadas LLM/pergunta':>22} {'ms/pergunta':>12}")
+    try:
+        for modo in (MODO_CHAT, MODO_CONFIGURACAO):
+            antes = server.chamadas_chat
+            t0 = time.perf_counter()
+            for i in range(args.perguntas):
+                run_graph(f"Pergunta de teste número {i}?", modo=modo)
+            dt = time.perf_counter() - t0
+            por_pergunta = (server.chamadas_chat - antes) / args.perguntas
+            ok = ok and por_pergunta == esperado[modo]
+            print(f"{modo:<14} {por_pergunta:>22.1f} {dt / args.perguntas * 1000:>12.1f}")
+    finally:
+        server.shutdown()
+    if not ok:
+        print(f"Esperado: {esperado}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Benchmark: construção e latência de consulta do índice BM25 dos trechos
+#
+# Uso: python -m src.benchmarks.lexical_search [--trechos 100000] [--consultas 2000]
+# Gera trechos sintéticos com códigos de produto espalhados, constrói o
+# índice em dois segmentos (como um assistente salvo e depois ampliado) e
+# mede a latência (p50/p99) de consultas por código e por palavras comuns,
+# e quantas dispensam a busca densa (resultado confiante).
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.data_persistence.chunks import bm25_index
+
+PALAVRAS = ("preço", "produto", "entrega", "garantia", "modelo", "cliente", "pedido", "nota", "fiscal", "prazo",
+            "estoque", "fornecedor", "contrato", "pagamento", "desconto", "frete", "devolução", "suporte")
+
+
+def gerar_trechos(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    trechos, codigos = [], []
+    for i in range(n):
+        trecho = " ".join(rng.choices(PALAVRAS, k=rng.randint(40, 90)))
+        if i % 50 == 0:
+            codigo = f"{rng.choice('ABCDEFGHJK')}{rng.choice('XYZW')}-{rng.randint(1000, 9999)}/{rng.choice('ABC')}"
+            trecho += f" Código do item: {codigo}."
+            codigos.append(codigo)
+        trechos.append(trecho)
+    return trechos, codigos
+
+
+def latencias(indice, consultas, k):
+    tempos = []
+    for consulta in consultas:
+        t0 = time.perf_counter()
+        indice.search(consulta, k)
+        tempos.append(time.perf_counter() - t0)
+    return np.percentile(np.array(tempos) * 1e6, [50, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência do índice BM25")
+    parser.add_argument("--trechos", type=int, default=100_000)
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=12)
+    args = parser.parse_args()
+
+    trechos, codigos = gerar_trechos(args.trechos)
+    pasta = tempfile.mkdtemp()
+    base = os.path.join(pasta, "assistente_bench_chunks")
+    try:
+        t0 = time.perf_counter()
+        metade = len(trechos) // 2
+        bm25_index.update_index(base, trechos[:metade], 0)
+        bm25_index.update_index(base, trechos, metade)
+        dt = time.perf_counter() - t0
+        tamanho = sum(os.path.getsize(os.path.join(bm25_index.index_dir(base), n))
+                      for n in os.listdir(bm25_index.index_dir(base)))
+        print(f"Construção: {args.trechos} trechos em {dt:.2f}s ({args.trechos / dt:,.0f} trechos/s), "
+              f"{tamanho / 2**20:.1f} MB em disco")
+
+        indice = bm25_index.LexicalIndex(base)
+        rng = random.Random(1)
+        so_codigo = [rng.choice(codigos) for _ in range(args.consultas)]
+        por_codigo = [f"qual o preço do {rng.choice(codigos)}?" for _ in range(args.consultas)]
+        comuns = [" ".join(rng.sample(PALAVRAS, 3)) for _ in range(args.consultas)]
+        print(f"{'consulta':<22} {'p50 (µs)':>10} {'p99 (µs)':>10}")
+        # Só a consulta que é o próprio código dispensa a busca densa; a pergunta com código passa pela fusão
+        for rotulo, consultas in (("só o código", so_codigo), ("pergunta com código", por_codigo)):
+            confiantes = sum(indice.search(c, args.k).confiante for c in consultas)
+            p50, p99 = latencias(indice, consultas, args.k)
+            print(f"{rotulo:<22} {p50:>10,.0f} {p99:>10,.0f}   confiantes: {confiantes}/{len(consultas)}")
+        p50, p99 = latencias(indice, comuns, args.k)
+        print(f"{'palavras comuns':<22} {p50:>10,.0f} {p99:>10,.0f}")
+    finally:
+        shutil.rmtree(pasta)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+# Teste de carga: N usuários simultâneos no turno do chat, contra OpenAI e mem0 falsos
+#
+# Uso: python -m src.benchmarks.load_test [--usuarios 20] [--turnos 5] [--modo chat|grafo]
+#          [--latencia-chat lognormal:0.6,0.4] [--erro-openai 0.01] [--erro-mem0 0.02] ...
+#          [--gravar fita.jsonl | --reproduzir fita.jsonl] [--json resultado.json]
+#
+# Sobe os servidores falsos da OpenAI (embeddings e chat, com stream) e do mem0
+# (src.devtools), com latências sorteadas de distribuições e taxas de erro
+# configuráveis, e cada usuário simulado conversa numa thread própria, como as
+# sessões do Streamlit:
+#   chat   o turno de pagina_chat_principal (src/frontend/app.py): mensagem no
+#          store de sessões, cache semântico na primeira pergunta, buscas de
+#          perfil/memórias/conhecimento (BM25 + FAISS) com orçamento, contexto,
+#          completion em stream, persistência e envio ao mem0 em segundo plano
+#   grafo  run_graph do LangGraph
+# Relata p50/p95/p99 da latência do turno (e do primeiro token no modo chat),
+# vazão, erros e avisos de recuperação por etapa. Com --tracing, também os
+# percentis de cada etapa do turno (src.core.tracing), para achar onde o
+# tempo vai quando a carga sobe.
+#
+# --gravar guarda numa fita as respostas e latências sorteadas pelos servidores
+# falsos, com os parâmetros da rodada; --reproduzir repete a rodada servindo
+# exatamente as mesmas respostas, depois das mesmas latências, para comparar
+# versões do código de forma determinística. Bancos e caches vão para uma
+# pasta temporária: toda rodada começa do zero.
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.devtools.cassette import MODO_GRAVAR, MODO_REPRODUZIR, Cassete
+from src.devtools.latency import Latencia
+
+ASSISTENTE = "assistente_carga"
+VERSAO_ASSISTENTE = "carga-v1"
+INSTRUCOES = "Você é um assistente de atendimento. Responda de forma objetiva usando o conhecimento fornecido."
+TRECHOS_CONHECIMENTO = 500
+PARAMETROS_DA_RODADA = ("usuarios", "turnos", "modo", "semente", "pausa", "rampa")
+
+PERGUNTAS = (
+    "Qual o prazo de {p1} para o pedido {n}?",
+    "Como funciona a {p1} quando o {p2} atrasa?",
+    "O que a política diz sobre {p1} e {p2} no contrato {n}?",
+    "Posso pedir {p1} de um {p2} comprado há {d} dias?",
+    "Qual é a situação do item {codigo}?",
+)
+
+
+@dataclass
+class ResultadoTurno:
+    usuario: int
+    turno: int
+    latencia_s: float
+    primeiro_token_s: Optional[float] = None
+    erro: Optional[str] = None
+    avisos: List[str] = field(default_factory=list)
+    cache: bool = False
+
+
+def _perguntas_do_usuario(usuario: int, turnos: int, semente: int, codigos: List[str]) -> List[str]:
+    from src.benchmarks.lexical_search import PALAVRAS
+    rng = random.Random(f"{semente}-{usuario}")
+    perguntas = []
+    for _ in range(turnos):
+        modelo = rng.choice(PERGUNTAS)
+        perguntas.append(modelo.format(p1=rng.choice(PALAVRAS), p2=rng.choice(PALAVRAS), n=rng.randint(1000, 99999),
+                                       d=rng.randint(2, 90), codigo=rng.choice(codigos) if codigos else "AX-1000/A"))
+    return perguntas
+
+
+def _percentis(valores: List[float]) -> Dict[str, float]:
+    if not valores:
+        return {"p50": float("nan"), "p95": float("nan"), "p99": float("nan"), "max": float("nan")}
+    p50, p95, p99 = np.percentile(np.array(valores) * 1000, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": max(valores) * 1000}
+
+
+class TurnoChat:
+    """O turno de pagina_chat_principal sem a interface: mesmas etapas, na mesma ordem."""
+
+    def __init__(self, openai_api_key: str, pasta: str):
+        import faiss
+        from src.benchmarks.lexical_search import gerar_trechos
+        from src.core.chat_turn import FilaPorSessao
+        from src.data_persistence.chunks import bm25_index
+        from src.devtools.fake_openai import fake_embedding
+
+        self.openai_api_key = openai_api_key
+        self.doc_chunks, self.codigos = gerar_trechos(TRECHOS_CONHECIMENTO, seed=7)
+        vetores = np.array([fake_embedding(t) for t in self.doc_chunks], dtype="float32")
+        self.faiss_index = faiss.IndexFlatL2(vetores.shape[1])
+        self.faiss_index.add(vetores)
+        self.indice_lexical = bm25_index.load_or_build(os.path.join(pasta, ASSISTENTE), self.doc_chunks)
+        self.executor_pos_resposta = FilaPorSessao(max_workers=4, thread_name_prefix="pos_resposta")
+
+    def nova_conversa(self, user_id: str) -> Dict:
+        from src.data_persistence.chat_sessions.session_store import get_session_store
+        return {"session_id": get_session_store().create_session(user_id, f"Chat com {ASSISTENTE}")["id"], "historico": []}
+
+    def executar(self, conversa: Dict, user_id: str, pergunta: str, resultado: ResultadoTurno, t_inicio: float):
+        from src.core import tracing
+        with tracing.trace("turno.chat", usuario=user_id, assistente=ASSISTENTE):
+            self._executar(conversa, user_id, pergunta, resultado, t_inicio)
+
+    def _executar(self, conversa: Dict, user_id: str, pergunta: str, resultado: ResultadoTurno, t_inicio: float):
+        from src.core import tracing
+        from src.core.chat_turn import (MODELO_CHAT, ORCAMENTO_RECUPERACAO_S, atualizar_resumo_sessao,
+                                        contexto_recuperado, persistir_turno_chat, salvar_mensagem_usuario,
+                                        tarefas_recuperacao)
+        from src.core.context_builder import ContextBuilder
+        from src.core.embeddings import embed_query
+        from src.core.resources import get_mem0_client, get_openai_client
+        from src.core.retrieval import fan_out
+        from src.core.token_meter import get_token_meter, usage_or_estimate
+        from src.data_persistence.cache.response_cache import get_response_cache
+        from src.data_persistence.chat_sessions.session_store import get_session_store
+
+        session_id, historico = conversa["session_id"], conversa["historico"]
+        client = get_openai_client(self.openai_api_key)
+        self.executor_pos_resposta.submit(session_id, tracing.bind(salvar_mensagem_usuario), session_id, pergunta)
+        historico.append({"role": "user", "content": pergunta})
+
+        chave_cache, vetor_pergunta = None, None
+        if len(historico) == 1:
+            try:
+                with tracing.span("cache.respostas") as etapa_cache:
+                    vetor_pergunta = embed_query(pergunta, client)
+                    chave_cache = (ASSISTENTE, user_id, VERSAO_ASSISTENTE)
+                    em_cache = get_response_cache().lookup(*chave_cache, vetor_pergunta)
+                    etapa_cache.set(acerto=em_cache is not None)
+            except Exception as e_cache:
+                resultado.avisos.append(f"cache:{type(e_cache).__name__}")
+                chave_cache, em_cache = None, None
+            if em_cache is not None:
+                resultado.cache = True
+                resultado.primeiro_token_s = time.perf_counter() - t_inicio
+                self.executor_pos_resposta.submit(session_id, tracing.bind(persistir_turno_chat), session_id,
+                                                  pergunta, em_cache.resposta, user_id, ASSISTENTE)
+                historico.append({"role": "assistant", "content": em_cache.resposta})
+                return
+
+        tarefas = tarefas_recuperacao(pergunta, user_id, ASSISTENTE, mem0_client=get_mem0_client(),
+                                      faiss_index=self.faiss_index, doc_chunks=self.doc_chunks, client=client,
+                                      indice_lexical=self.indice_lexical)
+        with tracing.span("recuperacao", tarefas=len(tarefas)):
+            resultados = fan_out(tarefas, orcamento_s=ORCAMENTO_RECUPERACAO_S)
+        for nome, r in resultados.items():
+            if r.erro is not None:
+                resultado.avisos.append(f"{nome}:{type(r.erro).__name__}")
+            elif r.expirou:
+                resultado.avisos.append(f"{nome}:tempo esgotado")
+        memorias, trechos = contexto_recuperado(resultados)
+
+        with tracing.span("contexto.montar") as etapa_contexto:
+            contexto = ContextBuilder(MODELO_CHAT).build(historico, instrucoes=INSTRUCOES, memorias=memorias,
+                                                         conhecimento=trechos,
+                                                         resumo=get_session_store().get_summary(session_id))
+            etapa_contexto.set(tokens=contexto.total)
+        partes, uso = [], None
+        with tracing.span("openai.completion", modelo=MODELO_CHAT) as etapa_llm:
+            t_inicio_llm = time.perf_counter()
+            stream = client.chat.completions.create(model=MODELO_CHAT, messages=contexto.mensagens, temperature=0.7,
+                                                    stream=True, stream_options={"include_usage": True})
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    uso = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not partes:
+                        resultado.primeiro_token_s = time.perf_counter() - t_inicio
+                        etapa_llm.set(ttft_ms=round((time.perf_counter() - t_inicio_llm) * 1000, 1))
+                    partes.append(chunk.choices[0].delta.content)
+        resposta = "".join(partes)
+
+        self.executor_pos_resposta.submit(session_id, tracing.bind(persistir_turno_chat), session_id, pergunta,
+                                          resposta, user_id, ASSISTENTE)
+        if chave_cache and resposta:
+            self.executor_pos_resposta.submit(session_id, tracing.bind(get_response_cache().store), *chave_cache,
+                                              pergunta, vetor_pergunta, resposta)
+        get_token_meter().record_usage(user_id, *usage_or_estimate(uso, contexto.mensagens, resposta, MODELO_CHAT))
+        if contexto.mensagens_omitidas:
+            self.executor_pos_resposta.submit(session_id, tracing.bind(atualizar_resumo_sessao), session_id,
+                                              list(historico), contexto.inicio_janela, self.openai_api_key)
+        historico.append({"role": "assistant", "content": resposta})
+
+    def fechar(self):
+        self.executor_pos_resposta.shutdown(wait=True)
+
+
+class TurnoGrafo:
+    """Uma pergunta pelo grafo LangGraph (run_graph), com o histórico da conversa como texto."""
+
+    def __init__(self):
+        self.codigos: List[str] = []
+
+    def nova_conversa(self, user_id: str) -> Dict:
+        return {"historico": []}
+
+    def executar(self, conversa: Dict, user_id: str, pergunta: str, resultado: ResultadoTurno, t_inicio: float):
+        from src.core.langgraph.graph_builder import run_graph
+        resposta = run_graph(pergunta, historico="\n".join(conversa["historico"]), user_id=user_id, agent_id=ASSISTENTE)
+        conversa["historico"] += [f"user: {pergunta}", f"assistant: {resposta}"]
+
+    def fechar(self):
+        pass
+
+
+def _usuario(turno, usuario: int, args, pausa: Latencia, inicio_em: float, resultados: List[ResultadoTurno],
+             lock: threading.Lock):
+    rng = random.Random(f"{args.semente}-pausa-{usuario}")
+    user_id = f"usuario-{usuario:04d}"
+    time.sleep(max(0.0, inicio_em - time.perf_counter()))
+    conversa = turno.nova_conversa(user_id)
+    for i, pergunta in enumerate(_perguntas_do_usuario(usuario, args.turnos, args.semente, turno.codigos)):
+        if i:
+            time.sleep(pausa.amostrar(rng))
+        resultado = ResultadoTurno(usuario, i, 0.0)
+        t0 = time.perf_counter()
+        try:
+            turno.executar(conversa, user_id, pergunta, resultado, t0)
+        except Exception as e:
+            resultado.erro = type(e).__name__
+        resultado.latencia_s = time.perf_counter() - t0
+        with lock:
+            resultados.append(resultado)
+
+
+def _configurar_ambiente(openai_url: str, mem0_url: str, pasta: str):
+    """Antes de importar o app: clientes apontados para os falsos e bancos/caches na pasta temporária."""
+    os.environ.update({
+        "OPENAI_API_KEY": "fake", "OPENAI_BASE_URL": openai_url,
+        "MEM0_API_KEY": "fake", "HUBBLET_MEM0_HOST": mem0_url, "MEM0_TELEMETRY": "False",
+        "HUBBLET_EMBEDDING_CACHE": os.path.join(pasta, "embeddings.db"),
+        "HUBBLET_MEM0_SPOOL": os.path.join(pasta, "mem0_spool.db"),
+        "HUBBLET_CHAT_DB": os.path.join(pasta, "chat_sessions.db"),
+        "HUBBLET_RESPONSE_CACHE": os.path.join(pasta, "responses.db"),
+        "HUBBLET_USAGE_DB": os.path.join(pasta, "token_usage.db"),
+        "HUBBLET_TRACE_FILE": os.path.join(pasta, "traces.jsonl"),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do turno do chat com OpenAI e mem0 falsos")
+    parser.add_argument("--usuarios", type=int, default=20)
+    parser.add_argument("--turnos", type=int, default=5, help="Perguntas por usuário")
+    parser.add_argument("--modo", choices=("chat", "grafo"), default="chat")
+    parser.add_argument("--pausa", default="exp:1.0", help="Tempo de leitura/digitação entre turnos (distribuição)")
+    parser.add_argument("--rampa", type=float, default=2.0, help="Segundos para todos os usuários entrarem")
+    parser.add_argument("--latencia-embeddings", default="lognormal:0.08,0.3")
+    parser.add_argument("--latencia-chat", default="lognormal:0.5,0.4", help="Até o primeiro pedaço da completion")
+    parser.add_argument("--intervalo-pedacos", type=float, default=0.02, help="Entre os pedaços do stream (s)")
+    parser.add_argument("--latencia-mem0", default="lognormal:0.15,0.5")
+    parser.add_argument("--erro-openai", type=float, default=0.0, help="Taxa de respostas 500 da OpenAI")
+    parser.add_argument("--erro-429", type=float, default=0.0, help="Taxa de respostas 429 da OpenAI")
+    parser.add_argument("--erro-mem0", type=float, default=0.0, help="Taxa de respostas 503 do mem0")
+    parser.add_argument("--semente", type=int, default=42)
+    gravacao = parser.add_mutually_exclusive_group()
+    gravacao.add_argument("--gravar", metavar="FITA", help="Grava respostas e latências dos servidores falsos")
+    gravacao.add_argument("--reproduzir", metavar="FITA", help="Repete uma rodada gravada com --gravar")
+    parser.add_argument("--json", metavar="ARQUIVO", help="Salva o resumo da rodada em JSON")
+    parser.add_argument("--verbose", action="store_true", help="Mostra o log do app durante a rodada")
+    parser.add_argument("--tracing", action="store_true", help="Rastreia as etapas do turno e relata os percentis de cada uma")
+    args = parser.parse_args()
+
+    cassete = None
+    if args.reproduzir:
+        cassete = Cassete(args.reproduzir, MODO_REPRODUZIR)
+        for nome in PARAMETROS_DA_RODADA: # A rodada gravada manda: mesmos usuários, perguntas e pausas
+            if nome in cassete.meta:
+                setattr(args, nome, cassete.meta[nome])
+    elif args.gravar:
+        cassete = Cassete(args.gravar, MODO_GRAVAR, meta={nome: getattr(args, nome) for nome in PARAMETROS_DA_RODADA})
+    if args.usuarios < 1 or args.turnos < 1:
+        parser.error("--usuarios e --turnos precisam ser pelo menos 1")
+    # Distribuições validadas antes de subir os servidores: um erro de digitação não vira exceção em cada thread
+    distribuicoes: Dict[str, Latencia] = {}
+    for opcao in ("pausa", "latencia_embeddings", "latencia_chat", "latencia_mem0"):
+        try:
+            distribuicoes[opcao] = Latencia.parse(getattr(args, opcao))
+        except ValueError as e:
+            parser.error(f"--{opcao.replace('_', '-')} '{getattr(args, opcao)}': {e}")
+
+    from src.devtools.fake_mem0 import start_fake_mem0
+    from src.devtools.fake_openai import start_fake_openai
+    openai_srv, _ = start_fake_openai(latencia_s=distribuicoes["latencia_embeddings"],
+                                      latencia_chat_s=distribuicoes["latencia_chat"],
+                                      intervalo_pedacos_s=args.intervalo_pedacos, taxa_erro_500=args.erro_openai,
+                                      taxa_erro_429=args.erro_429, semente=args.semente, cassete=cassete)
+    mem0_srv, _ = start_fake_mem0(latencia_s=distribuicoes["latencia_mem0"], taxa_falha=args.erro_mem0,
+                                  semente=args.semente + 1, cassete=cassete)
+    pasta = tempfile.mkdtemp(prefix="hubblet_carga_")
+    _configurar_ambiente(openai_srv.base_url, mem0_srv.base_url, pasta)
+    from src.core import tracing
+    tracing.set_enabled(args.tracing)
+
+    log_app = sys.stdout if args.verbose else io.StringIO()
+    if not args.verbose:
+        logging.getLogger("mem0").setLevel(logging.CRITICAL) # O SDK loga cada erro HTTP injetado
+    with contextlib.redirect_stdout(log_app):
+        turno = TurnoChat(os.environ["OPENAI_API_KEY"], pasta) if args.modo == "chat" else TurnoGrafo()
+        from src.core.memory_writer import get_memory_writer
+        get_memory_writer()
+
+    print(f"Modo {args.modo}: {args.usuarios} usuários x {args.turnos} turnos, pausa {args.pausa}, semente {args.semente}")
+    if cassete is not None:
+        print(f"Fita: {cassete.caminho} ({cassete.modo})")
+    else:
+        print(f"Latências: embeddings {args.latencia_embeddings}, chat {args.latencia_chat}, mem0 {args.latencia_mem0};"
+              f" erros: OpenAI 500 {args.erro_openai:.1%}, 429 {args.erro_429:.1%}, mem0 {args.erro_mem0:.1%}")
+
+    resultados: List[ResultadoTurno] = []
+    lock = threading.Lock()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(log_app):
+        threads = [threading.Thread(target=_usuario, args=(turno, u, args, distribuicoes["pausa"],
+                                                          t0 + args.rampa * u / args.usuarios, resultados, lock),
+                                    name=f"usuario-{u}")
+                   for u in range(args.usuarios)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - t0
+        turno.fechar()
+        get_memory_writer().stop()
+    openai_srv.shutdown()
+    mem0_srv.shutdown()
+    if cassete is not None:
+        cassete.salvar()
+
+    ok = [r for r in resultados if r.erro is None]
+    erros = Counter(r.erro for r in resultados if r.erro)
+    avisos = Counter(aviso for r in resultados for aviso in r.avisos)
+    resumo = {
+        "parametros": {nome: getattr(args, nome) for nome in PARAMETROS_DA_RODADA},
+        "turnos": len(resultados),
+        "turnos_ok": len(ok),
+        "duracao_s": duracao,
+        "vazao_turnos_s": len(ok) / duracao if duracao else 0.0,
+        "latencia_ms": _percentis([r.latencia_s for r in ok]),
+        "primeiro_token_ms": _percentis([r.primeiro_token_s for r in ok if r.primeiro_token_s is not None]),
+        "respostas_do_cache": sum(r.cache for r in ok),
+        "erros": dict(erros),
+        "avisos_recuperacao": dict(avisos),
+        "openai": {"requisicoes": openai_srv.requisicoes, "chat": openai_srv.chamadas_chat,
+                   "erros_injetados": openai_srv.erros_injetados},
+        "mem0": {"search": mem0_srv.contagem["search"], "add": mem0_srv.contagem["add"],
+                 "erros_injetados": mem0_srv.contagem["erros"]},
+    }
+    if args.tracing:
+        resumo["etapas_ms"] = tracing.get_collector().stage_summary()
+    if cassete is not None:
+        resumo["fita"] = {"modo": cassete.modo, "gravadas": cassete.gravadas, "reproduzidas": cassete.reproduzidas,
+                          "faltas": cassete.faltas}
+
+    print(f"\n{'':<18} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for rotulo, chave in (("turno", "latencia_ms"), ("primeiro token", "primeiro_token_ms")):
+        p = resumo[chave]
+        if p["p50"] == p["p50"]: # Sem NaN (o modo grafo não mede o primeiro token)
+            print(f"{rotulo:<18} {p['p50']:>8.0f} {p['p95']:>8.0f} {p['p99']:>8.0f} {p['max']:>8.0f}")
+    print(f"\nTurnos: {resumo['turnos_ok']}/{resumo['turnos']} ok em {duracao:.1f}s"
+          f" ({resumo['vazao_turnos_s']:.1f} turnos/s), {resumo['respostas_do_cache']} do cache de respostas")
+    print(f"Erros: {dict(erros) or 'nenhum'}")
+    print(f"Avisos de recuperação: {dict(avisos) or 'nenhum'}")
+    print(f"OpenAI: {openai_srv.requisicoes} requisições ({openai_srv.chamadas_chat} de chat,"
+          f" {openai_srv.erros_injetados} erros injetados); mem0: {resumo['mem0']['search']} search,"
+          f" {resumo['mem0']['add']} add, {resumo['mem0']['erros_injetados']} erros injetados")
+    if args.tracing:
+        print(f"\n{'etapa':<32} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+        for etapa in resumo["etapas_ms"]:
+            print(f"{etapa['etapa']:<32} {etapa['n']:>6} {etapa['p50_ms']:>8.1f} {etapa['p95_ms']:>8.1f}"
+                  f" {etapa['p99_ms']:>8.1f} {etapa['max_ms']:>8.1f}")
+        print(f"Traces em {tracing.get_collector().arquivo}")
+    if cassete is not None:
+        print(f"Fita: {cassete.gravadas} gravadas, {cassete.reproduzidas} reproduzidas, {cassete.faltas} faltas")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resumo, f, ensure_ascii=False, indent=2)
+    if not ok:
+        print("Nenhum turno concluído: a rodada não mediu nada.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Benchmark: latência por mensagem do SessionStore conforme o histórico cresce
+#
+# Uso: python -m src.benchmarks.session_store [--total 1000000] [--amostras 500]
+# O banco é criado em um diretório temporário; nada do histórico real é tocado.
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from src.data_persistence.chat_sessions.session_store import SessionStore
+
+
+def _crescer_historico(store: SessionStore, session_ids, quantidade: int):
+    """Insere `quantidade` mensagens em lote, distribuídas entre as sessões."""
+    conn = store._conn()
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO chat_messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+        ((session_ids[i % len(session_ids)], "user", "mensagem de preenchimento " * 8, "2025-01-01T00:00:00")
+         for i in range(quantidade)),
+    )
+    conn.execute("COMMIT")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência por mensagem do SessionStore")
+    parser.add_argument("--total", type=int, default=1_000_000, help="Tamanho final do histórico (mensagens)")
+    parser.add_argument("--amostras", type=int, default=500, help="Mensagens cronometradas em cada patamar")
+    parser.add_argument("--usuarios", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(os.path.join(tmp, "bench.db"))
+        session_ids = [store.create_session(f"user_{u}", "Chat de benchmark")["id"] for u in range(args.usuarios)]
+        alvo_sessao = session_ids[0]
+
+        patamares = [p for p in (1_000, 10_000, 100_000, 1_000_000, 10_000_000) if p <= args.total]
+        atual = 0
+        print(f"{'mensagens':>12} {'p50 (ms)':>10} {'p99 (ms)':>10} {'list (ms)':>10}")
+        for patamar in patamares:
+            _crescer_historico(store, session_ids, patamar - atual)
+            atual = patamar
+
+            tempos = []
+            for i in range(args.amostras):
+                t0 = time.perf_counter()
+                store.add_message(alvo_sessao, "user", f"mensagem {i}")
+                tempos.append((time.perf_counter() - t0) * 1000)
+            atual += args.amostras
+
+            t0 = time.perf_counter()
+            store.list_sessions("user_1")
+            t_list = (time.perf_counter() - t0) * 1000
+
+            tempos.sort()
+            p99 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))]
+            print(f"{patamar:>12,} {statistics.median(tempos):>10.3f} {p99:>10.3f} {t_list:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
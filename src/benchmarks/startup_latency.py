@@ -0,0 +1,82 @@
+# Benchmark: latência da primeira requisição e das seguintes, com e sem recursos compartilhados
+#
+# Uso: python -m src.benchmarks.startup_latency [--requisicoes 50] [--vetores 200000]
+# Compara (1) um cliente OpenAI novo por chamada contra o cliente do pool e
+# (2) ler o índice FAISS/chunks de um assistente a cada troca contra o registro.
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import faiss
+import numpy as np
+from openai import OpenAI
+
+from src.core.resources import file_version, get_openai_client, registry
+from src.devtools.fake_openai import start_fake_openai
+
+
+def _cronometrar(fn, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        fn()
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return tempos
+
+
+def _resumo(nome, tempos):
+    print(f"{nome:<38} primeira={tempos[0]:8.2f} ms  mediana demais={statistics.median(tempos[1:]):8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência de inicialização e primeira requisição")
+    parser.add_argument("--requisicoes", type=int, default=50)
+    parser.add_argument("--vetores", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    server, _ = start_fake_openai(dim=8)
+    try:
+        def cliente_novo():
+            OpenAI(api_key="fake", base_url=server.base_url).embeddings.create(input="olá", model="m")
+
+        def cliente_pool():
+            get_openai_client("fake", server.base_url).embeddings.create(input="olá", model="m")
+
+        _resumo("OpenAI() novo a cada chamada", _cronometrar(cliente_novo, args.requisicoes))
+        _resumo("get_openai_client (pool keep-alive)", _cronometrar(cliente_pool, args.requisicoes))
+    finally:
+        server.shutdown()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        faiss_file = os.path.join(tmp, "bench_faiss.index")
+        chunks_file = os.path.join(tmp, "bench_chunks.json")
+        index = faiss.IndexFlatL2(args.dim)
+        index.add(np.random.rand(args.vetores, args.dim).astype(np.float32))
+        faiss.write_index(index, faiss_file)
+        with open(chunks_file, "w", encoding="utf-8") as f:
+            json.dump([f"trecho {i} " * 100 for i in range(args.vetores)], f)
+        del index
+
+        def carregar_do_disco():
+            with open(chunks_file, "r", encoding="utf-8") as f:
+                json.load(f)
+            faiss.read_index(faiss_file)
+
+        def carregar_do_registro():
+            registry.get(("assistente", "bench", "chunks"), lambda: json.load(open(chunks_file, encoding="utf-8")),
+                         versao=file_version(chunks_file))
+            registry.get(("assistente", "bench", "faiss"), lambda: faiss.read_index(faiss_file),
+                         versao=file_version(faiss_file))
+
+        repeticoes = 5
+        _resumo(f"troca de assistente, disco ({args.vetores:,} vet.)", _cronometrar(carregar_do_disco, repeticoes))
+        _resumo("troca de assistente, registro", _cronometrar(carregar_do_registro, repeticoes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Etapas do turno do chat principal que não dependem do Streamlit
+#
+# A página (pagina_chat_principal em src/frontend/app.py) cuida da interface:
+# st.session_state, avisos e o stream da resposta na tela. As buscas de
+# contexto, a persistência da resposta e o resumo das mensagens antigas ficam
+# aqui, porque rodam nos pools de threads (sem acesso ao st.*) e são usadas
+# também fora do app, como no teste de carga (src.benchmarks.load_test).
+#
+# As gravações de uma sessão (pergunta, resposta, resumo) passam por uma
+# FilaPorSessao: rodam em ordem dentro da sessão, para o histórico salvo não
+# sair embaralhado, e em paralelo entre sessões diferentes.
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from src.core import tracing
+from src.core.context_builder import update_summary_if_needed
+from src.core.embeddings import embed_query # Embeddings de consulta passam pelo cache compartilhado
+from src.core.memory_writer import get_memory_writer
+from src.core.profile_memory import get_profile_cache
+from src.core.resources import get_openai_client, mem0_configured
+from src.core.retrieval import TaskResult, merge_memories, memory_text, reciprocal_rank_fusion, search_memories
+from src.data_persistence.chat_sessions.session_store import get_session_store
+from src.data_persistence.faiss.batch_search import get_micro_batcher
+
+ORCAMENTO_RECUPERACAO_S = 2.5 # Latência máxima das buscas de contexto antes de começar a gerar a resposta
+MODELO_CHAT = "gpt-3.5-turbo"
+LIMITE_MEMORIAS_CONTEXTO = 5
+FATOR_CANDIDATOS_HIBRIDOS = 4 # Cada busca (BM25 e FAISS) traz k * fator candidatos para a fusão
+
+AVISOS_RECUPERACAO = {
+    "perfil": "Não foi possível buscar memórias de perfil com mem0",
+    "contexto_agente": "Não foi possível buscar memórias de contexto (com agent_id) com mem0",
+    "contexto_usuario": "Não foi possível buscar memórias de contexto (apenas user_id) com mem0",
+    "conhecimento": "Erro durante a busca FAISS",
+}
+
+
+def buscar_conhecimento_assistente(pergunta: str, faiss_index, doc_chunks: List[str], client, k: int = 3,
+                                   indice_lexical=None) -> List[str]:
+    """BM25 + FAISS do assistente fundidos por RRF, trechos do mais ao menos relevante. Roda no pool de recuperação, sem acesso ao st.*."""
+    candidatos_lexicais = []
+    if indice_lexical is not None:
+        with tracing.span("bm25.search") as etapa_bm25:
+            lexical = indice_lexical.search(pergunta, k=k * FATOR_CANDIDATOS_HIBRIDOS)
+            etapa_bm25.set(confiante=lexical.confiante)
+        if lexical.confiante:
+            # A pergunta é um código raro achado literalmente: dispensa o embedding da pergunta
+            return [doc_chunks[i] for i in lexical.posicoes[:k] if i < len(doc_chunks)]
+        candidatos_lexicais = lexical.posicoes
+    query_embedding = embed_query(pergunta, client)
+    # Buscas de sessões simultâneas no mesmo assistente saem numa só chamada ao FAISS
+    with tracing.span("faiss.search"):
+        _, ids = get_micro_batcher().search(faiss_index, query_embedding, k * FATOR_CANDIDATOS_HIBRIDOS if candidatos_lexicais else k)
+    candidatos_densos = [i for i in ids.tolist() if i != -1]
+    posicoes = reciprocal_rank_fusion([candidatos_densos, candidatos_lexicais]) if candidatos_lexicais else candidatos_densos
+    return [doc_chunks[i] for i in posicoes[:k] if i < len(doc_chunks)] # Checa se o índice é válido
+
+
+def tarefas_recuperacao(pergunta: str, user_id: str, agent_id: Optional[str], mem0_client=None, faiss_index=None,
+                        doc_chunks=None, client=None, indice_lexical=None) -> Dict[str, Callable[[], object]]:
+    """Buscas de contexto do turno, para disparar em paralelo com fan_out."""
+    tarefas = {}
+    if mem0_client and user_id:
+        # ETAPA 1: Informações de perfil do usuário (APENAS com user_id), do cache compartilhado entre as sessões dele
+        tarefas["perfil"] = lambda: get_profile_cache().get(user_id)
+        # ETAPA 2.A: Memórias contextuais com user_id e agent_id (se agent_id existir)
+        if agent_id:
+            tarefas["contexto_agente"] = lambda: search_memories(
+                mem0_client, pergunta, user_id=user_id, agent_id=agent_id, limit=LIMITE_MEMORIAS_CONTEXTO)
+        # ETAPA 2.B: Memórias contextuais globais do usuário (apenas user_id)
+        tarefas["contexto_usuario"] = lambda: search_memories(
+            mem0_client, pergunta, user_id=user_id, limit=LIMITE_MEMORIAS_CONTEXTO)
+    if faiss_index is not None and faiss_index.ntotal > 0 and doc_chunks:
+        tarefas["conhecimento"] = lambda: buscar_conhecimento_assistente(
+            pergunta, faiss_index, doc_chunks, client, indice_lexical=indice_lexical)
+    return tarefas
+
+
+def contexto_recuperado(resultados: Dict[str, TaskResult]) -> Tuple[List[str], List[str]]:
+    """Textos das memórias (sem repetição) e trechos de conhecimento das buscas que terminaram a tempo."""
+    memorias_combinadas = merge_memories(
+        resultados[nome].valor for nome in ("perfil", "contexto_agente", "contexto_usuario")
+        if nome in resultados and resultados[nome].ok)
+    memorias = [memory_text(mem) for mem in memorias_combinadas if memory_text(mem)]
+    resultado_conhecimento = resultados.get("conhecimento")
+    trechos = resultado_conhecimento.valor if resultado_conhecimento and resultado_conhecimento.ok else []
+    return memorias, trechos
+
+
+class FilaPorSessao:
+    """Executor das tarefas de pós-resposta: em ordem de envio dentro de cada sessão, em paralelo entre sessões."""
+
+    def __init__(self, max_workers: int = 4, thread_name_prefix: str = "pos_resposta"):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._filas: Dict[str, Deque[Tuple[Callable, tuple]]] = {} # Sessões com tarefa rodando -> tarefas seguintes
+
+    def submit(self, session_id: str, fn: Callable, *args):
+        with self._lock:
+            fila = self._filas.get(session_id)
+            if fila is not None: # Já há um worker drenando esta sessão; ele executa esta tarefa na vez dela
+                fila.append((fn, args))
+                return
+            self._filas[session_id] = deque()
+        self._pool.submit(self._drenar, session_id, fn, args)
+
+    def _drenar(self, session_id: str, fn: Callable, args: tuple):
+        while True:
+            try:
+                fn(*args)
+            except Exception as e_tarefa:
+                print(f"Erro em tarefa de pós-resposta da sessão '{session_id}': {type(e_tarefa).__name__} - {e_tarefa}")
+            with self._lock:
+                fila = self._filas[session_id]
+                if not fila:
+                    del self._filas[session_id]
+                    return
+                fn, args = fila.popleft()
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+def salvar_mensagem_usuario(session_id: str, prompt: str):
+    """Salva a pergunta na sessão. Vai pela FilaPorSessao para não ultrapassar a resposta do turno anterior."""
+    try:
+        with tracing.span("sessao.add_message", papel="user"):
+            salva = get_session_store().add_message(session_id, "user", prompt)
+        if not salva:
+            print(f"Sessão com ID '{session_id}' não encontrada ao salvar a pergunta.")
+    except Exception as e_store:
+        print(f"Erro ao salvar a pergunta na sessão '{session_id}': {e_store}")
+
+
+def persistir_turno_chat(session_id: str, prompt: str, resposta: str, user_id: str, agent_id: str):
+    """Salva a resposta na sessão e enfileira a interação para o mem0. Roda em thread própria, sem acesso ao st.*."""
+    try:
+        with tracing.span("sessao.salvar_resposta"):
+            salva = get_session_store().add_message(session_id, "assistant", resposta)
+        if not salva:
+            print(f"Sessão com ID '{session_id}' não encontrada ao salvar a resposta.")
+    except Exception as e_store:
+        print(f"Erro ao salvar a resposta na sessão '{session_id}': {e_store}")
+
+    if user_id and mem0_configured():
+        # O envio ao mem0 acontece no worker write-behind; aqui é só um INSERT no spool local
+        messages_to_add_to_mem0 = [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": resposta}
+        ]
+        try:
+            with tracing.span("mem0.enfileirar"):
+                get_memory_writer().enqueue(messages_to_add_to_mem0, user_id=user_id, agent_id=agent_id or None)
+        except Exception as e_spool:
+            print(f"Erro ao enfileirar memória para o mem0: {type(e_spool).__name__} - {e_spool}")
+
+
+def atualizar_resumo_sessao(session_id: str, historico: List[Dict], inicio_janela: int, openai_api_key: str):
+    """Estende o resumo das mensagens que saíram da janela de contexto. Roda depois da resposta, sem acesso ao st.*."""
+    try:
+        with tracing.span("resumo.atualizar"):
+            atualizado = update_summary_if_needed(get_session_store(), session_id, historico, inicio_janela,
+                                                  get_openai_client(openai_api_key))
+        if atualizado:
+            print(f"Resumo da sessão '{session_id}' atualizado.")
+    except Exception as e_resumo:
+        print(f"Erro ao atualizar o resumo da sessão '{session_id}': {e_resumo}")
@@ -0,0 +1,151 @@
+# Divisão de documentos em trechos para indexação
+#
+# Lê o arquivo (ou o buffer do upload) em blocos, decodifica de forma
+# incremental e quebra o texto nas fronteiras naturais — títulos markdown,
+# parágrafos, frases e, em último caso, palavras — até um alvo de tokens,
+# com sobreposição configurável entre trechos vizinhos. Tudo é gerador: o
+# documento nunca é carregado inteiro e os trechos seguem direto para o
+# estágio de embeddings à medida que são produzidos.
+
+import codecs
+import re
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Tuple
+
+from src.core.tokenizer import count_tokens
+
+ALVO_TOKENS = 350            # ~1500 caracteres, o tamanho dos trechos fixos usados antes
+SOBREPOSICAO_TOKENS = 50
+TAMANHO_BLOCO_LEITURA = 1 << 20
+LIMITE_PENDENTE = 64 * 1024  # Texto sem linha em branco além disso é cortado na última quebra de linha
+AMOSTRA_ENCODING = 64 * 1024
+
+_RE_PARAGRAFO = re.compile(r"\n[ \t]*\n")
+_RE_TITULO = re.compile(r"^\s{0,3}#{1,6}\s")
+_RE_FRASE = re.compile(r"(?<=[.!?…;:])\s+")
+
+SEP_PARAGRAFO = "\n\n"
+SEP_FRASE = " "
+
+
+def detect_encoding(buffer: BinaryIO) -> str:
+    """'utf-8' se o começo do arquivo decodifica como UTF-8, senão 'latin-1'. Volta o buffer para onde estava."""
+    inicio = buffer.tell()
+    amostra = buffer.read(AMOSTRA_ENCODING)
+    buffer.seek(inicio)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(amostra, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def read_text(buffer: BinaryIO, encoding: str = None, tamanho_bloco: int = TAMANHO_BLOCO_LEITURA) -> Iterator[str]:
+    """Texto do buffer em pedaços, decodificado incrementalmente (caracteres multibyte nunca são cortados)."""
+    encoding = encoding or detect_encoding(buffer)
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    while True:
+        dados = buffer.read(tamanho_bloco)
+        if not dados:
+            break
+        texto = decoder.decode(dados)
+        if texto:
+            yield texto.replace("\r\n", "\n")
+    resto = decoder.decode(b"", final=True)
+    if resto:
+        yield resto
+
+
+def _unidades_do_paragrafo(paragrafo: str) -> Iterator[Tuple[bool, str]]:
+    """Separa títulos markdown (uma linha cada) do texto corrido do parágrafo."""
+    corrido: List[str] = []
+    for linha in paragrafo.split("\n"):
+        if _RE_TITULO.match(linha):
+            if corrido:
+                yield False, "\n".join(corrido)
+                corrido = []
+            yield True, linha.strip()
+        elif linha.strip():
+            corrido.append(linha)
+    if corrido:
+        yield False, "\n".join(corrido)
+
+
+def iter_units(pedacos: Iterable[str]) -> Iterator[Tuple[bool, str]]:
+    """(é_título, texto) para cada título e parágrafo do fluxo de texto."""
+    pendente = ""
+    for pedaco in pedacos:
+        pendente += pedaco
+        partes = _RE_PARAGRAFO.split(pendente)
+        pendente = partes.pop() # Pode continuar no próximo pedaço
+        if len(pendente) > LIMITE_PENDENTE:
+            corte = pendente.rfind("\n", 0, len(pendente) - 1)
+            corte = corte if corte > 0 else len(pendente)
+            partes.append(pendente[:corte])
+            pendente = pendente[corte:]
+        for paragrafo in partes:
+            yield from _unidades_do_paragrafo(paragrafo)
+    if pendente.strip():
+        yield from _unidades_do_paragrafo(pendente)
+
+
+def _segmentos(texto: str, alvo_tokens: int, contar: Callable[[str], int]) -> Iterator[Tuple[str, int, str]]:
+    """(texto, tokens, separador) de um parágrafo: inteiro se couber, senão por frases e, se preciso, por palavras."""
+    tokens = contar(texto)
+    if tokens <= alvo_tokens:
+        yield texto, tokens, SEP_PARAGRAFO
+        return
+    sep = SEP_PARAGRAFO
+    for frase in _RE_FRASE.split(texto):
+        if not frase:
+            continue
+        tokens = contar(frase)
+        if tokens <= alvo_tokens:
+            yield frase, tokens, sep
+        else:
+            # Frase maior que o trecho inteiro (tabela, texto sem pontuação): corta entre palavras
+            palavras = frase.split(" ")
+            por_parte = max(1, len(palavras) * alvo_tokens // tokens)
+            for i in range(0, len(palavras), por_parte):
+                parte = " ".join(palavras[i:i + por_parte])
+                yield parte, contar(parte), sep
+                sep = SEP_FRASE
+        sep = SEP_FRASE
+
+
+def chunk_stream(pedacos: Iterable[str], alvo_tokens: int = ALVO_TOKENS, sobreposicao_tokens: int = SOBREPOSICAO_TOKENS,
+                 contar: Callable[[str], int] = count_tokens) -> Iterator[str]:
+    """Trechos de até ~`alvo_tokens`, quebrados em títulos/parágrafos/frases, repetindo até `sobreposicao_tokens` do trecho anterior."""
+    atual: List[Tuple[str, int, str]] = []
+    total = 0
+    tem_novo = False # Evita emitir um trecho que seria só a sobreposição do anterior
+
+    def montar() -> str:
+        return "".join((sep if i else "") + texto for i, (texto, _, sep) in enumerate(atual))
+
+    for titulo, texto in iter_units(pedacos):
+        if titulo and tem_novo and total >= alvo_tokens // 4:
+            # Nova seção: fecha o trecho corrente sem sobreposição, para não misturar seções
+            yield montar()
+            atual, total, tem_novo = [], 0, False
+        for segmento in _segmentos(texto, alvo_tokens, contar):
+            if atual and total + segmento[1] > alvo_tokens:
+                if tem_novo:
+                    yield montar()
+                manter, soma = [], 0
+                for anterior in reversed(atual):
+                    if soma + anterior[1] > sobreposicao_tokens:
+                        break
+                    manter.insert(0, anterior)
+                    soma += anterior[1]
+                atual, total, tem_novo = manter, soma, False
+            atual.append(segmento)
+            total += segmento[1]
+            tem_novo = True
+    if tem_novo:
+        yield montar()
+
+
+def chunk_buffer(buffer: BinaryIO, alvo_tokens: int = ALVO_TOKENS, sobreposicao_tokens: int = SOBREPOSICAO_TOKENS,
+                 encoding: str = None) -> Iterator[str]:
+    """Atalho: trechos de um arquivo binário aberto ou do buffer de um upload."""
+    return chunk_stream(read_text(buffer, encoding), alvo_tokens, sobreposicao_tokens)
@@ -0,0 +1,209 @@
+# Montagem do prompt do chat principal dentro de um orçamento de tokens
+#
+# Cada turno tem um orçamento de tokens de prompt por modelo. Instruções e a
+# pergunta atual entram sempre; memórias do mem0 e trechos do FAISS têm um
+# teto cada (em ordem de relevância); as mensagens mais recentes entram
+# literalmente e as mais antigas são representadas por um resumo acumulado,
+# guardado no SessionStore e atualizado em incrementos depois da resposta
+# (nunca no caminho crítico do turno).
+
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from src.core.tokenizer import TOKENS_POR_MENSAGEM, TOKENS_RESPOSTA_PRIMING, count_tokens, truncate_to_tokens
+
+# Tokens de prompt por turno. Bem abaixo da janela dos modelos: o objetivo é custo e latência estáveis
+ORCAMENTO_POR_MODELO = {
+    "gpt-3.5-turbo": 6_000,
+    "gpt-4o-mini": 12_000,
+    "gpt-4o": 12_000,
+}
+ORCAMENTO_PADRAO = int(os.environ.get("HUBBLET_CONTEXT_BUDGET", 6_000))
+
+# Tetos por seção, como fração do orçamento
+FRACAO_INSTRUCOES = 0.30
+FRACAO_MEMORIAS = 0.15
+FRACAO_CONHECIMENTO = 0.30
+FRACAO_RESUMO = 0.10
+MIN_MENSAGENS_RECENTES = 4     # Últimas mensagens que entram antes de memórias e conhecimento
+LIMIAR_RESUMO = 6              # Mensagens fora da janela e ainda não resumidas antes de atualizar o resumo
+MODELO_RESUMO = "gpt-3.5-turbo"
+MAX_TOKENS_RESUMO = 400
+MAX_MENSAGENS_POR_RESUMO = 40  # Sessões antigas sem resumo são alcançadas em alguns turnos, sem estourar a janela do modelo
+MAX_TOKENS_MENSAGEM_RESUMO = 500
+
+CABECALHO_MEMORIAS = (
+    "Considere estas informações de interações passadas (memória de longo prazo via mem0) "
+    "ao formular sua resposta. É especialmente importante usar informações pessoais sobre o "
+    "usuário (como seu nome, preferências, etc.) se elas estiverem presentes nestas memórias:\n---\n"
+)
+CABECALHO_CONHECIMENTO = "Use as seguintes informações da base de conhecimento para responder à pergunta do usuário:\n"
+CABECALHO_RESUMO = "Resumo da parte anterior desta conversa (as mensagens mais recentes vêm a seguir):\n"
+
+
+def budget_for_model(model: str) -> int:
+    if "HUBBLET_CONTEXT_BUDGET" in os.environ:
+        return ORCAMENTO_PADRAO
+    return ORCAMENTO_POR_MODELO.get(model, ORCAMENTO_PADRAO)
+
+
+@dataclass
+class ContextoMontado:
+    mensagens: List[Dict]
+    tokens: Dict[str, int] = field(default_factory=dict)  # Tokens por seção
+    orcamento: int = 0
+    inicio_janela: int = 0      # Índice (no histórico) da primeira mensagem incluída literalmente
+    mensagens_omitidas: int = 0 # Mensagens que ficaram fora da janela e ainda não estão no resumo
+
+    @property
+    def total(self) -> int:
+        return sum(self.tokens.values())
+
+
+def _empacotar(itens: List[str], separador: str, teto: int, model: str) -> List[str]:
+    """Itens (em ordem de relevância) que cabem em `teto` tokens; o primeiro é truncado se sozinho não couber."""
+    escolhidos, usados = [], 0
+    custo_sep = count_tokens(separador, model)
+    for item in itens:
+        custo = count_tokens(item, model) + (custo_sep if escolhidos else 0)
+        if usados + custo <= teto:
+            escolhidos.append(item)
+            usados += custo
+        elif not escolhidos:
+            escolhidos.append(truncate_to_tokens(item, teto, model))
+            break
+        else:
+            break
+    return escolhidos
+
+
+class ContextBuilder:
+    """Decide o que entra no prompt de cada turno e quanto cada parte consome."""
+
+    def __init__(self, model: str = "gpt-3.5-turbo", orcamento: Optional[int] = None):
+        self.model = model
+        self.orcamento = orcamento or budget_for_model(model)
+
+    def _custo(self, texto: str) -> int:
+        return TOKENS_POR_MENSAGEM + count_tokens(texto, self.model)
+
+    def build(self, historico: List[Dict], instrucoes: Optional[str] = None, memorias: Optional[List[str]] = None,
+              conhecimento: Optional[List[str]] = None, resumo: Optional[Dict] = None) -> ContextoMontado:
+        """Monta as mensagens: [memórias, conhecimento, instruções, resumo, histórico recente]. A última mensagem do histórico é a pergunta atual."""
+        tokens = {"overhead": TOKENS_RESPOSTA_PRIMING}
+        restante = self.orcamento - TOKENS_RESPOSTA_PRIMING
+
+        msg_instrucoes = None
+        if instrucoes:
+            texto = truncate_to_tokens(instrucoes, int(self.orcamento * FRACAO_INSTRUCOES), self.model)
+            msg_instrucoes = {"role": "system", "content": texto}
+            tokens["instrucoes"] = self._custo(texto)
+            restante -= tokens["instrucoes"]
+
+        # A pergunta atual e as mensagens mais recentes têm prioridade sobre memórias e conhecimento
+        fim = len(historico)
+        inicio = fim
+        tokens["historico"] = 0
+        while inicio > 0:
+            custo = self._custo(historico[inicio - 1].get("content") or "")
+            if inicio < fim and (fim - inicio >= MIN_MENSAGENS_RECENTES or custo > restante):
+                break
+            inicio -= 1
+            tokens["historico"] += custo
+            restante -= custo
+
+        msg_memorias = None
+        if memorias:
+            teto = min(int(self.orcamento * FRACAO_MEMORIAS), restante) - self._custo(CABECALHO_MEMORIAS)
+            escolhidas = _empacotar(memorias, "\n---\n", teto, self.model) if teto > 0 else []
+            if escolhidas:
+                msg_memorias = {"role": "system", "content": CABECALHO_MEMORIAS + "\n---\n".join(escolhidas)}
+                tokens["memorias"] = self._custo(msg_memorias["content"])
+                restante -= tokens["memorias"]
+
+        msg_conhecimento = None
+        if conhecimento:
+            teto = min(int(self.orcamento * FRACAO_CONHECIMENTO), restante) - self._custo(CABECALHO_CONHECIMENTO)
+            escolhidos = _empacotar(conhecimento, "\n\n", teto, self.model) if teto > 0 else []
+            if escolhidos:
+                msg_conhecimento = {"role": "system", "content": CABECALHO_CONHECIMENTO + "\n\n".join(escolhidos)}
+                tokens["conhecimento"] = self._custo(msg_conhecimento["content"])
+                restante -= tokens["conhecimento"]
+
+        # Mensagens já cobertas pelo resumo não precisam voltar literalmente
+        cobertas = min(resumo["messages_covered"], len(historico)) if resumo else 0
+        msg_resumo = None
+        if resumo and cobertas > 0 and inicio > 0:
+            texto = truncate_to_tokens(resumo["summary"], int(self.orcamento * FRACAO_RESUMO), self.model)
+            msg_resumo = {"role": "system", "content": CABECALHO_RESUMO + texto}
+            tokens["resumo"] = self._custo(msg_resumo["content"])
+            restante -= tokens["resumo"]
+
+        # O que sobrou do orçamento vai para mais histórico recente
+        while inicio > cobertas:
+            custo = self._custo(historico[inicio - 1].get("content") or "")
+            if custo > restante:
+                break
+            inicio -= 1
+            tokens["historico"] += custo
+            restante -= custo
+
+        mensagens = [m for m in (msg_memorias, msg_conhecimento, msg_instrucoes, msg_resumo) if m]
+        # Índices seguem as posições do histórico salvo, por isso mensagens vazias só são puladas aqui
+        mensagens.extend({"role": m["role"], "content": m["content"]} for m in historico[inicio:]
+                         if m.get("role") and m.get("content"))
+        return ContextoMontado(
+            mensagens=mensagens,
+            tokens=tokens,
+            orcamento=self.orcamento,
+            inicio_janela=inicio,
+            mensagens_omitidas=max(0, inicio - cobertas),
+        )
+
+
+def format_breakdown(contexto: ContextoMontado) -> str:
+    """Linha de log com o consumo de tokens por seção."""
+    partes = " ".join(f"{nome}={valor}" for nome, valor in contexto.tokens.items() if nome != "overhead")
+    return (f"{partes} | total={contexto.total}/{contexto.orcamento} tokens, "
+            f"janela a partir da mensagem {contexto.inicio_janela}, {contexto.mensagens_omitidas} fora do resumo")
+
+
+def summarize_messages(client, resumo_anterior: Optional[str], mensagens: List[Dict],
+                       model: str = MODELO_RESUMO) -> str:
+    """Resumo acumulado: o resumo anterior mais as mensagens que acabaram de sair da janela."""
+    conversa = "\n".join(f"{m['role']}: {truncate_to_tokens(m['content'], MAX_TOKENS_MENSAGEM_RESUMO, model)}"
+                         for m in mensagens)
+    partes = []
+    if resumo_anterior:
+        partes.append(f"Resumo até aqui:\n{resumo_anterior}")
+    partes.append(f"Novas mensagens:\n{conversa}")
+    resposta = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": (
+                "Você mantém o resumo de uma conversa entre um usuário e um assistente. Atualize o resumo "
+                "incorporando as novas mensagens. Preserve fatos, decisões, preferências e pendências; "
+                "descarte cumprimentos e repetições. Responda apenas com o resumo, em português.")},
+            {"role": "user", "content": "\n\n".join(partes)},
+        ],
+        temperature=0.2,
+        max_tokens=MAX_TOKENS_RESUMO,
+    )
+    return (resposta.choices[0].message.content or "").strip()
+
+
+def update_summary_if_needed(store, session_id: str, historico: List[Dict], inicio_janela: int, client,
+                             model: str = MODELO_RESUMO) -> bool:
+    """Estende o resumo da sessão em direção a `inicio_janela` quando há mensagens suficientes fora dele. Retorna True se atualizou."""
+    atual = store.get_summary(session_id) or {"summary": "", "messages_covered": 0}
+    cobertas = atual["messages_covered"]
+    if inicio_janela - cobertas < LIMIAR_RESUMO:
+        return False
+    ate = min(inicio_janela, cobertas + MAX_MENSAGENS_POR_RESUMO)
+    novas = [m for m in historico[cobertas:ate] if m.get("role") and m.get("content")]
+    resumo = summarize_messages(client, atual["summary"], novas, model)
+    if not resumo:
+        return False
+    store.save_summary(session_id, resumo, ate)
+    return True
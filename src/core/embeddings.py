@@ -0,0 +1,164 @@
+# Pipeline de geração de embeddings em lote
+#
+# Agrupa vários trechos por requisição (limitado por um orçamento de tokens),
+# dispara os lotes em paralelo num pool de threads limitado e repete com
+# backoff quando a API devolve rate limit ou erro transitório. A saída fica
+# sempre alinhada com a lista de entrada: posição i -> embedding do texto i
+# (ou None se o texto estava vazio ou falhou definitivamente).
+# Antes de chamar a API, os textos passam pelo cache de embeddings
+# endereçado por conteúdo; só os que faltam (e sem repetição) são enviados.
+
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError
+
+from src.core import tracing
+from src.data_persistence.cache.embedding_cache import get_embedding_cache
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIMENSION = 1536
+
+MAX_TOKENS_POR_LOTE = 100_000  # Bem abaixo do limite de tokens por requisição da API de embeddings
+MAX_ITENS_POR_LOTE = 256
+MAX_WORKERS = 4
+MAX_TENTATIVAS = 6
+JANELA_STREAM = 1024  # Trechos acumulados do gerador antes de disparar os lotes (limita a memória)
+
+_ERROS_TRANSITORIOS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+def estimate_tokens(texto: str) -> int:
+    """Estimativa barata de tokens usada só para dimensionar os lotes."""
+    return max(1, len(texto) // 4)
+
+
+def build_batches(textos: Sequence[str], max_tokens: int = MAX_TOKENS_POR_LOTE,
+                  max_itens: int = MAX_ITENS_POR_LOTE) -> List[List[int]]:
+    """Agrupa os índices dos textos não vazios em lotes que respeitam o orçamento de tokens."""
+    lotes, atual, tokens_atual = [], [], 0
+    for i, texto in enumerate(textos):
+        if not texto or not texto.strip():
+            continue
+        tokens = estimate_tokens(texto)
+        if atual and (tokens_atual + tokens > max_tokens or len(atual) >= max_itens):
+            lotes.append(atual)
+            atual, tokens_atual = [], 0
+        atual.append(i)
+        tokens_atual += tokens
+    if atual:
+        lotes.append(atual)
+    return lotes
+
+
+def _embed_batch(client: OpenAI, textos: List[str], model: str, max_tentativas: int) -> List[np.ndarray]:
+    espera = 0.5
+    for tentativa in range(1, max_tentativas + 1):
+        try:
+            resp = client.embeddings.create(input=textos, model=model)
+            # A API devolve um item por entrada, identificado por `index`
+            ordenados = sorted(resp.data, key=lambda d: d.index)
+            return [np.asarray(d.embedding, dtype=np.float32) for d in ordenados]
+        except _ERROS_TRANSITORIOS:
+            if tentativa == max_tentativas:
+                raise
+            time.sleep(espera + random.uniform(0, espera))
+            espera = min(espera * 2, 20.0)
+
+
+def embed_texts(textos: Sequence[str], client: OpenAI, model: str = EMBEDDING_MODEL,
+                max_tokens_por_lote: int = MAX_TOKENS_POR_LOTE, max_itens_por_lote: int = MAX_ITENS_POR_LOTE,
+                max_workers: int = MAX_WORKERS, max_tentativas: int = MAX_TENTATIVAS,
+                on_error: Optional[Callable[[List[int], Exception], None]] = None,
+                usar_cache: bool = True) -> List[Optional[np.ndarray]]:
+    """Gera embeddings para `textos`, preservando o alinhamento com a lista de entrada."""
+    resultado: List[Optional[np.ndarray]] = [None] * len(textos)
+    cache = get_embedding_cache() if usar_cache else None
+    if cache is not None:
+        resultado = cache.get_many(model, textos)
+
+    # Textos que ainda faltam, sem repetição: cada texto distinto vai à API uma única vez
+    pendentes: Dict[str, List[int]] = {}
+    for i, texto in enumerate(textos):
+        if resultado[i] is None and texto and texto.strip():
+            pendentes.setdefault(texto, []).append(i)
+    unicos = list(pendentes)
+    lotes = build_batches(unicos, max_tokens_por_lote, max_itens_por_lote)
+    if not lotes:
+        return resultado
+
+    def processar(indices: List[int]):
+        try:
+            vetores = _embed_batch(client, [unicos[i] for i in indices], model, max_tentativas)
+        except Exception as e:
+            if on_error:
+                on_error([j for i in indices for j in pendentes[unicos[i]]], e)
+            return
+        if cache is not None:
+            cache.put_many(model, [unicos[i] for i in indices], vetores)
+        for i, vetor in zip(indices, vetores):
+            for j in pendentes[unicos[i]]:
+                resultado[j] = vetor
+
+    if max_workers <= 1 or len(lotes) == 1:
+        for indices in lotes:
+            processar(indices)
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(lotes))) as pool:
+            list(pool.map(processar, lotes))
+    return resultado
+
+
+def embed_stream(trechos: Iterable[str], client: OpenAI, janela: int = JANELA_STREAM,
+                 **kwargs) -> Iterator[Tuple[str, Optional[np.ndarray]]]:
+    """(trecho, embedding) à medida que o gerador de trechos produz; só `janela` trechos ficam em memória por vez."""
+    trechos = iter(trechos)
+    while True:
+        bloco = list(islice(trechos, janela))
+        if not bloco:
+            return
+        yield from zip(bloco, embed_texts(bloco, client, **kwargs))
+
+
+def embed_query(texto: str, client: OpenAI, model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """Embedding de uma única consulta, passando pelo cache. Levanta a exceção da API se falhar."""
+    with tracing.span("openai.embedding") as etapa:
+        cache = get_embedding_cache()
+        vetor = cache.get_many(model, [texto])[0]
+        etapa.set(cache=vetor is not None)
+        if vetor is None:
+            vetor = _embed_batch(client, [texto], model, MAX_TENTATIVAS)[0]
+            cache.put_many(model, [texto], [vetor])
+        return vetor
+
+
+async def aembed_query(texto: str, client: AsyncOpenAI, model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """Versão assíncrona de `embed_query` (mesmo cache e mesmas tentativas), para o servidor HTTP."""
+    with tracing.span("openai.embedding") as etapa:
+        return await _aembed_query(texto, client, model, etapa)
+
+
+async def _aembed_query(texto: str, client: AsyncOpenAI, model: str, etapa) -> np.ndarray:
+    cache = get_embedding_cache()
+    vetor = cache.get_many(model, [texto])[0]
+    etapa.set(cache=vetor is not None)
+    if vetor is not None:
+        return vetor
+    espera = 0.5
+    for tentativa in range(1, MAX_TENTATIVAS + 1):
+        try:
+            resp = await client.embeddings.create(input=[texto], model=model)
+            break
+        except _ERROS_TRANSITORIOS:
+            if tentativa == MAX_TENTATIVAS:
+                raise
+            await asyncio.sleep(espera + random.uniform(0, espera))
+            espera = min(espera * 2, 20.0)
+    vetor = np.asarray(resp.data[0].embedding, dtype=np.float32)
+    cache.put_many(model, [texto], [vetor])
+    return vetor
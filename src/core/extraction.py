@@ -0,0 +1,143 @@
+# Extração de texto de documentos por tipo de arquivo
+#
+# Texto puro (.txt, .md, ...) é só decodificado. PDF, DOCX, PPTX e HTML vão
+# para o docling, que devolve markdown (os títulos alimentam o divisor de
+# trechos). O docling é pesado em CPU, então roda num pool de processos: um
+# conversor por processo, criado uma vez. O resultado é guardado no cache de
+# extração pelo hash do arquivo. Se um processo do pool morrer (falta de
+# memória, crash do docling), o pool quebrado é descartado e o próximo envio
+# cria outro; só os arquivos em andamento naquele pool falham.
+
+import io
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from src.core.chunking import detect_encoding
+from src.data_persistence.cache.extraction_cache import file_key, get_extraction_cache
+
+EXTENSOES_TEXTO = {".txt", ".md", ".markdown", ".csv", ".json", ".log", ".rst"}
+EXTENSOES_DOCLING = {".pdf", ".docx", ".pptx", ".html", ".htm"}
+TAMANHO_MAX_TEXTO = 2 * 1024 * 1024       # 2MB por arquivo de texto
+TAMANHO_MAX_DOCUMENTO = 20 * 1024 * 1024  # PDF/DOCX/HTML carregam imagens e layout além do texto
+VERSAO_EXTRATOR = {"docling": "docling-1"} # Mudou o extrator? Suba a versão para invalidar o cache
+MAX_PROCESSOS = max(1, (os.cpu_count() or 2) - 1) # Deixa um núcleo para o Streamlit
+
+
+class ExtractionError(Exception):
+    """O arquivo não pôde ser convertido em texto."""
+
+
+def extractor_for(nome: str) -> Optional[str]:
+    """'texto', 'docling' ou None (tipo não suportado)."""
+    extensao = os.path.splitext(nome)[1].lower()
+    if extensao in EXTENSOES_TEXTO:
+        return "texto"
+    if extensao in EXTENSOES_DOCLING:
+        return "docling"
+    return None
+
+
+def _decodificar(dados: bytes) -> str:
+    buffer = io.BytesIO(dados)
+    return dados.decode(detect_encoding(buffer), errors="replace").replace("\r\n", "\n")
+
+
+_conversor = None
+
+
+def _extrair_docling(nome: str, dados: bytes) -> str:
+    """Roda dentro do processo do pool (função de módulo para poder ser enviada ao processo)."""
+    global _conversor
+    try:
+        from docling.datamodel.base_models import DocumentStream
+        from docling.document_converter import DocumentConverter
+    except ImportError as e:
+        raise ExtractionError("docling não está instalado (pip install docling)") from e
+    if _conversor is None:
+        _conversor = DocumentConverter() # Carrega os modelos de layout uma vez por processo
+    resultado = _conversor.convert(DocumentStream(name=nome, stream=io.BytesIO(dados)))
+    return resultado.document.export_to_markdown()
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=MAX_PROCESSOS)
+    return _pool
+
+
+def _descartar_pool(quebrado: ProcessPoolExecutor):
+    """Tira do módulo um pool com processo morto; a próxima chamada a `_get_pool` cria outro."""
+    global _pool
+    with _pool_lock:
+        if _pool is quebrado:
+            _pool = None
+    quebrado.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_extraction(nome: str, dados: bytes) -> Future:
+    """Agenda a extração de um arquivo. O Future devolve o texto (ou levanta ExtractionError)."""
+    extrator = extractor_for(nome)
+    futuro: Future = Future()
+    if extrator is None:
+        futuro.set_exception(ExtractionError(f"Tipo de arquivo não suportado: {os.path.splitext(nome)[1] or nome}"))
+        return futuro
+
+    if extrator == "texto":
+        # Decodificar não compensa nem o cache nem o custo de enviar os bytes a outro processo
+        futuro.set_result(_decodificar(dados))
+        return futuro
+
+    cache = get_extraction_cache()
+    chave = file_key(dados)
+    versao = VERSAO_EXTRATOR[extrator]
+    texto = cache.get(chave, versao)
+    if texto is not None:
+        futuro.set_result(texto)
+        return futuro
+
+    for tentativa in range(2): # Um pool quebrado por um arquivo anterior é trocado uma vez
+        pool = _get_pool()
+        try:
+            futuro_pool = pool.submit(_extrair_docling, nome, dados)
+            break
+        except BrokenProcessPool as e:
+            _descartar_pool(pool)
+            if tentativa == 1:
+                futuro.set_exception(ExtractionError(f"{nome}: pool de extração indisponível ({e})"))
+                return futuro
+
+    def concluir(f: Future):
+        try:
+            texto_extraido = f.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                _descartar_pool(pool)
+            futuro.set_exception(e if isinstance(e, ExtractionError) else ExtractionError(f"{nome}: {e}"))
+            return
+        cache.put(chave, versao, texto_extraido)
+        futuro.set_result(texto_extraido)
+
+    futuro_pool.add_done_callback(concluir)
+    return futuro
+
+
+def extract_text(nome: str, dados: bytes) -> str:
+    """Versão síncrona de `submit_extraction`."""
+    return submit_extraction(nome, dados).result()
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,174 @@
+# Fila de ingestão de documentos enviados
+#
+# Um upload vira um job: extração do texto (pool de processos do docling),
+# divisão em trechos e embeddings rodam em threads de fundo, fora do script
+# do Streamlit. A página só consulta o progresso do job e, quando ele
+# termina, aplica o resultado (trechos + vetores) no índice da sessão. Os
+# trechos de cada arquivo seguem sob demanda para o embed_stream, sem juntar
+# o upload inteiro em memória antes dos embeddings.
+
+import io
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from src.core.chunking import chunk_buffer, chunk_stream
+from src.core.embeddings import embed_stream
+from src.core.extraction import ExtractionError, extractor_for, submit_extraction
+from src.core.resources import get_openai_client
+
+MAX_JOBS_SIMULTANEOS = 2
+MANTER_JOBS_S = 3600 # Jobs concluídos e não consultados são descartados depois disso
+PESO_EXTRACAO = 0.3  # Fração da barra de progresso dedicada à extração; o resto é embeddings
+
+
+@dataclass
+class IngestionJob:
+    id: str
+    arquivos: List[str]
+    etapa: str = "na fila" # na fila -> extraindo (já com embeddings) -> gerando embeddings -> concluído | erro
+    arquivos_extraidos: int = 0
+    trechos_total: int = 0
+    trechos_processados: int = 0
+    avisos: List[Tuple[str, str]] = field(default_factory=list) # (nível: info/warning/error, mensagem)
+    trechos: List[str] = field(default_factory=list)
+    embeddings: List[np.ndarray] = field(default_factory=list)
+    nomes_processados: List[str] = field(default_factory=list)
+    criado_em: float = field(default_factory=time.time)
+    concluido_em: Optional[float] = None
+
+    @property
+    def concluido(self) -> bool:
+        return self.etapa in ("concluído", "erro")
+
+    @property
+    def progresso(self) -> float:
+        extracao = self.arquivos_extraidos / len(self.arquivos) if self.arquivos else 1.0
+        # trechos_total só conhece os arquivos já divididos: a fração é ponderada pelos arquivos alcançados
+        embeddings = self.trechos_processados / self.trechos_total * extracao if self.trechos_total else float(self.concluido)
+        return min(1.0, PESO_EXTRACAO * extracao + (1 - PESO_EXTRACAO) * embeddings)
+
+    def avisar(self, nivel: str, mensagem: str):
+        self.avisos.append((nivel, mensagem))
+
+
+def _trechos_dos_arquivos(arquivos: List[Tuple[str, bytes]], futuros: Dict[str, Future],
+                          job: IngestionJob) -> Iterator[str]:
+    """Trechos de cada arquivo, na ordem do upload, produzidos sob demanda para o embed_stream."""
+    for nome, dados in arquivos:
+        try:
+            if nome in futuros:
+                pedacos = chunk_stream([futuros[nome].result()])
+            else:
+                # Texto puro é dividido direto do buffer, decodificado em blocos
+                pedacos = chunk_buffer(io.BytesIO(dados))
+        except ExtractionError as e:
+            job.avisar("error", f"Erro ao extrair o texto de '{nome}': {e}")
+            continue
+        finally:
+            job.arquivos_extraidos += 1
+        trechos_arquivo = 0
+        for trecho in pedacos:
+            trechos_arquivo += 1
+            job.trechos_total += 1 # Cresce à medida que os arquivos são divididos
+            yield trecho
+        if trechos_arquivo:
+            job.nomes_processados.append(nome)
+        else:
+            job.avisar("warning", f"Arquivo '{nome}' não contém texto extraível ou está vazio após a leitura.")
+    job.etapa = "gerando embeddings" # Todos os arquivos divididos; faltam os últimos lotes
+
+
+def run_ingestion(arquivos: List[Tuple[str, bytes]], openai_api_key: str, job: Optional[IngestionJob] = None) -> IngestionJob:
+    """Extrai, divide e gera embeddings de `arquivos` (nome, bytes). Só os pares (trecho, embedding) válidos entram no resultado.
+
+    Os trechos vão direto do divisor para o embed_stream: os embeddings do primeiro arquivo começam enquanto os
+    seguintes ainda são divididos, e só uma janela de trechos sem embedding fica em memória.
+    """
+    job = job or IngestionJob(id=uuid.uuid4().hex, arquivos=[nome for nome, _ in arquivos])
+    job.etapa = "extraindo"
+    # Documentos ricos vão todos para o pool de uma vez; os resultados são lidos na ordem do upload
+    futuros: Dict[str, Future] = {}
+    for nome, dados in arquivos:
+        if extractor_for(nome) == "texto":
+            continue
+        try:
+            futuros[nome] = submit_extraction(nome, dados)
+        except Exception as e: # Erro ao agendar (cache, pool) afeta só este arquivo
+            futuros[nome] = Future()
+            futuros[nome].set_exception(ExtractionError(f"{nome}: {type(e).__name__} - {e}"))
+
+    falhas = []
+    client = get_openai_client(openai_api_key)
+    trechos = _trechos_dos_arquivos(arquivos, futuros, job)
+    for trecho, emb in embed_stream(trechos, client, on_error=lambda indices, e: falhas.append((len(indices), e))):
+        job.trechos_processados += 1
+        # doc_chunks[i] precisa continuar casando com o vetor i do FAISS
+        if emb is not None:
+            job.trechos.append(trecho)
+            job.embeddings.append(emb)
+    for qtd, e in falhas:
+        job.avisar("error", f"Erro ao gerar embeddings para um lote de {qtd} trecho(s): {e}. Esses trechos serão ignorados.")
+    if len(job.embeddings) < job.trechos_total:
+        job.avisar("warning", "Falha ao gerar embeddings para alguns ou todos os trechos, embora houvesse conteúdo.")
+    job.etapa = "concluído"
+    job.concluido_em = time.time()
+    return job
+
+
+class IngestionQueue:
+    """Executa jobs de ingestão em segundo plano e guarda o estado para a UI consultar."""
+
+    def __init__(self, max_jobs_simultaneos: int = MAX_JOBS_SIMULTANEOS,
+                 executar: Callable[..., IngestionJob] = run_ingestion):
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs_simultaneos, thread_name_prefix="ingestao")
+        self._executar = executar
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, arquivos: List[Tuple[str, bytes]], openai_api_key: str) -> str:
+        job = IngestionJob(id=uuid.uuid4().hex, arquivos=[nome for nome, _ in arquivos])
+        with self._lock:
+            self._descartar_antigos()
+            self._jobs[job.id] = job
+        self._executor.submit(self._rodar, job, arquivos, openai_api_key)
+        return job.id
+
+    def _rodar(self, job: IngestionJob, arquivos: List[Tuple[str, bytes]], openai_api_key: str):
+        try:
+            self._executar(arquivos, openai_api_key, job)
+        except Exception as e:
+            job.avisar("error", f"Erro ao processar os arquivos: {e}")
+            job.etapa = "erro"
+            job.concluido_em = time.time()
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    def discard(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _descartar_antigos(self):
+        limite = time.time() - MANTER_JOBS_S
+        for job_id in [j.id for j in self._jobs.values() if j.concluido_em and j.concluido_em < limite]:
+            del self._jobs[job_id]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    """Fila única por processo (sobrevive aos reruns do Streamlit)."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = IngestionQueue()
+    return _queue
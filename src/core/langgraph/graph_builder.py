@@ -1,38 +1,98 @@
 # Módulo para construir o grafo de conversação usando LangGraph
+#
+# Um nó roteador manda cada pedido para um de dois ramos: configuração (só a
+# IA configuradora) ou chat (memória e conhecimento em ramos paralelos que se
+# juntam antes da geração da resposta). Assim uma pergunta de chat faz uma
+# única chamada ao LLM. O grafo é compilado uma vez, na importação do módulo.
+#
+# `async_graph` tem a mesma forma com nós assíncronos (AsyncOpenAI,
+# AsyncMemoryClient, busca FAISS pelo micro-batcher), para o servidor HTTP de
+# src/api: a geração emite os pedaços da resposta pelo stream "custom" do
+# LangGraph, consumido por `astream_graph`.
+#
+# Quem executa o grafo pode passar `registrar_uso(prompt, completion, fonte)`:
+# o nó que chama o LLM o chama com o `usage` da API (ou a contagem do
+# tokenizer, se a resposta foi interrompida), como o chat principal faz com o
+# medidor de tokens.
 
-from typing import TypedDict, Annotated, Sequence
+from typing import AsyncIterator, Callable, Optional, TypedDict, Annotated, Sequence
+import asyncio
 import operator
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, END
-from mem0 import MemoryClient
-from src.data_persistence.faiss.faiss_retriever import search_knowledge, DIMENSION
-from openai import OpenAI
-import numpy as np
+from src.data_persistence.faiss.faiss_retriever import get_knowledge_retriever, search_knowledge
+from src.core import tracing
+from src.core.embeddings import aembed_query, embed_query
+from src.core.retrieval import fan_out, merge_memories, memory_text, search_memories
+from src.core.token_meter import usage_or_estimate
+from src.core.resources import get_async_mem0_client, get_async_openai_client, get_mem0_client, get_openai_client
 import os
 
+ORCAMENTO_RECUPERACAO_S = 2.5 # Latência máxima da recuperação de contexto antes da geração
+MODO_CHAT = "chat"
+MODO_CONFIGURACAO = "configuracao"
+SEM_MEMORIA = "Nenhuma memória relevante encontrada."
+MODELO_GRAFO = "gpt-3.5-turbo"
+LIMITE_MEMORIAS = 5
+
+RegistrarUso = Callable[[int, int, str], None] # (prompt_tokens, completion_tokens, fonte)
+
 # 1. Definir o Estado do Grafo
-class AgentState(TypedDict):
+class AgentState(TypedDict, total=False):
     user_input: str
-    memory_context: str
+    modo: str # MODO_CHAT (padrão) ou MODO_CONFIGURACAO
+    memory_context: str # No modo configuração, o histórico da configuração
     knowledge_context: str
     response: str
+    user_id: str # Opcionais: sem eles, USER_ID/AGENT_ID do ambiente
+    agent_id: str
+    registrar_uso: RegistrarUso # Opcional: recebe os tokens da chamada ao LLM
+
+def _ids(state: AgentState):
+    user_id = state.get('user_id') or os.environ.get("USER_ID", "default_user") # Or however you get the user_id for the graph
+    agent_id = state.get('agent_id') or os.environ.get("AGENT_ID", "graph_agent") # Or however you get the agent_id
+    return user_id, agent_id
+
+def _openai_api_key() -> str:
+    openai_api_key = os.environ.get("OPENAI_API_KEY", "")
+    if not openai_api_key:
+        raise ValueError("OPENAI_API_KEY não definido.")
+    return openai_api_key
+
+def _mensagens_resposta(state: AgentState) -> list:
+    memory_context = state.get('memory_context') or SEM_MEMORIA
+    knowledge_context = state.get('knowledge_context', '')
+    system_prompt = "Você é um assistente inteligente que responde de forma clara e objetiva, usando contexto de memória e conhecimento."
+    prompt = f"Usuário: {state['user_input']}\nMemória: {memory_context}\nConhecimento: {knowledge_context}"
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}]
+
+def _registrar_uso(state: AgentState, usage, mensagens: list, resposta: str):
+    """Repassa (prompt, completion, fonte) a quem executou o grafo, se pediu."""
+    registrar = state.get('registrar_uso')
+    if registrar is None or (usage is None and not resposta): # Falhou antes de gerar qualquer coisa
+        return
+    try:
+        registrar(*usage_or_estimate(usage, mensagens, resposta, MODELO_GRAFO))
+    except Exception as e_uso:
+        print(f"Erro ao registrar o uso de tokens: {type(e_uso).__name__} - {e_uso}")
+
+def _mensagens_configuracao(state: AgentState) -> list:
+    historico = state.get('memory_context', '')
+    prompt = f"Você é uma IA especialista em criar assistentes personalizados. Com base no histórico: {historico}, faça a próxima pergunta para configurar um novo assistente. Se todas as informações já foram coletadas, gere as instruções finais do assistente." 
+    return [{"role": "system", "content": "Conduza o usuário na configuração do assistente, perguntando apenas o necessário."}, {"role": "user", "content": prompt}]
 
 # 2. Definir os Nós do Grafo (Funções reais)
 def retrieve_memory(state: AgentState) -> AgentState:
     print("---NÓ: RECUPERAR MEMÓRIA---")
     user_input = state['user_input']
-    user_id = os.environ.get("USER_ID", "default_user") # Or however you get the user_id for the graph
-    agent_id = os.environ.get("AGENT_ID", "graph_agent") # Or however you get the agent_id
-    mem0_api_key = os.environ.get("MEM0_API_KEY")
-    if not mem0_api_key:
+    user_id, agent_id = _ids(state)
+    if not os.environ.get("MEM0_API_KEY"):
         print("AVISO: MEM0_API_KEY não configurada. Testes de memória podem falhar.")
-        mem0_client = MemoryClient()
-    else:
-        mem0_client = MemoryClient(api_key=mem0_api_key)
-    
-    memory_results = mem0_client.search(user_input, user_id=user_id, agent_id=agent_id)
-    # Format results for context; this might need adjustment based on mem0_client.search() output
+    mem0_client = get_mem0_client()
+
+    memory_results = merge_memories([search_memories(mem0_client, user_input, user_id=user_id, agent_id=agent_id)])
     if memory_results:
-        memory_context = "\n".join([res.get('text', '') for res in memory_results])
+        memory_context = "\n".join([memory_text(res) for res in memory_results])
     else:
         memory_context = "Nenhuma memória relevante encontrada."
     print(f"Contexto recuperado da memória: {memory_context}")
@@ -44,69 +104,186 @@ def retrieve_knowledge(state: AgentState) -> AgentState:
     openai_api_key = os.environ.get("OPENAI_API_KEY", "")
     if not openai_api_key:
         raise ValueError("OPENAI_API_KEY não definido.")
-    client = OpenAI(api_key=openai_api_key)
-    embedding_resp = client.embeddings.create(input=user_input, model="text-embedding-ada-002")
-    query_vector = np.array(embedding_resp.data[0].embedding, dtype=np.float32)
-    distances, indices = search_knowledge(query_vector, k=3)
-    knowledge_context = f"Índices encontrados: {indices}, Distâncias: {distances}"
-    print(f"Contexto recuperado do conhecimento: {knowledge_context}")
+    client = get_openai_client(openai_api_key)
+    query_vector = embed_query(user_input, client)
+    resultados = search_knowledge(query_vector, k=3)
+    knowledge_context = "\n\n".join(r.texto for r in resultados if r.texto)
+    print(f"Contexto recuperado do conhecimento: {len(resultados)} trechos.")
     return {"knowledge_context": knowledge_context}
 
+def _dentro_do_orcamento(nome: str, fn, padrao: dict) -> dict:
+    """Roda um nó de recuperação com o orçamento de latência; se falhar ou estourar, segue com `padrao`."""
+    resultado = fan_out({nome: fn}, orcamento_s=ORCAMENTO_RECUPERACAO_S)[nome]
+    if resultado.ok:
+        return resultado.valor
+    motivo = "tempo esgotado" if resultado.expirou else resultado.erro
+    print(f"Recuperação de {nome} ignorada ({motivo}).")
+    return padrao
+
+def recuperar_memoria(state: AgentState) -> AgentState:
+    return _dentro_do_orcamento("memoria", lambda: retrieve_memory(state), {"memory_context": SEM_MEMORIA})
+
+def recuperar_conhecimento(state: AgentState) -> AgentState:
+    return _dentro_do_orcamento("conhecimento", lambda: retrieve_knowledge(state), {"knowledge_context": ""})
+
 def generate_response(state: AgentState) -> AgentState:
     print("---NÓ: GERAR RESPOSTA---")
-    user_input = state['user_input']
-    memory_context = state['memory_context']
-    knowledge_context = state['knowledge_context']
-    openai_api_key = os.environ.get("OPENAI_API_KEY", "")
-    if not openai_api_key:
-        raise ValueError("OPENAI_API_KEY não definido.")
-    client = OpenAI(api_key=openai_api_key)
-    system_prompt = "Você é um assistente inteligente que responde de forma clara e objetiva, usando contexto de memória e conhecimento."
-    prompt = f"Usuário: {user_input}\nMemória: {memory_context}\nConhecimento: {knowledge_context}"
+    client = get_openai_client(_openai_api_key())
+    mensagens = _mensagens_resposta(state)
     chat_resp = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
+        model=MODELO_GRAFO,
+        messages=mensagens,
         temperature=0.2
     )
     response = chat_resp.choices[0].message.content.strip()
+    _registrar_uso(state, chat_resp.usage, mensagens, response)
     print(f"Resposta gerada: {response}")
     return {"response": response}
 
 # 2. Definir os Nós do Grafo (Funções reais)
 def ia_configuradora(state: AgentState) -> AgentState:
     print("---NÓ: IA CONFIGURADORA---")
-    openai_api_key = os.environ.get("OPENAI_API_KEY", "")
-    if not openai_api_key:
-        raise ValueError("OPENAI_API_KEY não definido.")
-    client = OpenAI(api_key=openai_api_key)
-    historico = state.get('memory_context', '')
-    prompt = f"Você é uma IA especialista em criar assistentes personalizados. Com base no histórico: {historico}, faça a próxima pergunta para configurar um novo assistente. Se todas as informações já foram coletadas, gere as instruções finais do assistente." 
+    client = get_openai_client(_openai_api_key())
+    mensagens = _mensagens_configuracao(state)
     chat_resp = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": "Conduza o usuário na configuração do assistente, perguntando apenas o necessário."}, {"role": "user", "content": prompt}],
+        model=MODELO_GRAFO,
+        messages=mensagens,
         temperature=0.2
     )
     proxima_pergunta = chat_resp.choices[0].message.content.strip()
+    _registrar_uso(state, chat_resp.usage, mensagens, proxima_pergunta)
     print(f"Pergunta/instrução gerada: {proxima_pergunta}")
     return {"response": proxima_pergunta}
 
+# Versões assíncronas dos nós (servidor HTTP): sem bloquear o event loop e sem threads por requisição
+async def aretrieve_memory(state: AgentState) -> AgentState:
+    user_id, agent_id = _ids(state)
+    mem0_client = await get_async_mem0_client()
+    resultado = await search_memories(mem0_client, state['user_input'], user_id=user_id, agent_id=agent_id,
+                                      limit=LIMITE_MEMORIAS)
+    memory_results = merge_memories([resultado])
+    return {"memory_context": "\n".join(memory_text(res) for res in memory_results) or SEM_MEMORIA}
+
+async def aretrieve_knowledge(state: AgentState) -> AgentState:
+    client = get_async_openai_client(_openai_api_key())
+    query_vector = await aembed_query(state['user_input'], client)
+    resultados = await get_knowledge_retriever().search_async(query_vector, k=3)
+    return {"knowledge_context": "\n\n".join(r.texto for r in resultados if r.texto)}
+
+async def _dentro_do_orcamento_async(nome: str, coro, padrao: dict) -> dict:
+    try:
+        return await asyncio.wait_for(coro, ORCAMENTO_RECUPERACAO_S)
+    except asyncio.TimeoutError:
+        motivo = "tempo esgotado"
+    except Exception as e:
+        motivo = e
+    print(f"Recuperação de {nome} ignorada ({motivo}).")
+    return padrao
+
+async def arecuperar_memoria(state: AgentState) -> AgentState:
+    return await _dentro_do_orcamento_async("memoria", aretrieve_memory(state), {"memory_context": SEM_MEMORIA})
+
+async def arecuperar_conhecimento(state: AgentState) -> AgentState:
+    return await _dentro_do_orcamento_async("conhecimento", aretrieve_knowledge(state), {"knowledge_context": ""})
+
+async def agenerate_response(state: AgentState) -> AgentState:
+    """Gera a resposta em stream, emitindo cada pedaço no stream "custom" do grafo."""
+    client = get_async_openai_client(_openai_api_key())
+    escrever = get_stream_writer()
+    mensagens = _mensagens_resposta(state)
+    partes, usage = [], None
+    try:
+        stream = await client.chat.completions.create(model=MODELO_GRAFO, messages=mensagens, temperature=0.2,
+                                                      stream=True, stream_options={"include_usage": True})
+        async for chunk in stream:
+            if chunk.usage is not None: # Último chunk: usage real da chamada
+                usage = chunk.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                partes.append(delta)
+                escrever({"delta": delta})
+    finally:
+        # Também no cancelamento (timeout, cliente desconectado): o que já foi gerado é contado pelo tokenizer
+        _registrar_uso(state, usage, mensagens, "".join(partes))
+    return {"response": "".join(partes).strip()}
+
+async def aia_configuradora(state: AgentState) -> AgentState:
+    client = get_async_openai_client(_openai_api_key())
+    mensagens = _mensagens_configuracao(state)
+    chat_resp = await client.chat.completions.create(model=MODELO_GRAFO, messages=mensagens, temperature=0.2)
+    proxima_pergunta = chat_resp.choices[0].message.content.strip()
+    _registrar_uso(state, chat_resp.usage, mensagens, proxima_pergunta)
+    get_stream_writer()({"delta": proxima_pergunta})
+    return {"response": proxima_pergunta}
+
+def rotear(state: AgentState) -> AgentState:
+    modo = state.get('modo') or MODO_CHAT
+    if modo not in (MODO_CHAT, MODO_CONFIGURACAO):
+        raise ValueError(f"Modo desconhecido: {modo}")
+    return {"modo": modo}
+
+def escolher_ramo(state: AgentState):
+    """Configuração vai direto à IA configuradora; chat dispara memória e conhecimento em paralelo."""
+    if state['modo'] == MODO_CONFIGURACAO:
+        return "ia_configuradora"
+    return ["memoria", "conhecimento"]
+
 # 3. Construir o Grafo
-workflow = StateGraph(AgentState)
-workflow.add_node("ia_configuradora", ia_configuradora)
-workflow.add_node("memoria", retrieve_memory)
-workflow.add_node("conhecimento", retrieve_knowledge)
-workflow.add_node("resposta", generate_response)
-workflow.add_edge("ia_configuradora", "memoria")
-workflow.add_edge("memoria", "conhecimento")
-workflow.add_edge("conhecimento", "resposta")
-workflow.add_edge("resposta", END)
-workflow.set_entry_point("ia_configuradora")
-
-def run_graph(user_input: str) -> str:
-    state = {"user_input": user_input, "memory_context": "", "knowledge_context": "", "response": ""}
-    result = workflow.run(state)
+def build_graph(assincrono: bool = False):
+    workflow = StateGraph(AgentState)
+    nos = {
+        "roteador": rotear,
+        "ia_configuradora": aia_configuradora if assincrono else ia_configuradora,
+        "memoria": arecuperar_memoria if assincrono else recuperar_memoria,
+        "conhecimento": arecuperar_conhecimento if assincrono else recuperar_conhecimento,
+        "resposta": agenerate_response if assincrono else generate_response,
+    }
+    for nome, no in nos.items():
+        workflow.add_node(nome, tracing.traced(f"grafo.{nome}")(no)) # Cada nó é um span do turno.grafo
+    workflow.set_entry_point("roteador")
+    workflow.add_conditional_edges("roteador", escolher_ramo, ["ia_configuradora", "memoria", "conhecimento"])
+    workflow.add_edge(["memoria", "conhecimento"], "resposta") # Espera os dois ramos
+    workflow.add_edge("resposta", END)
+    workflow.add_edge("ia_configuradora", END)
+    return workflow.compile()
+
+graph = build_graph()
+async_graph = build_graph(assincrono=True)
+
+def _estado_inicial(user_input: str, modo: str, historico: str, user_id: Optional[str], agent_id: Optional[str],
+                    registrar_uso: Optional[RegistrarUso] = None) -> AgentState:
+    state = {"user_input": user_input, "modo": modo, "memory_context": historico if modo == MODO_CONFIGURACAO else ""}
+    if user_id:
+        state["user_id"] = user_id
+    if agent_id:
+        state["agent_id"] = agent_id
+    if registrar_uso:
+        state["registrar_uso"] = registrar_uso
+    return state
+
+def run_graph(user_input: str, modo: str = MODO_CHAT, historico: str = "", user_id: Optional[str] = None,
+              agent_id: Optional[str] = None, registrar_uso: Optional[RegistrarUso] = None) -> str:
+    with tracing.trace("turno.grafo", modo=modo, usuario=user_id):
+        result = graph.invoke(_estado_inicial(user_input, modo, historico, user_id, agent_id, registrar_uso))
     return result["response"]
 
+async def arun_graph(user_input: str, modo: str = MODO_CHAT, historico: str = "", user_id: Optional[str] = None,
+                     agent_id: Optional[str] = None, registrar_uso: Optional[RegistrarUso] = None) -> str:
+    with tracing.trace("turno.grafo", modo=modo, usuario=user_id):
+        result = await async_graph.ainvoke(_estado_inicial(user_input, modo, historico, user_id, agent_id,
+                                                           registrar_uso))
+    return result["response"]
+
+async def astream_graph(user_input: str, modo: str = MODO_CHAT, historico: str = "", user_id: Optional[str] = None,
+                        agent_id: Optional[str] = None, registrar_uso: Optional[RegistrarUso] = None) -> AsyncIterator[str]:
+    """Pedaços da resposta à medida que o LLM os gera."""
+    with tracing.trace("turno.grafo", modo=modo, usuario=user_id, stream=True):
+        async for evento in async_graph.astream(_estado_inicial(user_input, modo, historico, user_id, agent_id,
+                                                                registrar_uso),
+                                                stream_mode="custom"):
+            if evento.get("delta"):
+                yield evento["delta"]
+
 if __name__ == "__main__":
     print("Testando execução do LangGraph...")
     test_input = "Qual a relação entre gatos e felinos?"
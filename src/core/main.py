@@ -3,6 +3,7 @@
 from mem0 import MemoryClient # Importa o MemoryClient
 from src.data_persistence.faiss import faiss_retriever # Importa o módulo FAISS
 from src.core.langgraph.graph_builder import run_graph # Importa a função de execução do grafo
+from src.core.retrieval import search_memories # Busca no mem0 no formato aceito pelo SDK instalado
 import os # Para acessar variáveis de ambiente
 import numpy as np # Necessário para criar vetores de teste
 
@@ -23,7 +24,7 @@ def main():
     print("Memória de teste adicionada.")
 
     # Buscando na memória
-    results = mem0_client.search("Qual a mensagem de teste?", user_id=test_user, agent_id="main_agent")
+    results = search_memories(mem0_client, "Qual a mensagem de teste?", user_id=test_user, agent_id="main_agent")
     print(f"Resultado da busca na memória: {results}")
 
     # Exemplo de uso da busca de conhecimento (FAISS)
@@ -33,8 +34,8 @@ def main():
     try:
         mock_dimension = faiss_retriever.DIMENSION
         mock_query_vector = np.random.rand(mock_dimension).astype('float32')
-        distances, indices = faiss_retriever.search_knowledge(mock_query_vector, k=3)
-        print(f"Resultado da busca no FAISS (simulado): Distâncias={distances}, Índices={indices}")
+        resultados = faiss_retriever.search_knowledge(mock_query_vector, k=3)
+        print(f"Resultado da busca no FAISS (simulado): {[(r.fonte, round(r.distancia, 4)) for r in resultados]}")
     except Exception as e:
         print(f"Erro ao testar busca FAISS: {e}")
 
@@ -48,7 +49,7 @@ def main():
     except Exception as e:
         print(f"Erro ao executar o grafo LangGraph: {e}")
 
-    # Aqui virá a lógica principal: API, etc.
+    # A API HTTP fica em src/api/server.py: python -m src.api.server
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,251 @@
+# Fila write-behind para gravações no mem0
+#
+# O chat só enfileira a interação (um INSERT num spool SQLite local) e segue;
+# uma thread em segundo plano junta as interações pendentes de cada par
+# (user_id, agent_id) numa única chamada `add`, repete falhas com backoff e
+# só apaga do spool o que foi confirmado. Como o spool fica em disco, nada se
+# perde se o processo reiniciar: o worker retoma os itens pendentes. Sem o
+# mem0 configurado (MEM0_API_KEY) nada deve ser enfileirado; se mesmo assim
+# houver itens, o worker os devolve ao spool sem gastar tentativas e para.
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from src.core import tracing
+from src.core.resources import get_mem0_client, mem0_configured
+
+# Assume this script is in c:\hubblet ai\src\core
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')) # Points to c:\hubblet ai
+SPOOL_DIR = os.path.join(BASE_DIR, 'data', 'spool')
+SPOOL_FILE = os.environ.get("HUBBLET_MEM0_SPOOL", os.path.join(SPOOL_DIR, 'mem0_spool.db'))
+
+MAX_ITENS_POR_ENVIO = 20      # Interações combinadas numa única chamada add
+MAX_TENTATIVAS = 8            # Depois disso o item vai para a fila morta (status 'dead')
+INTERVALO_OCIOSO_S = 0.5
+RECLAMAR_APOS_S = 300         # Itens "em envio" há mais tempo que isso voltam para a fila (processo morreu)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mem0_spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    agent_id TEXT,
+    messages TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mem0_spool_due ON mem0_spool (status, next_attempt_at);
+"""
+
+
+class MemoryWriteBehind:
+    """Worker com spool durável que envia as interações ao mem0 fora do caminho da resposta."""
+
+    def __init__(self, client_factory: Callable[[], object], spool_file: str = SPOOL_FILE,
+                 max_itens_por_envio: int = MAX_ITENS_POR_ENVIO, max_tentativas: int = MAX_TENTATIVAS):
+        self.client_factory = client_factory
+        self.spool_file = spool_file
+        self.max_itens_por_envio = max_itens_por_envio
+        self.max_tentativas = max_tentativas
+        self.worker_id = uuid.uuid4().hex
+        self._client = None
+        self._local = threading.local()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[str, Optional[str]], None]] = []
+        self._lock = threading.Lock()
+        self.enviados = 0
+        self.chamadas_add = 0
+        self.falhas = 0
+        self.em_envio = 0
+        os.makedirs(os.path.dirname(os.path.abspath(spool_file)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.spool_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def add_listener(self, fn: Callable[[str, Optional[str]], None]):
+        """Registra um callback chamado (user_id, agent_id) depois de cada envio confirmado."""
+        self._listeners.append(fn)
+
+    def enqueue(self, messages: List[Dict], user_id: str, agent_id: Optional[str] = None):
+        """Grava a interação no spool e acorda o worker. Não faz chamada de rede."""
+        agora = time.time()
+        self._conn().execute(
+            "INSERT INTO mem0_spool (user_id, agent_id, messages, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, agent_id, json.dumps(messages, ensure_ascii=False), agora, agora),
+        )
+        self._acordar.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="mem0-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Pede para o worker parar depois do envio em andamento; o que sobrar fica no spool."""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                enviou = self.flush_once()
+            except Exception as e:
+                print(f"Erro no worker de memória: {type(e).__name__} - {e}")
+                enviou = False
+            if not enviou:
+                self._acordar.wait(INTERVALO_OCIOSO_S)
+                self._acordar.clear()
+
+    def _reservar_grupo(self) -> List[sqlite3.Row]:
+        """Reserva os itens vencidos mais antigos de um único par (user_id, agent_id)."""
+        conn = self._conn()
+        agora = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE mem0_spool SET status = 'pending', claimed_by = NULL "
+                "WHERE status = 'claimed' AND claimed_at < ?", (agora - RECLAMAR_APOS_S,))
+            primeiro = conn.execute(
+                "SELECT user_id, agent_id FROM mem0_spool WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY id LIMIT 1", (agora,)).fetchone()
+            if primeiro is None:
+                conn.execute("COMMIT")
+                return []
+            linhas = conn.execute(
+                "SELECT id, user_id, agent_id, messages, attempts FROM mem0_spool "
+                "WHERE status = 'pending' AND next_attempt_at <= ? AND user_id = ? AND agent_id IS ? "
+                "ORDER BY id LIMIT ?",
+                (agora, primeiro[0], primeiro[1], self.max_itens_por_envio)).fetchall()
+            conn.executemany(
+                "UPDATE mem0_spool SET status = 'claimed', claimed_by = ?, claimed_at = ? WHERE id = ?",
+                [(self.worker_id, agora, linha[0]) for linha in linhas])
+            conn.execute("COMMIT")
+            return linhas
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _devolver(self, ids: List[int]):
+        """Itens reservados voltam a pendentes, sem contar tentativa."""
+        self._conn().executemany("UPDATE mem0_spool SET status = 'pending', claimed_by = NULL WHERE id = ?",
+                                 [(i,) for i in ids])
+
+    @property
+    def parado(self) -> bool:
+        return self._parar.is_set()
+
+    def flush_once(self) -> bool:
+        """Envia um grupo de interações pendentes. Retorna False se não havia nada vencido (ou não há cliente)."""
+        linhas = self._reservar_grupo()
+        if not linhas:
+            return False
+        user_id, agent_id = linhas[0][1], linhas[0][2]
+        mensagens = [m for linha in linhas for m in json.loads(linha[3])]
+        ids = [linha[0] for linha in linhas]
+        conn = self._conn()
+        with self._lock:
+            self.em_envio += len(ids)
+        try:
+            if self._client is None:
+                self._client = self.client_factory()
+                if self._client is None:
+                    self._devolver(ids)
+                    self._parar.set()
+                    print("mem0 não configurado; o worker de memória parou (itens pendentes continuam no spool).")
+                    return False
+            params = {"messages": mensagens, "user_id": user_id}
+            if agent_id:
+                params["agent_id"] = agent_id
+            with tracing.trace("mem0.add", interacoes=len(ids)): # Lote de vários turnos: trace próprio
+                self._client.add(**params)
+        except Exception as e:
+            with self._lock:
+                self.falhas += 1
+            # O grupo pode juntar itens novos e itens já repetidos: backoff e fila morta são por item
+            agora, erro = time.time(), f"{type(e).__name__}: {e}"
+            atualizacoes = []
+            for linha in linhas:
+                tentativas = linha[4] + 1
+                status = "dead" if tentativas >= self.max_tentativas else "pending"
+                atualizacoes.append((status, tentativas, agora + min(2 ** tentativas, 300), erro, linha[0]))
+            conn.executemany(
+                "UPDATE mem0_spool SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "claimed_by = NULL, last_error = ? WHERE id = ?", atualizacoes)
+            mortos = sum(1 for a in atualizacoes if a[0] == "dead")
+            print(f"Falha ao enviar {len(ids)} interação(ões) ao mem0 ({mortos} para a fila morta): {e}")
+            return True
+        finally:
+            with self._lock:
+                self.em_envio -= len(ids)
+
+        conn.executemany("DELETE FROM mem0_spool WHERE id = ?", [(i,) for i in ids])
+        with self._lock:
+            self.enviados += len(ids)
+            self.chamadas_add += 1
+        for listener in self._listeners:
+            try:
+                listener(user_id, agent_id)
+            except Exception as e:
+                print(f"Erro em listener do worker de memória: {e}")
+        return True
+
+    def metrics(self) -> Dict[str, float]:
+        """Profundidade da fila e contadores do worker."""
+        conn = self._conn()
+        por_status = dict(conn.execute("SELECT status, COUNT(*) FROM mem0_spool GROUP BY status").fetchall())
+        mais_antigo = conn.execute(
+            "SELECT MIN(created_at) FROM mem0_spool WHERE status != 'dead'").fetchone()[0]
+        with self._lock:
+            return {
+                "pendentes": por_status.get("pending", 0) + por_status.get("claimed", 0),
+                "mortos": por_status.get("dead", 0),
+                "em_envio": self.em_envio,
+                "idade_mais_antigo_s": time.time() - mais_antigo if mais_antigo else 0.0,
+                "enviados": self.enviados,
+                "chamadas_add": self.chamadas_add,
+                "falhas": self.falhas,
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _cliente_mem0():
+    """Cliente do processo, ou None sem MEM0_API_KEY (o worker então para)."""
+    return get_mem0_client() if mem0_configured() else None
+
+
+def get_memory_writer(client_factory: Callable[[], object] = _cliente_mem0) -> MemoryWriteBehind:
+    """Worker único por processo, iniciado na primeira chamada."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = MemoryWriteBehind(client_factory)
+                writer.start()
+                atexit.register(writer.stop)
+                _writer = writer
+    return _writer
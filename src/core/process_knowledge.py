@@ -1,56 +1,297 @@
-# Script para processar e indexar conhecimento usando Docling e FAISS
+# Script para processar e indexar conhecimento usando embeddings da OpenAI e FAISS
+#
+# Indexação incremental: um manifesto guarda, para cada arquivo de
+# knowledge_sources/, o hash do conteúdo e os ids dos seus trechos no índice
+# (IndexIDMap2). A cada execução só os arquivos novos ou alterados são
+# divididos e vão para a API de embeddings; trechos de arquivos alterados ou
+# apagados saem do índice (remove_ids no Flat; IVF e HNSW são reconstruídos
+# sem eles, ver remove_chunk_ids). O progresso é gravado em arquivos
+# de checkpoint, então uma execução interrompida continua de onde parou. O
+# resultado final é publicado numa pasta nova em versoes/ (índice, metadados,
+# meta e manifesto) e só então o ponteiro knowledge_current.json passa a
+# apontar para ela: quem lê o índice nunca mistura arquivos de versões
+# diferentes (ver faiss_retriever).
 
+import hashlib
+import json
 import os
-from docling import process_documents # Supondo função de processamento Docling
-from src.data_persistence.faiss import faiss_retriever
-import faiss # Explicitly import faiss for faiss.write_index and faiss.IndexFlatL2
+import shutil
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import faiss # Explicitly import faiss for faiss.write_index
 import numpy as np
 
+from src.core.chunking import chunk_buffer, chunk_stream
+from src.core.embeddings import embed_texts
+from src.core.extraction import ExtractionError, extract_text, extractor_for
+from src.core.resources import get_openai_client
+from src.data_persistence.faiss import faiss_retriever, index_factory
+from src.data_persistence.faiss.bulk_ingest import add_in_blocks, next_ids, stack_embeddings, with_id_map
+from src.data_persistence.faiss.index_io import write_index_atomic
+
 # Diretórios
 # Assume this script is in c:\hubblet ai\src\core
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')) # Points to c:\hubblet ai
 SOURCES_DIR = os.path.join(BASE_DIR, 'knowledge_sources')
 INDEX_DIR = os.path.join(BASE_DIR, 'data', 'knowledge_base', 'faiss_index')
 INDEX_FILE = os.path.join(INDEX_DIR, 'knowledge.index')
+METADATA_FILE = faiss_retriever.METADATA_FILE
+MANIFEST_FILE = os.path.join(INDEX_DIR, 'knowledge_manifest.json') # arquivo -> hash, tamanho, mtime e ids dos trechos
+SUFIXO_CHECKPOINT = '.checkpoint'
+
+VERSAO_MANIFESTO = 1
+CHECKPOINT_A_CADA_TRECHOS = 5_000 # Trechos novos desde o último checkpoint
+CHECKPOINT_A_CADA_S = 60.0
+TAMANHO_BLOCO_HASH = 1 << 20
+
+
+def _checkpoint(caminho: str) -> str:
+    return caminho + SUFIXO_CHECKPOINT
+
+
+def _write_json_atomic(dados, caminho: str):
+    tmp_path = f"{caminho}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dados, f, ensure_ascii=False)
+    os.replace(tmp_path, caminho)
+
+
+def _read_json(caminho: str, padrao):
+    if not os.path.exists(caminho):
+        return padrao
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao ler {caminho}: {e}")
+        return padrao
+
+
+def file_hash(caminho: str) -> str:
+    """sha256 do arquivo, lido em blocos."""
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO_HASH), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def list_sources(sources_dir: str = SOURCES_DIR) -> List[str]:
+    return [fname for fname in sorted(os.listdir(sources_dir))
+            if os.path.isfile(os.path.join(sources_dir, fname)) and not fname.startswith('.')]
+
+
+def _assinatura(caminho: str, anterior: Optional[Dict]) -> Dict:
+    """Hash, tamanho e mtime do arquivo. Se tamanho e mtime não mudaram, o hash anterior é reaproveitado sem reler o arquivo."""
+    st = os.stat(caminho)
+    if anterior and anterior.get("tamanho") == st.st_size and anterior.get("mtime_ns") == st.st_mtime_ns:
+        return {"sha256": anterior["sha256"], "tamanho": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return {"sha256": file_hash(caminho), "tamanho": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _trechos_do_arquivo(caminho: str) -> List[str]:
+    fname = os.path.basename(caminho)
+    if extractor_for(fname) == "docling":
+        with open(caminho, 'rb') as f:
+            texto = extract_text(fname, f.read()) # Cacheado pelo hash: reindexar não reconverte o documento
+        return list(chunk_stream([texto]))
+    with open(caminho, 'rb') as f:
+        return list(chunk_buffer(f))
+
+
+def _novo_indice(dim: int = faiss_retriever.DIMENSION) -> faiss.Index:
+    return with_id_map(faiss.IndexFlatL2(dim))
+
+
+def remove_chunk_ids(index: faiss.Index, ids) -> faiss.Index:
+    """Remove os vetores dos `ids`. Só o Flat remove no lugar; IVF e HNSW são reconstruídos sem eles.
+
+    No IVF o remove_ids não falha, mas não compacta os ids internos enquanto o IndexIDMap2 compacta o id_map:
+    os dois se desalinham e as buscas devolvem ids trocados.
+    """
+    ids = np.asarray(sorted(ids), dtype=np.int64)
+    if len(ids) == 0:
+        return index
+    interno = faiss.downcast_index(index.index)
+    if isinstance(interno, faiss.IndexFlat):
+        index.remove_ids(ids)
+        return index
+    todos_ids = faiss.vector_to_array(index.id_map)
+    manter = ~np.isin(todos_ids, ids)
+    vetores = index_factory.all_vectors(index)[manter]
+    if faiss.try_extract_index_ivf(interno) is not None:
+        # Mesmos centróides (e codificador SQ/PQ): só as listas são refeitas, sem retreinar o k-means
+        vazio = faiss.clone_index(interno)
+        vazio.reset()
+        novo = with_id_map(vazio)
+        add_in_blocks(novo, vetores, ids=todos_ids[manter])
+        return novo
+    return index_factory.build_index(vetores, index_factory.describe_index(interno), ids=todos_ids[manter])
+
+
+def _publicado(caminho: str) -> str:
+    return faiss_retriever.published_file(caminho, faiss_retriever.published_version(INDEX_DIR), INDEX_DIR)
+
+
+def _carregar_estado() -> Tuple[faiss.Index, Dict, Dict]:
+    """Índice, manifesto e metadados de onde continuar: o checkpoint de uma execução interrompida ou a versão publicada."""
+    for origem, arquivos in (("checkpoint", [_checkpoint(p) for p in (INDEX_FILE, MANIFEST_FILE, METADATA_FILE)]),
+                             ("índice publicado", [_publicado(p) for p in (INDEX_FILE, MANIFEST_FILE, METADATA_FILE)])):
+        if not all(os.path.exists(p) for p in arquivos):
+            continue
+        index = faiss.read_index(arquivos[0])
+        manifesto = _read_json(arquivos[1], {})
+        metadados = _read_json(arquivos[2], {})
+        if manifesto.get("versao") != VERSAO_MANIFESTO or not isinstance(metadados, dict) \
+                or not isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            print(f"Estado em formato antigo ({origem}); o conhecimento será reindexado do zero.")
+            break
+        print(f"Continuando a partir do {origem} ({index.ntotal} vetores).")
+        return index, manifesto, metadados
+    return _novo_indice(), {"versao": VERSAO_MANIFESTO, "arquivos": {}}, {}
+
+
+def _reconciliar(index: faiss.Index, manifesto: Dict, metadados: Dict) -> faiss.Index:
+    """Descarta o que ficou pela metade numa interrupção: arquivos com trechos faltando e vetores/metadados sem dono."""
+    presentes: Set[int] = set(faiss.vector_to_array(index.id_map).tolist())
+    for fname, entrada in list(manifesto["arquivos"].items()):
+        if not all(i in presentes and str(i) in metadados for i in entrada["ids"]):
+            print(f"Trechos de '{fname}' incompletos no índice; o arquivo será reprocessado.")
+            del manifesto["arquivos"][fname]
+    referenciados = {i for entrada in manifesto["arquivos"].values() for i in entrada["ids"]}
+    orfaos = presentes - referenciados
+    if orfaos:
+        print(f"Removendo {len(orfaos)} vetores sem arquivo de origem.")
+        index = remove_chunk_ids(index, orfaos)
+    for chave in [c for c in metadados if int(c) not in referenciados]:
+        del metadados[chave]
+    return index
+
+
+def _gravar_checkpoint(index: faiss.Index, manifesto: Dict, metadados: Dict):
+    """Grava índice, metadados e, por último, o manifesto (cada arquivo com troca atômica)."""
+    write_index_atomic(index, _checkpoint(INDEX_FILE))
+    _write_json_atomic(metadados, _checkpoint(METADATA_FILE))
+    _write_json_atomic(manifesto, _checkpoint(MANIFEST_FILE))
+
+
+def publish(index: faiss.Index, manifesto: Dict, metadados: Dict, meta: Dict, index_dir: str = INDEX_DIR) -> str:
+    """Grava tudo numa pasta de versão nova e troca o ponteiro por último. Retorna o nome da versão.
+
+    A versão anterior fica em disco (um leitor pode ter acabado de resolver o ponteiro para ela); as mais antigas
+    e os arquivos soltos do formato sem versões são apagados.
+    """
+    anterior = faiss_retriever.published_version(index_dir)
+    versao = str(time.time_ns())
+    destino = lambda p: faiss_retriever.published_file(p, versao, index_dir)
+    os.makedirs(os.path.dirname(destino(INDEX_FILE)))
+    faiss.write_index(index, destino(INDEX_FILE))
+    _write_json_atomic(metadados, destino(METADATA_FILE))
+    index_factory.save_index_meta(meta, destino(faiss_retriever.META_FILE))
+    _write_json_atomic(manifesto, destino(MANIFEST_FILE))
+    _write_json_atomic({"versao": versao}, os.path.join(index_dir, faiss_retriever.PONTEIRO)) # O ponto da publicação
+
+    pasta_versoes = os.path.join(index_dir, faiss_retriever.PASTA_VERSOES)
+    for nome in os.listdir(pasta_versoes):
+        if nome not in (versao, anterior):
+            shutil.rmtree(os.path.join(pasta_versoes, nome), ignore_errors=True)
+    for caminho in (INDEX_FILE, METADATA_FILE, faiss_retriever.META_FILE, MANIFEST_FILE):
+        solto = faiss_retriever.published_file(caminho, None, index_dir)
+        if os.path.exists(solto):
+            os.remove(solto)
+    return versao
+
+
+def _migrar(index: faiss.Index) -> Tuple[faiss.Index, Dict]:
+    """O tipo do índice (Flat, IVF, HNSW...) depende do tamanho da base; a migração preserva os ids."""
+    return index_factory.upgrade_if_needed(index, index_factory.load_index_meta(_publicado(faiss_retriever.META_FILE)))
+
+
+def _remover_checkpoint():
+    for caminho in (INDEX_FILE, MANIFEST_FILE, METADATA_FILE):
+        if os.path.exists(_checkpoint(caminho)):
+            os.remove(_checkpoint(caminho))
+
 
 # Função para processar e indexar conhecimento
 def process_and_index_knowledge():
-    print("Iniciando processamento de conhecimento com Docling...")
-    # 1. Ler arquivos do diretório de fontes
-    sources = []
-    for fname in os.listdir(SOURCES_DIR):
-        fpath = os.path.join(SOURCES_DIR, fname)
-        if os.path.isfile(fpath):
-            with open(fpath, 'r', encoding='utf-8') as f:
-                sources.append(f.read())
-    if not sources:
-        print("Nenhuma fonte encontrada em knowledge/sources.")
+    print("Iniciando processamento de conhecimento...")
+    # 1. Listar arquivos do diretório de fontes e comparar com o manifesto
+    sources = list_sources(SOURCES_DIR)
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    index, manifesto, metadados = _carregar_estado()
+    index = _reconciliar(index, manifesto, metadados)
+    arquivos = manifesto["arquivos"]
+
+    assinaturas = {fname: _assinatura(os.path.join(SOURCES_DIR, fname), arquivos.get(fname)) for fname in sources}
+    pendentes = [fname for fname in sources if arquivos.get(fname, {}).get("sha256") != assinaturas[fname]["sha256"]]
+    removidos = [fname for fname in arquivos if fname not in assinaturas]
+    # Arquivo só "tocado" (mesmo hash, outro mtime): atualiza a assinatura para não rehashear da próxima vez
+    for fname in sources:
+        if fname in arquivos and fname not in pendentes:
+            arquivos[fname].update(assinaturas[fname])
+    print(f"{len(sources)} arquivos: {len(pendentes)} novos ou alterados, {len(removidos)} removidos, "
+          f"{len(sources) - len(pendentes)} sem alteração.")
+    if not pendentes and not removidos:
+        if faiss_retriever.published_version(INDEX_DIR) is None or os.path.exists(_checkpoint(MANIFEST_FILE)):
+            index, meta = _migrar(index)
+            publish(index, manifesto, metadados, meta)
+        _remover_checkpoint()
+        print("Índice de conhecimento já está atualizado.")
         return
-    # 2. Processar conhecimento com Docling (gera embeddings e metadados)
-    print(f"Processando {len(sources)} documentos...")
-    embeddings, metadados = process_documents(sources) # embeddings: np.ndarray, metadados: list
-    # 2.1. Salvar metadados em JSON
-    metadados_file = os.path.join(INDEX_DIR, 'knowledge_metadata.json')
-    import json
-    with open(metadados_file, 'w', encoding='utf-8') as mf:
-        json.dump(metadados, mf, ensure_ascii=False, indent=2)
-    print(f"Metadados salvos em {metadados_file}")
-    # 3. Indexar vetores no FAISS
-    print("Indexando vetores no FAISS...")
-    if np.array(embeddings).shape[1] != faiss_retriever.DIMENSION:
-        print(f"[AVISO] Dimensão dos embeddings ({np.array(embeddings).shape[1]}) difere da configuração do índice FAISS ({faiss_retriever.DIMENSION})!")
-    # Ensure INDEX_DIR exists
-    if not os.path.exists(INDEX_DIR):
-        os.makedirs(INDEX_DIR)
-        print(f"Criado diretório de índice: {INDEX_DIR}")
-
-    index = faiss.IndexFlatL2(faiss_retriever.DIMENSION) # Use imported faiss
-    index.add(np.array(embeddings).astype('float32'))
-    faiss.write_index(index, INDEX_FILE) # Use imported faiss
-    print(f"Indexação concluída. Índice salvo em {INDEX_FILE}")
-    # 4. Log simples
-    print(f"{len(embeddings)} vetores indexados.")
+
+    # 2. Arquivos apagados: os vetores saem do índice pelos ids
+    for fname in removidos:
+        entrada = arquivos.pop(fname)
+        index = remove_chunk_ids(index, entrada["ids"])
+        for i in entrada["ids"]:
+            metadados.pop(str(i), None)
+        print(f"'{fname}' removido ({len(entrada['ids'])} trechos).")
+
+    # 3. Arquivos novos ou alterados, um por vez: dividir, gerar embeddings e só então trocar os trechos antigos
+    openai_api_key = os.environ.get("OPENAI_API_KEY", "")
+    if pendentes and not openai_api_key:
+        raise ValueError("OPENAI_API_KEY não definido.")
+    client = get_openai_client(openai_api_key) if pendentes else None
+    desde_checkpoint, ultimo_checkpoint = 0, time.monotonic()
+    for fname in pendentes:
+        try:
+            trechos = _trechos_do_arquivo(os.path.join(SOURCES_DIR, fname))
+        except (OSError, ExtractionError) as e:
+            print(f"Erro ao ler '{fname}': {e}. O arquivo será tentado de novo na próxima execução.")
+            continue
+        vetores = embed_texts(trechos, client) # Via cache: trechos repetidos não voltam à API
+        if any(v is None for v in vetores):
+            print(f"Falha ao gerar embeddings de parte de '{fname}'; a versão anterior (se houver) é mantida.")
+            continue
+        anterior = arquivos.pop(fname, None)
+        if anterior:
+            index = remove_chunk_ids(index, anterior["ids"])
+            for i in anterior["ids"]:
+                metadados.pop(str(i), None)
+        embeddings = stack_embeddings(vetores, index.d)
+        if len(embeddings) and embeddings.shape[1] != index.d:
+            raise ValueError(f"Dimensão dos embeddings ({embeddings.shape[1]}) difere da do índice ({index.d})")
+        ids = next_ids(index, len(embeddings))
+        add_in_blocks(index, embeddings, ids=ids, verbose=False)
+        for i, trecho in zip(ids.tolist(), trechos):
+            metadados[str(i)] = {"fonte": fname, "texto": trecho}
+        arquivos[fname] = {**assinaturas[fname], "ids": ids.tolist()}
+        print(f"'{fname}': {len(ids)} trechos indexados.")
+
+        desde_checkpoint += len(ids)
+        if desde_checkpoint >= CHECKPOINT_A_CADA_TRECHOS or time.monotonic() - ultimo_checkpoint >= CHECKPOINT_A_CADA_S:
+            _gravar_checkpoint(index, manifesto, metadados)
+            desde_checkpoint, ultimo_checkpoint = 0, time.monotonic()
+            print(f"Checkpoint gravado ({index.ntotal} vetores).")
+
+    # 4. Migra se preciso e publica índice, metadados, meta e manifesto juntos
+    index, meta = _migrar(index)
+    versao = publish(index, manifesto, metadados, meta)
+    _remover_checkpoint()
+    print(f"Indexação concluída. Versão {versao} publicada em {INDEX_DIR} ({index.ntotal} vetores, {meta['tipo_indice']}).")
 
 if __name__ == "__main__":
     print("Processamento e indexação de conhecimento iniciado.")
-    process_and_index_knowledge()
\ No newline at end of file
+    process_and_index_knowledge()
@@ -0,0 +1,158 @@
+# Cache das memórias de perfil do usuário
+#
+# A etapa de perfil da recuperação busca no mem0 sempre a mesma consulta fixa
+# (PROFILE_QUERY_TEXT) para o usuário, e o resultado quase nunca muda. O cache
+# guarda esse resultado por usuário no processo, compartilhado entre as
+# sessões dele: dentro do TTL a resposta sai da memória; vencido, o valor
+# antigo continua sendo servido enquanto uma busca em segundo plano o
+# atualiza. Cada `add` confirmado pelo worker de memória (memory_writer)
+# invalida o perfil do usuário e dispara essa atualização.
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from src.core.memory_writer import get_memory_writer
+from src.core.resources import get_mem0_client
+from src.core.retrieval import as_memory_list, search_memories
+
+PROFILE_QUERY_TEXT = "Informações de perfil do usuário, nome do usuário, preferências gerais do usuário."
+LIMITE_PERFIL = 3 # Limite menor, pois esperamos informações concisas de perfil
+TTL_S = float(os.environ.get("HUBBLET_PROFILE_CACHE_TTL", "600"))
+MAX_USUARIOS = 10_000
+
+
+@dataclass
+class _Entrada:
+    memorias: List[Dict]
+    carregado_em: float
+    geracao: int # Geração do usuário quando a busca começou; um add confirmado depois a torna antiga
+
+
+class ProfileMemoryCache:
+    """Memórias de perfil por usuário com TTL, atualização em segundo plano e invalidação por add."""
+
+    def __init__(self, client_factory: Callable[[], object] = get_mem0_client, ttl_s: float = TTL_S,
+                 limite: int = LIMITE_PERFIL, max_usuarios: int = MAX_USUARIOS):
+        self.client_factory = client_factory
+        self.ttl_s = ttl_s
+        self.limite = limite
+        self.max_usuarios = max_usuarios
+        self._entradas: Dict[str, _Entrada] = {}
+        self._geracoes: Dict[str, int] = {}
+        self._em_atualizacao: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="perfil-mem0")
+        self.hits = 0
+        self.antigos = 0   # Servidos vencidos enquanto a atualização roda
+        self.misses = 0
+        self.atualizacoes = 0
+        self.falhas = 0
+
+    def _buscar(self, user_id: str) -> List[Dict]:
+        with self._lock:
+            geracao = self._geracoes.get(user_id, 0)
+        try:
+            memorias = as_memory_list(search_memories(
+                self.client_factory(), PROFILE_QUERY_TEXT, user_id=user_id, limit=self.limite))
+        except Exception:
+            with self._lock:
+                self.falhas += 1
+            raise
+        with self._lock:
+            self.atualizacoes += 1
+            if len(self._entradas) >= self.max_usuarios and user_id not in self._entradas:
+                mais_antigo = min(self._entradas, key=lambda u: self._entradas[u].carregado_em)
+                del self._entradas[mais_antigo]
+            self._entradas[user_id] = _Entrada(memorias, time.monotonic(), geracao)
+        return memorias
+
+    def _atualizar(self, user_id: str) -> Future:
+        """Agenda uma busca para o usuário, reaproveitando a que já estiver em andamento."""
+        with self._lock:
+            futuro = self._em_atualizacao.get(user_id)
+            if futuro is None:
+                futuro = self._executor.submit(self._buscar, user_id)
+                self._em_atualizacao[user_id] = futuro
+                futuro.add_done_callback(lambda _f: self._fim_atualizacao(user_id, _f))
+        return futuro
+
+    def _fim_atualizacao(self, user_id: str, futuro: Future):
+        with self._lock:
+            if self._em_atualizacao.get(user_id) is futuro:
+                del self._em_atualizacao[user_id]
+        if futuro.exception() is not None:
+            print(f"Erro ao atualizar as memórias de perfil de '{user_id}': {futuro.exception()}")
+
+    def _fresca(self, user_id: str, entrada: _Entrada) -> bool:
+        """Chamar com o lock."""
+        return (entrada.geracao == self._geracoes.get(user_id, 0)
+                and time.monotonic() - entrada.carregado_em < self.ttl_s)
+
+    def get(self, user_id: str, timeout: Optional[float] = None) -> List[Dict]:
+        """Memórias de perfil do usuário. Só espera a rede na primeira busca dele no processo."""
+        with self._lock:
+            entrada = self._entradas.get(user_id)
+            if entrada is not None:
+                if self._fresca(user_id, entrada):
+                    self.hits += 1
+                    return entrada.memorias
+                self.antigos += 1
+            else:
+                self.misses += 1
+        futuro = self._atualizar(user_id)
+        if entrada is not None:
+            return entrada.memorias
+        return futuro.result(timeout)
+
+    def prefetch(self, user_id: str):
+        """Busca em segundo plano se o perfil não estiver em cache ou estiver vencido (ex.: ao abrir o chat)."""
+        with self._lock:
+            entrada = self._entradas.get(user_id)
+            if entrada is not None and self._fresca(user_id, entrada):
+                return
+        self._atualizar(user_id)
+
+    def invalidate(self, user_id: str):
+        """Marca o perfil como desatualizado e, se ele estava em cache, já busca o novo."""
+        with self._lock:
+            self._geracoes[user_id] = self._geracoes.get(user_id, 0) + 1
+            em_cache = user_id in self._entradas
+        if em_cache:
+            self._atualizar(user_id)
+
+    def on_memory_added(self, user_id: str, agent_id: Optional[str] = None):
+        """Listener do memory_writer: toda memória nova pode mudar o perfil."""
+        self.invalidate(user_id)
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.antigos + self.misses
+            return {
+                "usuarios": len(self._entradas),
+                "hits": self.hits,
+                "antigos": self.antigos,
+                "misses": self.misses,
+                "atualizacoes": self.atualizacoes,
+                "falhas": self.falhas,
+                "taxa_sem_rede": (self.hits + self.antigos) / total if total else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_profile_cache() -> ProfileMemoryCache:
+    """Cache único por processo, ligado ao worker de memória para invalidar a cada add confirmado."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                cache = ProfileMemoryCache()
+                get_memory_writer().add_listener(cache.on_memory_added)
+                _cache = cache
+    return _cache
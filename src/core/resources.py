@@ -0,0 +1,131 @@
+# Recursos de longa duração compartilhados pelo processo
+#
+# Clientes OpenAI/mem0 (com pool de conexões keep-alive) e os dados carregados
+# de cada assistente (índice FAISS, trechos) são criados uma vez e reutilizados
+# entre reruns do Streamlit, sessões de navegador e nós do grafo. Os dados de
+# um assistente são invalidados explicitamente quando ele é salvo de novo, e
+# também quando o arquivo em disco muda (a versão inclui o mtime).
+
+import asyncio
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from openai import AsyncOpenAI, OpenAI
+
+TIMEOUT_OPENAI_S = 60.0
+MEM0_HOST = os.environ.get("HUBBLET_MEM0_HOST") # Outro servidor mem0 (ex.: o falso de src.devtools.fake_mem0); padrão: api.mem0.ai
+
+_lock = threading.Lock()
+_openai_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+_mem0_client = None
+# Clientes assíncronos ficam presos ao event loop que os criou: um por (loop, ...)
+_async_openai_clients: Dict[Tuple[int, str, Optional[str]], AsyncOpenAI] = {}
+_async_mem0_clients: Dict[int, Any] = {}
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """Cliente OpenAI único por (chave, base_url).
+
+    O cliente HTTP do SDK já mantém um pool de conexões keep-alive; o ganho vem de reaproveitá-lo
+    em vez de abrir conexões (TCP + TLS) novas a cada chamada.
+    """
+    chave = (api_key, base_url)
+    client = _openai_clients.get(chave)
+    if client is None:
+        with _lock:
+            client = _openai_clients.get(chave)
+            if client is None:
+                client = OpenAI(api_key=api_key, base_url=base_url, timeout=TIMEOUT_OPENAI_S)
+                _openai_clients[chave] = client
+    return client
+
+
+def mem0_configured() -> bool:
+    """Há MEM0_API_KEY no ambiente (sem ela o MemoryClient falha ao ser criado)."""
+    return bool(os.environ.get("MEM0_API_KEY"))
+
+
+def get_mem0_client():
+    """MemoryClient único por processo (MEM0_API_KEY lida do ambiente)."""
+    global _mem0_client
+    if _mem0_client is None:
+        with _lock:
+            if _mem0_client is None:
+                from mem0 import MemoryClient
+                mem0_api_key = os.environ.get("MEM0_API_KEY")
+                _mem0_client = MemoryClient(api_key=mem0_api_key, host=MEM0_HOST) if mem0_api_key else MemoryClient(host=MEM0_HOST)
+    return _mem0_client
+
+
+def get_async_openai_client(api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """AsyncOpenAI único por (event loop, chave, base_url), para o servidor HTTP e os nós assíncronos do grafo."""
+    chave = (id(asyncio.get_running_loop()), api_key, base_url)
+    client = _async_openai_clients.get(chave)
+    if client is None:
+        with _lock:
+            client = _async_openai_clients.get(chave)
+            if client is None:
+                client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=TIMEOUT_OPENAI_S)
+                _async_openai_clients[chave] = client
+    return client
+
+
+async def get_async_mem0_client():
+    """AsyncMemoryClient único por event loop. A criação valida a chave com uma chamada síncrona, feita fora do loop."""
+    chave = id(asyncio.get_running_loop())
+    client = _async_mem0_clients.get(chave)
+    if client is None:
+        from mem0 import AsyncMemoryClient
+        mem0_api_key = os.environ.get("MEM0_API_KEY")
+        novo = await asyncio.to_thread(AsyncMemoryClient, api_key=mem0_api_key, host=MEM0_HOST)
+        with _lock:
+            client = _async_mem0_clients.setdefault(chave, novo)
+    return client
+
+
+class ResourceRegistry:
+    """Cache de objetos carregados do disco, com versão e invalidação por prefixo de chave."""
+
+    def __init__(self):
+        self._itens: Dict[Hashable, Tuple[Any, Any]] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, chave: tuple, loader: Callable[[], Any], versao: Any = None) -> Any:
+        """Devolve o objeto em cache para `chave` se a versão bate; senão carrega uma vez (sem corrida entre sessões)."""
+        item = self._itens.get(chave)
+        if item is not None and item[0] == versao:
+            return item[1]
+        with self._lock:
+            lock_chave = self._locks.setdefault(chave, threading.Lock())
+        with lock_chave:
+            item = self._itens.get(chave)
+            if item is not None and item[0] == versao:
+                return item[1]
+            valor = loader()
+            self._itens[chave] = (versao, valor)
+            return valor
+
+    def invalidate(self, *prefixo):
+        """Remove todas as entradas cuja chave começa com `prefixo`."""
+        with self._lock:
+            for chave in [c for c in self._itens if c[:len(prefixo)] == prefixo]:
+                del self._itens[chave]
+
+
+registry = ResourceRegistry()
+
+
+def file_version(path: str) -> Optional[Tuple[float, int]]:
+    """Versão barata de um arquivo (mtime, tamanho) para detectar mudanças feitas por outro processo."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def invalidate_assistant(safe_nome_assistente: str):
+    """Descarta os dados compartilhados de um assistente (chamar ao salvá-lo)."""
+    registry.invalidate("assistente", safe_nome_assistente)
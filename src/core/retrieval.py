@@ -0,0 +1,154 @@
+# Orquestrador de recuperação de contexto
+#
+# Dispara as buscas de um turno (memórias do mem0, conhecimento no FAISS...)
+# ao mesmo tempo num pool compartilhado, aplica um timeout por tarefa e um
+# orçamento total de latência, e devolve o que terminou a tempo. Tarefas que
+# estouram o prazo continuam no pool, mas o resultado delas é descartado.
+
+import asyncio
+import functools
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence
+
+from src.core import tracing
+
+ORCAMENTO_PADRAO_S = 2.5
+MAX_WORKERS = 16
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="recuperacao")
+
+
+@dataclass
+class TaskResult:
+    nome: str
+    valor: Any = None
+    erro: Optional[BaseException] = None
+    expirou: bool = False
+    duracao_s: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.erro is None and not self.expirou
+
+
+def fan_out(tarefas: Dict[str, Callable[[], Any]], orcamento_s: float = ORCAMENTO_PADRAO_S,
+            timeouts: Optional[Dict[str, float]] = None) -> Dict[str, TaskResult]:
+    """Executa as tarefas em paralelo e espera no máximo `orcamento_s` (ou o timeout de cada uma)."""
+    timeouts = timeouts or {}
+    inicio = time.perf_counter()
+    prazos, futuros = {}, {}
+    for nome, fn in tarefas.items():
+        futuros[_executor.submit(_cronometrar, tracing.bind(_etapa(nome, fn)))] = nome
+        prazos[nome] = inicio + min(timeouts.get(nome, orcamento_s), orcamento_s)
+
+    resultados: Dict[str, TaskResult] = {}
+    pendentes = set(futuros)
+    while pendentes:
+        agora = time.perf_counter()
+        for futuro in [f for f in pendentes if prazos[futuros[f]] <= agora]:
+            nome = futuros[futuro]
+            resultados[nome] = TaskResult(nome, expirou=True, duracao_s=agora - inicio)
+            pendentes.discard(futuro)
+        if not pendentes:
+            break
+        proximo_prazo = min(prazos[futuros[f]] for f in pendentes)
+        concluidos, pendentes = wait(pendentes, timeout=max(0.0, proximo_prazo - agora),
+                                     return_when=FIRST_COMPLETED)
+        for futuro in concluidos:
+            nome = futuros[futuro]
+            try:
+                valor, duracao = futuro.result()
+                resultados[nome] = TaskResult(nome, valor=valor, duracao_s=duracao)
+            except Exception as e:
+                resultados[nome] = TaskResult(nome, erro=e, duracao_s=time.perf_counter() - inicio)
+    return resultados
+
+
+def _etapa(nome: str, fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Com o rastreamento ligado, cada tarefa vira um span `recuperacao.<nome>` do turno."""
+    if not tracing.enabled():
+        return fn
+
+    def executar():
+        with tracing.span(f"recuperacao.{nome}"):
+            return fn()
+    return executar
+
+
+def _cronometrar(fn: Callable[[], Any]):
+    t0 = time.perf_counter()
+    return fn(), time.perf_counter() - t0
+
+
+def as_memory_list(resultado: Any) -> List[Dict]:
+    """Normaliza o retorno do mem0 search (lista ou {"results": [...]}) para uma lista de dicts."""
+    if isinstance(resultado, dict):
+        resultado = resultado.get("results", [])
+    if not isinstance(resultado, list):
+        return []
+    return [m for m in resultado if isinstance(m, dict)]
+
+
+@functools.lru_cache(maxsize=None)
+def _ids_em_filtros(tipo_cliente: type) -> bool:
+    """O SDK 2.x do mem0 recusa user_id/agent_id soltos no search(); eles vão em `filters`."""
+    if not tipo_cliente.__module__.startswith("mem0"):
+        return False
+    try:
+        from mem0.client.main import ENTITY_PARAMS  # Só existe nas versões que exigem `filters`
+    except ImportError:
+        return False
+    return "user_id" in ENTITY_PARAMS
+
+
+def search_memories(client, query: str, user_id: str, agent_id: Optional[str] = None, limit: int = 10):
+    """mem0 search com os ids no formato que o cliente aceita. Com o AsyncMemoryClient devolve a coroutine."""
+    if _ids_em_filtros(type(client)):
+        filtros = [{"user_id": user_id}] + ([{"agent_id": agent_id}] if agent_id else [])
+        parametros = {"filters": {"AND": filtros}, "top_k": limit}
+    else:
+        parametros = {"user_id": user_id, "limit": limit, **({"agent_id": agent_id} if agent_id else {})}
+    if asyncio.iscoroutinefunction(client.search):
+        return _asearch_memories(client, query, parametros, agent_id is not None)
+    with tracing.span("mem0.search", agente=agent_id is not None):
+        return client.search(query=query, **parametros)
+
+
+async def _asearch_memories(client, query: str, parametros: Dict, com_agente: bool):
+    with tracing.span("mem0.search", agente=com_agente):
+        return await client.search(query=query, **parametros)
+
+
+def memory_text(memoria: Dict) -> str:
+    return memoria.get("memory") or memoria.get("text") or ""
+
+
+def merge_memories(listas: Iterable[Any]) -> List[Dict]:
+    """Junta os resultados de várias buscas do mem0, sem repetir id nem texto, mantendo a ordem."""
+    vistos_ids, vistos_textos, combinadas = set(), set(), []
+    for lista in listas:
+        for mem in as_memory_list(lista):
+            mem_id = mem.get("id")
+            texto = memory_text(mem)
+            if (mem_id and mem_id in vistos_ids) or (texto and texto in vistos_textos):
+                continue
+            if mem_id:
+                vistos_ids.add(mem_id)
+            if texto:
+                vistos_textos.add(texto)
+            combinadas.append(mem)
+    return combinadas
+
+
+RRF_K = 60 # Constante do reciprocal rank fusion: amortece a diferença entre as primeiras posições
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[Hashable]], k: int = RRF_K) -> List[Hashable]:
+    """Funde rankings (ex.: FAISS e BM25) somando 1 / (k + posição) de cada item; não depende da escala dos scores."""
+    pontos: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for posicao, item in enumerate(ranking, start=1):
+            pontos[item] = pontos.get(item, 0.0) + 1.0 / (k + posicao)
+    return sorted(pontos, key=pontos.get, reverse=True)
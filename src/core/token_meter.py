@@ -0,0 +1,169 @@
+# Medição e cota de tokens por usuário
+#
+# O consumo de cada resposta é contado com o `usage` devolvido pela API quando
+# existe (é o que a OpenAI cobra) e, na falta dele (stream interrompido), com
+# o tokenizer BPE do modelo. Os contadores ficam num SQLite durável e cada
+# incremento é atômico, então várias sessões do mesmo usuário (abas,
+# processos) somam corretamente. A verificação de cota feita a cada rerun lê
+# um saldo em memória, revalidado no disco só de tempos em tempos.
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from src.core.tokenizer import count_message_tokens, count_tokens
+
+# Assume this script is in c:\hubblet ai\src\core
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')) # Points to c:\hubblet ai
+USAGE_DIR = os.path.join(BASE_DIR, 'data', 'usage')
+DB_FILE = os.environ.get("HUBBLET_USAGE_DB", os.path.join(USAGE_DIR, 'token_usage.db'))
+
+DEFAULT_TOTAL_TOKENS = 2_000_000
+REVALIDAR_APOS_S = 30 # Saldo em memória é relido do disco depois disso (outros processos podem ter gasto)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_usage (
+    user_id TEXT PRIMARY KEY,
+    used_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS token_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    origem TEXT NOT NULL,
+    fonte TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_token_events_user ON token_events (user_id, id);
+"""
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class Saldo:
+    usados: int
+    total: int
+    lido_em: float = 0.0
+
+    @property
+    def restante(self) -> int:
+        return max(0, self.total - self.usados)
+
+    @property
+    def esgotado(self) -> bool:
+        return self.usados >= self.total
+
+
+class TokenMeter:
+    """Contadores de tokens por usuário em SQLite, com saldo em memória para consultas baratas."""
+
+    def __init__(self, db_file: str = DB_FILE, total_padrao: int = DEFAULT_TOTAL_TOKENS,
+                 revalidar_apos_s: float = REVALIDAR_APOS_S):
+        self.db_file = db_file
+        self.total_padrao = total_padrao
+        self.revalidar_apos_s = revalidar_apos_s
+        self._local = threading.local()
+        self._saldos: Dict[str, Saldo] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _atualizar(self, user_id: str, sql: str, params: tuple, evento: Optional[tuple] = None) -> Saldo:
+        """Aplica `sql` à linha do usuário (criada se preciso) e relê o saldo, tudo na mesma transação."""
+        conn = self._conn()
+        agora_iso = _now_iso()
+        conn.execute("BEGIN IMMEDIATE") # Serializa escritores: dois incrementos simultâneos nunca se perdem
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO token_usage (user_id, used_tokens, total_tokens, updated_at) VALUES (?, 0, ?, ?)",
+                (user_id, self.total_padrao, agora_iso),
+            )
+            conn.execute(sql, params + (agora_iso, user_id))
+            if evento is not None:
+                conn.execute(
+                    "INSERT INTO token_events (user_id, origem, fonte, prompt_tokens, completion_tokens, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id,) + evento + (agora_iso,),
+                )
+            usados, total = conn.execute(
+                "SELECT used_tokens, total_tokens FROM token_usage WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        saldo = Saldo(usados, total, time.monotonic())
+        self._saldos[user_id] = saldo
+        return saldo
+
+    def _carregar(self, user_id: str) -> Saldo:
+        row = self._conn().execute(
+            "SELECT used_tokens, total_tokens FROM token_usage WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        saldo = Saldo(row[0], row[1], time.monotonic()) if row else Saldo(0, self.total_padrao, time.monotonic())
+        self._saldos[user_id] = saldo
+        return saldo
+
+    def balance(self, user_id: str) -> Saldo:
+        """Saldo do usuário; vem da memória e só vai ao disco quando a cópia local passou de `revalidar_apos_s`."""
+        saldo = self._saldos.get(user_id)
+        if saldo is None or time.monotonic() - saldo.lido_em > self.revalidar_apos_s:
+            saldo = self._carregar(user_id)
+        return saldo
+
+    def has_quota(self, user_id: str) -> bool:
+        return not self.balance(user_id).esgotado
+
+    def record_usage(self, user_id: str, prompt_tokens: int, completion_tokens: int,
+                     fonte: str = "api", origem: str = "chat") -> Saldo:
+        """Soma o consumo de uma chamada ao contador do usuário (incremento atômico) e registra o evento."""
+        return self._atualizar(
+            user_id, "UPDATE token_usage SET used_tokens = used_tokens + ?, updated_at = ? WHERE user_id = ?",
+            (int(prompt_tokens) + int(completion_tokens),),
+            evento=(origem, fonte, int(prompt_tokens), int(completion_tokens)),
+        )
+
+    def add_quota(self, user_id: str, tokens: int) -> Saldo:
+        return self._atualizar(
+            user_id, "UPDATE token_usage SET total_tokens = total_tokens + ?, updated_at = ? WHERE user_id = ?",
+            (int(tokens),),
+        )
+
+
+def usage_or_estimate(usage, mensagens: List[Dict], resposta: str, model: str) -> Tuple[int, int, str]:
+    """(prompt_tokens, completion_tokens, fonte): o `usage` da API se veio, senão a contagem do tokenizer."""
+    if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+        return usage.prompt_tokens, usage.completion_tokens or 0, "api"
+    return count_message_tokens(mensagens, model), count_tokens(resposta, model), "tokenizer"
+
+
+_meter = None
+_meter_lock = threading.Lock()
+
+
+def get_token_meter() -> TokenMeter:
+    """Instância única por processo (o saldo em memória é compartilhado entre as sessões)."""
+    global _meter
+    if _meter is None:
+        with _meter_lock:
+            if _meter is None:
+                _meter = TokenMeter(DB_FILE)
+    return _meter
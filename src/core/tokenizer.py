@@ -0,0 +1,54 @@
+# Contagem de tokens no mesmo vocabulário dos modelos da OpenAI
+#
+# Usa o tiktoken quando instalado; sem ele cai numa estimativa de ~4
+# caracteres por token, suficiente para orçamento mas não para cobrança.
+
+from functools import lru_cache
+from typing import Dict, List
+
+try:
+    import tiktoken
+except ImportError:  # Dependência opcional
+    tiktoken = None
+
+CODIFICACAO_PADRAO = "cl100k_base"
+TOKENS_POR_MENSAGEM = 4 # Marcadores de papel/início/fim que a API acrescenta a cada mensagem do chat
+TOKENS_RESPOSTA_PRIMING = 3 # Início da resposta do assistente
+
+
+@lru_cache(maxsize=16)
+def _encoder(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(CODIFICACAO_PADRAO)
+
+
+def count_tokens(texto: str, model: str = "gpt-3.5-turbo") -> int:
+    """Número de tokens de `texto` para `model`."""
+    if not texto:
+        return 0
+    enc = _encoder(model)
+    if enc is None:
+        return max(1, len(texto) // 4)
+    return len(enc.encode(texto, disallowed_special=()))
+
+
+def count_message_tokens(mensagens: List[Dict], model: str = "gpt-3.5-turbo") -> int:
+    """Tokens de prompt de uma lista de mensagens do chat, incluindo o overhead por mensagem."""
+    return sum(TOKENS_POR_MENSAGEM + count_tokens(m.get("content") or "", model) for m in mensagens) + TOKENS_RESPOSTA_PRIMING
+
+
+def truncate_to_tokens(texto: str, max_tokens: int, model: str = "gpt-3.5-turbo") -> str:
+    """Corta `texto` para caber em `max_tokens` (mantém o começo)."""
+    if max_tokens <= 0:
+        return ""
+    enc = _encoder(model)
+    if enc is None:
+        return texto[:max_tokens * 4]
+    tokens = enc.encode(texto, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return texto
+    return enc.decode(tokens[:max_tokens])
@@ -0,0 +1,414 @@
+# Rastreamento de latência por etapa do turno do chat
+#
+# Cada turno vira um trace: um span raiz (`trace`) com spans aninhados
+# (`span`) para as etapas (gravar a mensagem, buscas no mem0, embedding da
+# pergunta, busca no FAISS, completion, persistência...). O span atual fica
+# num ContextVar; o fan_out da recuperação e as tarefas pós-resposta levam o
+# contexto para as threads delas (`bind`), então os spans feitos lá entram no
+# mesmo trace. O trace fecha quando o span raiz e todas as tarefas ligadas a
+# ele terminam; aí ele vai para:
+#   - um buffer em memória com os turnos recentes (página de admin do app)
+#   - histogramas por etapa, expostos no formato do Prometheus (/metrics)
+#   - um arquivo JSONL, um trace por linha (HUBBLET_TRACE_FILE)
+#
+# Ligado por HUBBLET_TRACING=1 (ou pela página de admin). Desligado, `span` e
+# `trace` devolvem um objeto nulo compartilhado e `bind` devolve a própria
+# função: o custo é uma leitura de variável global por chamada.
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+# Assume this script is in c:\hubblet ai\src\core
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')) # Points to c:\hubblet ai
+TRACE_DIR = os.path.join(BASE_DIR, 'data', 'traces')
+TRACE_FILE = os.environ.get("HUBBLET_TRACE_FILE", os.path.join(TRACE_DIR, 'traces.jsonl'))
+MAX_BYTES_ARQUIVO = 50 * 1024 * 1024 # Acima disso o arquivo vira .1 e um novo começa
+MAX_TRACES_RECENTES = 1000
+METRICS_PORT = os.environ.get("HUBBLET_METRICS_PORT")
+METRICS_HOST = os.environ.get("HUBBLET_METRICS_HOST", "127.0.0.1") # 0.0.0.0 para o Prometheus raspar de outra máquina
+TIPO_CONTEUDO_METRICAS = "text/plain; version=0.0.4; charset=utf-8" # Formato de texto do Prometheus
+PREFIXO_TURNO = "turno." # Traces raiz com esse prefixo são turnos de conversa (os demais: envio ao mem0...)
+
+# Limites dos buckets dos histogramas, em segundos (como o Prometheus espera)
+BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+
+def _ligado_no_ambiente() -> bool:
+    return os.environ.get("HUBBLET_TRACING", "0").lower() in ("1", "true", "sim", "on")
+
+
+_ativo = _ligado_no_ambiente()
+_span_atual: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("hubblet_span_atual", default=None)
+
+
+def enabled() -> bool:
+    return _ativo
+
+
+def set_enabled(ativo: bool):
+    """Liga/desliga o rastreamento no processo (traces em andamento terminam normalmente)."""
+    global _ativo
+    _ativo = bool(ativo)
+
+
+class _SpanNulo:
+    """Devolvido com o rastreamento desligado ou fora de um trace: não mede nada."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        return False
+
+    def set(self, **atributos):
+        pass
+
+
+_NULO = _SpanNulo()
+_EXCECOES_DE_CONTROLE = ("RerunException", "StopException") # st.rerun()/st.stop() encerram o turno sem erro
+
+
+class Span:
+    __slots__ = ("trace", "nome", "id", "pai", "atributos", "inicio", "fim", "erro", "_token")
+
+    def __init__(self, trace: "Trace", nome: str, pai: Optional[str], atributos: Dict[str, Any]):
+        self.trace = trace
+        self.nome = nome
+        self.id = uuid.uuid4().hex[:8]
+        self.pai = pai
+        self.atributos = atributos
+        self.inicio = 0.0
+        self.fim: Optional[float] = None
+        self.erro: Optional[str] = None
+        self._token = None
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        self._token = _span_atual.set(self)
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        self.fim = time.perf_counter()
+        if isinstance(exc, Exception) and type(exc).__name__ not in _EXCECOES_DE_CONTROLE:
+            self.erro = type(exc).__name__
+        try:
+            _span_atual.reset(self._token)
+        except ValueError: # Fechado em outro contexto (ex.: gerador assíncrono retomado por outra task)
+            pass
+        self.trace._fechar()
+        return False
+
+    def set(self, **atributos):
+        """Acrescenta atributos ao span (ex.: tokens, acerto de cache)."""
+        self.atributos.update(atributos)
+
+    @property
+    def duracao_s(self) -> float:
+        return (self.fim or time.perf_counter()) - self.inicio
+
+
+class Trace:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.inicio_epoch = time.time()
+        self.spans: List[Span] = []
+        self.raiz: Optional[Span] = None
+        self.finalizado = False
+        self._abertos = 0
+        self._lock = threading.Lock()
+
+    def _abrir(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            self._abertos += 1
+
+    def _reter(self):
+        with self._lock:
+            self._abertos += 1
+
+    def _fechar(self):
+        with self._lock:
+            self._abertos -= 1
+            if self._abertos or self.finalizado or self.raiz is None or self.raiz.fim is None:
+                return
+            self.finalizado = True
+        get_collector().registrar(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        base = self.raiz.inicio
+        return {
+            "trace_id": self.id,
+            "nome": self.raiz.nome,
+            "inicio": self.inicio_epoch,
+            "duracao_ms": round(self.raiz.duracao_s * 1000, 3),
+            "atributos": self.raiz.atributos,
+            "erro": self.raiz.erro,
+            "spans": [{
+                "id": s.id, "pai": s.pai, "nome": s.nome,
+                "inicio_ms": round((s.inicio - base) * 1000, 3),
+                "duracao_ms": round(s.duracao_s * 1000, 3),
+                "atributos": s.atributos, "erro": s.erro,
+            } for s in self.spans if s is not self.raiz and s.fim is not None],
+        }
+
+
+def trace(nome: str, **atributos):
+    """Span raiz de um turno (`with trace("turno.chat", user=...)`). Dentro de outro trace vira um span filho."""
+    if not _ativo:
+        return _NULO
+    pai = _span_atual.get()
+    if pai is not None and not pai.trace.finalizado:
+        return span(nome, **atributos)
+    novo = Trace()
+    raiz = Span(novo, nome, None, atributos)
+    novo.raiz = raiz
+    novo._abrir(raiz)
+    return raiz
+
+
+def span(nome: str, **atributos):
+    """Etapa dentro do trace atual (`with span("mem0.search"):`); fora de um trace não mede nada."""
+    if not _ativo:
+        return _NULO
+    pai = _span_atual.get()
+    if pai is None or pai.trace.finalizado:
+        return _NULO
+    novo = Span(pai.trace, nome, pai.id, atributos)
+    pai.trace._abrir(novo)
+    return novo
+
+
+def bind(fn: Callable) -> Callable:
+    """Leva o contexto do trace atual para `fn` rodar em outra thread; o trace só fecha depois que ela terminar."""
+    if not _ativo:
+        return fn
+    atual = _span_atual.get()
+    if atual is None or atual.trace.finalizado:
+        return fn
+    trace_atual = atual.trace
+    trace_atual._reter()
+    contexto = contextvars.copy_context()
+
+    def executar(*args, **kwargs):
+        try:
+            return contexto.run(fn, *args, **kwargs)
+        finally:
+            trace_atual._fechar()
+    return executar
+
+
+def traced(nome: str):
+    """Decorador: a função (síncrona ou assíncrona) inteira vira um span."""
+    def decorador(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def envolvida_async(*args, **kwargs):
+                with span(nome):
+                    return await fn(*args, **kwargs)
+            return envolvida_async
+
+        @functools.wraps(fn)
+        def envolvida(*args, **kwargs):
+            with span(nome):
+                return fn(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+class _Histograma:
+    __slots__ = ("contagens", "soma_s", "total", "erros")
+
+    def __init__(self):
+        self.contagens = [0] * (len(BUCKETS_S) + 1) # O último é o +Inf
+        self.soma_s = 0.0
+        self.total = 0
+        self.erros = 0
+
+    def observar(self, duracao_s: float, erro: bool):
+        i = 0
+        while i < len(BUCKETS_S) and duracao_s > BUCKETS_S[i]:
+            i += 1
+        self.contagens[i] += 1
+        self.soma_s += duracao_s
+        self.total += 1
+        if erro:
+            self.erros += 1
+
+
+class TraceCollector:
+    """Destino dos traces fechados: buffer dos recentes, histogramas por etapa e o arquivo JSONL."""
+
+    def __init__(self, arquivo: Optional[str] = TRACE_FILE, max_recentes: int = MAX_TRACES_RECENTES):
+        self.arquivo = arquivo
+        self._recentes: Deque[Dict[str, Any]] = deque(maxlen=max_recentes)
+        self._histogramas: Dict[str, _Histograma] = {}
+        self._lock = threading.Lock()
+        self._lock_arquivo = threading.Lock()
+
+    def registrar(self, trace_fechado: Trace):
+        registro = trace_fechado.to_dict()
+        with self._lock:
+            self._recentes.append(registro)
+            self._observar(registro["nome"], registro["duracao_ms"], registro["erro"])
+            for s in registro["spans"]:
+                self._observar(s["nome"], s["duracao_ms"], s["erro"])
+        if self.arquivo:
+            try:
+                self._gravar(registro)
+            except OSError as e:
+                print(f"Erro ao gravar o trace em {self.arquivo}: {e}")
+
+    def _observar(self, nome: str, duracao_ms: float, erro: Optional[str]):
+        """Chamar com o lock."""
+        histograma = self._histogramas.get(nome)
+        if histograma is None:
+            histograma = self._histogramas[nome] = _Histograma()
+        histograma.observar(duracao_ms / 1000, erro is not None)
+
+    def _gravar(self, registro: Dict[str, Any]):
+        linha = json.dumps(registro, ensure_ascii=False, default=str) + "\n"
+        with self._lock_arquivo:
+            os.makedirs(os.path.dirname(os.path.abspath(self.arquivo)), exist_ok=True)
+            if os.path.exists(self.arquivo) and os.path.getsize(self.arquivo) > MAX_BYTES_ARQUIVO:
+                os.replace(self.arquivo, self.arquivo + ".1")
+            with open(self.arquivo, "a", encoding="utf-8") as f:
+                f.write(linha)
+
+    def recent(self, prefixo: str = PREFIXO_TURNO) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [t for t in self._recentes if t["nome"].startswith(prefixo)]
+
+    def slowest(self, n: int = 20, prefixo: str = PREFIXO_TURNO) -> List[Dict[str, Any]]:
+        """Turnos recentes mais lentos, do mais lento ao mais rápido."""
+        return sorted(self.recent(prefixo), key=lambda t: t["duracao_ms"], reverse=True)[:n]
+
+    def stage_durations(self) -> Dict[str, List[float]]:
+        """Durações (ms) de cada etapa nos traces recentes, inclusive o span raiz."""
+        duracoes: Dict[str, List[float]] = {}
+        with self._lock:
+            for t in self._recentes:
+                duracoes.setdefault(t["nome"], []).append(t["duracao_ms"])
+                for s in t["spans"]:
+                    duracoes.setdefault(s["nome"], []).append(s["duracao_ms"])
+        return duracoes
+
+    def stage_summary(self) -> List[Dict[str, Any]]:
+        """p50/p95/p99 por etapa nos traces recentes, da etapa com maior p95 para a menor."""
+        linhas = []
+        for nome, valores in self.stage_durations().items():
+            p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+            linhas.append({"etapa": nome, "n": len(valores), "p50_ms": float(p50), "p95_ms": float(p95),
+                           "p99_ms": float(p99), "max_ms": max(valores)})
+        return sorted(linhas, key=lambda linha: linha["p95_ms"], reverse=True)
+
+    def render_prometheus(self) -> str:
+        """Histogramas por etapa no formato texto de exposição do Prometheus."""
+        linhas = [
+            "# HELP hubblet_tracing_enabled 1 se o rastreamento de latência está ligado.",
+            "# TYPE hubblet_tracing_enabled gauge",
+            f"hubblet_tracing_enabled {int(_ativo)}",
+            "# HELP hubblet_stage_duration_seconds Duração das etapas do turno do chat.",
+            "# TYPE hubblet_stage_duration_seconds histogram",
+        ]
+        erros = ["# HELP hubblet_stage_errors_total Etapas que terminaram com exceção.",
+                 "# TYPE hubblet_stage_errors_total counter"]
+        with self._lock:
+            for nome in sorted(self._histogramas):
+                h = self._histogramas[nome]
+                rotulo = nome.replace("\\", "\\\\").replace('"', '\\"')
+                acumulado = 0
+                for limite, contagem in zip(BUCKETS_S, h.contagens):
+                    acumulado += contagem
+                    linhas.append(f'hubblet_stage_duration_seconds_bucket{{stage="{rotulo}",le="{limite:g}"}} {acumulado}')
+                linhas.append(f'hubblet_stage_duration_seconds_bucket{{stage="{rotulo}",le="+Inf"}} {h.total}')
+                linhas.append(f'hubblet_stage_duration_seconds_sum{{stage="{rotulo}"}} {h.soma_s:.6f}')
+                linhas.append(f'hubblet_stage_duration_seconds_count{{stage="{rotulo}"}} {h.total}')
+                erros.append(f'hubblet_stage_errors_total{{stage="{rotulo}"}} {h.erros}')
+        return "\n".join(linhas + erros) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._recentes.clear()
+            self._histogramas.clear()
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def get_collector() -> TraceCollector:
+    global _collector
+    if _collector is None:
+        with _collector_lock:
+            if _collector is None:
+                _collector = TraceCollector(os.environ.get("HUBBLET_TRACE_FILE", TRACE_FILE))
+    return _collector
+
+
+def span_tree(registro: Dict[str, Any]) -> List[tuple]:
+    """(profundidade, span) de um trace exportado, cada span logo abaixo do pai e irmãos na ordem de início."""
+    filhos: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {s["id"] for s in registro["spans"]}
+    for s in sorted(registro["spans"], key=lambda s: s["inicio_ms"]):
+        filhos.setdefault(s["pai"] if s["pai"] in ids else None, []).append(s)
+    arvore, pilha = [], [(0, s) for s in reversed(filhos.get(None, []))]
+    while pilha:
+        profundidade, s = pilha.pop()
+        arvore.append((profundidade, s))
+        pilha.extend((profundidade + 1, f) for f in reversed(filhos.get(s["id"], [])))
+    return arvore
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass  # Silencia o log de acesso padrão
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        dados = get_collector().render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", TIPO_CONTEUDO_METRICAS)
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+
+_metrics_server = None
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """Serve GET /metrics numa thread (porta HUBBLET_METRICS_PORT). Idempotente; sem porta configurada não faz nada."""
+    global _metrics_server
+    port = port if port is not None else (int(METRICS_PORT) if METRICS_PORT else None)
+    if port is None or _metrics_server is not None:
+        return _metrics_server
+    with _collector_lock:
+        if _metrics_server is None:
+            servidor = ThreadingHTTPServer((host, port), _MetricsHandler)
+            servidor.daemon_threads = True
+            threading.Thread(target=servidor.serve_forever, name="metrics", daemon=True).start()
+            _metrics_server = servidor
+            print(f"Métricas de latência em http://{host}:{servidor.server_address[1]}/metrics")
+    return _metrics_server
+
+
+def configure_from_env() -> Optional[ThreadingHTTPServer]:
+    """Relê HUBBLET_TRACING e HUBBLET_METRICS_* (ex.: depois do load_dotenv) e sobe o /metrics se houver porta."""
+    set_enabled(_ligado_no_ambiente())
+    porta = os.environ.get("HUBBLET_METRICS_PORT")
+    return start_metrics_server(int(porta) if porta else None, os.environ.get("HUBBLET_METRICS_HOST", METRICS_HOST))
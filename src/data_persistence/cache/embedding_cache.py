@@ -0,0 +1,185 @@
+# Cache de embeddings endereçado por conteúdo
+#
+# Chave: (modelo, sha256(texto)). Os vetores ficam em SQLite como blobs
+# float32, com um LRU em memória por cima. O disco tem tamanho máximo: ao
+# passar do limite, as entradas acessadas há mais tempo são removidas.
+# O cache é compartilhado entre assistentes, sessões e reinícios do processo.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Assume this script is in c:\hubblet ai\src\data_persistence\cache
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')) # Points to c:\hubblet ai
+CACHE_DIR = os.path.join(BASE_DIR, 'data', 'cache')
+CACHE_FILE = os.environ.get("HUBBLET_EMBEDDING_CACHE", os.path.join(CACHE_DIR, 'embeddings.db'))
+
+MAX_ENTRADAS_MEMORIA = 5_000      # ~30 MB com vetores de 1536 dimensões
+MAX_ENTRADAS_DISCO = 500_000      # ~3 GB com vetores de 1536 dimensões
+FRACAO_DESPEJO = 0.05             # Quanto remover de uma vez quando o disco enche
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (model, sha256)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access);
+"""
+
+
+def text_key(texto: str) -> str:
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache de dois níveis (LRU em memória + SQLite) para embeddings."""
+
+    def __init__(self, db_file: str = CACHE_FILE, max_memoria: int = MAX_ENTRADAS_MEMORIA,
+                 max_disco: int = MAX_ENTRADAS_DISCO):
+        self.db_file = db_file
+        self.max_memoria = max_memoria
+        self.max_disco = max_disco
+        self._lru: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+        self.despejos = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        self._total_disco = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _lembrar(self, chave: tuple, vetor: np.ndarray):
+        # Chamado com self._lock adquirido
+        self._lru[chave] = vetor
+        self._lru.move_to_end(chave)
+        while len(self._lru) > self.max_memoria:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model: str, textos: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Busca os vetores de `textos`; posições sem entrada no cache voltam como None."""
+        resultado: List[Optional[np.ndarray]] = [None] * len(textos)
+        faltando: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, texto in enumerate(textos):
+                chave = (model, text_key(texto))
+                vetor = self._lru.get(chave)
+                if vetor is not None:
+                    self._lru.move_to_end(chave)
+                    resultado[i] = vetor
+                    self.hits_memoria += 1
+                else:
+                    faltando.setdefault(chave[1], []).append(i)
+        if not faltando:
+            return resultado
+
+        conn = self._conn()
+        encontrados = {}
+        shas = list(faltando)
+        for inicio in range(0, len(shas), 500):  # Respeita o limite de parâmetros do SQLite
+            parte = shas[inicio:inicio + 500]
+            marcadores = ",".join("?" * len(parte))
+            for sha, blob in conn.execute(
+                    f"SELECT sha256, vector FROM embeddings WHERE model = ? AND sha256 IN ({marcadores})",
+                    [model, *parte]):
+                encontrados[sha] = np.frombuffer(blob, dtype=np.float32)
+        if encontrados:
+            agora = time.time()
+            conn.executemany("UPDATE embeddings SET last_access = ? WHERE model = ? AND sha256 = ?",
+                             [(agora, model, sha) for sha in encontrados])
+
+        with self._lock:
+            for sha, indices in faltando.items():
+                vetor = encontrados.get(sha)
+                if vetor is None:
+                    self.misses += len(indices)
+                    continue
+                self.hits_disco += len(indices)
+                self._lembrar((model, sha), vetor)
+                for i in indices:
+                    resultado[i] = vetor
+        return resultado
+
+    def put_many(self, model: str, textos: Sequence[str], vetores: Sequence[np.ndarray]):
+        """Grava os pares (texto, vetor) no disco e no LRU."""
+        agora = time.time()
+        linhas = []
+        with self._lock:
+            for texto, vetor in zip(textos, vetores):
+                if vetor is None:
+                    continue
+                vetor = np.ascontiguousarray(vetor, dtype=np.float32)
+                sha = text_key(texto)
+                self._lembrar((model, sha), vetor)
+                linhas.append((model, sha, vetor.tobytes(), agora))
+        if not linhas:
+            return
+        conn = self._conn()
+        antes = conn.total_changes
+        conn.execute("BEGIN")
+        conn.executemany("INSERT OR IGNORE INTO embeddings (model, sha256, vector, last_access) VALUES (?, ?, ?, ?)",
+                         linhas)
+        conn.execute("COMMIT")
+        with self._lock:
+            self._total_disco += conn.total_changes - antes
+            excedeu = self._total_disco > self.max_disco
+        if excedeu:
+            self._despejar(conn)
+
+    def _despejar(self, conn: sqlite3.Connection):
+        quantidade = max(1, int(self.max_disco * FRACAO_DESPEJO)) + (self._total_disco - self.max_disco)
+        cur = conn.execute(
+            "DELETE FROM embeddings WHERE (model, sha256) IN "
+            "(SELECT model, sha256 FROM embeddings ORDER BY last_access LIMIT ?)",
+            (quantidade,))
+        with self._lock:
+            self._total_disco -= cur.rowcount
+            self.despejos += cur.rowcount
+
+    def stats(self) -> Dict[str, float]:
+        """Contadores de acerto/falha, úteis para exibir no app ou em logs."""
+        with self._lock:
+            consultas = self.hits_memoria + self.hits_disco + self.misses
+            return {
+                "hits_memoria": self.hits_memoria,
+                "hits_disco": self.hits_disco,
+                "misses": self.misses,
+                "taxa_acerto": (self.hits_memoria + self.hits_disco) / consultas if consultas else 0.0,
+                "entradas_memoria": len(self._lru),
+                "entradas_disco": self._total_disco,
+                "despejos": self.despejos,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Instância única do cache por processo."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -0,0 +1,98 @@
+# Cache do texto extraído de documentos, endereçado pelo hash do arquivo
+#
+# Chave: (sha256 dos bytes do arquivo, versão do extrator). Reenviar o mesmo
+# PDF (mesmo arquivo com outro nome, outro assistente, reprocessamento) não
+# passa de novo pelo docling. O texto fica comprimido (zlib) em SQLite.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+# Assume this script is in c:\hubblet ai\src\data_persistence\cache
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')) # Points to c:\hubblet ai
+CACHE_DIR = os.path.join(BASE_DIR, 'data', 'cache')
+CACHE_FILE = os.environ.get("HUBBLET_EXTRACTION_CACHE", os.path.join(CACHE_DIR, 'extracted_text.db'))
+
+MAX_ENTRADAS = 20_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extracted_text (
+    sha256 TEXT NOT NULL,
+    extractor TEXT NOT NULL,
+    text BLOB NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (sha256, extractor)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_extracted_text_last_access ON extracted_text (last_access);
+"""
+
+
+def file_key(dados: bytes) -> str:
+    return hashlib.sha256(dados).hexdigest()
+
+
+class ExtractionCache:
+    """Texto extraído por (hash do arquivo, extrator), em SQLite."""
+
+    def __init__(self, db_file: str = CACHE_FILE, max_entradas: int = MAX_ENTRADAS):
+        self.db_file = db_file
+        self.max_entradas = max_entradas
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sha256: str, extrator: str) -> Optional[str]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT text FROM extracted_text WHERE sha256 = ? AND extractor = ?", (sha256, extrator)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conn.execute("UPDATE extracted_text SET last_access = ? WHERE sha256 = ? AND extractor = ?",
+                     (time.time(), sha256, extrator))
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, sha256: str, extrator: str, texto: str):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO extracted_text (sha256, extractor, text, last_access) VALUES (?, ?, ?, ?)",
+            (sha256, extrator, zlib.compress(texto.encode("utf-8"), 6), time.time()),
+        )
+        total = conn.execute("SELECT COUNT(*) FROM extracted_text").fetchone()[0]
+        if total > self.max_entradas:
+            conn.execute(
+                "DELETE FROM extracted_text WHERE (sha256, extractor) IN "
+                "(SELECT sha256, extractor FROM extracted_text ORDER BY last_access LIMIT ?)",
+                (total - self.max_entradas,),
+            )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Instância única do cache por processo."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache()
+    return _cache
@@ -0,0 +1,195 @@
+# Cache semântico de respostas do chat
+#
+# Perguntas quase idênticas feitas ao mesmo assistente recebem a resposta já
+# gerada, sem mem0, sem busca de conhecimento e sem completion. As entradas
+# ficam em SQLite (pergunta, vetor, resposta) e, por partição (assistente,
+# usuário, versão do assistente), num IndexFlatIP pequeno em memória com os
+# vetores normalizados: a similaridade do vizinho mais próximo é o cosseno.
+# A versão do assistente muda quando instruções ou índice de conhecimento
+# são salvos de novo, o que torna as respostas antigas inalcançáveis.
+
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Assume this script is in c:\hubblet ai\src\data_persistence\cache
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')) # Points to c:\hubblet ai
+CACHE_DIR = os.path.join(BASE_DIR, 'data', 'cache')
+CACHE_FILE = os.environ.get("HUBBLET_RESPONSE_CACHE", os.path.join(CACHE_DIR, 'responses.db'))
+
+LIMIAR_SIMILARIDADE = float(os.environ.get("HUBBLET_RESPONSE_CACHE_THRESHOLD", "0.97")) # Cosseno no ada-002: perguntas distintas já ficam perto de 0.8-0.9
+TTL_S = 7 * 24 * 3600
+MAX_ENTRADAS_POR_PARTICAO = 1_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    assistant TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    question TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_responses_partition ON responses (assistant, user_id, version, last_access);
+"""
+
+Particao = Tuple[str, str, str] # (assistente, usuário, versão)
+
+
+@dataclass
+class CachedAnswer:
+    pergunta: str
+    resposta: str
+    similaridade: float
+    criado_em: float
+
+
+def _normalizar(vetor: np.ndarray) -> np.ndarray:
+    vetor = np.ascontiguousarray(vetor, dtype=np.float32).reshape(1, -1).copy()
+    faiss.normalize_L2(vetor)
+    return vetor
+
+
+class ResponseCache:
+    """Respostas por similaridade de pergunta, com TTL, LRU por partição e contadores de acerto."""
+
+    def __init__(self, db_file: str = CACHE_FILE, limiar: float = LIMIAR_SIMILARIDADE, ttl_s: float = TTL_S,
+                 max_por_particao: int = MAX_ENTRADAS_POR_PARTICAO):
+        self.db_file = db_file
+        self.limiar = limiar
+        self.ttl_s = ttl_s
+        self.max_por_particao = max_por_particao
+        self._indices: Dict[Particao, faiss.Index] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits: Counter = Counter()   # por assistente
+        self.misses: Counter = Counter()
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _indice(self, particao: Particao) -> Optional[faiss.Index]:
+        """Índice da partição, carregado do SQLite no primeiro acesso (chamar com o lock)."""
+        if particao in self._indices:
+            return self._indices[particao]
+        index = None # Partição sem entradas: None até a primeira resposta guardada
+        linhas = self._conn().execute(
+            "SELECT id, vector FROM responses WHERE assistant = ? AND user_id = ? AND version = ? AND created_at >= ?",
+            (*particao, time.time() - self.ttl_s)).fetchall()
+        for id_linha, blob in linhas:
+            vetor = np.frombuffer(blob, dtype=np.float32).reshape(1, -1)
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(vetor.shape[1]))
+            index.add_with_ids(vetor, np.array([id_linha], dtype=np.int64))
+        self._indices[particao] = index
+        return index
+
+    def lookup(self, assistente: str, usuario: str, versao: str, vetor: np.ndarray) -> Optional[CachedAnswer]:
+        """Resposta guardada para uma pergunta com cosseno >= limiar, ou None."""
+        particao = (assistente, usuario, versao)
+        consulta = _normalizar(vetor)
+        with self._lock:
+            index = self._indice(particao)
+            if index is None or index.ntotal == 0 or index.d != consulta.shape[1]:
+                self.misses[assistente] += 1
+                return None
+            similaridades, ids = index.search(consulta, 1)
+        similaridade, id_linha = float(similaridades[0][0]), int(ids[0][0])
+        if id_linha < 0 or similaridade < self.limiar:
+            self.misses[assistente] += 1
+            return None
+        conn = self._conn()
+        linha = conn.execute("SELECT question, answer, created_at FROM responses WHERE id = ?", (id_linha,)).fetchone()
+        if linha is None or linha[2] < time.time() - self.ttl_s:
+            # Expirada (ou removida por outro processo): sai do índice e conta como falta
+            with self._lock:
+                index.remove_ids(np.array([id_linha], dtype=np.int64))
+            conn.execute("DELETE FROM responses WHERE id = ?", (id_linha,))
+            self.misses[assistente] += 1
+            return None
+        conn.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE id = ?", (time.time(), id_linha))
+        self.hits[assistente] += 1
+        return CachedAnswer(pergunta=linha[0], resposta=linha[1], similaridade=similaridade, criado_em=linha[2])
+
+    def store(self, assistente: str, usuario: str, versao: str, pergunta: str, vetor: np.ndarray, resposta: str):
+        particao = (assistente, usuario, versao)
+        normalizado = _normalizar(vetor)
+        agora = time.time()
+        conn = self._conn()
+        cursor = conn.execute(
+            "INSERT INTO responses (assistant, user_id, version, question, vector, answer, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (*particao, pergunta, normalizado.tobytes(), resposta, agora, agora))
+        with self._lock:
+            carregada = particao in self._indices
+            index = self._indice(particao) # Se ainda não estava carregada, já vem do SQLite com a linha nova
+            if carregada:
+                if index is None:
+                    index = self._indices[particao] = faiss.IndexIDMap2(faiss.IndexFlatIP(normalizado.shape[1]))
+                index.add_with_ids(normalizado, np.array([cursor.lastrowid], dtype=np.int64))
+            self._despejar(particao, index)
+
+    def _despejar(self, particao: Particao, index: faiss.Index):
+        """Mantém a partição em `max_por_particao`, removendo as menos acessadas (chamar com o lock)."""
+        excesso = index.ntotal - self.max_por_particao
+        if excesso <= 0:
+            return
+        conn = self._conn()
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM responses WHERE assistant = ? AND user_id = ? AND version = ? ORDER BY last_access LIMIT ?",
+            (*particao, excesso)).fetchall()]
+        conn.executemany("DELETE FROM responses WHERE id = ?", [(i,) for i in ids])
+        index.remove_ids(np.array(ids, dtype=np.int64))
+
+    def invalidate(self, assistente: str):
+        """Descarta todas as respostas do assistente (chamar ao salvá-lo)."""
+        self._conn().execute("DELETE FROM responses WHERE assistant = ?", (assistente,))
+        with self._lock:
+            for particao in [p for p in self._indices if p[0] == assistente]:
+                del self._indices[particao]
+
+    def purge_expired(self) -> int:
+        """Remove do disco as entradas vencidas; retorna quantas."""
+        cursor = self._conn().execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_s,))
+        with self._lock:
+            self._indices.clear() # Recarregadas sob demanda, já sem as vencidas
+        return cursor.rowcount
+
+    def hit_rate(self, assistente: Optional[str] = None) -> float:
+        hits = self.hits[assistente] if assistente else sum(self.hits.values())
+        total = hits + (self.misses[assistente] if assistente else sum(self.misses.values()))
+        return hits / total if total else 0.0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Instância única do cache por processo."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+                _cache.purge_expired()
+    return _cache
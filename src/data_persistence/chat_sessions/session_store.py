@@ -0,0 +1,224 @@
+# Armazenamento indexado das sessões de chat (SQLite)
+#
+# Substitui o chat_history.json monolítico: cada mensagem nova é um INSERT
+# e cada listagem usa os índices por user_id/updated_at, então o custo por
+# turno não cresce com o tamanho do histórico de todos os usuários.
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# Assume this script is in c:\hubblet ai\src\data_persistence\chat_sessions
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')) # Points to c:\hubblet ai
+DB_DIR = os.path.join(BASE_DIR, 'data', 'chat_history')
+DB_FILE = os.environ.get("HUBBLET_CHAT_DB", os.path.join(DB_DIR, 'chat_sessions.db'))
+LEGACY_JSON_FILE = os.path.join(BASE_DIR, 'src', 'chat_history.json')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated ON chat_sessions (user_id, updated_at);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, id);
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    session_id TEXT PRIMARY KEY,
+    messages_covered INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SessionStore:
+    """Sessões e mensagens de chat em SQLite, com uma conexão por thread."""
+
+    def __init__(self, db_file: str = DB_FILE):
+        self.db_file = db_file
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # WAL permite leituras concorrentes enquanto outra sessão grava
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create_session(self, user_id: str, title: str = "Nova Conversa") -> Dict:
+        """Cria uma sessão vazia e devolve seus metadados."""
+        now_iso = _now_iso()
+        session = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "title": title,
+            "created_at": now_iso,
+            "updated_at": now_iso,
+            "messages": []
+        }
+        self._conn().execute(
+            "INSERT INTO chat_sessions (id, user_id, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (session["id"], user_id, title, now_iso, now_iso),
+        )
+        return session
+
+    def list_sessions(self, user_id: str) -> List[Dict]:
+        """Lista as sessões do usuário (sem as mensagens), mais recentes primeiro."""
+        rows = self._conn().execute(
+            "SELECT id, user_id, title, created_at, updated_at, message_count FROM chat_sessions "
+            "WHERE user_id = ? ORDER BY updated_at DESC",
+            (user_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_messages(self, session_id: str) -> List[Dict]:
+        """Mensagens de uma sessão em ordem de inserção."""
+        rows = self._conn().execute(
+            "SELECT role, content, created_at FROM chat_messages WHERE session_id = ? ORDER BY id",
+            (session_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_message(self, session_id: str, role: str, content: str) -> bool:
+        """Acrescenta uma mensagem à sessão. Retorna False se a sessão não existir."""
+        now_iso = _now_iso()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "UPDATE chat_sessions SET updated_at = ?, message_count = message_count + 1 WHERE id = ?",
+                (now_iso, session_id),
+            )
+            if cur.rowcount == 0:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT INTO chat_messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, now_iso),
+            )
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_summary(self, session_id: str) -> Optional[Dict]:
+        """Resumo acumulado das mensagens antigas da sessão: {"summary", "messages_covered"} ou None."""
+        row = self._conn().execute(
+            "SELECT summary, messages_covered FROM chat_summaries WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_summary(self, session_id: str, summary: str, messages_covered: int):
+        """Grava o resumo das primeiras `messages_covered` mensagens (nunca volta para um resumo que cobre menos)."""
+        self._conn().execute(
+            "INSERT INTO chat_summaries (session_id, messages_covered, summary, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET messages_covered = excluded.messages_covered, "
+            "summary = excluded.summary, updated_at = excluded.updated_at "
+            "WHERE excluded.messages_covered > chat_summaries.messages_covered",
+            (session_id, messages_covered, summary, _now_iso()),
+        )
+
+    def is_empty(self) -> bool:
+        return self._conn().execute("SELECT 1 FROM chat_sessions LIMIT 1").fetchone() is None
+
+    def import_history(self, history: Dict) -> int:
+        """Importa um histórico no formato do chat_history.json. Sessões já existentes são ignoradas."""
+        conn = self._conn()
+        imported = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for session in history.get("chat_sessions", []):
+                messages = session.get("messages", [])
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO chat_sessions (id, user_id, title, created_at, updated_at, message_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (session["id"], session["user_id"], session.get("title", "Nova Conversa"),
+                     session.get("created_at", ""), session.get("updated_at", ""), len(messages)),
+                )
+                if cur.rowcount == 0:
+                    continue
+                conn.executemany(
+                    "INSERT INTO chat_messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    [(session["id"], m.get("role", ""), m.get("content", ""), m.get("created_at", ""))
+                     for m in messages],
+                )
+                imported += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return imported
+
+    def export_history(self) -> Dict:
+        """Exporta tudo no formato antigo do chat_history.json (uso administrativo, custo O(histórico))."""
+        sessions = [dict(row) for row in self._conn().execute(
+            "SELECT id, user_id, title, created_at, updated_at FROM chat_sessions ORDER BY created_at")]
+        for session in sessions:
+            session["messages"] = self.get_messages(session["id"])
+        return {"chat_sessions": sessions}
+
+
+def migrate_json_history(json_file: str = LEGACY_JSON_FILE, store: Optional[SessionStore] = None) -> int:
+    """Migra um chat_history.json para o SQLite. Pode ser executada mais de uma vez."""
+    store = store or get_session_store()
+    if not os.path.exists(json_file):
+        return 0
+    with open(json_file, "r", encoding="utf-8") as f:
+        history = json.load(f)
+    return store.import_history(history)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Instância única do store por processo; na primeira abertura migra o JSON legado se o banco estiver vazio."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = SessionStore(DB_FILE)
+                if store.is_empty() and os.path.exists(LEGACY_JSON_FILE):
+                    try:
+                        n = migrate_json_history(LEGACY_JSON_FILE, store)
+                        print(f"{n} sessões migradas de {LEGACY_JSON_FILE} para {DB_FILE}")
+                    except (json.JSONDecodeError, IOError) as e:
+                        print(f"Não foi possível migrar o histórico legado: {e}")
+                _store = store
+    return _store
+
+
+if __name__ == "__main__":
+    # Uso: python -m src.data_persistence.chat_sessions.session_store [caminho/do/chat_history.json]
+    origem = sys.argv[1] if len(sys.argv) > 1 else LEGACY_JSON_FILE
+    total = migrate_json_history(origem, SessionStore(DB_FILE))
+    print(f"Migração concluída: {total} sessões importadas de {origem} para {DB_FILE}")
@@ -0,0 +1,257 @@
+# Índice lexical BM25 dos trechos de um assistente
+#
+# Fica ao lado do armazenamento de trechos, em <base>.bm25/, dividido em
+# segmentos imutáveis: cada salvamento que acrescenta trechos grava um
+# segmento novo só com eles (listas de postings em arrays numpy: ids uint32 e
+# frequências uint16). Passando de MAX_SEGMENTOS, o índice é regravado num
+# segmento só. As posições dos trechos são as mesmas do FAISS do assistente.
+#
+# A busca não chama nenhuma API: tokeniza a pergunta e soma os pesos BM25 das
+# postings em numpy. Códigos de produto, nomes e números que a busca densa
+# confunde aparecem aqui como termos exatos. O resultado só é "confiante" (o
+# chat dispensa a busca densa) quando a pergunta é essencialmente um código:
+# um número solto numa frase ("clientes em 2019") não basta.
+
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+K1 = 1.2
+B = 0.75
+MAX_SEGMENTOS = 8
+FRACAO_DF_IGNORAR = 0.5
+MAX_DF_IDENTIFICADOR = 3 # Um código que aparece em até tantos trechos identifica a resposta sozinho
+FRACAO_CONSULTA_IDENTIFICADOR = 0.5 # Palavras da consulta com dígitos, no mínimo, para ela "ser" o código
+FRACAO_SCORE_IDENTIFICADOR = 0.7    # Parte do score do primeiro trecho que tem de vir dos termos do código
+MARGEM_CONFIANTE = 1.5              # O primeiro trecho precisa de um score tantas vezes maior que o do segundo
+
+_RE_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+_RE_SEPARADOR = re.compile(r"[-./]")
+_RE_ACENTOS = re.compile("[\u0300-\u036f]")
+_DTYPE_DOC = np.uint32
+_DTYPE_TF = np.uint16
+
+
+def _palavras(texto: str) -> List[str]:
+    """Palavras inteiras em minúsculas e sem acento, sem separar códigos ("abc-123/4" fica inteiro)."""
+    return _RE_TOKEN.findall(_RE_ACENTOS.sub("", unicodedata.normalize("NFKD", texto.lower())))
+
+
+def _partes(palavra: str) -> List[str]:
+    """A palavra e, se for um código com separadores, cada parte dele."""
+    if not _RE_SEPARADOR.search(palavra):
+        return [palavra]
+    return [palavra] + [parte for parte in _RE_SEPARADOR.split(palavra) if parte]
+
+
+def tokenize(texto: str) -> List[str]:
+    """Termos em minúsculas e sem acento. "ABC-123/4" gera "abc-123/4", "abc", "123" e "4"."""
+    return [termo for palavra in _palavras(texto) for termo in _partes(palavra)]
+
+
+def _is_identificador(termo: str) -> bool:
+    return any(c.isdigit() for c in termo)
+
+
+def index_dir(base_path: str) -> str:
+    return f"{base_path}.bm25"
+
+
+def _segmento_file(base_path: str, inicio: int) -> str:
+    return os.path.join(index_dir(base_path), f"seg_{inicio:010d}.npz")
+
+
+@dataclass
+class _Segmento:
+    inicio: int              # Posição do primeiro trecho do segmento
+    termos: Dict[str, int]   # termo -> posição em `offsets`
+    offsets: np.ndarray      # postings do termo t: docs[offsets[t]:offsets[t + 1]]
+    docs: np.ndarray
+    tfs: np.ndarray
+    doc_len: np.ndarray
+
+    @property
+    def total(self) -> int:
+        return len(self.doc_len)
+
+
+def _construir(trechos: Sequence[str], inicio: int) -> Dict[str, np.ndarray]:
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_len = np.empty(len(trechos), dtype=_DTYPE_DOC)
+    for pos, trecho in enumerate(trechos):
+        contagem = Counter(tokenize(trecho))
+        doc_len[pos] = sum(contagem.values())
+        for termo, tf in contagem.items():
+            postings.setdefault(termo, []).append((inicio + pos, tf))
+    termos = sorted(postings)
+    tamanhos = np.fromiter((len(postings[t]) for t in termos), dtype=np.uint64, count=len(termos))
+    offsets = np.concatenate(([0], np.cumsum(tamanhos, dtype=np.uint64))).astype(np.uint64)
+    total = int(offsets[-1])
+    docs = np.fromiter((d for t in termos for d, _ in postings[t]), dtype=_DTYPE_DOC, count=total)
+    tfs = np.fromiter((min(tf, 65_535) for t in termos for _, tf in postings[t]), dtype=_DTYPE_TF, count=total)
+    return {
+        "inicio": np.array([inicio], dtype=np.uint64),
+        "termos": np.frombuffer("\n".join(termos).encode("utf-8"), dtype=np.uint8),
+        "offsets": offsets, "docs": docs, "tfs": tfs, "doc_len": doc_len,
+    }
+
+
+def _gravar_segmento(base_path: str, trechos: Sequence[str], inicio: int):
+    os.makedirs(index_dir(base_path), exist_ok=True)
+    destino = _segmento_file(base_path, inicio)
+    tmp_path = f"{destino}.tmp.npz"
+    np.savez(tmp_path, **_construir(trechos, inicio))
+    os.replace(tmp_path, destino)
+
+
+def _ler_segmento(caminho: str) -> _Segmento:
+    with np.load(caminho) as dados:
+        texto_termos = dados["termos"].tobytes().decode("utf-8")
+        termos = texto_termos.split("\n") if texto_termos else []
+        return _Segmento(inicio=int(dados["inicio"][0]), termos={t: i for i, t in enumerate(termos)},
+                         offsets=dados["offsets"], docs=dados["docs"], tfs=dados["tfs"], doc_len=dados["doc_len"])
+
+
+def _segmentos_em_disco(base_path: str) -> List[str]:
+    pasta = index_dir(base_path)
+    if not os.path.isdir(pasta):
+        return []
+    return sorted(os.path.join(pasta, n) for n in os.listdir(pasta) if n.startswith("seg_") and n.endswith(".npz")
+                  and ".tmp" not in n)
+
+
+def exists(base_path: str) -> bool:
+    return bool(_segmentos_em_disco(base_path))
+
+
+def rebuild_index(base_path: str, trechos: Sequence[str]):
+    """Regrava o índice inteiro num segmento só."""
+    antigos = _segmentos_em_disco(base_path)
+    _gravar_segmento(base_path, trechos, 0) # Substitui seg_0 atomicamente; os demais viram sobreposição e são ignorados
+    for caminho in antigos:
+        if caminho != _segmento_file(base_path, 0):
+            os.remove(caminho)
+
+
+def update_index(base_path: str, trechos: Sequence[str], inicio_novos: int):
+    """Acompanha o chunk_store: acrescenta um segmento com trechos[inicio_novos:] ou regrava tudo se não bater."""
+    segmentos = _segmentos_em_disco(base_path)
+    total = sum(_ler_segmento(c).total for c in segmentos) if segmentos else 0
+    if inicio_novos == 0 or total != inicio_novos or len(segmentos) >= MAX_SEGMENTOS:
+        rebuild_index(base_path, trechos)
+    elif len(trechos) > inicio_novos:
+        _gravar_segmento(base_path, trechos[inicio_novos:], inicio_novos)
+
+
+@dataclass
+class LexicalResult:
+    posicoes: List[int] = field(default_factory=list)
+    scores: List[float] = field(default_factory=list)
+    confiante: bool = False # Dá para responder sem a busca densa (e sem o embedding da pergunta)
+
+
+class LexicalIndex:
+    """Índice BM25 somente leitura, carregado dos segmentos em disco."""
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self._segmentos: List[_Segmento] = []
+        for caminho in _segmentos_em_disco(base_path):
+            segmento = _ler_segmento(caminho)
+            if segmento.inicio != self.total:
+                break # Segmento de uma regravação em andamento: o que veio antes já é consistente
+            self._segmentos.append(segmento)
+        soma = sum(int(s.doc_len.sum()) for s in self._segmentos)
+        self._media_len = soma / self.total if self.total else 0.0
+
+    @property
+    def total(self) -> int:
+        return sum(s.total for s in self._segmentos)
+
+    def _postings(self, termo: str) -> List[Tuple[_Segmento, np.ndarray, np.ndarray]]:
+        encontrados = []
+        for segmento in self._segmentos:
+            t = segmento.termos.get(termo)
+            if t is not None:
+                ini, fim = int(segmento.offsets[t]), int(segmento.offsets[t + 1])
+                encontrados.append((segmento, segmento.docs[ini:fim], segmento.tfs[ini:fim]))
+        return encontrados
+
+    def search(self, consulta: str, k: int = 5) -> LexicalResult:
+        """Os k trechos de maior BM25 para a consulta, do mais ao menos relevante."""
+        n = self.total
+        if not n:
+            return LexicalResult()
+        palavras = _palavras(consulta)
+        # Termos vindos das palavras com dígitos (o código inteiro e suas partes, como "abc" de "abc-123")
+        termos_codigo = {t for p in palavras if _is_identificador(p) for t in _partes(p)}
+        termos = {}
+        for termo in {t for p in palavras for t in _partes(p)}:
+            postings = self._postings(termo)
+            df = sum(len(docs) for _, docs, _ in postings)
+            if df:
+                termos[termo] = (postings, df)
+        # Termos presentes em mais da metade dos trechos pesam quase nada (idf < log 2) e têm as maiores
+        # listas: são ignorados quando a consulta tem algum termo mais seletivo
+        if any(df <= n * FRACAO_DF_IGNORAR for _, df in termos.values()):
+            termos = {t: v for t, v in termos.items() if v[1] <= n * FRACAO_DF_IGNORAR}
+        todos_docs, todos_pesos = [], []
+        pesos_codigo: List[Tuple[np.ndarray, np.ndarray]] = []
+        identificadores: Dict[str, np.ndarray] = {}
+        for termo, (postings, df) in termos.items():
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for segmento, docs, tfs in postings:
+                dl = segmento.doc_len[docs - segmento.inicio].astype(np.float32)
+                tf = tfs.astype(np.float32)
+                pesos = idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / self._media_len))
+                todos_docs.append(docs)
+                todos_pesos.append(pesos)
+                if termo in termos_codigo:
+                    pesos_codigo.append((docs, pesos))
+            if _is_identificador(termo) and df <= MAX_DF_IDENTIFICADOR:
+                identificadores[termo] = np.concatenate([docs for _, docs, _ in postings])
+        if not todos_docs:
+            return LexicalResult()
+        docs_unicos, inverso = np.unique(np.concatenate(todos_docs), return_inverse=True)
+        scores = np.bincount(inverso, weights=np.concatenate(todos_pesos))
+        k = min(k, len(scores))
+        melhores = np.argpartition(-scores, k - 1)[:k]
+        melhores = melhores[np.argsort(-scores[melhores])]
+        posicoes = docs_unicos[melhores].tolist()
+        melhores_scores = scores[melhores].tolist()
+        confiante = self._confiante(palavras, identificadores, pesos_codigo, posicoes, melhores_scores, k)
+        return LexicalResult(posicoes=posicoes, scores=melhores_scores, confiante=confiante)
+
+    @staticmethod
+    def _confiante(palavras: List[str], identificadores: Dict[str, np.ndarray],
+                   pesos_codigo: List[Tuple[np.ndarray, np.ndarray]], posicoes: List[int], scores: List[float],
+                   k: int) -> bool:
+        """O primeiro trecho responde sozinho? Só quando a consulta é o código e ele decide o ranking."""
+        # A consulta é essencialmente o código ("ABC-123/4", "pedido 12345"), não uma frase com um número
+        if sum(_is_identificador(p) for p in palavras) < len(palavras) * FRACAO_CONSULTA_IDENTIFICADOR:
+            return False
+        primeiro = posicoes[0]
+        # Um código/número raro da pergunta está no primeiro trecho e cabe inteiro no resultado
+        if not any(primeiro in docs and len(docs) <= k for docs in identificadores.values()):
+            return False
+        # O score do primeiro trecho vem do código, não das outras palavras
+        score_codigo = sum(float(pesos[docs == primeiro].sum()) for docs, pesos in pesos_codigo)
+        if score_codigo < FRACAO_SCORE_IDENTIFICADOR * scores[0]:
+            return False
+        # E o primeiro se destaca do segundo
+        return len(scores) == 1 or scores[0] >= MARGEM_CONFIANTE * scores[1]
+
+
+def load_or_build(base_path: str, trechos: Optional[Sequence[str]] = None) -> LexicalIndex:
+    """Índice do assistente; assistentes salvos antes do BM25 (ou com índice desatualizado) ganham um índice novo."""
+    indice = LexicalIndex(base_path)
+    if trechos is not None and indice.total != len(trechos):
+        rebuild_index(base_path, trechos)
+        indice = LexicalIndex(base_path)
+    return indice
@@ -0,0 +1,290 @@
+# Armazenamento dos trechos (chunks) de um assistente com acesso por posição
+#
+# Dois arquivos por assistente:
+#   <base>.blob   texto dos trechos em blocos comprimidos (zstd se o pacote
+#                 zstandard estiver instalado, senão zlib), um após o outro
+#   <base>.offs   cabeçalho (formato + codec) e uma entrada de largura fixa
+#                 por trecho: offset e tamanho do bloco no .blob e o início/fim
+#                 do trecho dentro do bloco descomprimido
+#   <base>.sum    quantidade de trechos e sha256 do conteúdo gravado, para
+#                 `save_chunks` confirmar que o disco é prefixo da lista nova
+# O trecho i (= vetor i do FAISS) é lido direto: entrada i do .offs, um bloco
+# do .blob mapeado em memória, descompressão só desse bloco (com um LRU
+# pequeno de blocos). Novos trechos viram blocos novos no fim dos dois
+# arquivos, sem regravar o que já existe. O formato anterior (.jsonl + .idx)
+# é convertido na primeira abertura.
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # Opcional: sem ele os blocos são comprimidos com zlib
+    zstandard = None
+
+USAR_MMAP = os.name != "nt" # No Windows o mapeamento impediria acrescentar/substituir o arquivo com o app aberto
+TAMANHO_BLOCO = 32 * 1024   # Texto por bloco antes da compressão: maior comprime mais, menor descomprime menos por leitura
+BLOCOS_EM_CACHE = 64
+
+MAGICO = b"HBCHUNK2"
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+_CABECALHO = np.dtype([("magico", "S8"), ("codec", "<u4"), ("reservado", "<u4")])
+_ENTRADA = np.dtype([("bloco_inicio", "<u8"), ("bloco_tamanho", "<u4"), ("inicio", "<u4"), ("fim", "<u4"), ("reservado", "<u4")])
+
+
+def data_file(base_path: str) -> str:
+    return f"{base_path}.blob"
+
+
+def index_file(base_path: str) -> str:
+    return f"{base_path}.offs"
+
+
+def checksum_file(base_path: str) -> str:
+    return f"{base_path}.sum"
+
+
+def exists(base_path: str) -> bool:
+    return os.path.exists(data_file(base_path)) and os.path.exists(index_file(base_path))
+
+
+def _codec_padrao() -> int:
+    return CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+
+def _comprimir(codec: int, dados: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=9).compress(dados)
+    return zlib.compress(dados, 6)
+
+
+def _descomprimir(codec: int, dados: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Trechos comprimidos com zstd: instale o pacote zstandard")
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return zlib.decompress(dados)
+
+
+def _ler_codec(base_path: str) -> int:
+    with open(index_file(base_path), "rb") as f:
+        cabecalho = np.frombuffer(f.read(_CABECALHO.itemsize), dtype=_CABECALHO)
+    if len(cabecalho) != 1 or cabecalho["magico"][0] != MAGICO:
+        raise ValueError(f"{index_file(base_path)} não é um armazenamento de trechos válido")
+    return int(cabecalho["codec"][0])
+
+
+class ChunkStore(Sequence):
+    """Sequência somente leitura de trechos, carregados sob demanda."""
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        self.codec = _ler_codec(base_path)
+        self._entradas = np.fromfile(index_file(base_path), dtype=_ENTRADA, offset=_CABECALHO.itemsize)
+        self._mm = None
+        self._blocos: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        if len(self._entradas):
+            ultima = self._entradas[-1]
+            tamanho = int(ultima["bloco_inicio"]) + int(ultima["bloco_tamanho"])
+            if USAR_MMAP and tamanho > 0:
+                with open(data_file(base_path), "rb") as f:
+                    self._mm = mmap.mmap(f.fileno(), tamanho, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def _ler(self, inicio: int, tamanho: int) -> bytes:
+        if self._mm is not None:
+            return self._mm[inicio:inicio + tamanho]
+        with open(data_file(self.base_path), "rb") as f:
+            f.seek(inicio)
+            return f.read(tamanho)
+
+    def _bloco(self, inicio: int, tamanho: int) -> bytes:
+        with self._lock:
+            bloco = self._blocos.get(inicio)
+            if bloco is not None:
+                self._blocos.move_to_end(inicio)
+                return bloco
+        bloco = _descomprimir(self.codec, self._ler(inicio, tamanho))
+        with self._lock:
+            self._blocos[inicio] = bloco
+            if len(self._blocos) > BLOCOS_EM_CACHE:
+                self._blocos.popitem(last=False)
+        return bloco
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        entrada = self._entradas[i]
+        bloco = self._bloco(int(entrada["bloco_inicio"]), int(entrada["bloco_tamanho"]))
+        return bloco[int(entrada["inicio"]):int(entrada["fim"])].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+def _blocos(chunks: Iterable[str]) -> Iterator[List[bytes]]:
+    """Agrupa os trechos codificados em blocos de ~TAMANHO_BLOCO (um trecho nunca é dividido entre blocos)."""
+    bloco, tamanho = [], 0
+    for chunk in chunks:
+        dados = chunk.encode("utf-8")
+        if bloco and tamanho + len(dados) > TAMANHO_BLOCO:
+            yield bloco
+            bloco, tamanho = [], 0
+        bloco.append(dados)
+        tamanho += len(dados)
+    if bloco:
+        yield bloco
+
+
+def append_chunks(base_path: str, chunks: Sequence[str]):
+    """Acrescenta trechos no fim do armazenamento (cria os arquivos se não existirem)."""
+    if not exists(base_path):
+        _criar(base_path)
+    if not chunks:
+        return
+    codec = _ler_codec(base_path)
+    partes, entradas = [], []
+    with open(data_file(base_path), "ab") as f_dados:
+        posicao = f_dados.tell()
+        for bloco in _blocos(chunks):
+            comprimido = _comprimir(codec, b"".join(bloco))
+            fins = np.cumsum([len(d) for d in bloco])
+            for fim, dados in zip(fins.tolist(), bloco):
+                entradas.append((posicao, len(comprimido), fim - len(dados), fim, 0))
+            partes.append(comprimido)
+            posicao += len(comprimido)
+        f_dados.write(b"".join(partes))
+        f_dados.flush()
+        os.fsync(f_dados.fileno())
+    # Os dados vão antes das entradas: uma queda entre os dois só deixa bytes órfãos no fim do .blob
+    with open(index_file(base_path), "ab") as f_idx:
+        f_idx.write(np.array(entradas, dtype=_ENTRADA).tobytes())
+
+
+def _soma(chunks: Iterable[str]) -> str:
+    """sha256 da sequência de trechos (cada um prefixado pelo tamanho, para ["ab", "c"] != ["a", "bc"])."""
+    h = hashlib.sha256()
+    for chunk in chunks:
+        dados = chunk.encode("utf-8")
+        h.update(len(dados).to_bytes(8, "little"))
+        h.update(dados)
+    return h.hexdigest()
+
+
+def _ler_soma(base_path: str) -> Optional[Tuple[int, str]]:
+    try:
+        with open(checksum_file(base_path), "r", encoding="utf-8") as f:
+            quantidade, soma = f.read().split()
+        return int(quantidade), soma
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar_soma(base_path: str, chunks: Sequence[str]):
+    temporario = f"{checksum_file(base_path)}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(f"{len(chunks)} {_soma(chunks)}\n")
+    os.replace(temporario, checksum_file(base_path))
+
+
+def _prefixo_confere(base_path: str, atual: ChunkStore, chunks: Sequence[str]) -> bool:
+    """Os trechos em disco são exatamente os primeiros len(atual) de `chunks`?"""
+    n = len(atual)
+    if n > len(chunks):
+        return False
+    registrada = _ler_soma(base_path)
+    if registrada is not None and registrada[0] == n:
+        return registrada[1] == _soma(islice(chunks, n)) # Só hash em memória, sem ler o .blob
+    # Sem soma (armazenamento antigo, append_chunks avulso, queda antes de gravá-la): compara trecho a trecho
+    return all(a == b for a, b in zip(atual, islice(chunks, n)))
+
+
+def _criar(base_path: str, codec: int = None):
+    cabecalho = np.array([(MAGICO, codec or _codec_padrao(), 0)], dtype=_CABECALHO)
+    # Remove em vez de truncar: sessões com o .blob mapeado continuam lendo o arquivo antigo
+    for path in (data_file(base_path), index_file(base_path), checksum_file(base_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    open(data_file(base_path), "wb").close()
+    with open(index_file(base_path), "wb") as f_idx:
+        f_idx.write(cabecalho.tobytes())
+
+
+def write_chunks(base_path: str, chunks: Sequence[str]):
+    """Regrava o armazenamento inteiro com `chunks`."""
+    _criar(base_path)
+    append_chunks(base_path, chunks)
+    _gravar_soma(base_path, chunks)
+
+
+def save_chunks(base_path: str, chunks: Sequence[str]) -> int:
+    """Salva `chunks`, acrescentando só o final quando o conteúdo em disco é um prefixo deles.
+
+    O prefixo inteiro é conferido (pela soma em <base>.sum ou trecho a trecho), não só o último trecho:
+    uma edição no meio da lista regrava o armazenamento. Retorna a posição do primeiro trecho gravado
+    agora (0 quando o armazenamento foi regravado).
+    """
+    if exists(base_path):
+        atual = ChunkStore(base_path)
+        try:
+            n = len(atual)
+            prefixo_igual = _prefixo_confere(base_path, atual, chunks)
+        finally:
+            atual.close()
+        if prefixo_igual:
+            append_chunks(base_path, chunks[n:])
+            _gravar_soma(base_path, chunks)
+            return n
+    write_chunks(base_path, chunks)
+    return 0
+
+
+def migrate_json_chunks(json_file: str, base_path: str) -> int:
+    """Converte o antigo <assistente>_chunks.json (lista JSON) para o formato em blocos."""
+    with open(json_file, "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+    write_chunks(base_path, chunks)
+    return len(chunks)
+
+
+def migrate_jsonl_chunks(base_path: str) -> int:
+    """Converte o formato anterior (<base>.jsonl + <base>.idx, um trecho JSON por linha) e remove os arquivos antigos."""
+    jsonl_file, idx_file = f"{base_path}.jsonl", f"{base_path}.idx"
+    fins = np.fromfile(idx_file, dtype="<u8")
+    chunks = []
+    with open(jsonl_file, "rb") as f:
+        inicio = 0
+        for fim in fins.tolist():
+            chunks.append(json.loads(f.read(fim - inicio)))
+            inicio = fim
+    write_chunks(base_path, chunks)
+    os.remove(jsonl_file)
+    os.remove(idx_file)
+    return len(chunks)
+
+
+def has_legacy_jsonl(base_path: str) -> bool:
+    return os.path.exists(f"{base_path}.jsonl") and os.path.exists(f"{base_path}.idx")
@@ -0,0 +1,129 @@
+# Busca em lote no FAISS
+#
+# Uma chamada `index.search` com uma matriz (n, d) de consultas custa bem
+# menos que n chamadas com uma consulta cada: o FAISS paraleliza o lote com
+# OpenMP e, no Flat, transforma as distâncias num produto de matrizes (BLAS).
+# O MicroBatcher junta as consultas que chegam de sessões diferentes dentro
+# de uma janela de poucos milissegundos e faz uma busca por índice.
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+JANELA_PADRAO_S = 0.003 # Espera máxima por companhia depois da primeira consulta do lote
+MAX_LOTE = 64
+
+# O Flat calcula as distâncias com BLAS (produto de matrizes) quando consultas x dimensão passa deste limiar.
+# O padrão do FAISS (128000) só liga o BLAS com ~84 consultas de dimensão 1536, acima do lote típico do
+# micro-batcher; medido com src.benchmarks.batch_search, a partir de 4 consultas o BLAS já é mais rápido,
+# e abaixo disso (uma pergunta sozinha) o caminho sequencial continua melhor.
+DIMENSAO_EMBEDDINGS = 1536
+LIMIAR_BLAS_CONSULTAS = int(os.environ.get("HUBBLET_FAISS_BLAS_QUERIES", "4"))
+faiss.cvar.distance_compute_blas_threshold = LIMIAR_BLAS_CONSULTAS * DIMENSAO_EMBEDDINGS
+
+# Threads OpenMP do FAISS (padrão: todos os núcleos). Com muitos processos na mesma máquina, vale limitar.
+if os.environ.get("HUBBLET_FAISS_THREADS"):
+    faiss.omp_set_num_threads(int(os.environ["HUBBLET_FAISS_THREADS"]))
+
+
+def as_query_matrix(consultas) -> np.ndarray:
+    """Matriz (n, d) float32 C-contígua a partir de um vetor, lista de vetores ou matriz."""
+    matriz = np.asarray(consultas, dtype=np.float32)
+    if matriz.ndim == 1:
+        matriz = matriz.reshape(1, -1)
+    return np.ascontiguousarray(matriz)
+
+
+def search_batch(index: faiss.Index, consultas, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Uma única chamada ao FAISS para todas as consultas. Retorna (distâncias, ids), ambos (n, k)."""
+    matriz = as_query_matrix(consultas)
+    if matriz.shape[1] != index.d:
+        raise ValueError(f"Dimensão das consultas ({matriz.shape[1]}) difere da do índice ({index.d})")
+    return index.search(matriz, k)
+
+
+@dataclass
+class _Pedido:
+    index: faiss.Index
+    vetor: np.ndarray
+    k: int
+    futuro: Future
+
+
+class MicroBatcher:
+    """Agrupa buscas concorrentes no mesmo índice numa só chamada ao FAISS."""
+
+    def __init__(self, janela_s: float = JANELA_PADRAO_S, max_lote: int = MAX_LOTE):
+        self.janela_s = janela_s
+        self.max_lote = max_lote
+        self.lotes = 0
+        self.consultas = 0
+        self._fila: "queue.Queue[_Pedido]" = queue.Queue()
+        self._thread = threading.Thread(target=self._laco, daemon=True, name="faiss-microbatch")
+        self._thread.start()
+
+    def submit(self, index: faiss.Index, vetor: np.ndarray, k: int) -> Future:
+        """Agenda a busca de um vetor; o Future devolve (distâncias, ids) com forma (k,)."""
+        futuro: Future = Future()
+        self._fila.put(_Pedido(index, np.asarray(vetor, dtype=np.float32).reshape(-1), k, futuro))
+        return futuro
+
+    def search(self, index: faiss.Index, vetor: np.ndarray, k: int, timeout: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.submit(index, vetor, k).result(timeout)
+
+    def _coletar(self) -> List[_Pedido]:
+        pedidos = [self._fila.get()]
+        limite = time.monotonic() + self.janela_s
+        while len(pedidos) < self.max_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                pedidos.append(self._fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return pedidos
+
+    def _laco(self):
+        while True:
+            pedidos = self._coletar()
+            # Índices diferentes (assistentes diferentes) não podem ir na mesma chamada
+            por_indice: Dict[int, List[_Pedido]] = {}
+            for pedido in pedidos:
+                por_indice.setdefault(id(pedido.index), []).append(pedido)
+            for grupo in por_indice.values():
+                self._executar(grupo)
+
+    def _executar(self, grupo: List[_Pedido]):
+        k = max(p.k for p in grupo)
+        try:
+            distancias, ids = search_batch(grupo[0].index, np.stack([p.vetor for p in grupo]), k)
+        except Exception as e:
+            for pedido in grupo:
+                pedido.futuro.set_exception(e)
+            return
+        self.lotes += 1
+        self.consultas += len(grupo)
+        for i, pedido in enumerate(grupo):
+            pedido.futuro.set_result((distancias[i, :pedido.k], ids[i, :pedido.k]))
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_micro_batcher() -> MicroBatcher:
+    """MicroBatcher único por processo (compartilhado pelas sessões do Streamlit)."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher()
+    return _batcher
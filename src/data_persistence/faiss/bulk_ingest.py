@@ -0,0 +1,89 @@
+# Inserção de vetores no FAISS em lote
+#
+# Em vez de um `index.add` por vetor (uma travessia Python -> C++ e uma
+# alocação por trecho), os embeddings são empilhados uma única vez numa
+# matriz float32 contígua e adicionados em blocos grandes. Os blocos são
+# fatias (views) da mesma matriz, sem cópia. Com IndexIDMap os ids são os de
+# cada trecho, e continuam os mesmos se outros trechos forem removidos.
+
+import time
+from dataclasses import dataclass
+from typing import Optional, Sequence, Union
+
+import faiss
+import numpy as np
+
+TAMANHO_BLOCO = 65_536 # Grande o bastante para o FAISS paralelizar; pequeno o bastante para não duplicar a RAM em IVF
+
+
+@dataclass
+class IngestStats:
+    vetores: int = 0
+    duracao_s: float = 0.0
+
+    @property
+    def vetores_por_s(self) -> float:
+        return self.vetores / self.duracao_s if self.duracao_s > 0 else 0.0
+
+
+def stack_embeddings(embeddings: Union[np.ndarray, Sequence[np.ndarray]], dim: Optional[int] = None) -> np.ndarray:
+    """Matriz (n, d) float32 C-contígua. Uma matriz que já está no formato é devolvida sem cópia."""
+    if isinstance(embeddings, np.ndarray):
+        return np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+    if len(embeddings) == 0:
+        return np.empty((0, dim or 0), dtype=np.float32)
+    dim = dim or len(embeddings[0])
+    # Preenche uma matriz pré-alocada: uma cópia por vetor, sem a lista intermediária do np.array/np.vstack
+    matriz = np.empty((len(embeddings), dim), dtype=np.float32)
+    for i, emb in enumerate(embeddings):
+        matriz[i] = emb
+    return matriz
+
+
+def is_id_map(index: faiss.Index) -> bool:
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+
+def with_id_map(index: faiss.Index) -> faiss.Index:
+    """Envolve um índice vazio em IndexIDMap2 (ids explícitos e `reconstruct` por id)."""
+    if is_id_map(index):
+        return index
+    if index.ntotal:
+        raise ValueError("Só é possível envolver em IndexIDMap um índice vazio (os vetores existentes perderiam o id)")
+    return faiss.IndexIDMap2(index) # O wrapper Python do FAISS mantém a referência ao índice interno
+
+
+def next_ids(index: faiss.Index, n: int) -> np.ndarray:
+    """Ids para `n` trechos novos, depois do maior id já usado no índice."""
+    if is_id_map(index) and index.ntotal:
+        inicio = int(faiss.vector_to_array(index.id_map).max()) + 1
+    else:
+        inicio = int(index.ntotal)
+    return np.arange(inicio, inicio + n, dtype=np.int64)
+
+
+def add_in_blocks(index: faiss.Index, embeddings: Union[np.ndarray, Sequence[np.ndarray]],
+                  ids: Optional[np.ndarray] = None, tamanho_bloco: int = TAMANHO_BLOCO,
+                  verbose: bool = True) -> IngestStats:
+    """Adiciona os vetores em blocos contíguos; com IndexIDMap usa `ids` (ou os próximos ids livres)."""
+    inicio = time.perf_counter()
+    vetores = stack_embeddings(embeddings, index.d)
+    n = len(vetores)
+    if n and vetores.shape[1] != index.d:
+        raise ValueError(f"Dimensão dos embeddings ({vetores.shape[1]}) difere da do índice ({index.d})")
+    if ids is None and is_id_map(index):
+        ids = next_ids(index, n)
+    if ids is not None:
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        if len(ids) != n:
+            raise ValueError(f"{len(ids)} ids para {n} vetores")
+    for i in range(0, n, tamanho_bloco):
+        bloco = vetores[i:i + tamanho_bloco] # view: sem cópia
+        if ids is None:
+            index.add(bloco)
+        else:
+            index.add_with_ids(bloco, ids[i:i + tamanho_bloco])
+    stats = IngestStats(vetores=n, duracao_s=time.perf_counter() - inicio)
+    if verbose and n:
+        print(f"FAISS: {n} vetores adicionados em {stats.duracao_s:.3f}s ({stats.vetores_por_s:,.0f} vetores/s)")
+    return stats
@@ -1,51 +1,250 @@
 # Módulo para buscar informações no índice FAISS
+#
+# O retriever mantém um "retrato" imutável (índice + metadados dos trechos)
+# e confere de tempos em tempos qual versão está publicada em disco. O
+# process_knowledge grava índice, metadados e meta numa pasta nova em
+# versoes/ e só então troca o ponteiro knowledge_current.json, então os três
+# arquivos de um retrato são sempre da mesma versão. Quando a versão muda, o
+# retrato novo é carregado numa thread de fundo e trocado de uma vez; buscas
+# em andamento terminam no retrato antigo, que continua válido até ser
+# descartado. Sem ponteiro (índices gravados antes das versões), os arquivos
+# soltos em INDEX_DIR são lidos como antes.
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
 
 import faiss
 import numpy as np
-import os
+
+from src.core import tracing
+from src.core.resources import file_version
+from src.data_persistence.faiss import index_factory
+from src.data_persistence.faiss.batch_search import as_query_matrix, get_micro_batcher, search_batch
+from src.data_persistence.faiss.index_io import read_index_shared
+
+logger = logging.getLogger(__name__)
 
 # Diretório onde o índice FAISS será armazenado
 # Assume this script is in c:\hubblet ai\src\data_persistence\faiss
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')) # Points to c:\hubblet ai
 INDEX_DIR = os.path.join(BASE_DIR, 'data', 'knowledge_base', 'faiss_index')
 INDEX_FILE = os.path.join(INDEX_DIR, 'knowledge.index')
+META_FILE = os.path.join(INDEX_DIR, 'knowledge_index_meta.json') # Tipo do índice e parâmetros de busca (nprobe/efSearch)
+METADATA_FILE = os.path.join(INDEX_DIR, 'knowledge_metadata.json') # id do trecho -> {"fonte", "texto"}
+PONTEIRO = 'knowledge_current.json' # {"versao": nome}: qual pasta de versoes/ está publicada
+PASTA_VERSOES = 'versoes'
 
 # Garante que o diretório do índice exista
 if not os.path.exists(INDEX_DIR):
     os.makedirs(INDEX_DIR)
 
-DIMENSION = 128 # Dimensão dos vetores (deve ser igual ao usado no process_knowledge.py)
+DIMENSION = 1536 # Dimensão dos vetores do text-embedding-ada-002 (deve ser igual ao usado no process_knowledge.py)
+INTERVALO_VERIFICACAO_S = 2.0 # No máximo um stat dos arquivos a cada intervalo
+
+
+@dataclass
+class KnowledgeHit:
+    id: int
+    distancia: float
+    texto: str
+    fonte: Optional[str] = None
+    metadados: Dict = field(default_factory=dict)
+
+
+@dataclass
+class _Retrato:
+    index: faiss.Index
+    metadados: Dict[int, Dict]
+    versao: Tuple
+    carregado_em: float
+
+
+def published_version(index_dir: str = INDEX_DIR) -> Optional[str]:
+    """Versão apontada por knowledge_current.json (None se o índice ainda está em arquivos soltos)."""
+    try:
+        with open(os.path.join(index_dir, PONTEIRO), 'r', encoding='utf-8') as f:
+            return json.load(f)["versao"]
+    except FileNotFoundError:
+        return None
+
+
+def published_file(caminho: str, versao: Optional[str], index_dir: str = INDEX_DIR) -> str:
+    """Onde fica um dos arquivos do índice (INDEX_FILE, METADATA_FILE, META_FILE...) na versão dada."""
+    if versao is None:
+        return os.path.join(index_dir, os.path.basename(caminho))
+    return os.path.join(index_dir, PASTA_VERSOES, versao, os.path.basename(caminho))
+
+
+def _ler_metadados(caminho: str) -> Dict[int, Dict]:
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, 'r', encoding='utf-8') as f:
+        dados = json.load(f)
+    if isinstance(dados, list): # Formato antigo: lista alinhada à posição do vetor
+        return dict(enumerate(dados))
+    return {int(chave): valor for chave, valor in dados.items()}
+
+
+class KnowledgeRetriever:
+    """Busca na base de conhecimento global, recarregando o índice quando ele é republicado em disco."""
+
+    def __init__(self, index_dir: str = INDEX_DIR, intervalo_verificacao_s: float = INTERVALO_VERIFICACAO_S):
+        self.index_dir = index_dir
+        self.intervalo_verificacao_s = intervalo_verificacao_s
+        self.recarregamentos = 0
+        self._retrato: Optional[_Retrato] = None
+        self._proxima_verificacao = 0.0
+        self._lock = threading.Lock()
+        self._recarregando = False
+
+    def _arquivos(self, versao: Tuple) -> Tuple[str, str, str]:
+        publicada = versao[1] if versao[0] == "versao" else None
+        return tuple(published_file(p, publicada, self.index_dir) for p in (INDEX_FILE, METADATA_FILE, META_FILE))
+
+    def _versao(self) -> Tuple:
+        publicada = published_version(self.index_dir)
+        if publicada is not None:
+            return ("versao", publicada) # A pasta de uma versão não muda depois de publicada
+        return ("arquivos",) + tuple(file_version(p) for p in self._arquivos(("arquivos",)))
+
+    def _carregar(self, versao: Tuple) -> _Retrato:
+        inicio = time.perf_counter()
+        index_file, metadata_file, meta_file = self._arquivos(versao)
+        if os.path.exists(index_file):
+            index = index_factory.apply_meta(read_index_shared(index_file), index_factory.load_index_meta(meta_file))
+        else:
+            logger.warning("Arquivo de índice FAISS não encontrado (%s). Usando índice vazio.", index_file)
+            index = faiss.IndexFlatL2(DIMENSION)
+        retrato = _Retrato(index, _ler_metadados(metadata_file), versao, time.time())
+        logger.info("Índice de conhecimento carregado: %s, %d vetores, %d trechos (%.1f ms)",
+                    index_factory.describe_index(index), index.ntotal, len(retrato.metadados),
+                    (time.perf_counter() - inicio) * 1000)
+        return retrato
+
+    def _recarregar(self, versao: Tuple):
+        try:
+            retrato = self._carregar(versao)
+            self._retrato = retrato # Troca atômica da referência; buscas em andamento seguem no retrato antigo
+            self.recarregamentos += 1
+        except Exception:
+            # Arquivo sendo trocado ou corrompido: mantém o retrato atual e tenta de novo na próxima verificação
+            logger.exception("Falha ao recarregar o índice de conhecimento; mantendo a versão anterior")
+        finally:
+            self._recarregando = False
+
+    def snapshot(self) -> _Retrato:
+        """Retrato atual. O primeiro carregamento é síncrono; os seguintes acontecem em segundo plano."""
+        retrato = self._retrato
+        if retrato is None:
+            with self._lock:
+                if self._retrato is None:
+                    self._retrato = self._carregar(self._versao())
+                    self._proxima_verificacao = time.monotonic() + self.intervalo_verificacao_s
+                return self._retrato
+        agora = time.monotonic()
+        if agora >= self._proxima_verificacao:
+            self._proxima_verificacao = agora + self.intervalo_verificacao_s
+            versao = self._versao()
+            if versao != retrato.versao:
+                with self._lock:
+                    if self._recarregando:
+                        return retrato
+                    self._recarregando = True
+                logger.info("Índice de conhecimento mudou em disco; recarregando em segundo plano.")
+                threading.Thread(target=self._recarregar, args=(versao,), daemon=True, name="recarregar-conhecimento").start()
+        return retrato
+
+    def reload(self):
+        """Recarrega já, de forma síncrona (ex.: logo depois de reindexar no mesmo processo)."""
+        with self._lock:
+            self._recarregando = True
+        self._recarregar(self._versao())
+
+    def search_batch(self, consultas, k: int = 5) -> List[List[KnowledgeHit]]:
+        """Os k trechos mais próximos de cada consulta da matriz (n, d), numa única chamada ao FAISS."""
+        retrato = self.snapshot()
+        matriz = as_query_matrix(consultas)
+        if retrato.index.ntotal == 0:
+            logger.info("Índice de conhecimento vazio; nenhuma busca realizada.")
+            return [[] for _ in range(len(matriz))]
+        inicio = time.perf_counter()
+        with tracing.span("faiss.search", consultas=len(matriz), k=k):
+            distancias, ids = search_batch(retrato.index, matriz, k)
+        resultados = [_acertos(retrato, linha_dist, linha_ids)
+                      for linha_dist, linha_ids in zip(distancias.tolist(), ids.tolist())]
+        logger.debug("Busca no conhecimento: %d consulta(s), k=%d em %.2f ms", len(matriz), k,
+                     (time.perf_counter() - inicio) * 1000)
+        return resultados
+
+    def search(self, query_vector: np.ndarray, k: int = 5) -> List[KnowledgeHit]:
+        """Os k trechos mais próximos do vetor de consulta, com texto e metadados."""
+        return self.search_batch(query_vector, k)[0]
+
+    async def search_async(self, query_vector: np.ndarray, k: int = 5) -> List[KnowledgeHit]:
+        """`search` sem bloquear o event loop: a busca vai para o micro-batcher, junto com as de outras requisições."""
+        retrato = self.snapshot()
+        if retrato.index.ntotal == 0:
+            return []
+        with tracing.span("faiss.search", consultas=1, k=k):
+            distancias, ids = await asyncio.wrap_future(get_micro_batcher().submit(retrato.index, query_vector, k))
+        return _acertos(retrato, distancias.tolist(), ids.tolist())
+
+    def search_multi(self, consultas, k: int = 5) -> List[KnowledgeHit]:
+        """Várias formulações da mesma pergunta (reescritas, HyDE): uma busca em lote, trechos sem repetição pela menor distância."""
+        melhores: Dict[int, KnowledgeHit] = {}
+        for acertos in self.search_batch(consultas, k):
+            for acerto in acertos:
+                if acerto.id not in melhores or acerto.distancia < melhores[acerto.id].distancia:
+                    melhores[acerto.id] = acerto
+        return sorted(melhores.values(), key=lambda a: a.distancia)[:k]
+
+
+def _acertos(retrato: _Retrato, distancias: List[float], ids: List[int]) -> List[KnowledgeHit]:
+    acertos = []
+    for distancia, id_trecho in zip(distancias, ids):
+        if id_trecho < 0:
+            continue
+        dados = retrato.metadados.get(id_trecho, {})
+        acertos.append(KnowledgeHit(id=id_trecho, distancia=distancia, texto=dados.get("texto", ""),
+                                    fonte=dados.get("fonte"), metadados=dados))
+    return acertos
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_knowledge_retriever() -> KnowledgeRetriever:
+    """Retriever único por processo."""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = KnowledgeRetriever()
+    return _retriever
 
-_cached_index = None
 
 def load_faiss_index():
-    """Carrega o índice FAISS do disco (real)."""
-    global _cached_index
-    if _cached_index is not None:
-        return _cached_index
-    if os.path.exists(INDEX_FILE):
-        print(f"Carregando índice FAISS de {INDEX_FILE}")
-        index = faiss.read_index(INDEX_FILE)
-        print("Índice FAISS carregado com sucesso.")
-    else:
-        print("Arquivo de índice FAISS não encontrado. Criando índice vazio.")
-        index = faiss.IndexFlatL2(DIMENSION)
-    _cached_index = index
-    return index
-
-def search_knowledge(query_vector: np.ndarray, k: int = 5):
-    """Busca os k vizinhos mais próximos no índice FAISS real."""
-    index = load_faiss_index()
-    if index.ntotal == 0:
-        print("Índice FAISS está vazio. Nenhuma busca realizada.")
-        return [], []
-    print(f"Buscando {k} vizinhos para o vetor de consulta...")
-    distances, indices = index.search(np.array([query_vector]).astype('float32'), k)
-    print(f"Busca no FAISS concluída. Distâncias: {distances}, Índices: {indices}")
-    return distances[0].tolist(), indices[0].tolist()
+    """Índice FAISS atual da base de conhecimento (acompanha as republicações em disco)."""
+    return get_knowledge_retriever().snapshot().index
+
+def search_knowledge(query_vector: np.ndarray, k: int = 5) -> List[KnowledgeHit]:
+    """Busca os k trechos mais próximos na base de conhecimento global."""
+    return get_knowledge_retriever().search(query_vector, k)
+
+def search_knowledge_batch(query_vectors: np.ndarray, k: int = 5) -> List[List[KnowledgeHit]]:
+    """Versão em lote de `search_knowledge`: uma lista de trechos por linha da matriz (n, d)."""
+    return get_knowledge_retriever().search_batch(query_vectors, k)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
     print("Testando o módulo FAISS Retriever...")
     mock_query_vector = np.random.rand(DIMENSION).astype('float32')
-    search_knowledge(mock_query_vector)
-    print("Módulo FAISS Retriever testado.")
\ No newline at end of file
+    print(search_knowledge(mock_query_vector))
+    print("Módulo FAISS Retriever testado.")
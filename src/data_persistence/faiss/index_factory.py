@@ -0,0 +1,164 @@
+# Fábrica de índices FAISS por faixa de tamanho do corpus
+#
+# Bases pequenas continuam em busca exata (Flat). Passando dos limiares, o
+# índice é treinado e migrado para IVF (e, em bases muito grandes, IVF com
+# compressão SQ8/PQ) ou HNSW. A migração preserva a ordem dos vetores, então
+# o vetor i continua correspondendo ao trecho i do assistente; num IndexIDMap
+# os ids de cada vetor também são preservados.
+
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from src.data_persistence.faiss.bulk_ingest import add_in_blocks, is_id_map, with_id_map
+
+LIMIAR_IVF = 50_000           # A partir daqui a busca exata começa a pesar (dezenas de ms por consulta)
+LIMIAR_COMPRESSAO = 1_000_000 # A partir daqui os vetores float32 não cabem confortavelmente na RAM
+NPROBE_PADRAO = 16
+EF_SEARCH_PADRAO = 64
+HNSW_M = 32
+AMOSTRA_TREINO_POR_LISTA = 64 # O FAISS recomenda pelo menos ~39 vetores por lista para o k-means
+
+CONFIG_PADRAO = {
+    "tipo": "auto",           # "auto", "flat", "ivf" ou "hnsw"
+    "limiar_ivf": LIMIAR_IVF,
+    "limiar_compressao": LIMIAR_COMPRESSAO,
+    "compressao": "SQ8",      # Usada acima de LIMIAR_COMPRESSAO: None, "SQ8" ou "PQ"
+    "nprobe": NPROBE_PADRAO,
+    "ef_search": EF_SEARCH_PADRAO,
+}
+
+
+def _nlist_para(n: int) -> int:
+    return int(max(64, min(65_536, 4 * np.sqrt(n))))
+
+
+def choose_index_type(n: int, dim: int, config: Optional[Dict] = None) -> str:
+    """String do index_factory adequada para `n` vetores de dimensão `dim`."""
+    config = {**CONFIG_PADRAO, **(config or {})}
+    tipo = config["tipo"]
+    if tipo == "flat" or (tipo == "auto" and n < config["limiar_ivf"]):
+        return "Flat"
+    if tipo == "hnsw":
+        return f"HNSW{HNSW_M},Flat"
+    compressao = config.get("compressao") if n >= config["limiar_compressao"] else None
+    nlist = _nlist_para(n)
+    if compressao == "PQ":
+        m = next(m for m in (96, 64, 48, 32, 16, 8, 4, 2, 1) if dim % m == 0)
+        return f"IVF{nlist},PQ{m}"
+    if compressao == "SQ8":
+        return f"IVF{nlist},SQ8"
+    return f"IVF{nlist},Flat"
+
+
+def _interno(index: faiss.Index) -> faiss.Index:
+    return faiss.downcast_index(index.index) if is_id_map(index) else index
+
+
+def describe_index(index: faiss.Index) -> str:
+    """Tipo do índice no mesmo vocabulário do index_factory (para gravar nos metadados)."""
+    if is_id_map(index):
+        return "IDMap2," + describe_index(_interno(index))
+    if isinstance(index, faiss.IndexFlat):
+        return "Flat"
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf = faiss.downcast_index(ivf) # try_extract devolve a classe base IndexIVF
+        codificacao = "Flat"
+        if isinstance(ivf, faiss.IndexIVFScalarQuantizer):
+            codificacao = "SQ8"
+        elif isinstance(ivf, faiss.IndexIVFPQ):
+            codificacao = f"PQ{ivf.pq.M}"
+        return f"IVF{ivf.nlist},{codificacao}"
+    if isinstance(index, faiss.IndexHNSW):
+        return f"HNSW{index.hnsw.nb_neighbors(1)},Flat"
+    return type(index).__name__
+
+
+def _familia(descricao: str) -> str:
+    # IVF1024,Flat e IVF2048,Flat são da mesma família: não vale retreinar só porque nlist mudou
+    if descricao.startswith("IDMap2,"):
+        descricao = descricao[len("IDMap2,"):]
+    if descricao.startswith("IVF"):
+        return "IVF," + descricao.split(",", 1)[1]
+    return descricao
+
+
+def build_index(vetores: np.ndarray, descricao: str, ids: Optional[np.ndarray] = None) -> faiss.Index:
+    """Cria o índice `descricao`, treina se necessário e adiciona `vetores` (com `ids`, dentro de um IndexIDMap2)."""
+    vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+    index = faiss.index_factory(vetores.shape[1], descricao)
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        tamanho_amostra = AMOSTRA_TREINO_POR_LISTA * (ivf.nlist if ivf is not None else 256)
+        if len(vetores) > tamanho_amostra:
+            amostra = vetores[np.random.default_rng(0).choice(len(vetores), tamanho_amostra, replace=False)]
+        else:
+            amostra = vetores
+        index.train(amostra)
+    if ids is not None:
+        index = with_id_map(index)
+    add_in_blocks(index, vetores, ids=ids)
+    return index
+
+
+def all_vectors(index: faiss.Index) -> np.ndarray:
+    """Reconstrói todos os vetores do índice, na ordem de inserção (num IndexIDMap, na ordem de `id_map`)."""
+    index = _interno(index)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def set_search_params(index: faiss.Index, nprobe: int = NPROBE_PADRAO, ef_search: int = EF_SEARCH_PADRAO):
+    """Aplica os parâmetros de busca do tipo de índice (ignorados em Flat)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    index = _interno(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def upgrade_if_needed(index: faiss.Index, config: Optional[Dict] = None) -> Tuple[faiss.Index, Dict]:
+    """Migra o índice para a faixa adequada ao seu tamanho atual. Retorna o índice e os metadados a persistir."""
+    config = {**CONFIG_PADRAO, **(config or {})}
+    atual = describe_index(index)
+    alvo = choose_index_type(index.ntotal, index.d, config)
+    if _familia(alvo) != _familia(atual) and index.ntotal > 0:
+        # Só sobe de faixa: descer (ex: após remoções) não compensa o custo de retreinar
+        if not (alvo == "Flat" and atual != "Flat"):
+            print(f"Migrando índice FAISS de {atual} para {alvo} ({index.ntotal} vetores)...")
+            ids = faiss.vector_to_array(index.id_map).copy() if is_id_map(index) else None
+            index = build_index(all_vectors(index), alvo, ids=ids)
+    set_search_params(index, config["nprobe"], config["ef_search"])
+    # A configuração vai junto: ajustes feitos à mão no arquivo (nprobe, limiares...) sobrevivem ao próximo salvamento
+    meta = {**config, "tipo_indice": describe_index(index), "ntotal": int(index.ntotal)}
+    return index, meta
+
+
+def load_index_meta(meta_file: str) -> Dict:
+    """Metadados do índice salvos junto dele (dicionário vazio se não houver)."""
+    if not os.path.exists(meta_file):
+        return {}
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao ler metadados do índice {meta_file}: {e}")
+        return {}
+
+
+def save_index_meta(meta: Dict, meta_file: str):
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def apply_meta(index: faiss.Index, meta: Dict) -> faiss.Index:
+    """Aplica ao índice recém-lido os parâmetros de busca gravados nos metadados."""
+    set_search_params(index, meta.get("nprobe", NPROBE_PADRAO), meta.get("ef_search", EF_SEARCH_PADRAO))
+    return index
@@ -0,0 +1,37 @@
+# Leitura e escrita de índices FAISS compartilhados entre sessões
+#
+# Para o chat, o índice de cada assistente é aberto com memória mapeada
+# (IO_FLAG_MMAP_IFC): os vetores ficam no page cache do sistema operacional e
+# não são copiados para a memória do processo. Um índice mapeado é somente
+# leitura — qualquer `add` nele aborta o processo —, por isso quem precisa
+# alterar o índice pede uma cópia privada com `private_copy`.
+
+import os
+
+import faiss
+
+# No Windows um arquivo mapeado não pode ser substituído enquanto estiver aberto,
+# o que impediria salvar o assistente; lá o índice é lido normalmente.
+USAR_MMAP = os.name != "nt" and hasattr(faiss, "IO_FLAG_MMAP_IFC")
+
+
+def read_index_shared(path: str) -> faiss.Index:
+    """Abre o índice para leitura compartilhada (mapeado em memória quando o tipo de índice permite)."""
+    if USAR_MMAP:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+        except RuntimeError:
+            pass  # Tipos de índice sem suporte a mmap são lidos por inteiro
+    return faiss.read_index(path)
+
+
+def private_copy(index: faiss.Index) -> faiss.Index:
+    """Cópia em memória, segura para `add`/`remove_ids` (clone_index manteria a visão mapeada)."""
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+def write_index_atomic(index: faiss.Index, path: str):
+    """Grava em arquivo temporário e troca de uma vez: quem tem o arquivo antigo mapeado continua lendo o antigo."""
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
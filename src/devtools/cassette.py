@@ -0,0 +1,107 @@
+# Gravação e reprodução das respostas dos servidores falsos
+#
+# No modo "gravar", cada resposta dos servidores falsos (status, corpo e a
+# latência sorteada) é guardada sob uma chave lógica da requisição; no modo
+# "reproduzir", a mesma requisição recebe exatamente a mesma resposta, depois
+# da mesma latência. Com isso uma rodada de carga com latências aleatórias e
+# erros injetados pode ser repetida de forma determinística para comparar
+# versões do código.
+#
+# A chave usa só o que identifica a chamada (ex.: a última mensagem do chat,
+# a consulta do mem0 e os ids), não o prompt inteiro: memórias e trechos que
+# entram no prompt podem variar com a ordem das threads. Requisições com a
+# mesma chave recebem as respostas na ordem em que foram gravadas.
+#
+# Arquivo JSONL: a primeira linha traz os metadados da rodada (parâmetros do
+# teste de carga), cada linha seguinte uma resposta.
+
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+MODO_GRAVAR = "gravar"
+MODO_REPRODUZIR = "reproduzir"
+
+
+@dataclass
+class RespostaFalsa:
+    status: int
+    tipo_conteudo: str
+    corpo: bytes
+    latencia_s: float = 0.0
+
+
+def chave_requisicao(servico: str, *partes) -> str:
+    dados = json.dumps([servico, *partes], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(dados.encode("utf-8")).hexdigest()[:32]
+
+
+class Cassete:
+    """Respostas gravadas por chave, compartilhadas pelos servidores falsos de uma rodada."""
+
+    def __init__(self, caminho: str, modo: str, meta: Optional[Dict] = None):
+        if modo not in (MODO_GRAVAR, MODO_REPRODUZIR):
+            raise ValueError(f"Modo de cassete inválido: '{modo}'")
+        self.caminho = caminho
+        self.modo = modo
+        self.meta: Dict = dict(meta or {})
+        self._respostas: Dict[str, List[RespostaFalsa]] = defaultdict(list)
+        self._ocorrencias: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.gravadas = 0
+        self.reproduzidas = 0
+        self.faltas = 0 # Requisições sem resposta gravada (o código mudou as chamadas feitas)
+        if modo == MODO_REPRODUZIR:
+            self._carregar()
+
+    @property
+    def gravando(self) -> bool:
+        return self.modo == MODO_GRAVAR
+
+    @property
+    def reproduzindo(self) -> bool:
+        return self.modo == MODO_REPRODUZIR
+
+    def _carregar(self):
+        with open(self.caminho, "r", encoding="utf-8") as f:
+            for numero, linha in enumerate(f):
+                registro = json.loads(linha)
+                if numero == 0 and registro.get("tipo") == "meta":
+                    self.meta = registro.get("meta", {})
+                    continue
+                self._respostas[registro["chave"]].append(RespostaFalsa(
+                    registro["status"], registro["tipo_conteudo"], registro["corpo"].encode("utf-8"),
+                    registro["latencia_s"]))
+
+    def reproduzir(self, chave: str) -> Optional[RespostaFalsa]:
+        """Próxima resposta gravada para a chave (a última se a chave se repetir mais vezes que na gravação)."""
+        with self._lock:
+            gravadas = self._respostas.get(chave)
+            if not gravadas:
+                self.faltas += 1
+                return None
+            ordem = self._ocorrencias[chave]
+            self._ocorrencias[chave] += 1
+            self.reproduzidas += 1
+            return gravadas[min(ordem, len(gravadas) - 1)]
+
+    def gravar(self, chave: str, resposta: RespostaFalsa):
+        with self._lock:
+            self._respostas[chave].append(resposta)
+            self.gravadas += 1
+
+    def salvar(self):
+        """Grava o arquivo (modo gravar). As respostas de cada chave ficam na ordem em que aconteceram."""
+        if not self.gravando:
+            return
+        with self._lock, open(self.caminho, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"tipo": "meta", "meta": self.meta}, ensure_ascii=False) + "\n")
+            for chave, respostas in self._respostas.items():
+                for resposta in respostas:
+                    f.write(json.dumps({
+                        "chave": chave, "status": resposta.status, "tipo_conteudo": resposta.tipo_conteudo,
+                        "corpo": resposta.corpo.decode("utf-8"), "latencia_s": round(resposta.latencia_s, 6),
+                    }, ensure_ascii=False) + "\n")
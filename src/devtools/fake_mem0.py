@@ -0,0 +1,193 @@
+# MemoryClient falso, em memória, com a mesma interface usada no app (add/search)
+#
+# Útil para exercitar a fila write-behind e o orquestrador de recuperação sem
+# a API do mem0: latência (fixa ou uma distribuição de src.devtools.latency)
+# e taxa de falha são configuráveis, e cada chamada fica registrada para
+# inspeção.
+#
+# FakeMem0Server expõe o mesmo cliente por HTTP, com as rotas da plataforma
+# mem0 usadas pelos SDKs (GET /v1/ping/, POST .../memories/add/ e
+# .../memories/search/), para quem usa o SDK de verdade, como o
+# AsyncMemoryClient do servidor HTTP. Aponte o app para ele com
+# HUBBLET_MEM0_HOST=<base_url> e qualquer MEM0_API_KEY. Com uma Cassete as
+# respostas são gravadas ou reproduzidas (src.devtools.cassette).
+
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from src.devtools.cassette import Cassete, RespostaFalsa, chave_requisicao
+from src.devtools.latency import LatenciaConfig, como_latencia
+
+
+def _palavras(texto: str) -> set:
+    return set(re.findall(r"\w+", texto.lower()))
+
+
+class FakeMemoryClient:
+    def __init__(self, latencia_s: LatenciaConfig = 0.0, taxa_falha: float = 0.0, semente: Optional[int] = None):
+        self.latencia = como_latencia(latencia_s)
+        self.taxa_falha = taxa_falha
+        self.rng = random.Random(semente)
+        self.memorias: List[Dict] = []
+        self.chamadas_add: List[Dict] = []
+        self.chamadas_search: List[Dict] = []
+        self.falhas_injetadas = 0
+        self._lock = threading.Lock()
+
+    def sortear_rede(self) -> Tuple[float, bool]:
+        """Latência desta chamada e se ela falha."""
+        latencia = self.latencia.amostrar(self.rng)
+        falha = bool(self.taxa_falha) and self.rng.random() < self.taxa_falha
+        if falha:
+            with self._lock:
+                self.falhas_injetadas += 1
+        return latencia, falha
+
+    def _simular_rede(self):
+        latencia, falha = self.sortear_rede()
+        time.sleep(latencia)
+        if falha:
+            raise ConnectionError("Falha simulada do mem0")
+
+    def add(self, messages, user_id: str, agent_id: Optional[str] = None, **kwargs) -> Dict:
+        self._simular_rede()
+        return self._add(messages, user_id, agent_id)
+
+    def _add(self, messages, user_id: str, agent_id: Optional[str] = None) -> Dict:
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        novas = [{"id": str(uuid.uuid4()), "memory": m["content"], "user_id": user_id, "agent_id": agent_id}
+                 for m in messages if m.get("role") == "user" and m.get("content")]
+        with self._lock:
+            self.chamadas_add.append({"messages": messages, "user_id": user_id, "agent_id": agent_id})
+            self.memorias.extend(novas)
+        return {"results": [{"id": m["id"], "memory": m["memory"], "event": "ADD"} for m in novas]}
+
+    def search(self, query: str, user_id: str, agent_id: Optional[str] = None, limit: int = 10, **kwargs) -> List[Dict]:
+        self._simular_rede()
+        return self._search(query, user_id, agent_id, limit)
+
+    def _search(self, query: str, user_id: str, agent_id: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        termos = _palavras(query)
+        with self._lock:
+            self.chamadas_search.append({"query": query, "user_id": user_id, "agent_id": agent_id})
+            candidatas = [m for m in self.memorias
+                          if m["user_id"] == user_id and (agent_id is None or m["agent_id"] == agent_id)]
+        pontuadas = [(len(termos & _palavras(m["memory"])), m) for m in candidatas]
+        pontuadas.sort(key=lambda par: par[0], reverse=True)
+        return [dict(m, score=float(p)) for p, m in pontuadas[:limit]]
+
+
+def _id_do_filtro(payload: dict, campo: str) -> Optional[str]:
+    """Id no corpo (SDK antigo) ou dentro de `filters`, inclusive em {"AND": [...]} (SDK atual)."""
+    if payload.get(campo):
+        return payload[campo]
+    pendentes = [payload.get("filters") or {}]
+    while pendentes:
+        filtro = pendentes.pop()
+        if isinstance(filtro, dict):
+            if filtro.get(campo):
+                return filtro[campo]
+            pendentes.extend(filtro.get("AND", []) + filtro.get("OR", []))
+    return None
+
+
+class FakeMem0Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latencia_s: LatenciaConfig = 0.0, taxa_falha: float = 0.0,
+                 cliente: Optional[FakeMemoryClient] = None, semente: Optional[int] = None,
+                 cassete: Optional[Cassete] = None):
+        super().__init__((host, port), _Handler)
+        self.cliente = cliente or FakeMemoryClient(latencia_s=latencia_s, taxa_falha=taxa_falha, semente=semente)
+        self.cassete = cassete
+        self.contagem: Dict[str, int] = {"search": 0, "add": 0, "erros": 0} # Por requisição HTTP, também ao reproduzir
+        self._lock = threading.Lock()
+
+    def contar(self, operacao: str, erro: bool):
+        with self._lock:
+            self.contagem[operacao] += 1
+            if erro:
+                self.contagem["erros"] += 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def _json(status: int, corpo, latencia_s: float = 0.0) -> RespostaFalsa:
+    return RespostaFalsa(status, "application/json", json.dumps(corpo).encode("utf-8"), latencia_s)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeMem0Server
+    protocol_version = "HTTP/1.1" # Mantém a conexão aberta, como a API real (keep-alive)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # Silencia o log de acesso padrão
+
+    def _enviar(self, resposta: RespostaFalsa):
+        time.sleep(resposta.latencia_s)
+        self.send_response(resposta.status)
+        self.send_header("Content-Type", resposta.tipo_conteudo)
+        self.send_header("Content-Length", str(len(resposta.corpo)))
+        self.end_headers()
+        self.wfile.write(resposta.corpo)
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/").endswith("/ping"):
+            self._enviar(_json(200, {"status": "ok", "org_id": "fake-org", "project_id": "fake-project",
+                                     "user_email": "fake@localhost"}))
+        else:
+            self._enviar(_json(404, {"detail": f"Rota não suportada: {self.path}"}))
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(tamanho) or b"{}")
+        rota = self.path.split("?")[0].rstrip("/")
+        user_id = _id_do_filtro(payload, "user_id") or "anonimo"
+        agent_id = _id_do_filtro(payload, "agent_id")
+        if rota.endswith("/memories/search"):
+            operacao, chave = "search", chave_requisicao("search", payload.get("query", ""), user_id, agent_id)
+        elif rota.endswith("/memories/add") or rota.endswith("/v1/memories"):
+            operacao = "add"
+            chave = chave_requisicao("add", [m.get("content") for m in payload.get("messages", [])], user_id, agent_id)
+        else:
+            self._enviar(_json(404, {"detail": f"Rota não suportada: {self.path}"}))
+            return
+
+        cassete = self.server.cassete
+        resposta = cassete.reproduzir(chave) if cassete is not None and cassete.reproduzindo else None
+        if resposta is None:
+            resposta = self._executar(rota, payload, user_id, agent_id)
+            if cassete is not None and cassete.gravando:
+                cassete.gravar(chave, resposta)
+        self.server.contar(operacao, erro=resposta.status >= 400)
+        self._enviar(resposta)
+
+    def _executar(self, rota: str, payload: dict, user_id: str, agent_id: Optional[str]) -> RespostaFalsa:
+        cliente = self.server.cliente
+        latencia, falha = cliente.sortear_rede()
+        if falha:
+            return _json(503, {"detail": "Falha simulada do mem0"}, latencia)
+        if rota.endswith("/memories/search"):
+            limite = int(payload.get("top_k") or payload.get("limit") or 10)
+            resultado = cliente._search(payload.get("query", ""), user_id=user_id, agent_id=agent_id, limit=limite)
+            return _json(200, {"results": resultado}, latencia)
+        return _json(200, cliente._add(payload.get("messages", []), user_id=user_id, agent_id=agent_id), latencia)
+
+
+def start_fake_mem0(**kwargs) -> Tuple[FakeMem0Server, threading.Thread]:
+    """Sobe o servidor numa thread daemon. Use server.base_url e server.shutdown()."""
+    server = FakeMem0Server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
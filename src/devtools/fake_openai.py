@@ -0,0 +1,227 @@
+# Servidor local que imita a API de embeddings e de chat da OpenAI
+#
+# Serve POST /v1/embeddings com vetores determinísticos (mesmo texto -> mesmo
+# vetor) e POST /v1/chat/completions (com ou sem stream) com uma resposta
+# fixa, contando as chamadas. A latência pode seguir uma distribuição
+# (src.devtools.latency), separada para o chat, e taxas de respostas 429 e
+# 500 exercitam o retry; lotes de embeddings com algum dos `textos_com_erro`
+# recebem 500 sempre, como uma falha definitiva. Com uma Cassete as respostas são gravadas ou
+# reproduzidas (src.devtools.cassette). Aponte o cliente para ele com
+# OpenAI(api_key="fake", base_url=url).
+
+import array
+import base64
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List, Optional, Tuple
+
+from src.devtools.cassette import Cassete, RespostaFalsa, chave_requisicao
+from src.devtools.latency import LatenciaConfig, como_latencia
+
+DIMENSAO_PADRAO = 1536
+
+
+def fake_embedding(texto: str, dim: int = DIMENSAO_PADRAO) -> List[float]:
+    """Vetor pseudoaleatório e estável derivado do hash do texto."""
+    rng = random.Random(hashlib.sha256(texto.encode("utf-8")).digest())
+    return [rng.uniform(-1.0, 1.0) for _ in range(dim)]
+
+
+def _base64_float32(vetor: List[float]) -> str:
+    valores = array.array("f", vetor)
+    if sys.byteorder != "little":
+        valores.byteswap()
+    return base64.b64encode(valores.tobytes()).decode("ascii")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latencia_s: LatenciaConfig = 0.0,
+                 latencia_por_item_s: float = 0.0, taxa_erro_429: float = 0.0, dim: int = DIMENSAO_PADRAO,
+                 latencia_chat_s: Optional[LatenciaConfig] = None, taxa_erro_500: float = 0.0,
+                 intervalo_pedacos_s: float = 0.0, semente: Optional[int] = None, cassete: Optional[Cassete] = None,
+                 textos_com_erro: Iterable[str] = ()):
+        super().__init__((host, port), _Handler)
+        self.latencia = como_latencia(latencia_s)
+        self.latencia_chat = como_latencia(latencia_chat_s) if latencia_chat_s is not None else self.latencia
+        self.latencia_por_item_s = latencia_por_item_s
+        self.taxa_erro_429 = taxa_erro_429
+        self.taxa_erro_500 = taxa_erro_500
+        self.intervalo_pedacos_s = intervalo_pedacos_s # Entre os pedaços do stream: separa o primeiro token do fim
+        self.textos_com_erro = frozenset(textos_com_erro)
+        self.dim = dim
+        self.cassete = cassete
+        self.rng = random.Random(semente)
+        self.requisicoes = 0
+        self.chamadas_chat = 0
+        self.erros_injetados = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def contar_requisicao(self, chat: bool = False):
+        with self._lock:
+            self.requisicoes += 1
+            if chat:
+                self.chamadas_chat += 1
+
+    def contar_erro(self):
+        with self._lock:
+            self.erros_injetados += 1
+
+    def sortear_erro(self) -> Optional[RespostaFalsa]:
+        """Erro injetado (429 ou 500) conforme as taxas configuradas, ou None."""
+        sorteio = self.rng.random()
+        if sorteio < self.taxa_erro_429:
+            return _json(429, {"error": {"message": "Rate limit (simulado)", "type": "rate_limit_error"}})
+        if sorteio < self.taxa_erro_429 + self.taxa_erro_500:
+            return _json(500, {"error": {"message": "Erro interno (simulado)", "type": "server_error"}})
+        return None
+
+    def erro_permanente(self, entradas) -> Optional[RespostaFalsa]:
+        """500 para todo lote de embeddings que contenha um dos `textos_com_erro`, em qualquer tentativa."""
+        if isinstance(entradas, str):
+            entradas = [entradas]
+        if self.textos_com_erro.intersection(entradas):
+            return _json(500, {"error": {"message": "Erro interno permanente (simulado)", "type": "server_error"}})
+        return None
+
+
+def _json(status: int, corpo: dict, latencia_s: float = 0.0) -> RespostaFalsa:
+    return RespostaFalsa(status, "application/json", json.dumps(corpo).encode("utf-8"), latencia_s)
+
+
+def _ultima_mensagem(payload: dict) -> str:
+    mensagens = payload.get("messages") or [{}]
+    return str(mensagens[-1].get("content", ""))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = "HTTP/1.1" # Mantém a conexão aberta, como a API real (keep-alive)
+    disable_nagle_algorithm = True # Evita o atraso de ~40ms entre cabeçalho e corpo com keep-alive
+
+    def log_message(self, format, *args):
+        pass  # Silencia o log de acesso padrão
+
+    def _responder(self, status: int, corpo: dict):
+        self._enviar(_json(status, corpo))
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(tamanho) or b"{}")
+        rota = self.path.rstrip("/")
+        chat = rota.endswith("/chat/completions")
+        self.server.contar_requisicao(chat=chat)
+        if not chat and not rota.endswith("/embeddings"):
+            self._responder(404, {"error": {"message": f"Rota não suportada: {self.path}"}})
+            return
+
+        cassete = self.server.cassete
+        if chat:
+            chave = chave_requisicao("chat", payload.get("model"), bool(payload.get("stream")), _ultima_mensagem(payload))
+        else:
+            chave = chave_requisicao("embeddings", payload.get("model"), payload.get("encoding_format"), payload.get("input"))
+        resposta = cassete.reproduzir(chave) if cassete is not None and cassete.reproduzindo else None
+        if resposta is None:
+            erro = None if chat else self.server.erro_permanente(payload.get("input", []))
+            resposta = erro or self.server.sortear_erro() or (self._chat(payload) if chat else self._embeddings(payload))
+            if cassete is not None and cassete.gravando:
+                cassete.gravar(chave, resposta)
+        if resposta.status >= 400: # Sorteado agora ou reproduzido da fita
+            self.server.contar_erro()
+        self._enviar(resposta)
+
+    def _embeddings(self, payload: dict) -> RespostaFalsa:
+        entradas = payload.get("input", [])
+        if isinstance(entradas, str):
+            entradas = [entradas]
+        srv = self.server
+        latencia = srv.latencia.amostrar(srv.rng) + srv.latencia_por_item_s * len(entradas)
+        # O SDK pede base64 (float32 little-endian) por padrão, como a API real responde; listas só se pedidas
+        em_base64 = payload.get("encoding_format") == "base64"
+        dados = [{"object": "embedding", "index": i,
+                  "embedding": _base64_float32(fake_embedding(t, srv.dim)) if em_base64 else fake_embedding(t, srv.dim)}
+                 for i, t in enumerate(entradas)]
+        tokens = sum(max(1, len(t) // 4) for t in entradas)
+        return _json(200, {
+            "object": "list",
+            "data": dados,
+            "model": payload.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }, latencia)
+
+    def _chat(self, payload: dict) -> RespostaFalsa:
+        latencia = self.server.latencia_chat.amostrar(self.server.rng)
+        modelo = payload.get("model", "gpt-3.5-turbo")
+        prompt = " ".join(str(m.get("content", "")) for m in payload.get("messages", []))
+        texto = "Resposta simulada."
+        uso = {"prompt_tokens": max(1, len(prompt) // 4), "completion_tokens": 3,
+               "total_tokens": max(1, len(prompt) // 4) + 3}
+        if not payload.get("stream"):
+            return _json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": modelo,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+                "usage": uso,
+            }, latencia)
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": modelo}
+        partes = [p + " " for p in texto.split(" ")]
+        partes[-1] = partes[-1].rstrip()
+        eventos = [dict(base, choices=[{"index": 0, "delta": {"content": parte},
+                                        "finish_reason": "stop" if i == len(partes) - 1 else None}])
+                   for i, parte in enumerate(partes)]
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            eventos.append(dict(base, choices=[], usage=uso))
+        corpo = "".join(f"data: {json.dumps(evento)}\n\n" for evento in eventos) + "data: [DONE]\n\n"
+        return RespostaFalsa(200, "text/event-stream", corpo.encode("utf-8"), latencia)
+
+    def _enviar(self, resposta: RespostaFalsa):
+        time.sleep(resposta.latencia_s)
+        if resposta.tipo_conteudo != "text/event-stream":
+            self.send_response(resposta.status)
+            self.send_header("Content-Type", resposta.tipo_conteudo)
+            self.send_header("Content-Length", str(len(resposta.corpo)))
+            self.end_headers()
+            self.wfile.write(resposta.corpo)
+            return
+        self.send_response(resposta.status)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        eventos = [e + b"\n\n" for e in resposta.corpo.split(b"\n\n") if e]
+        for i, evento in enumerate(eventos):
+            if i and self.server.intervalo_pedacos_s:
+                time.sleep(self.server.intervalo_pedacos_s)
+            self._enviar_pedaco(evento)
+        self._enviar_pedaco(b"")
+
+    def _enviar_pedaco(self, dados: bytes):
+        self.wfile.write(f"{len(dados):X}\r\n".encode("ascii") + dados + b"\r\n")
+        self.wfile.flush()
+
+
+def start_fake_openai(**kwargs) -> Tuple[FakeOpenAIServer, threading.Thread]:
+    """Sobe o servidor numa thread daemon. Use server.base_url e server.shutdown()."""
+    server = FakeOpenAIServer(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+if __name__ == "__main__":
+    srv, _ = start_fake_openai(port=8765, latencia_s=0.05)
+    print(f"Fake OpenAI ouvindo em {srv.base_url} (Ctrl+C para sair)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
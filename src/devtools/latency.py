@@ -0,0 +1,74 @@
+# Distribuições de latência para os servidores falsos (fake_openai, fake_mem0)
+#
+# Uma latência fixa esconde a cauda: com várias chamadas por turno, o p99 do
+# turno vem das chamadas lentas. As distribuições são escritas como texto,
+# para vir direto da linha de comando:
+#   "0.2" ou "fixa:0.2"       fixa, em segundos
+#   "uniforme:0.1,0.3"        entre mínimo e máximo
+#   "normal:0.2,0.05"         média e desvio (cortada em zero)
+#   "lognormal:0.2,0.5"       mediana e sigma: cauda longa, como APIs reais
+#   "exp:0.2"                 exponencial com a média dada
+
+import math
+import random
+from typing import Optional, Union
+
+
+class Latencia:
+    """Distribuição de latência; `amostrar` devolve segundos (nunca negativos)."""
+
+    TIPOS = ("fixa", "uniforme", "normal", "lognormal", "exp")
+
+    def __init__(self, tipo: str = "fixa", a: float = 0.0, b: float = 0.0):
+        if tipo not in self.TIPOS:
+            raise ValueError(f"Distribuição de latência desconhecida: '{tipo}' (use {', '.join(self.TIPOS)})")
+        self.tipo = tipo
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, texto: str) -> "Latencia":
+        texto = texto.strip()
+        if ":" not in texto:
+            return cls("fixa", float(texto))
+        tipo, parametros = texto.split(":", 1)
+        if tipo not in cls.TIPOS:
+            raise ValueError(f"Distribuição de latência desconhecida: '{tipo}' (use {', '.join(cls.TIPOS)})")
+        valores = [float(v) for v in parametros.split(",")]
+        if tipo in ("fixa", "exp") and len(valores) == 1:
+            return cls(tipo, valores[0])
+        if len(valores) != 2:
+            raise ValueError(f"Latência '{texto}': '{tipo}' recebe dois parâmetros")
+        return cls(tipo, *valores)
+
+    def amostrar(self, rng: random.Random) -> float:
+        if self.tipo == "fixa":
+            valor = self.a
+        elif self.tipo == "uniforme":
+            valor = rng.uniform(self.a, self.b)
+        elif self.tipo == "normal":
+            valor = rng.gauss(self.a, self.b)
+        elif self.tipo == "lognormal":
+            valor = rng.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        else:
+            valor = rng.expovariate(1.0 / self.a) if self.a > 0 else 0.0
+        return max(0.0, valor)
+
+    def __repr__(self) -> str:
+        if self.tipo == "fixa":
+            return f"{self.a:g}"
+        if self.tipo == "exp":
+            return f"exp:{self.a:g}"
+        return f"{self.tipo}:{self.a:g},{self.b:g}"
+
+
+LatenciaConfig = Union[float, str, Latencia]
+
+
+def como_latencia(valor: Optional[LatenciaConfig]) -> Latencia:
+    """Aceita segundos (número), o formato texto ou uma Latencia pronta."""
+    if isinstance(valor, Latencia):
+        return valor
+    if isinstance(valor, str):
+        return Latencia.parse(valor)
+    return Latencia("fixa", float(valor or 0.0))
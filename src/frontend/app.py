@@ -7,37 +7,32 @@ import os
 import json # Adicionado para salvar/carregar metadados de arquivos
 from dotenv import load_dotenv
 import numpy as np
-from mem0 import MemoryClient
-from openai import OpenAI # Para uso direto na IA de configuração
+import altair as alt
+import pandas as pd
 
 # --- Início: Funções de Gerenciamento de Tokens ---
-DEFAULT_TOTAL_TOKENS = 2_000_000
+# Os contadores ficam no servidor (src/core/token_meter.py), por usuário; st.session_state só espelha o saldo para a UI.
+
+def _espelhar_saldo(saldo):
+    st.session_state.total_tokens = saldo.total
+    st.session_state.used_tokens = saldo.usados
 
 def inicializar_tokens_usuario():
-    if "total_tokens" not in st.session_state:
-        st.session_state.total_tokens = DEFAULT_TOTAL_TOKENS
-    if "used_tokens" not in st.session_state:
-        st.session_state.used_tokens = 0
-
-def contar_tokens_texto(texto: str) -> int:
-    if not texto:
-        return 0
-    return len(texto) // 4 # Estimativa simples: 1 token ~ 4 caracteres
-
-def atualizar_tokens_usados(input_texto: str, output_texto: str):
-    inicializar_tokens_usuario() # Garante que os tokens estejam inicializados
-    input_tokens = contar_tokens_texto(input_texto)
-    output_tokens = contar_tokens_texto(output_texto)
-    st.session_state.used_tokens += (input_tokens + output_tokens)
-    # st.rerun() # Descomente se a UI não atualizar imediatamente
+    """Espelha o saldo do usuário logado (vem da memória do medidor; o disco só é relido de tempos em tempos)."""
+    _espelhar_saldo(get_token_meter().balance(st.session_state.get("username") or ""))
+
+def registrar_uso_tokens(mensagens_prompt: List[Dict], resposta: str, usage, model: str):
+    """Soma ao usuário os tokens de uma chamada: o `usage` da API quando veio, senão a contagem do tokenizer."""
+    prompt_tokens, completion_tokens, fonte = usage_or_estimate(usage, mensagens_prompt, resposta, model)
+    saldo = get_token_meter().record_usage(st.session_state.get("username") or "", prompt_tokens, completion_tokens, fonte)
+    _espelhar_saldo(saldo)
 
 def adicionar_milhao_tokens():
-    inicializar_tokens_usuario() # Garante que os tokens estejam inicializados
-    st.session_state.total_tokens += 1_000_000
+    _espelhar_saldo(get_token_meter().add_quota(st.session_state.get("username") or "", 1_000_000))
     st.rerun() # Força a atualização da UI para refletir o novo total e liberar o chat se estava bloqueado
 
 def verificar_limite_tokens() -> bool:
-    inicializar_tokens_usuario() # Garante que os tokens estejam inicializados
+    inicializar_tokens_usuario() # Barato: chamado em todo rerun pelo input do chat
     return st.session_state.used_tokens >= st.session_state.total_tokens
 # --- Fim: Funções de Gerenciamento de Tokens ---
 
@@ -47,21 +42,57 @@ from utils import (
     reset_session,
     inicializar_faiss,
     gerar_embeddings,
-    processar_arquivos,
+    validar_arquivos_upload,
+    mostrar_avisos_ingestao,
     carregar_ou_inicializar_dados_assistente,
+    caminhos_assistente,
+    versao_assistente,
     load_chat_history,  # Adicionado
     save_chat_history,  # Adicionado
     create_new_chat_session,  # Adicionado
     list_chat_sessions,  # Adicionado
     get_chat_session_messages,  # Adicionado
-    add_message_to_session  # Adicionado
 )
+from src.core.chat_turn import (
+    AVISOS_RECUPERACAO,
+    MODELO_CHAT,
+    ORCAMENTO_RECUPERACAO_S,
+    FilaPorSessao,
+    atualizar_resumo_sessao,
+    contexto_recuperado,
+    persistir_turno_chat,
+    salvar_mensagem_usuario,
+    tarefas_recuperacao,
+)
+from src.core import tracing
+from src.core.context_builder import ContextBuilder, format_breakdown
+from src.core.ingestion import get_ingestion_queue
+from src.core.embeddings import embed_query # Embeddings de consulta passam pelo cache compartilhado
+from src.core.retrieval import fan_out
+from src.core.token_meter import DEFAULT_TOTAL_TOKENS, get_token_meter, usage_or_estimate
+from src.core.memory_writer import get_memory_writer
+from src.core.profile_memory import get_profile_cache
+from src.core.resources import get_mem0_client, get_openai_client, invalidate_assistant, mem0_configured
+from src.data_persistence.chunks import bm25_index
+from src.data_persistence.chunks.chunk_store import save_chunks
+from src.data_persistence.faiss import index_factory
+from src.data_persistence.faiss.bulk_ingest import add_in_blocks
+from src.data_persistence.faiss.index_io import write_index_atomic
+from src.data_persistence.chat_sessions.session_store import get_session_store
+from src.data_persistence.cache.response_cache import get_response_cache
 
 # Carrega variáveis de ambiente do arquivo .env
 load_dotenv()
 
 st.set_page_config(page_title="Hubblet: Criação de Assistente", layout="wide")
 
+@st.cache_resource(show_spinner=False)
+def iniciar_rastreamento():
+    """HUBBLET_TRACING/HUBBLET_METRICS_PORT do .env, uma vez por processo (o liga/desliga da página de admin sobrevive aos reruns)."""
+    return tracing.configure_from_env()
+
+iniciar_rastreamento()
+
 st.markdown("<div style='height:3.5rem;'></div>", unsafe_allow_html=True)
 
 # Constantes para o fluxo de configuração do assistente
@@ -216,7 +247,7 @@ def pagina_chat_assistente():
                     st.session_state["config_chat_history"].append({"role": "assistant", "content": "OPENAI_API_KEY não configurada. Não posso processar este pedido."})
                 else:
                     try:
-                        client = OpenAI(api_key=openai_api_key)
+                        client = get_openai_client(openai_api_key)
                         # Prepara o contexto para a IA de configuração
                         config_context = []
                         # Adiciona uma instrução de sistema para a IA de configuração
@@ -264,16 +295,18 @@ def pagina_chat_assistente():
     with col_upload:
         st.markdown("<div style='font-size:1.3rem;font-weight:600;margin-bottom:0.5rem;'>Base de Conhecimento (Opcional)</div>", unsafe_allow_html=True)
         uploaded_file_objects = st.file_uploader(
-            "Adicione arquivos (.txt, .md, .pdf) para o assistente usar como referência.", 
+            "Adicione arquivos (.txt, .md, .pdf, .docx, .html) para o assistente usar como referência.", 
             accept_multiple_files=True, 
-            type=['txt', 'md', 'pdf'],
+            type=['txt', 'md', 'pdf', 'docx', 'pptx', 'html', 'htm'],
             key="file_uploader_config"
         )
 
+        aplicar_job_ingestao()
+
         if uploaded_file_objects:
-            # Processa apenas os arquivos que ainda não foram processados
+            # Processa apenas os arquivos que ainda não foram processados nem estão em processamento
             novos_arquivos_para_processar = []
-            nomes_ja_processados = st.session_state.get("uploaded_files", [])
+            nomes_ja_processados = set(st.session_state.get("uploaded_files", [])) | set(st.session_state.get("arquivos_em_ingestao", []))
             for ufo in uploaded_file_objects:
                 if ufo.name not in nomes_ja_processados:
                     novos_arquivos_para_processar.append(ufo)
@@ -281,16 +314,17 @@ def pagina_chat_assistente():
             if novos_arquivos_para_processar:
                 if not openai_api_key:
                     st.warning("OPENAI_API_KEY não definida. Não é possível processar arquivos.")
+                elif st.session_state.get("job_ingestao"):
+                    st.info("Aguarde o processamento atual terminar para enviar novos arquivos.")
                 else:
-                    chunks, embeddings, nomes_processados = processar_arquivos(novos_arquivos_para_processar, openai_api_key)
-                    if chunks and embeddings:
-                        st.session_state["doc_chunks"].extend(chunks)
-                        for emb in embeddings:
-                            st.session_state["faiss_index"].add(np.expand_dims(emb, axis=0))
-                        st.session_state["uploaded_files"].extend(nomes_processados)
-                        st.success(f"{len(nomes_processados)} novo(s) arquivo(s) processado(s) e adicionado(s) à base de conhecimento.")
-                    elif nomes_processados: # Arquivos foram lidos mas não geraram embeddings
-                        st.warning(f"{len(nomes_processados)} arquivo(s) lido(s), mas falha ao gerar embeddings. Verifique o conteúdo e a chave da API.")
+                    arquivos_validos = validar_arquivos_upload(novos_arquivos_para_processar)
+                    if arquivos_validos:
+                        # Extração, divisão e embeddings rodam em segundo plano; o script segue respondendo
+                        st.session_state["job_ingestao"] = get_ingestion_queue().submit(arquivos_validos, openai_api_key)
+                        st.session_state["arquivos_em_ingestao"] = [nome for nome, _ in arquivos_validos]
+
+        if st.session_state.get("job_ingestao"):
+            acompanhar_job_ingestao()
 
         st.subheader("Arquivos Carregados:")
         if st.session_state.get("uploaded_files"):
@@ -332,11 +366,11 @@ def pagina_chat_assistente():
                 try:
                     # Salvar instruções
                     # Garante que o caminho seja relativo ao diretório do frontend, onde utils.py espera.
-                    path_base = os.path.join(os.path.dirname(__file__), "assistentes_salvos")
-                    os.makedirs(path_base, exist_ok=True)
-                    safe_nome_assistente = nome_assistente_config.replace(' ', '_').lower().strip()
+                    arquivos_assistente = caminhos_assistente(nome_assistente_config)
+                    os.makedirs(os.path.dirname(arquivos_assistente["instrucoes"]), exist_ok=True)
+                    safe_nome_assistente = arquivos_assistente["safe_nome"]
                     
-                    config_file_md = os.path.join(path_base, f"assistente_{safe_nome_assistente}_config.md")
+                    config_file_md = arquivos_assistente["instrucoes"]
                     with open(config_file_md, "w", encoding="utf-8") as f:
                         # Adiciona um cabeçalho simples ou apenas salva as instruções diretamente
                         # Se for salvar apenas as instruções, pode ser f.write(st.session_state["instrucoes_finais"])
@@ -348,39 +382,42 @@ def pagina_chat_assistente():
                     # Adicionar instruções finais ao FAISS index
                     if st.session_state.get("instrucoes_finais") and openai_api_key:
                         instrucoes_texto = st.session_state["instrucoes_finais"]
-                        # Usar a função gerar_embeddings de utils.py (precisa ser importada ou chamada via processar_arquivos)
-                        # Para simplificar aqui, vamos chamar a lógica de embedding diretamente se possível
-                        # ou garantir que processar_arquivos pode lidar com texto direto.
-                         # Assumindo que gerar_embeddings está acessível ou podemos replicar a chamada:
-                         
+                        # As instruções viram mais um trecho; o embedding é gerado aqui, fora da fila de ingestão
                         instrucoes_embeddings = gerar_embeddings([instrucoes_texto], openai_api_key)
                         if instrucoes_embeddings:
                             if "doc_chunks" not in st.session_state:
                                 st.session_state["doc_chunks"] = []
                             if "faiss_index" not in st.session_state or st.session_state["faiss_index"] is None:
                                 # A dimensão do embedding é 1536 para text-embedding-ada-002
-                                st.session_state["faiss_index"] = faiss.IndexFlatL2(1536) 
+                                st.session_state["faiss_index"] = inicializar_faiss(1536)
 
                             st.session_state["doc_chunks"].append(f"Instruções do Assistente: {instrucoes_texto}") # Adiciona com um prefixo
-                            st.session_state["faiss_index"].add(np.array(instrucoes_embeddings[0], dtype=np.float32).reshape(1, -1))
+                            add_in_blocks(st.session_state["faiss_index"], instrucoes_embeddings, verbose=False)
                             st.info("Instruções do assistente adicionadas ao índice de conhecimento.")
                         else:
                             st.warning("Não foi possível gerar embeddings para as instruções do assistente.")
                     
                     # Salvar FAISS e chunks se existirem (agora pode incluir as instruções)
                     if st.session_state.get("faiss_index") and st.session_state["faiss_index"].ntotal > 0:
-                        faiss_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_faiss.index")
-                        faiss.write_index(st.session_state["faiss_index"], faiss_file)
-                        
-                        chunks_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_chunks.json")
-                        with open(chunks_file, "w", encoding="utf-8") as f:
-                            json.dump(st.session_state.get("doc_chunks", []), f)
+                        # Bases que cresceram além dos limiares migram de Flat para IVF/HNSW (ordem dos vetores preservada)
+                        meta_indice = index_factory.load_index_meta(arquivos_assistente["faiss_meta"])
+                        st.session_state["faiss_index"], meta_indice = index_factory.upgrade_if_needed(
+                            st.session_state["faiss_index"], meta_indice)
+                        # Troca atômica: sessões com o índice antigo mapeado em memória seguem lendo o arquivo antigo
+                        write_index_atomic(st.session_state["faiss_index"], arquivos_assistente["faiss"])
+                        index_factory.save_index_meta(meta_indice, arquivos_assistente["faiss_meta"])
+                        # Só os chunks novos são acrescentados quando os salvos são prefixo dos atuais
+                        inicio_novos = save_chunks(arquivos_assistente["chunks"], st.session_state.get("doc_chunks", []))
+                        # O BM25 acompanha: um segmento novo só com os trechos acrescentados
+                        bm25_index.update_index(arquivos_assistente["chunks"], st.session_state.get("doc_chunks", []), inicio_novos)
                         
                         # Salvar nomes dos arquivos originais
-                        uploaded_files_info_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_uploaded_files.json")
+                        uploaded_files_info_file = arquivos_assistente["uploaded_files"]
                         with open(uploaded_files_info_file, "w", encoding="utf-8") as f_info:
                             json.dump(st.session_state.get("uploaded_files", []), f_info)
 
+                    invalidate_assistant(safe_nome_assistente) # Outras sessões passam a ver a versão salva
+                    get_response_cache().invalidate(safe_nome_assistente) # Respostas antigas não refletem as novas instruções/documentos
                     st.success(f"Assistente '{nome_assistente_config}' salvo com sucesso!")
                     st.session_state["assistente_selecionado"] = nome_assistente_config # Define como selecionado
                     st.session_state["menu_sidebar"] = "Chat Principal" # Muda para o chat principal
@@ -399,12 +436,65 @@ def pagina_chat_assistente():
                 except Exception as e:
                     st.error(f"Erro ao salvar o assistente: {e}")
 
+def aplicar_job_ingestao():
+    """Quando o job de ingestão da sessão termina, acrescenta os trechos e vetores ao assistente em edição."""
+    job_id = st.session_state.get("job_ingestao")
+    job = get_ingestion_queue().get(job_id) if job_id else None
+    if job_id and job is None: # Processo reiniciado ou job expirado
+        st.session_state["job_ingestao"] = None
+        st.session_state["arquivos_em_ingestao"] = []
+        return
+    if job is None or not job.concluido:
+        return
+    mostrar_avisos_ingestao(job)
+    if job.trechos and job.embeddings:
+        st.session_state["doc_chunks"].extend(job.trechos)
+        stats_ingestao = add_in_blocks(st.session_state["faiss_index"], job.embeddings) # Uma matriz, blocos grandes
+        st.session_state["uploaded_files"].extend(job.nomes_processados)
+        st.success(f"{len(job.nomes_processados)} novo(s) arquivo(s) processado(s) e adicionado(s) à base de conhecimento.")
+        st.caption(f"{stats_ingestao.vetores} vetores indexados ({stats_ingestao.vetores_por_s:,.0f} vetores/s)")
+    elif job.nomes_processados: # Arquivos foram lidos mas não geraram embeddings
+        st.warning(f"{len(job.nomes_processados)} arquivo(s) lido(s), mas falha ao gerar embeddings. Verifique o conteúdo e a chave da API.")
+    get_ingestion_queue().discard(job_id)
+    st.session_state["job_ingestao"] = None
+    st.session_state["arquivos_em_ingestao"] = []
+
+def _progresso_job_ingestao():
+    job = get_ingestion_queue().get(st.session_state.get("job_ingestao") or "")
+    if job is None:
+        return
+    if job.concluido:
+        st.rerun() # Rerun completo: aplicar_job_ingestao incorpora o resultado
+    detalhe = f"{job.arquivos_extraidos}/{len(job.arquivos)} arquivo(s)"
+    if job.trechos_total:
+        detalhe += f", {job.trechos_processados}/{job.trechos_total} trechos"
+    st.progress(job.progresso, text=f"Processando: {job.etapa} ({detalhe})")
+
+# Com st.fragment só o bloco de progresso é reexecutado a cada segundo; versões antigas do Streamlit usam um botão
+if hasattr(st, "fragment"):
+    acompanhar_job_ingestao = st.fragment(run_every=1.0)(_progresso_job_ingestao)
+else:
+    def acompanhar_job_ingestao():
+        _progresso_job_ingestao()
+        st.button("Atualizar progresso", key="atualizar_progresso_ingestao")
+
+AVISO_RESPOSTA_INTERROMPIDA = "\n\n_(resposta interrompida)_"
+
+@st.cache_resource
+def executor_pos_resposta() -> FilaPorSessao:
+    """Fila compartilhada entre reruns para as gravações da sessão; as de uma mesma sessão rodam na ordem de envio."""
+    return FilaPorSessao(max_workers=4, thread_name_prefix="pos_resposta")
+
+def registrar_metrica_resposta(nome: str, valor: float):
+    """Guarda a última medição (ex: tempo até o primeiro token) para exibir no chat."""
+    st.session_state.setdefault("metricas_resposta", {})[nome] = valor
+
 # Página de Chat Principal
 def pagina_chat_principal():
     inicializar_tokens_usuario() # Inicializa os tokens para a sessão
     openai_api_key = os.environ.get("OPENAI_API_KEY", "")
     # Adicionar inicialização do Mem0 Client
-    mem0_client = MemoryClient() # Assumindo que a configuração (ex: API key) é feita via variáveis de ambiente se necessário
+    mem0_client = get_mem0_client() if mem0_configured() else None # Cliente único do processo; MEM0_API_KEY vem do ambiente
 
     if "username" not in st.session_state or not st.session_state["username"]:
         st.warning("Por favor, faça login primeiro.")
@@ -412,6 +502,10 @@ def pagina_chat_principal():
         st.rerun()
         return
 
+    if mem0_client:
+        # Perfil do usuário buscado em segundo plano ao abrir o chat: a primeira pergunta já o encontra em cache
+        get_profile_cache().prefetch(st.session_state["username"])
+
     # Inicializa o estado da sessão para o chat principal, se necessário
     if "chat_principal_history" not in st.session_state: st.session_state["chat_principal_history"] = []
     if "current_chat_session_id" not in st.session_state:
@@ -442,7 +536,7 @@ def pagina_chat_principal():
         if st.button("Configurar/Editar Assistente", key="goto_config_btn"):
             st.session_state["menu_sidebar"] = "Configuração/Chat"
             if st.session_state.get("assistente_selecionado") and st.session_state.get("assistente_selecionado") != "Criar novo assistente":
-                 carregar_ou_inicializar_dados_assistente(username=st.session_state["username"], nome_assistente=st.session_state["assistente_selecionado"], openai_api_key=openai_api_key)
+                 carregar_ou_inicializar_dados_assistente(username=st.session_state["username"], nome_assistente=st.session_state["assistente_selecionado"], openai_api_key=openai_api_key, editavel=True)
                  st.session_state["chat_mode"] = "editar"
             else: 
                  carregar_ou_inicializar_dados_assistente(username=st.session_state["username"], nome_assistente="", openai_api_key=openai_api_key)
@@ -458,6 +552,13 @@ def pagina_chat_principal():
         if st.button("Logout", key="logout_btn_chat"):
             reset_session()
             st.rerun()
+        if usuario_admin(st.session_state["username"]) and st.button("Latência (admin)", key="goto_latencia_btn"):
+            st.session_state["menu_sidebar"] = "Latência"
+            st.rerun()
+        if mem0_configured():
+            metricas_memoria = get_memory_writer().metrics()
+            if metricas_memoria["pendentes"]:
+                st.caption(f"🧠 Memórias aguardando envio ao mem0: {metricas_memoria['pendentes']}")
         st.divider()
         st.subheader("Minhas Conversas")
 
@@ -536,6 +637,16 @@ def pagina_chat_principal():
         st.warning("Você atingiu o limite de tokens. Adicione mais para continuar.")
     # --- Fim: Exibição de Tokens e Botão Adicionar ---
 
+    metricas_resposta = st.session_state.get("metricas_resposta", {})
+    if "ttft_s" in metricas_resposta:
+        if metricas_resposta.get("cache_similaridade") is not None:
+            detalhe_resposta = (f"resposta do cache (similaridade {metricas_resposta['cache_similaridade']:.3f},"
+                                f" {get_response_cache().hit_rate():.0%} de acertos)")
+        else:
+            detalhe_resposta = f"prompt de {metricas_resposta.get('tokens_prompt', 0):,} tokens"
+        st.caption(f"⏱️ Última resposta: primeiro token em {metricas_resposta['ttft_s']:.2f}s, completa em {metricas_resposta.get('total_s', 0):.2f}s"
+                   f" · {detalhe_resposta}")
+
     chat_container_principal = st.container()
     with chat_container_principal:
         for msg in st.session_state["chat_principal_history"]:
@@ -550,190 +661,234 @@ def pagina_chat_principal():
     prompt_principal = st.chat_input(f"Pergunte ao {st.session_state.get('assistente_selecionado', 'Assistente')}...", disabled=chat_input_disabled, key="main_chat_input")
 
     if prompt_principal:
-        if verificar_limite_tokens():
-            st.warning("Limite de tokens atingido. Não é possível enviar novas mensagens até adicionar mais tokens.")
-            st.stop() # Interrompe o processamento da mensagem
-        if not openai_api_key:
-            st.warning("OPENAI_API_KEY não definida. Não é possível gerar resposta.")
-            st.stop()
-
-        add_message_to_session(st.session_state["current_chat_session_id"], "user", prompt_principal)
-        st.session_state["chat_principal_history"].append({"role": "user", "content": prompt_principal})
+        # Turno inteiro rastreado (HUBBLET_TRACING=1): etapas na página de latência e em /metrics
+        with tracing.trace("turno.chat", usuario=st.session_state.get("username"),
+                           assistente=st.session_state.get("assistente_selecionado")):
+            t_inicio_turno = time.perf_counter() # Base para o tempo até o primeiro token, medido do envio da pergunta
+            if verificar_limite_tokens():
+                st.warning("Limite de tokens atingido. Não é possível enviar novas mensagens até adicionar mais tokens.")
+                st.stop() # Interrompe o processamento da mensagem
+            if not openai_api_key:
+                st.warning("OPENAI_API_KEY não definida. Não é possível gerar resposta.")
+                st.stop()
+
+            executor_pos_resposta().submit(st.session_state["current_chat_session_id"], tracing.bind(salvar_mensagem_usuario),
+                                           st.session_state["current_chat_session_id"], prompt_principal)
+            st.session_state["chat_principal_history"].append({"role": "user", "content": prompt_principal})
         
-        with st.chat_message("user"):
-            st.markdown(prompt_principal)
+            with st.chat_message("user"):
+                st.markdown(prompt_principal)
 
-        contexto_chat_ia = []
-        if st.session_state.get("instrucoes_finais"):
-            contexto_chat_ia.append({"role": "system", "content": st.session_state["instrucoes_finais"]})
-        
-        current_user_id = st.session_state["username"]
-        current_agent_id = st.session_state.get('assistente_selecionado')
-        
-        # Adicionar busca de memória do mem0 AQUI
-        if mem0_client and current_user_id:
-            try:
-                all_retrieved_memories_raw = []
-                processed_memory_ids = set() # Usado para desduplicar memórias se elas tiverem IDs únicos
-
-                # --- ETAPA 1: Busca de Informações de Perfil do Usuário (APENAS com user_id) ---
-                profile_query_text = "Informações de perfil do usuário, nome do usuário, preferências gerais do usuário."
+            current_user_id = st.session_state["username"]
+            current_agent_id = st.session_state.get('assistente_selecionado')
+            registrar_metrica_resposta("cache_similaridade", None)
+
+            # Cache semântico: só na primeira pergunta da conversa, quando a resposta não depende do histórico.
+            # A chave inclui o usuário (as respostas usam as memórias dele) e a versão salva do assistente.
+            chave_cache, vetor_pergunta = None, None
+            if current_agent_id and current_user_id and len(st.session_state["chat_principal_history"]) == 1:
                 try:
-                    search_params_profile = {
-                        "query": profile_query_text,
-                        "user_id": current_user_id,
-                        "limit": 3 # Limite menor, pois esperamos informações concisas de perfil
-                    }
-                    profile_memories = mem0_client.search(**search_params_profile)
-                    if profile_memories and isinstance(profile_memories, list):
-                        for mem in profile_memories:
-                            mem_id = mem.get("id")
-                            if mem_id and mem_id not in processed_memory_ids:
-                                all_retrieved_memories_raw.append(mem)
-                                processed_memory_ids.add(mem_id)
-                            elif not mem_id and mem not in all_retrieved_memories_raw:
-                                all_retrieved_memories_raw.append(mem)
-                except Exception as e_mem0_profile_search:
-                    st.warning(f"Aviso: Não foi possível buscar memórias de perfil com mem0: {e_mem0_profile_search}")
-
-                # --- ETAPA 2: Busca de Memórias Contextuais da Conversa (baseada no prompt_principal) ---
-                # Busca 2.A: Com user_id e agent_id (se agent_id existir)
-                if current_agent_id:
-                    try:
-                        search_params_agent_context = {
-                            "query": prompt_principal,
-                            "user_id": current_user_id,
-                            "agent_id": current_agent_id,
-                            "limit": 5 
-                        }
-                        context_memories_agent = mem0_client.search(**search_params_agent_context)
-                        if context_memories_agent and isinstance(context_memories_agent, list):
-                            for mem in context_memories_agent:
-                                mem_id = mem.get("id") 
-                                if mem_id and mem_id not in processed_memory_ids:
-                                    all_retrieved_memories_raw.append(mem)
-                                    processed_memory_ids.add(mem_id)
-                                elif not mem_id and mem not in all_retrieved_memories_raw:
-                                    all_retrieved_memories_raw.append(mem)
-                    except Exception as e_mem0_agent_context_search:
-                        st.warning(f"Aviso: Não foi possível buscar memórias de contexto (com agent_id) com mem0: {e_mem0_agent_context_search}")
-                
-                # Busca 2.B: Com user_id apenas (para memórias contextuais globais do usuário)
+                    with tracing.span("cache.respostas") as etapa_cache:
+                        vetor_pergunta = embed_query(prompt_principal, get_openai_client(openai_api_key)) # Reaproveitado pela busca (cache de embeddings)
+                        chave_cache = (caminhos_assistente(current_agent_id)["safe_nome"], current_user_id, versao_assistente(current_agent_id))
+                        resposta_em_cache = get_response_cache().lookup(*chave_cache, vetor_pergunta)
+                        etapa_cache.set(acerto=resposta_em_cache is not None)
+                except Exception as e_cache:
+                    print(f"Erro ao consultar o cache de respostas: {e_cache}")
+                    chave_cache, resposta_em_cache = None, None
+                if resposta_em_cache is not None:
+                    print(f"[cache] Resposta reaproveitada (similaridade {resposta_em_cache.similaridade:.3f}, "
+                          f"taxa de acerto {get_response_cache().hit_rate():.0%}).")
+                    registrar_metrica_resposta("ttft_s", time.perf_counter() - t_inicio_turno)
+                    with st.chat_message("assistant"):
+                        st.markdown(resposta_em_cache.resposta)
+                    executor_pos_resposta().submit(
+                        st.session_state["current_chat_session_id"], tracing.bind(persistir_turno_chat),
+                        st.session_state["current_chat_session_id"],
+                        prompt_principal, resposta_em_cache.resposta, current_user_id, current_agent_id)
+                    registrar_metrica_resposta("total_s", time.perf_counter() - t_inicio_turno)
+                    registrar_metrica_resposta("cache_similaridade", resposta_em_cache.similaridade)
+                    st.session_state["chat_principal_history"].append({"role": "assistant", "content": resposta_em_cache.resposta})
+                    st.rerun()
+
+            # Buscas de memória (mem0) e conhecimento (FAISS) disparadas em paralelo, com orçamento de latência
+            tarefas = tarefas_recuperacao(
+                prompt_principal, current_user_id, current_agent_id, mem0_client=mem0_client,
+                faiss_index=st.session_state.get("faiss_index"), doc_chunks=st.session_state.get("doc_chunks"),
+                client=get_openai_client(openai_api_key), indice_lexical=st.session_state.get("indice_lexical"))
+            with tracing.span("recuperacao", tarefas=len(tarefas)):
+                resultados_recuperacao = fan_out(tarefas, orcamento_s=ORCAMENTO_RECUPERACAO_S)
+            for nome, resultado in resultados_recuperacao.items():
+                if resultado.erro is not None:
+                    st.warning(f"Aviso: {AVISOS_RECUPERACAO[nome]}: {resultado.erro}")
+                elif resultado.expirou:
+                    print(f"Recuperação '{nome}' excedeu o orçamento de {ORCAMENTO_RECUPERACAO_S}s e foi ignorada neste turno.")
+
+            unique_memories_text, trechos_conhecimento = contexto_recuperado(resultados_recuperacao)
+
+            # Prompt dentro do orçamento de tokens: memórias, conhecimento, instruções, resumo das mensagens antigas e histórico recente
+            session_id_atual = st.session_state["current_chat_session_id"]
+            with tracing.span("contexto.montar") as etapa_contexto:
+                contexto_montado = ContextBuilder(MODELO_CHAT).build(
+                    st.session_state["chat_principal_history"],
+                    instrucoes=st.session_state.get("instrucoes_finais"),
+                    memorias=unique_memories_text,
+                    conhecimento=trechos_conhecimento,
+                    resumo=get_session_store().get_summary(session_id_atual),
+                )
+                etapa_contexto.set(tokens=contexto_montado.total)
+            contexto_chat_ia = contexto_montado.mensagens
+            print(f"[contexto] sessão {session_id_atual[:8]}: {format_breakdown(contexto_montado)}")
+            registrar_metrica_resposta("tokens_prompt", contexto_montado.total)
+
+            client_final = get_openai_client(openai_api_key)
+            partes_resposta = []
+            resposta_concluida = False
+            requisicao_aceita = False
+            uso_api = None
+            with st.chat_message("assistant"):
+                placeholder_resposta = st.empty()
+                placeholder_resposta.markdown("Pensando...")
                 try:
-                    search_params_user_context = {
-                        "query": prompt_principal,
-                        "user_id": current_user_id,
-                        "limit": 5
-                    }
-                    context_memories_user = mem0_client.search(**search_params_user_context)
-                    if context_memories_user and isinstance(context_memories_user, list):
-                        for mem in context_memories_user:
-                            mem_id = mem.get("id")
-                            if mem_id and mem_id not in processed_memory_ids:
-                                all_retrieved_memories_raw.append(mem)
-                                processed_memory_ids.add(mem_id)
-                            elif not mem_id and mem not in all_retrieved_memories_raw:
-                                all_retrieved_memories_raw.append(mem)
-                except Exception as e_mem0_user_context_search:
-                    st.warning(f"Aviso: Não foi possível buscar memórias de contexto (apenas user_id) com mem0: {e_mem0_user_context_search}")
-
-                # st.write(f"Memórias recuperadas mem0 (brutas combinadas): {all_retrieved_memories_raw}") # Para debug
-                
-                if all_retrieved_memories_raw:
-                    memories_text_content_list = [mem.get("memory") for mem in all_retrieved_memories_raw if mem.get("memory")]
-                    unique_memories_text = []
-                    seen_texts = set()
-                    for text_content in memories_text_content_list:
-                        if text_content not in seen_texts:
-                            unique_memories_text.append(text_content)
-                            seen_texts.add(text_content)
-                    
-                    if unique_memories_text:
-                        memories_content_for_prompt = "\n---\n".join(unique_memories_text)
-                        memory_context_message = (
-                            f"Considere estas informações de interações passadas (memória de longo prazo via mem0) "
-                            f"ao formular sua resposta. É especialmente importante usar informações pessoais sobre o "
-                            f"usuário (como seu nome, preferências, etc.) se elas estiverem presentes nestas memórias:"
-                            f"\n---\n{memories_content_for_prompt}"
+                    with tracing.span("openai.completion", modelo=MODELO_CHAT) as etapa_llm:
+                        t_inicio_llm = time.perf_counter()
+                        stream_final = client_final.chat.completions.create(
+                            model=MODELO_CHAT,
+                            messages=contexto_chat_ia,
+                            temperature=0.7,
+                            stream=True,
+                            stream_options={"include_usage": True}, # O último chunk traz o usage real da chamada
                         )
-                        contexto_chat_ia.insert(0, {"role": "system", "content": memory_context_message})
-            except Exception as e_mem0_search_generic:
-                st.warning(f"Aviso: Erro genérico durante a busca de memória com mem0: {e_mem0_search_generic}")
-
-        mensagens_formatadas_ia = []
-        for msg_hist_ia in st.session_state["chat_principal_history"]:
-            if msg_hist_ia.get("role") and msg_hist_ia.get("content"):
-                mensagens_formatadas_ia.append({"role": msg_hist_ia["role"], "content": msg_hist_ia["content"]})
-        contexto_chat_ia.extend(mensagens_formatadas_ia)
-
-        if st.session_state.get("faiss_index") and st.session_state["faiss_index"].ntotal > 0 and st.session_state.get("doc_chunks"):
-            try:
-                client_openai_faiss = OpenAI(api_key=openai_api_key)
-                query_embedding_response = client_openai_faiss.embeddings.create(input=prompt_principal, model="text-embedding-ada-002")
-                query_embedding = np.array(query_embedding_response.data[0].embedding, dtype=np.float32).reshape(1, -1)
-                
-                D, I = st.session_state["faiss_index"].search(query_embedding, k=3)
-                
-                retrieved_chunks_content = ""
-                if I[0][0] != -1: # Verifica se algum resultado foi encontrado
-                    for idx_faiss in I[0]:
-                        if idx_faiss != -1 and idx_faiss < len(st.session_state["doc_chunks"]): # Checa se o índice é válido
-                            retrieved_chunks_content += st.session_state["doc_chunks"][idx_faiss] + "\n\n"
-                
-                if retrieved_chunks_content:
-                    system_message_faiss = f"Use as seguintes informações da base de conhecimento para responder à pergunta do usuário:\n{retrieved_chunks_content}"
-                    # Inserir após a memória do mem0, se existir, ou no início
-                    insert_index = 1 if (contexto_chat_ia and contexto_chat_ia[0].get("role") == "system" and "mem0" in contexto_chat_ia[0].get("content","")) else 0
-                    contexto_chat_ia.insert(insert_index, {"role": "system", "content": system_message_faiss})
-
-            except Exception as e_faiss:
-                st.warning(f"Erro durante a busca FAISS: {e_faiss}")
-
-        with st.spinner("Pensando..."):
-            try:
-                client_final = OpenAI(api_key=openai_api_key)
-                response_final = client_final.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=contexto_chat_ia,
-                    temperature=0.7,
-                )
-                assistant_response_final = response_final.choices[0].message.content
-                
-                add_message_to_session(st.session_state["current_chat_session_id"], "assistant", assistant_response_final)
-                # Atualiza tokens ANTES de adicionar ao histórico e dar rerun, para que a UI reflita o uso correto
-                atualizar_tokens_usados(prompt_principal, assistant_response_final)
-                st.session_state["chat_principal_history"].append({"role": "assistant", "content": assistant_response_final})
+                        requisicao_aceita = True
+                        for chunk in stream_final:
+                            if getattr(chunk, "usage", None):
+                                uso_api = chunk.usage
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                if not partes_resposta:
+                                    registrar_metrica_resposta("ttft_s", time.perf_counter() - t_inicio_turno)
+                                    etapa_llm.set(ttft_ms=round((time.perf_counter() - t_inicio_llm) * 1000, 1))
+                                partes_resposta.append(delta)
+                                placeholder_resposta.markdown("".join(partes_resposta) + "▌")
+                        if uso_api is not None:
+                            etapa_llm.set(tokens_prompt=uso_api.prompt_tokens, tokens_resposta=uso_api.completion_tokens)
+                    resposta_concluida = True
+                except Exception as e_ia_final:
+                    st.warning(f"Erro ao gerar resposta da IA: {e_ia_final}")
+                finally:
+                    # Também roda se o Streamlit interromper o script no meio do stream (novo input, navegação);
+                    # o que já foi gerado é salvo fora do caminho de renderização.
+                    assistant_response_final = "".join(partes_resposta)
+                    if assistant_response_final and not resposta_concluida:
+                        assistant_response_final += AVISO_RESPOSTA_INTERROMPIDA
+                    if assistant_response_final:
+                        executor_pos_resposta().submit(
+                            session_id_atual, tracing.bind(persistir_turno_chat), session_id_atual,
+                            prompt_principal, assistant_response_final, current_user_id, current_agent_id)
+                    if resposta_concluida and chave_cache and assistant_response_final:
+                        executor_pos_resposta().submit(
+                            session_id_atual, tracing.bind(get_response_cache().store), *chave_cache, prompt_principal, vetor_pergunta, assistant_response_final)
+                    if requisicao_aceita:
+                        # Stream interrompido não traz usage: a parte gerada é contada pelo tokenizer
+                        registrar_uso_tokens(contexto_chat_ia, "".join(partes_resposta), uso_api, MODELO_CHAT)
+                    if contexto_montado.mensagens_omitidas:
+                        executor_pos_resposta().submit(
+                            session_id_atual, tracing.bind(atualizar_resumo_sessao), session_id_atual, list(st.session_state["chat_principal_history"]),
+                            contexto_montado.inicio_janela, openai_api_key)
+                if assistant_response_final:
+                    placeholder_resposta.markdown(assistant_response_final)
+                else:
+                    placeholder_resposta.empty()
 
-                # Adicionar a interação ao mem0 AQUI
-                # current_user_id e current_agent_id já definidos acima
-                if mem0_client and current_user_id:
-                    try:
-                        messages_to_add_to_mem0 = [
-                            {"role": "user", "content": prompt_principal},
-                            {"role": "assistant", "content": assistant_response_final}
-                        ]
-                        add_params = {
-                            "messages": messages_to_add_to_mem0, # Corrigido de 'data' para 'messages'
-                            "user_id": current_user_id
-                        }
-                        if current_agent_id: # Adiciona agent_id se disponível
-                            add_params["agent_id"] = current_agent_id
-                        # Adicionar try-except para a chamada de adicionar memória
-                        try:
-                            mem0_client.add(**add_params)
-                        except Exception as e_mem0_add:
-                            st.warning(f"Aviso: Não foi possível adicionar a memória ao mem0: {e_mem0_add}")
-                            print(f"DETALHE DO ERRO AO ADICIONAR MEMÓRIA NO MEM0: {type(e_mem0_add).__name__} - {e_mem0_add}")
-                        # st.write("Memória adicionada ao mem0.") # Para debug
-                    except Exception as e_mem0_add:
-                        st.warning(f"Aviso: Não foi possível adicionar memória ao mem0: {e_mem0_add}")
-
-                with st.chat_message("assistant"):
-                    st.markdown(assistant_response_final)
+            registrar_metrica_resposta("total_s", time.perf_counter() - t_inicio_turno)
+            if assistant_response_final:
+                st.session_state["chat_principal_history"].append({"role": "assistant", "content": assistant_response_final})
                 st.rerun()
 
-            except Exception as e_ia_final:
-                st.warning(f"Erro ao gerar resposta da IA: {e_ia_final}")
+def usuario_admin(username: str) -> bool:
+    """Só os usuários listados em HUBBLET_ADMIN_USERS (separados por vírgulas) veem a página de latência; sem a lista, ninguém."""
+    admins = {u.strip() for u in os.environ.get("HUBBLET_ADMIN_USERS", "").split(",") if u.strip()}
+    return bool(username) and username in admins
+
+def _faixa_bucket(limite_s: float) -> str:
+    return f"≤{limite_s * 1000:g}ms" if limite_s < 1 else f"≤{limite_s:g}s"
+
+def histograma_etapa(duracoes_ms: List[float]) -> pd.DataFrame:
+    """Contagem por faixa, nas mesmas faixas do histograma exportado para o Prometheus."""
+    limites_ms = [b * 1000 for b in tracing.BUCKETS_S]
+    contagens = np.bincount(np.searchsorted(limites_ms, duracoes_ms, side="left"), minlength=len(limites_ms) + 1)
+    faixas = [_faixa_bucket(b) for b in tracing.BUCKETS_S] + [f">{tracing.BUCKETS_S[-1]:g}s"]
+    return pd.DataFrame({"faixa": faixas, "quantidade": contagens.tolist()})
+
+# Página de Administração: latência por etapa dos turnos
+def pagina_admin_latencia():
+    if not st.session_state.get("username"):
+        st.session_state["menu_sidebar"] = "Login"
+        st.rerun()
+        return
+    if not usuario_admin(st.session_state["username"]):
+        st.warning("Acesso restrito aos administradores.")
+        st.stop()
+
+    with st.sidebar:
+        st.title("Hubblet AI")
+        if st.button("Voltar ao chat", key="voltar_chat_latencia_btn"):
+            st.session_state["menu_sidebar"] = "Chat Principal"
+            st.rerun()
+        ligado = st.toggle("Rastreamento ligado", value=tracing.enabled(),
+                           help="Vale para todo o processo. Padrão: HUBBLET_TRACING no .env")
+        if ligado != tracing.enabled():
+            tracing.set_enabled(ligado)
+            st.rerun()
+        coletor = tracing.get_collector()
+        if st.button("Limpar dados", key="limpar_traces_btn"):
+            coletor.reset()
+            st.rerun()
+        if coletor.arquivo:
+            st.caption(f"Traces gravados em `{coletor.arquivo}`")
+        servidor_metricas = iniciar_rastreamento()
+        if servidor_metricas is not None:
+            host, porta = servidor_metricas.server_address[:2]
+            st.caption(f"Prometheus: `http://{host}:{porta}/metrics`")
+
+    st.title("Latência por etapa")
+    resumo = coletor.stage_summary()
+    if not resumo:
+        st.info("Nenhum turno rastreado ainda." if tracing.enabled()
+                else "Rastreamento desligado: ligue-o na barra lateral e converse no chat.")
+        return
+
+    st.subheader("Resumo dos traces recentes")
+    st.dataframe(pd.DataFrame(resumo).round(1), hide_index=True, use_container_width=True)
+
+    st.subheader("Histograma")
+    duracoes = coletor.stage_durations()
+    etapa = st.selectbox("Etapa", [linha["etapa"] for linha in resumo], key="etapa_histograma")
+    grafico = alt.Chart(histograma_etapa(duracoes[etapa])).mark_bar().encode(
+        x=alt.X("faixa:N", sort=None, title="Duração"), y=alt.Y("quantidade:Q", title="Ocorrências"))
+    st.altair_chart(grafico, use_container_width=True)
+
+    st.subheader("Turnos mais lentos")
+    mais_lentos = coletor.slowest(20)
+    if not mais_lentos:
+        st.info("Nenhum turno de conversa entre os traces recentes.")
+        return
+    for t in mais_lentos:
+        quando = datetime.fromtimestamp(t["inicio"]).strftime("%d/%m %H:%M:%S")
+        titulo = f"{t['duracao_ms']:,.0f} ms · {t['nome']} · {quando}" + (f" · erro {t['erro']}" if t["erro"] else "")
+        with st.expander(titulo):
+            if t["atributos"]:
+                st.caption(" · ".join(f"{chave}: {valor}" for chave, valor in t["atributos"].items()))
+            linhas = [{
+                "etapa": "\u00a0\u00a0" * profundidade + s["nome"],
+                "início (ms)": round(s["inicio_ms"], 1),
+                "duração (ms)": round(s["duracao_ms"], 1),
+                "detalhes": ", ".join(f"{chave}={valor}" for chave, valor in s["atributos"].items()),
+                "erro": s["erro"] or "",
+            } for profundidade, s in tracing.span_tree(t)]
+            st.dataframe(pd.DataFrame(linhas), hide_index=True, use_container_width=True)
 
 # Controle de Navegação Principal
 if "menu_sidebar" not in st.session_state:
@@ -745,5 +900,7 @@ elif st.session_state["menu_sidebar"] == "Configuração/Chat":
     pagina_chat_assistente()
 elif st.session_state["menu_sidebar"] == "Chat Principal":
     pagina_chat_principal()
+elif st.session_state["menu_sidebar"] == "Latência":
+    pagina_admin_latencia()
 else:
     pagina_login() # Default para login se estado for inválido
\ No newline at end of file
@@ -37,6 +37,8 @@ function setTokenUsage(usage) {
 
 /**
  * Estima o número de tokens em um texto (caracteres / 4).
+ * Serve só para exibição imediata no navegador: a contagem que vale para a cota
+ * é feita no servidor (src/core/token_meter.py), com o usage da API ou o tokenizer do modelo.
  * @param {string} text - O texto para calcular os tokens.
  * @returns {number} - O número estimado de tokens.
  */
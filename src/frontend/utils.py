@@ -1,85 +1,65 @@
 import streamlit as st
+import hashlib
 import os
 import json
 import faiss
 import numpy as np
 # from mem0 import MemoryClient # Removido
-from typing import List, Dict
-import tempfile
-from openai import OpenAI # Adicionado para gerar_embeddings
+from typing import List, Dict, Optional
 import glob
-import uuid
-from datetime import datetime, timezone
+import sys
+
+# Permite importar os módulos compartilhados do backend (src.*) quando o app roda via `streamlit run`
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from src.core import tracing
+from src.core.embeddings import embed_texts
+from src.core.extraction import TAMANHO_MAX_DOCUMENTO, TAMANHO_MAX_TEXTO, extractor_for
+from src.core.resources import file_version, get_openai_client, registry
+from src.data_persistence.chunks import bm25_index, chunk_store
+from src.data_persistence.chunks.chunk_store import ChunkStore
+from src.data_persistence.faiss import index_factory
+from src.data_persistence.faiss.bulk_ingest import stack_embeddings
+from src.data_persistence.faiss.index_io import private_copy, read_index_shared, write_index_atomic
+from src.data_persistence.chat_sessions.session_store import get_session_store
 
 CHAT_HISTORY_FILE = os.path.join(os.path.dirname(__file__), "..", "chat_history.json")
 
 def load_chat_history() -> Dict:
-    """Carrega o histórico de chat do arquivo JSON."""
-    if not os.path.exists(CHAT_HISTORY_FILE):
-        return {"chat_sessions": []}
+    """Exporta o histórico completo no formato antigo do JSON (custo proporcional ao histórico inteiro)."""
     try:
-        with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
+        return get_session_store().export_history()
+    except Exception as e:
         st.error(f"Erro ao carregar o histórico de chat: {e}")
         return {"chat_sessions": []}
 
 def save_chat_history(history: Dict):
-    """Salva o histórico de chat no arquivo JSON."""
+    """Importa no store as sessões de um histórico no formato antigo do JSON."""
     try:
-        with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
-    except IOError as e:
+        with tracing.span("sessao.importar_historico", sessoes=len(history.get("chat_sessions", []))):
+            get_session_store().import_history(history)
+    except Exception as e:
         st.error(f"Erro ao salvar o histórico de chat: {e}")
 
 def create_new_chat_session(user_id: str, title: str = "Nova Conversa") -> Dict:
     """Cria uma nova sessão de chat."""
-    history = load_chat_history()
-    session_id = str(uuid.uuid4())
-    now_iso = datetime.now(timezone.utc).isoformat()
-    new_session = {
-        "id": session_id,
-        "user_id": user_id,
-        "title": title,
-        "created_at": now_iso,
-        "updated_at": now_iso,
-        "messages": []
-    }
-    history["chat_sessions"].append(new_session)
-    save_chat_history(history)
-    return new_session
+    return get_session_store().create_session(user_id, title)
 
 def list_chat_sessions(user_id: str) -> List[Dict]:
-    """Lista todas as sessões de chat para um usuário específico."""
-    history = load_chat_history()
-    return [session for session in history["chat_sessions"] if session["user_id"] == user_id]
+    """Lista todas as sessões de chat (sem as mensagens) para um usuário específico."""
+    return get_session_store().list_sessions(user_id)
 
 def get_chat_session_messages(session_id: str) -> List[Dict]:
     """Busca todas as mensagens de uma sessão de chat específica."""
-    history = load_chat_history()
-    for session in history["chat_sessions"]:
-        if session["id"] == session_id:
-            return session["messages"]
-    return []
+    return get_session_store().get_messages(session_id)
 
 def add_message_to_session(session_id: str, role: str, content: str):
     """Adiciona uma nova mensagem a uma sessão de chat existente."""
-    history = load_chat_history()
-    session_found = False
-    for session in history["chat_sessions"]:
-        if session["id"] == session_id:
-            now_iso = datetime.now(timezone.utc).isoformat()
-            session["messages"].append({
-                "role": role,
-                "content": content,
-                "created_at": now_iso
-            })
-            session["updated_at"] = now_iso
-            session_found = True
-            break
-    if session_found:
-        save_chat_history(history)
-    else:
+    with tracing.span("sessao.add_message", papel=role):
+        adicionada = get_session_store().add_message(session_id, role, content)
+    if not adicionada:
         st.error(f"Sessão com ID '{session_id}' não encontrada.")
 
 
@@ -87,220 +67,150 @@ def add_message_to_session(session_id: str, role: str, content: str):
 # Funções utilitárias para o frontend Hubblet AI
 
 def inicializar_faiss(dim: int = 1536) -> faiss.Index:
-    """Inicializa um índice FAISS simples em memória."""
+    """Inicializa um índice FAISS exato (Flat) em memória; a troca por IVF/HNSW acontece ao salvar, conforme o tamanho."""
     return faiss.IndexFlatL2(dim)
 
-def gerar_embeddings(textos: List[str], openai_api_key: str) -> List[np.ndarray]:
-    """Gera embeddings para uma lista de textos usando a API da OpenAI."""
+def gerar_embeddings_alinhados(textos: List[str], openai_api_key: str) -> List[Optional[np.ndarray]]:
+    """Gera embeddings em lotes paralelos; a posição i do resultado corresponde a textos[i] (None se vazio ou com falha)."""
     if not openai_api_key:
         st.error("Chave da API OpenAI (OPENAI_API_KEY) não fornecida. Embeddings não podem ser gerados.")
-        return []
-    
-    client = OpenAI(api_key=openai_api_key)
-    embeddings = []
-    for i, chunk in enumerate(textos):
-        if not chunk.strip(): # Pular chunks vazios ou apenas com espaços
-            # st.info(f"Trecho {i+1}/{len(textos)} está vazio e será ignorado.")
-            continue
-        try:
-            resp = client.embeddings.create(input=chunk, model="text-embedding-ada-002")
-            embeddings.append(np.array(resp.data[0].embedding, dtype=np.float32))
-        except Exception as e:
-            st.error(f"Erro ao gerar embedding para o trecho {i+1}/{len(textos)}: {e}. Este trecho será ignorado.")
-    return embeddings
+        return [None] * len(textos)
 
-def processar_arquivos(arquivos: List[st.runtime.uploaded_file_manager.UploadedFile], openai_api_key: str) -> tuple[List[str], List[np.ndarray], List[str]]:
-    """Processa arquivos enviados, extrai texto, gera chunks e embeddings."""
-    doc_chunks_total = []
-    nomes_arquivos_processados = []
-    tamanho_max_por_arquivo = 2 * 1024 * 1024  # 2MB por arquivo
+    client = get_openai_client(openai_api_key)
+    falhas = []
+    resultado = embed_texts(textos, client, on_error=lambda indices, e: falhas.append((len(indices), e)))
+    # Os lotes rodam em threads sem contexto do Streamlit; os avisos são exibidos aqui
+    for qtd, e in falhas:
+        st.error(f"Erro ao gerar embeddings para um lote de {qtd} trecho(s): {e}. Esses trechos serão ignorados.")
+    return resultado
 
-    if not arquivos:
-        return [], [], []
+def gerar_embeddings(textos: List[str], openai_api_key: str) -> List[np.ndarray]:
+    """Gera embeddings para uma lista de textos usando a API da OpenAI (ignora vazios e falhas)."""
+    return [emb for emb in gerar_embeddings_alinhados(textos, openai_api_key) if emb is not None]
 
-    for arq in arquivos:
+def validar_arquivos_upload(arquivos: List[st.runtime.uploaded_file_manager.UploadedFile]) -> List[tuple]:
+    """(nome, bytes) dos arquivos aceitos para ingestão; avisa sobre os vazios, grandes demais ou de tipo não suportado."""
+    validos = []
+    for arq in arquivos or []:
         nome = arq.name
+        extrator = extractor_for(nome)
+        tamanho_max = TAMANHO_MAX_DOCUMENTO if extrator == "docling" else TAMANHO_MAX_TEXTO
+        if extrator is None:
+            st.warning(f"Arquivo '{nome}' tem um tipo não suportado e será ignorado.")
+            continue
         if arq.size == 0:
             st.warning(f"Arquivo '{nome}' está vazio e será ignorado.")
             continue
-        if arq.size > tamanho_max_por_arquivo:
-            st.warning(f"Arquivo '{nome}' ({arq.size / (1024*1024):.2f}MB) excede o limite de 2MB e será ignorado.")
+        if arq.size > tamanho_max:
+            st.warning(f"Arquivo '{nome}' ({arq.size / (1024*1024):.2f}MB) excede o limite de {tamanho_max // (1024*1024)}MB e será ignorado.")
             continue
-        
-        tmp_path = ""
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{os.path.basename(nome)}", mode='wb') as tmp:
-                tmp.write(arq.getvalue()) 
-                tmp_path = tmp.name
-            
-            texto_arquivo = ""
-            try:
-                with open(tmp_path, "r", encoding="utf-8") as f:
-                    texto_arquivo = f.read()
-            except UnicodeDecodeError:
-                try:
-                    with open(tmp_path, "r", encoding="latin-1") as f:
-                        texto_arquivo = f.read()
-                    st.info(f"Arquivo '{nome}' lido com encoding 'latin-1' após falha com 'utf-8'.")
-                except Exception as e_read:
-                    st.error(f"Erro ao ler o arquivo '{nome}' com diferentes encodings: {e_read}")
-                    if os.path.exists(tmp_path): os.unlink(tmp_path)
-                    continue 
-            except Exception as e_open:
-                 st.error(f"Erro ao abrir/ler o arquivo temporário para '{nome}': {e_open}")
-                 if os.path.exists(tmp_path): os.unlink(tmp_path)
-                 continue
-
-            if texto_arquivo.strip():
-                chunk_size = 1500  
-                chunks_do_arquivo = [texto_arquivo[i:i+chunk_size] for i in range(0, len(texto_arquivo), chunk_size)]
-                doc_chunks_total.extend(chunks_do_arquivo)
-                nomes_arquivos_processados.append(nome)
-            else:
-                st.warning(f"Arquivo '{nome}' não contém texto extraível ou está vazio após a leitura.")
-
-            if os.path.exists(tmp_path): os.unlink(tmp_path)
-        except Exception as e_outer:
-            st.error(f"Erro geral ao processar o arquivo '{nome}': {e_outer}")
-            if tmp_path and os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-    
-    if not doc_chunks_total:
-        return [], [], nomes_arquivos_processados
-
-    embeddings_gerados = []
-    if openai_api_key and doc_chunks_total:
-        with st.spinner(f"Gerando embeddings para {len(doc_chunks_total)} trechos de {len(nomes_arquivos_processados)} arquivo(s)..."):
-            embeddings_gerados = gerar_embeddings(doc_chunks_total, openai_api_key)
-            if embeddings_gerados:
-                 st.success(f"{len(embeddings_gerados)} embeddings gerados.")
-            elif doc_chunks_total: # Se havia chunks mas não gerou embeddings
-                 st.warning("Falha ao gerar embeddings para alguns ou todos os trechos, embora houvesse conteúdo.")
-    elif not openai_api_key and doc_chunks_total:
-        st.warning("OPENAI_API_KEY não fornecida. Embeddings não foram gerados para os documentos processados.")
-
-    return doc_chunks_total, embeddings_gerados, nomes_arquivos_processados
+        validos.append((nome, arq.getvalue())) # Sem arquivo temporário: os bytes já estão no buffer do upload
+    return validos
 
+def mostrar_avisos_ingestao(job):
+    for nivel, mensagem in job.avisos:
+        getattr(st, nivel, st.warning)(mensagem)
 
+def caminhos_assistente(nome_assistente: str) -> Dict[str, str]:
+    """Caminhos dos arquivos salvos de um assistente (a partir do nome exibido)."""
+    path_base = ASSISTENTES_SAVE_DIR
+    safe_nome_assistente = nome_assistente.replace(' ', '_').lower().strip()
+    return {
+        "safe_nome": safe_nome_assistente,
+        "instrucoes": os.path.join(path_base, f"assistente_{safe_nome_assistente}_config.md"),
+        "faiss": os.path.join(path_base, f"assistente_{safe_nome_assistente}_faiss.index"),
+        "faiss_meta": os.path.join(path_base, f"assistente_{safe_nome_assistente}_faiss_meta.json"), # tipo do índice e parâmetros de busca
+        "chunks": os.path.join(path_base, f"assistente_{safe_nome_assistente}_chunks"), # base do .blob/.offs
+        "chunks_json_legado": os.path.join(path_base, f"assistente_{safe_nome_assistente}_chunks.json"),
+        # Arquivo para armazenar nomes dos arquivos originais associados aos chunks/FAISS
+        "uploaded_files": os.path.join(path_base, f"assistente_{safe_nome_assistente}_uploaded_files.json"),
+    }
 
-def carregar_ou_inicializar_dados_assistente(username: str, nome_assistente: str, openai_api_key: str):
-    """Carrega dados de um assistente existente ou inicializa o estado para um novo/selecionado."""
+def versao_assistente(nome_assistente: str) -> str:
+    """Versão das instruções + base de conhecimento salvas do assistente (muda a cada salvamento)."""
+    arquivos = caminhos_assistente(nome_assistente)
+    versoes = (file_version(arquivos["instrucoes"]), file_version(arquivos["faiss"]),
+               file_version(chunk_store.index_file(arquivos["chunks"])))
+    return hashlib.sha256(repr(versoes).encode("utf-8")).hexdigest()[:16]
+
+def carregar_dados_compartilhados(safe_nome_assistente: str, chunks_base: str, faiss_file: str, meta_file: Optional[str] = None):
+    """Chunks (sob demanda) e índice FAISS (mapeado em memória), abertos uma vez por processo e compartilhados entre sessões."""
+    doc_chunks = registry.get(("assistente", safe_nome_assistente, "chunks"), lambda: ChunkStore(chunks_base),
+                              versao=file_version(chunk_store.index_file(chunks_base)))
+    meta = index_factory.load_index_meta(meta_file) if meta_file else {}
+    faiss_index = registry.get(("assistente", safe_nome_assistente, "faiss"),
+                               lambda: index_factory.apply_meta(read_index_shared(faiss_file), meta),
+                               versao=(file_version(faiss_file), file_version(meta_file) if meta_file else None))
+    return doc_chunks, faiss_index
+
+def carregar_indice_lexical(safe_nome_assistente: str, chunks_base: str, doc_chunks):
+    """Índice BM25 dos trechos do assistente, compartilhado entre sessões (criado na primeira carga se faltar)."""
+    return registry.get(("assistente", safe_nome_assistente, "bm25"),
+                        lambda: bm25_index.load_or_build(chunks_base, doc_chunks),
+                        versao=file_version(chunk_store.index_file(chunks_base)))
+
+def carregar_ou_inicializar_dados_assistente(username: str, nome_assistente: str, openai_api_key: str, editavel: bool = False):
+    """Carrega dados de um assistente existente ou inicializa o estado para um novo/selecionado.
+
+    Com editavel=False (chat) o índice e os chunks são os objetos compartilhados do processo e não devem ser alterados.
+    """
     st.session_state["chat_principal_history"] = [] # Histórico do chat ativo na UI
-    # st.session_state["chat_history_from_mem0"] = [] # Removido
     st.session_state["uploaded_files"] = [] # Lista de nomes de arquivos, não os objetos UploadedFile
     st.session_state["doc_chunks"] = []
     st.session_state["faiss_index"] = inicializar_faiss()
+    st.session_state["indice_lexical"] = None # Só no chat; na edição os trechos ainda mudam
     st.session_state["instrucoes_finais"] = None
-    # st.session_state["mem0_instance"] = None # Removido
     st.session_state["loading_ia"] = False
     st.session_state["assistente_config"] = {"nome": nome_assistente} # Garante que o nome está na config
-    # st.session_state["chat_history_from_mem0"] = [] # Removido
 
     if nome_assistente == "Nenhum Assistente Salvo" or nome_assistente == "Nenhum" or not nome_assistente.strip():
         st.info("Nenhum assistente específico para carregar. Estado inicializado para um novo assistente ou modo padrão.")
         return
 
-    # Define o diretório 'assistentes_salvos' dentro do diretório 'frontend'
-    # Assume que utils.py está em frontend/, então os.getcwd() pode não ser o ideal se app.py estiver em outro lugar.
-    # Melhor usar caminhos relativos ao script ou uma configuração mais robusta.
-    # Para simplificar, vamos assumir que os arquivos são salvos na raiz do projeto por enquanto.
-    # No entanto, para melhor organização, um subdiretório seria ideal.
-    # path_base = os.path.join(os.path.dirname(__file__), "..", "assistentes_salvos") # Exemplo se utils.py está em frontend/
-    path_base = ASSISTENTES_SAVE_DIR # Usar o diretório definido
-    os.makedirs(path_base, exist_ok=True) # Garante que o diretório exista
-
-    safe_nome_assistente = nome_assistente.replace(' ', '_').lower().strip()
-    instrucoes_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_config.md") # Alterado para _config.md
-    faiss_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_faiss.index")
-    chunks_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_chunks.json")
-    # Arquivo para armazenar nomes dos arquivos originais associados aos chunks/FAISS
-    uploaded_files_info_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_uploaded_files.json") 
+    os.makedirs(ASSISTENTES_SAVE_DIR, exist_ok=True) # Garante que o diretório exista
+    arquivos = caminhos_assistente(nome_assistente)
+    safe_nome_assistente = arquivos["safe_nome"]
+    faiss_file = arquivos["faiss"]
+    chunks_base = arquivos["chunks"]
 
     loaded_something = False
-    if os.path.exists(instrucoes_file):
+    if os.path.exists(arquivos["instrucoes"]):
         try:
-            with open(instrucoes_file, "r", encoding="utf-8") as f:
+            with open(arquivos["instrucoes"], "r", encoding="utf-8") as f:
                 st.session_state["instrucoes_finais"] = f.read()
             loaded_something = True
         except Exception as e:
             st.error(f"Erro ao carregar instruções para '{nome_assistente}': {e}")
-    
-    if os.path.exists(chunks_file) and os.path.exists(faiss_file):
-        try:
-            with open(chunks_file, "r", encoding="utf-8") as f:
-                st.session_state["doc_chunks"] = json.load(f)
-            st.session_state["faiss_index"] = faiss.read_index(faiss_file)
-            if os.path.exists(uploaded_files_info_file):
-                with open(uploaded_files_info_file, "r", encoding="utf-8") as f_info:
-                    st.session_state["uploaded_files"] = json.load(f_info) # Carrega lista de nomes
-            loaded_something = True
-        except Exception as e:
-            st.error(f"Erro ao carregar chunks, índice FAISS ou info de arquivos para '{nome_assistente}': {e}")
-            st.session_state["doc_chunks"] = []
-            st.session_state["faiss_index"] = inicializar_faiss()
-            st.session_state["uploaded_files"] = []
-    elif os.path.exists(chunks_file) and not os.path.exists(faiss_file):
-        st.warning(f"Chunks para '{nome_assistente}' encontrados, mas índice FAISS não. Documentos podem precisar ser reprocessados ou o índice recriado.")
+
+    # Assistentes salvos no formato .jsonl/.idx: converte para os blocos comprimidos uma única vez
+    if not chunk_store.exists(chunks_base) and chunk_store.has_legacy_jsonl(chunks_base):
         try:
-            with open(chunks_file, "r", encoding="utf-8") as f:
-                st.session_state["doc_chunks"] = json.load(f)
-            # Tentar recriar o índice FAISS se houver chunks e API key
-            if st.session_state["doc_chunks"] and openai_api_key:
-                st.info(f"Tentando recriar índice FAISS para '{nome_assistente}' a partir dos chunks existentes...")
-                embeddings = gerar_embeddings(st.session_state["doc_chunks"], openai_api_key)
-                if embeddings:
-                    new_index = inicializar_faiss()
-                    for emb in embeddings:
-                        new_index.add(np.expand_dims(emb, axis=0))
-                    st.session_state["faiss_index"] = new_index
-                    faiss.write_index(new_index, faiss_file) # Salva o índice recriado
-                    st.success(f"Índice FAISS para '{nome_assistente}' recriado e salvo.")
-                else:
-                    st.error(f"Não foi possível recriar o índice FAISS para '{nome_assistente}'.")
+            chunk_store.migrate_jsonl_chunks(chunks_base)
         except Exception as e:
-            st.error(f"Erro ao carregar chunks ou tentar recriar FAISS para '{nome_assistente}': {e}")
-
-    # st.session_state["mem0_instance"] = inicializar_mem0(username, nome_assistente, mem0_api_key) # Removido
-    # Lógica de carregamento do Mem0 removida
+            st.error(f"Erro ao converter os chunks de '{nome_assistente}' para o novo formato: {e}")
 
-    if loaded_something:
-        st.success(f"Dados para o assistente '{nome_assistente}' carregados.")
-    elif nome_assistente and nome_assistente not in ["Nenhum Assistente Salvo", "Nenhum"]:
-        # Se nenhum arquivo foi carregado, mas um nome de assistente foi fornecido (e não é um placeholder)
-        st.info(f"Nenhum dado salvo encontrado para '{nome_assistente}'. Iniciando com configuração padrão.")
-
-    # Define o diretório 'assistentes_salvos' dentro do diretório 'frontend'
-    # Assume que utils.py está em frontend/, então os.getcwd() pode não ser o ideal se app.py estiver em outro lugar.
-    # Melhor usar caminhos relativos ao script ou uma configuração mais robusta.
-    # Para simplificar, vamos assumir que os arquivos são salvos na raiz do projeto por enquanto.
-    # No entanto, para melhor organização, um subdiretório seria ideal.
-    # path_base = os.path.join(os.path.dirname(__file__), "..", "assistentes_salvos") # Exemplo se utils.py está em frontend/
-    path_base = ASSISTENTES_SAVE_DIR # Usar o diretório definido
-    os.makedirs(path_base, exist_ok=True) # Garante que o diretório exista
-
-    safe_nome_assistente = nome_assistente.replace(' ', '_').lower().strip()
-    instrucoes_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_config.md") # Alterado para _config.md
-    faiss_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_faiss.index")
-    chunks_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_chunks.json")
-    # Arquivo para armazenar nomes dos arquivos originais associados aos chunks/FAISS
-    uploaded_files_info_file = os.path.join(path_base, f"assistente_{safe_nome_assistente}_uploaded_files.json") 
-
-    loaded_something = False
-    if os.path.exists(instrucoes_file):
+    # Assistentes salvos antes do formato com offsets: converte o JSON uma única vez
+    if not chunk_store.exists(chunks_base) and os.path.exists(arquivos["chunks_json_legado"]):
         try:
-            with open(instrucoes_file, "r", encoding="utf-8") as f:
-                st.session_state["instrucoes_finais"] = f.read()
-            loaded_something = True
+            chunk_store.migrate_json_chunks(arquivos["chunks_json_legado"], chunks_base)
+            os.remove(arquivos["chunks_json_legado"])
         except Exception as e:
-            st.error(f"Erro ao carregar instruções para '{nome_assistente}': {e}")
-    
-    if os.path.exists(chunks_file) and os.path.exists(faiss_file):
+            st.error(f"Erro ao converter os chunks de '{nome_assistente}' para o novo formato: {e}")
+
+    if chunk_store.exists(chunks_base) and os.path.exists(faiss_file):
         try:
-            with open(chunks_file, "r", encoding="utf-8") as f:
-                st.session_state["doc_chunks"] = json.load(f)
-            st.session_state["faiss_index"] = faiss.read_index(faiss_file)
-            if os.path.exists(uploaded_files_info_file):
-                with open(uploaded_files_info_file, "r", encoding="utf-8") as f_info:
+            doc_chunks, faiss_index = carregar_dados_compartilhados(safe_nome_assistente, chunks_base, faiss_file,
+                                                                    arquivos["faiss_meta"])
+            # O chat só lê os dados compartilhados; a edição trabalha numa cópia privada da sessão
+            st.session_state["doc_chunks"] = list(doc_chunks) if editavel else doc_chunks
+            st.session_state["faiss_index"] = private_copy(faiss_index) if editavel else faiss_index
+            if not editavel:
+                try:
+                    st.session_state["indice_lexical"] = carregar_indice_lexical(safe_nome_assistente, chunks_base, doc_chunks)
+                except Exception as e_lexical: # Sem BM25 a busca continua só densa
+                    print(f"Erro ao carregar o índice BM25 de '{nome_assistente}': {e_lexical}")
+            if os.path.exists(arquivos["uploaded_files"]):
+                with open(arquivos["uploaded_files"], "r", encoding="utf-8") as f_info:
                     st.session_state["uploaded_files"] = json.load(f_info) # Carrega lista de nomes
             loaded_something = True
         except Exception as e:
@@ -308,31 +218,30 @@ def carregar_ou_inicializar_dados_assistente(username: str, nome_assistente: str
             st.session_state["doc_chunks"] = []
             st.session_state["faiss_index"] = inicializar_faiss()
             st.session_state["uploaded_files"] = []
-    elif os.path.exists(chunks_file) and not os.path.exists(faiss_file):
+    elif chunk_store.exists(chunks_base) and not os.path.exists(faiss_file):
         st.warning(f"Chunks para '{nome_assistente}' encontrados, mas índice FAISS não. Documentos podem precisar ser reprocessados ou o índice recriado.")
         try:
-            with open(chunks_file, "r", encoding="utf-8") as f:
-                st.session_state["doc_chunks"] = json.load(f)
+            doc_chunks = list(ChunkStore(chunks_base))
+            st.session_state["doc_chunks"] = doc_chunks
             # Tentar recriar o índice FAISS se houver chunks e API key
-            if st.session_state["doc_chunks"] and openai_api_key:
+            if doc_chunks and openai_api_key:
                 st.info(f"Tentando recriar índice FAISS para '{nome_assistente}' a partir dos chunks existentes...")
-                embeddings = gerar_embeddings(st.session_state["doc_chunks"], openai_api_key)
-                if embeddings:
-                    new_index = inicializar_faiss()
-                    for emb in embeddings:
-                        new_index.add(np.expand_dims(emb, axis=0))
+                embeddings = gerar_embeddings_alinhados(doc_chunks, openai_api_key)
+                if embeddings and all(emb is not None for emb in embeddings):
+                    meta = index_factory.load_index_meta(arquivos["faiss_meta"])
+                    vetores = stack_embeddings(embeddings) # Uma matriz contígua; o índice é montado em blocos
+                    new_index = index_factory.build_index(vetores, index_factory.choose_index_type(len(vetores), vetores.shape[1], meta))
+                    new_index, meta = index_factory.upgrade_if_needed(new_index, meta) # Só aplica os parâmetros de busca
                     st.session_state["faiss_index"] = new_index
-                    faiss.write_index(new_index, faiss_file) # Salva o índice recriado
+                    write_index_atomic(new_index, faiss_file) # Salva o índice recriado
+                    index_factory.save_index_meta(meta, arquivos["faiss_meta"])
                     st.success(f"Índice FAISS para '{nome_assistente}' recriado e salvo.")
                 else:
+                    # Um índice parcial ficaria desalinhado com os chunks (vetor i != chunk i)
                     st.error(f"Não foi possível recriar o índice FAISS para '{nome_assistente}'.")
         except Exception as e:
             st.error(f"Erro ao carregar chunks ou tentar recriar FAISS para '{nome_assistente}': {e}")
 
-    # st.session_state["mem0_instance"] = inicializar_mem0(username, nome_assistente, mem0_api_key) # Removido
-    # Lógica de carregamento do Mem0 removida
-    # st.session_state["chat_history_from_mem0"] = [] # Removido
-
     if loaded_something:
         st.success(f"Dados do assistente '{nome_assistente}' carregados.")
     elif nome_assistente and nome_assistente not in ["Nenhum Assistente Salvo", "Nenhum"]:
@@ -0,0 +1,5 @@
+# Os testes importam o código como `src.` a partir da raiz do projeto (como os benchmarks: python -m src...)
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.api import server
+from src.core.token_meter import TokenMeter
+
+
+@pytest.fixture
+def cliente(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "CHAVES_API", server.parse_api_keys("token-ana=ana, token-root=root"))
+    monkeypatch.setattr(server, "ADMINS_API", {"root"})
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(server, "mem0_configured", lambda: False)
+    medidor = TokenMeter(str(tmp_path / "uso.db"), total_padrao=100)
+    monkeypatch.setattr(server, "get_token_meter", lambda: medidor)
+    chamadas = []
+
+    async def arun_graph_falso(mensagem, modo, historico, user_id, agent_id, registrar_uso):
+        chamadas.append((user_id, agent_id))
+        registrar_uso(30, 10, "api")
+        return "ok"
+
+    async def astream_graph_falso(mensagem, modo, historico, user_id, agent_id, registrar_uso):
+        chamadas.append((user_id, agent_id))
+        for pedaco in ("o", "k"):
+            yield pedaco
+        registrar_uso(20, 2, "api")
+
+    monkeypatch.setattr(server, "arun_graph", arun_graph_falso)
+    monkeypatch.setattr(server, "astream_graph", astream_graph_falso)
+    # Sem o lifespan: não carrega índice nem worker do mem0
+    server.app.state.limitador = server.Limitador()
+    server.app.state.cobranca = ThreadPoolExecutor(max_workers=1)
+    cliente = TestClient(server.app)
+    cliente.chamadas = chamadas
+    cliente.medidor = medidor
+    yield cliente
+    server.app.state.cobranca.shutdown(wait=True)
+
+
+def _usados(cliente, usuario):
+    server.app.state.cobranca.submit(lambda: None).result() # Espera a cobrança pendente (worker único, em ordem)
+    return cliente.medidor.balance(usuario).usados
+
+
+def _bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.parametrize("cabecalhos", [{}, _bearer("errado"), {"Authorization": "Basic dG9rZW4tYW5h"}])
+def test_chat_sem_token_valido_recusado(cliente, cabecalhos):
+    resp = cliente.post("/chat", json={"mensagem": "oi"}, headers=cabecalhos)
+    assert resp.status_code == 401
+    assert cliente.chamadas == []
+
+
+def test_user_id_vem_do_token_e_nao_do_corpo(cliente):
+    resp = cliente.post("/chat", json={"mensagem": "oi", "user_id": "bia", "agent_id": "suporte"},
+                        headers=_bearer("token-ana"))
+    assert resp.status_code == 200
+    assert cliente.chamadas == [("ana", "suporte")]
+
+
+def test_upload_exige_admin(cliente):
+    arquivo = {"arquivos": ("nota.txt", b"conteudo", "text/plain")}
+    assert cliente.post("/upload", files=arquivo).status_code == 401
+    assert cliente.post("/upload", files=arquivo, headers=_bearer("token-ana")).status_code == 403
+    assert cliente.get("/upload/status", headers=_bearer("token-ana")).status_code == 403
+
+
+def test_sem_tokens_configurados_recusa_tudo(cliente, monkeypatch):
+    monkeypatch.setattr(server, "CHAVES_API", server.parse_api_keys(""))
+    assert cliente.post("/chat", json={"mensagem": "oi"}, headers=_bearer("token-ana")).status_code == 401
+    assert cliente.post("/search", json={"consulta": "x"}, headers=_bearer("")).status_code == 401
+
+
+def test_parse_api_keys():
+    chaves = server.parse_api_keys(" abc=ana , x=y=bia,semusuario=, ")
+    assert sorted(chaves.values()) == ["ana", "bia"]
+    assert "abc" not in chaves # Só o hash do token fica guardado
+
+
+def test_consumo_do_chat_e_cobrado_do_dono_do_token(cliente):
+    assert cliente.post("/chat", json={"mensagem": "oi"}, headers=_bearer("token-ana")).status_code == 200
+    resp = cliente.post("/chat/stream", json={"mensagem": "oi"}, headers=_bearer("token-ana"))
+    assert resp.status_code == 200 and '"resposta": "ok"' in resp.text
+
+    assert _usados(cliente, "ana") == 40 + 22
+    assert _usados(cliente, "root") == 0
+
+
+@pytest.mark.parametrize("rota", ["/chat", "/chat/stream"])
+def test_cota_esgotada_recusa_com_402(cliente, rota):
+    cliente.medidor.record_usage("ana", 100, 0)
+
+    resp = cliente.post(rota, json={"mensagem": "oi"}, headers=_bearer("token-ana"))
+    assert resp.status_code == 402
+    assert cliente.chamadas == []
+    assert cliente.post(rota, json={"mensagem": "oi"}, headers=_bearer("token-root")).status_code == 200
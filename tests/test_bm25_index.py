@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.core import chat_turn
+from src.core.retrieval import reciprocal_rank_fusion
+from src.data_persistence.chunks import bm25_index
+
+PALAVRAS = ["preço", "produto", "entrega", "garantia", "modelo", "cliente", "pedido", "prazo", "estoque", "frete"]
+
+
+def _corpus(n: int = 60):
+    trechos = [" ".join(PALAVRAS[(i + j) % len(PALAVRAS)] for j in range(12)) for i in range(n)]
+    trechos[7] += " Código do item: AX-4821/B."
+    trechos[23] += " Relatório anual de 2019 com o desempenho das lojas."
+    trechos[41] += " Código do item: AX-5532/C."
+    return trechos
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "assistente_chunks")
+
+
+@pytest.fixture
+def indice(base):
+    bm25_index.rebuild_index(base, _corpus())
+    return bm25_index.LexicalIndex(base)
+
+
+def test_tokenize_mantem_o_codigo_inteiro_e_as_partes():
+    assert bm25_index.tokenize("Preço do ABC-123/4?") == ["preco", "do", "abc-123/4", "abc", "123", "4"]
+    assert bm25_index.tokenize("versão 2.0.1 e v2") == ["versao", "2.0.1", "2", "0", "1", "e", "v2"]
+    assert bm25_index.tokenize("") == []
+
+
+def test_segmentos_incrementais_e_regravacao(base):
+    trechos = _corpus()
+    bm25_index.update_index(base, trechos[:30], 0)
+    bm25_index.update_index(base, trechos, 30) # Acrescenta um segmento só com os novos
+    assert len(os.listdir(bm25_index.index_dir(base))) == 2
+    incremental = bm25_index.LexicalIndex(base)
+    assert incremental.total == 60
+    assert incremental.search("AX-5532/C", k=3).posicoes[0] == 41 # Trecho do segundo segmento
+
+    bm25_index.update_index(base, trechos, 25) # Não bate com o que está em disco: regrava num segmento
+    assert os.listdir(bm25_index.index_dir(base)) == [os.path.basename(bm25_index._segmento_file(base, 0))]
+    regravado = bm25_index.LexicalIndex(base)
+    assert regravado.total == 60
+    consulta = "garantia estoque AX-4821/B"
+    assert regravado.search(consulta, k=5).posicoes == incremental.search(consulta, k=5).posicoes
+
+
+def test_load_or_build_reconstroi_indice_desatualizado(base):
+    trechos = _corpus()
+    bm25_index.rebuild_index(base, trechos[:10])
+    assert bm25_index.load_or_build(base, trechos).total == 60
+
+
+def test_reciprocal_rank_fusion():
+    # "b" está bem colocado nas duas listas e passa na frente de quem lidera só uma
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]]) == ["b", "a", "d", "c"]
+    assert reciprocal_rank_fusion([[], [3, 1]]) == [3, 1]
+
+
+@pytest.mark.parametrize("consulta, posicao", [("AX-4821/B", 7), ("código AX-5532/C", 41), ("ax-4821/b", 7)])
+def test_confiante_quando_a_consulta_e_o_codigo(indice, consulta, posicao):
+    resultado = indice.search(consulta, k=12)
+    assert resultado.posicoes[0] == posicao
+    assert resultado.confiante
+
+
+@pytest.mark.parametrize("consulta", [
+    "Quantos clientes tivemos em 2019?",      # Número incidental numa pergunta em linguagem natural
+    "qual o prazo de entrega do AX-4821/B?",  # O código está lá, mas a pergunta é sobre outras palavras também
+    "AX",                                     # Parte comum a vários códigos: nenhum trecho se destaca
+    "prazo frete",
+])
+def test_nao_confiante(indice, consulta):
+    assert not indice.search(consulta, k=12).confiante
+
+
+def test_busca_densa_roda_sem_confianca(indice, monkeypatch):
+    trechos = _corpus()
+    chamadas = []
+
+    class BatcherFalso:
+        def search(self, faiss_index, vetor, k):
+            return None, np.array([3, 23, 5])
+
+    monkeypatch.setattr(chat_turn, "embed_query", lambda pergunta, client: chamadas.append(pergunta) or [0.0])
+    monkeypatch.setattr(chat_turn, "get_micro_batcher", BatcherFalso)
+
+    codigo = chat_turn.buscar_conhecimento_assistente("AX-4821/B", None, trechos, None, indice_lexical=indice)
+    assert chamadas == [] # Atalho lexical: nem o embedding da pergunta
+    assert codigo[0] == trechos[7]
+
+    pergunta = "Quantos clientes tivemos em 2019?"
+    fundidos = chat_turn.buscar_conhecimento_assistente(pergunta, None, trechos, None, indice_lexical=indice)
+    assert chamadas == [pergunta] # Sem confiança: embedding, busca densa e fusão
+    assert fundidos[0] == trechos[23] and len(fundidos) == 3 and trechos[3] in fundidos
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from src.core.chat_turn import FilaPorSessao
+
+
+def test_tarefas_da_mesma_sessao_rodam_em_ordem():
+    fila = FilaPorSessao(max_workers=4)
+    gravadas = {"s1": [], "s2": []}
+
+    def gravar(sessao, i):
+        time.sleep(0.002 if i % 2 == 0 else 0) # Uma tarefa lenta não pode ser ultrapassada pela seguinte
+        gravadas[sessao].append(i)
+
+    for i in range(20):
+        fila.submit("s1", gravar, "s1", i)
+        fila.submit("s2", gravar, "s2", i)
+    fila.shutdown(wait=True)
+
+    assert gravadas == {"s1": list(range(20)), "s2": list(range(20))}
+
+
+def test_sessoes_diferentes_rodam_em_paralelo():
+    fila = FilaPorSessao(max_workers=2)
+    liberar = threading.Event()
+    fila.submit("lenta", liberar.wait, 5)
+    outra = threading.Event()
+    fila.submit("rapida", outra.set)
+
+    assert outra.wait(1) # Não espera a sessão bloqueada
+    liberar.set()
+    fila.shutdown(wait=True)
+
+
+def test_erro_em_uma_tarefa_nao_trava_a_sessao():
+    fila = FilaPorSessao(max_workers=1)
+    feitas = []
+    fila.submit("s1", lambda: 1 / 0)
+    fila.submit("s1", feitas.append, "depois do erro")
+    fila.shutdown(wait=True)
+
+    assert feitas == ["depois do erro"]
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from src.data_persistence.chunks import chunk_store
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "assistente_chunks")
+
+
+def _ler(base):
+    store = chunk_store.ChunkStore(base)
+    try:
+        return list(store)
+    finally:
+        store.close()
+
+
+def test_acrescenta_quando_o_disco_e_prefixo(base):
+    trechos = [f"trecho {i}" for i in range(10)]
+    assert chunk_store.save_chunks(base, trechos[:6]) == 0
+    tamanho_blob = os.path.getsize(chunk_store.data_file(base))
+
+    assert chunk_store.save_chunks(base, trechos) == 6
+    assert os.path.getsize(chunk_store.data_file(base)) > tamanho_blob
+    assert _ler(base) == trechos
+
+
+@pytest.mark.parametrize("sem_soma", [False, True])
+def test_edicao_no_meio_regrava(base, sem_soma):
+    trechos = [f"trecho {i}" for i in range(10)]
+    chunk_store.save_chunks(base, trechos[:6])
+    if sem_soma: # Armazenamento gravado antes do <base>.sum existir
+        os.remove(chunk_store.checksum_file(base))
+    editados = trechos[:2] + ["trecho alterado"] + trechos[3:] # Último trecho salvo (5) continua igual
+
+    assert chunk_store.save_chunks(base, editados) == 0
+    assert _ler(base) == editados
+
+
+def test_append_avulso_nao_engana_a_soma(base):
+    chunk_store.save_chunks(base, ["a", "b"])
+    chunk_store.append_chunks(base, ["x"]) # Soma fica desatualizada: a conferência cai para trecho a trecho
+
+    assert chunk_store.save_chunks(base, ["a", "b", "c", "d"]) == 0
+    assert _ler(base) == ["a", "b", "c", "d"]
+    assert chunk_store.save_chunks(base, ["a", "b", "c", "d", "e"]) == 4
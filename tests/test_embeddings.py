@@ -0,0 +1,102 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from openai import OpenAI
+
+from src.core import embeddings
+from src.core.embeddings import build_batches, embed_texts
+from src.devtools.fake_openai import fake_embedding, start_fake_openai
+
+DIM = 8
+
+
+@pytest.fixture
+def servidor():
+    servidores = []
+
+    def iniciar(**kwargs):
+        server, _ = start_fake_openai(dim=DIM, semente=0, **kwargs)
+        servidores.append(server)
+        return server, OpenAI(api_key="fake", base_url=server.base_url, max_retries=0) # Só o retry do pipeline
+    yield iniciar
+    for server in servidores:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def esperas(monkeypatch):
+    feitas, lock = [], threading.Lock()
+
+    def dormir(segundos):
+        with lock:
+            feitas.append(segundos)
+    monkeypatch.setattr(embeddings, "time", SimpleNamespace(sleep=dormir)) # Backoff sem esperar de verdade
+    return feitas
+
+
+def _confere(textos, resultado):
+    assert len(resultado) == len(textos)
+    for texto, vetor in zip(textos, resultado):
+        np.testing.assert_allclose(vetor, fake_embedding(texto, DIM), rtol=1e-6)
+
+
+def test_build_batches_respeita_orcamento_e_pula_vazios():
+    textos = ["a" * 40, "", "b" * 40, "   ", "c" * 40, "d" * 400, "e"]
+    assert build_batches(textos, max_tokens=25, max_itens=10) == [[0, 2], [4], [5], [6]]
+    assert build_batches(textos, max_tokens=1000, max_itens=2) == [[0, 2], [4, 5], [6]]
+    assert build_batches(["", " "]) == []
+
+
+def test_ordem_alinhada_com_lotes_concorrentes(servidor):
+    server, client = servidor(latencia_s="uniforme:0,0.03") # Lotes terminam fora de ordem
+    textos = [f"trecho {i % 50}" for i in range(60)] + ["", "  "]
+
+    resultado = embed_texts(textos, client, max_itens_por_lote=4, max_workers=4, usar_cache=False)
+
+    _confere(textos[:60], resultado[:60])
+    assert resultado[60:] == [None, None] # Textos vazios não vão à API
+    assert server.requisicoes == 13 # 50 textos distintos em lotes de 4: os repetidos não são reenviados
+
+
+def test_retry_com_backoff_em_429_e_500(servidor, esperas):
+    server, client = servidor(taxa_erro_429=0.3, taxa_erro_500=0.2)
+    textos = [f"trecho {i}" for i in range(40)]
+
+    resultado = embed_texts(textos, client, max_itens_por_lote=4, max_workers=4, max_tentativas=30, usar_cache=False)
+
+    _confere(textos, resultado)
+    assert server.erros_injetados > 0
+    assert len(esperas) == server.erros_injetados # Uma espera antes de cada nova tentativa
+
+
+def test_backoff_exponencial_ate_desistir(servidor, esperas):
+    server, client = servidor(taxa_erro_429=1.0)
+    falhas = []
+
+    resultado = embed_texts(["a", "b"], client, max_tentativas=4, usar_cache=False,
+                            on_error=lambda indices, e: falhas.append((indices, type(e).__name__)))
+
+    assert resultado == [None, None]
+    assert falhas == [([0, 1], "RateLimitError")]
+    assert server.requisicoes == 4
+    for espera, base in zip(esperas, (0.5, 1.0, 2.0)): # Base dobra a cada tentativa, mais um jitter de até 100%
+        assert base <= espera < 2 * base
+    assert len(esperas) == 3
+
+
+def test_lote_com_falha_definitiva_vira_none(servidor, esperas):
+    server, client = servidor(textos_com_erro={"trecho 7"})
+    textos = [f"trecho {i}" for i in range(12)] + ["trecho 5"] # Repetido de um texto do lote que falha
+    falhas = []
+
+    resultado = embed_texts(textos, client, max_itens_por_lote=4, max_workers=3, max_tentativas=3, usar_cache=False,
+                            on_error=lambda indices, e: falhas.append(sorted(indices)))
+
+    assert [i for i, vetor in enumerate(resultado) if vetor is None] == [4, 5, 6, 7, 12]
+    assert falhas == [[4, 5, 6, 7, 12]]
+    _confere([t for i, t in enumerate(textos) if i not in (4, 5, 6, 7, 12)],
+             [v for i, v in enumerate(resultado) if i not in (4, 5, 6, 7, 12)])
+    assert server.erros_injetados == 3 # As tentativas do lote que falha; os outros passam de primeira
@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+from src.core import extraction, ingestion
+from src.data_persistence.cache import extraction_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_temporario(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction_cache, "_cache", extraction_cache.ExtractionCache(str(tmp_path / "extracao.db")))
+    yield
+    extraction.shutdown_pool()
+
+
+def _quebrar_pool() -> ProcessPoolExecutor:
+    pool = extraction._get_pool()
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result() # Simula um processo do docling morto pelo sistema
+    return pool
+
+
+def test_pool_quebrado_e_trocado_no_proximo_envio():
+    quebrado = _quebrar_pool()
+
+    with pytest.raises(extraction.ExtractionError, match="docling"):
+        # Sem docling instalado o processo novo devolve um ExtractionError: a extração chegou a rodar
+        extraction.extract_text("manual.pdf", b"%PDF-1.4")
+    assert extraction._pool is not None and extraction._pool is not quebrado
+
+
+def test_falha_ao_agendar_afeta_so_o_arquivo(monkeypatch):
+    def agendar(nome, dados):
+        if nome == "quebrado.pdf":
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        return extraction.submit_extraction(nome, dados)
+
+    monkeypatch.setattr(ingestion, "submit_extraction", agendar)
+    monkeypatch.setattr(ingestion, "embed_stream", lambda trechos, client, **kwargs: ((t, None) for t in trechos))
+    monkeypatch.setattr(ingestion, "get_openai_client", lambda chave: None)
+
+    job = ingestion.run_ingestion([("quebrado.pdf", b"%PDF"), ("notas.txt", "Texto de teste.".encode())], "sk-teste")
+
+    assert job.arquivos_extraidos == 2
+    assert "notas.txt" in job.nomes_processados
+    assert any("quebrado.pdf" in aviso[1] for aviso in job.avisos)
+
+
+def test_embeddings_comecam_antes_de_dividir_os_proximos_arquivos(monkeypatch):
+    from src.core import embeddings
+    alcancados = []
+
+    def embed_texts(bloco, client, **kwargs):
+        alcancados.append((job.arquivos_extraidos, job.trechos_total)) # Onde a divisão estava quando o lote saiu
+        return [np.ones(4, dtype=np.float32) for _ in bloco]
+
+    monkeypatch.setattr(embeddings, "embed_texts", embed_texts)
+    monkeypatch.setattr(ingestion, "embed_stream", lambda trechos, client, **kwargs: embeddings.embed_stream(trechos, client, janela=2, **kwargs))
+    monkeypatch.setattr(ingestion, "get_openai_client", lambda chave: None)
+
+    paragrafos = "\n\n".join(f"Parágrafo {i}: " + "texto de teste " * 120 for i in range(6))
+    arquivos = [(f"doc{i}.txt", paragrafos.encode()) for i in range(3)] + [("vazio.txt", b"")]
+    job = ingestion.IngestionJob(id="teste", arquivos=[nome for nome, _ in arquivos])
+    ingestion.run_ingestion(arquivos, "sk-teste", job)
+
+    assert alcancados[0] == (1, 2) # O primeiro lote sai com só dois trechos do primeiro arquivo divididos
+    assert [total for _, total in alcancados] == sorted(total for _, total in alcancados)
+    assert job.trechos_total == job.trechos_processados == len(job.trechos) > 6 and job.progresso == 1.0
+    assert job.nomes_processados == ["doc0.txt", "doc1.txt", "doc2.txt"]
+    assert any("vazio.txt" in aviso[1] for aviso in job.avisos)
@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.core.langgraph import graph_builder
+
+
+def _chunk(delta=None, usage=None):
+    escolhas = [SimpleNamespace(delta=SimpleNamespace(content=delta))] if delta is not None else []
+    return SimpleNamespace(choices=escolhas, usage=usage)
+
+
+class ClienteAsyncFalso:
+    """AsyncOpenAI mínimo: stream com os pedaços dados e, se pedido, o chunk final de usage."""
+
+    def __init__(self, pedacos, usage=None, falhar_depois=None):
+        self.pedacos, self.usage, self.falhar_depois = pedacos, usage, falhar_depois
+        self.parametros = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **parametros):
+        self.parametros = parametros
+
+        async def stream():
+            for i, pedaco in enumerate(self.pedacos):
+                if i == self.falhar_depois:
+                    raise ConnectionError("conexão caiu")
+                yield _chunk(pedaco)
+            if (parametros.get("stream_options") or {}).get("include_usage"):
+                yield _chunk(usage=self.usage)
+        return stream()
+
+
+@pytest.fixture
+def gerar(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(graph_builder, "get_stream_writer", lambda: lambda evento: None)
+
+    def gerar(cliente, usos):
+        monkeypatch.setattr(graph_builder, "get_async_openai_client", lambda chave: cliente)
+        estado = {"user_input": "Qual o prazo?", "memory_context": "", "knowledge_context": "",
+                  "registrar_uso": lambda *uso: usos.append(uso)}
+        return asyncio.run(graph_builder.agenerate_response(estado))
+    return gerar
+
+
+def test_stream_pede_e_repassa_o_usage_da_api(gerar):
+    cliente = ClienteAsyncFalso(["Cinco ", "dias."], usage=SimpleNamespace(prompt_tokens=42, completion_tokens=3))
+    usos = []
+
+    assert gerar(cliente, usos)["response"] == "Cinco dias."
+    assert cliente.parametros["stream_options"] == {"include_usage": True}
+    assert usos == [(42, 3, "api")]
+
+
+def test_stream_interrompido_e_contado_pelo_tokenizer(gerar):
+    usos = []
+    with pytest.raises(ConnectionError):
+        gerar(ClienteAsyncFalso(["Cinco ", "dias ", "úteis."], falhar_depois=2), usos)
+
+    # O nó registra no finally: o prompt inteiro e os dois pedaços já gerados, pelo tokenizer
+    (prompt_tokens, completion_tokens, fonte), = usos
+    assert fonte == "tokenizer" and prompt_tokens > 0 and completion_tokens > 0
+
+
+def test_falha_antes_de_gerar_nao_cobra(gerar):
+    usos = []
+    with pytest.raises(ConnectionError):
+        gerar(ClienteAsyncFalso(["nada"], falhar_depois=0), usos)
+    assert usos == []
+
+
+def test_sem_registrar_uso_nada_e_chamado(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(graph_builder, "get_stream_writer", lambda: lambda evento: None)
+    monkeypatch.setattr(graph_builder, "get_async_openai_client", lambda chave: ClienteAsyncFalso(["ok"]))
+    estado = {"user_input": "oi", "memory_context": "", "knowledge_context": ""}
+    assert asyncio.run(graph_builder.agenerate_response(estado)) == {"response": "ok"}
@@ -0,0 +1,164 @@
+import sqlite3
+import time
+
+import pytest
+
+from src.core.memory_writer import MemoryWriteBehind
+
+
+class ClienteFalso:
+    """MemoryClient local: registra cada `add` e falha nas próximas `falhas` chamadas."""
+
+    def __init__(self, falhas: int = 0):
+        self.falhas = falhas
+        self.chamadas = []
+
+    def add(self, **params):
+        if self.falhas:
+            self.falhas -= 1
+            raise ConnectionError("mem0 fora do ar")
+        self.chamadas.append(params)
+
+
+def _mensagens(i: int):
+    return [{"role": "user", "content": f"pergunta {i}"}, {"role": "assistant", "content": f"resposta {i}"}]
+
+
+def _linhas(writer: MemoryWriteBehind):
+    with sqlite3.connect(writer.spool_file) as conn:
+        return conn.execute("SELECT id, status, attempts, next_attempt_at FROM mem0_spool ORDER BY id").fetchall()
+
+
+def _vencer_todos(writer: MemoryWriteBehind):
+    """Pula o backoff: todos os itens ficam prontos para a próxima tentativa."""
+    writer._conn().execute("UPDATE mem0_spool SET next_attempt_at = 0")
+
+
+@pytest.fixture
+def criar_writer(tmp_path):
+    def criar(cliente, **kwargs):
+        return MemoryWriteBehind(lambda: cliente, spool_file=str(tmp_path / "spool.db"), **kwargs)
+    return criar
+
+
+def test_agrupa_por_usuario_e_agente(criar_writer):
+    cliente = ClienteFalso()
+    writer = criar_writer(cliente, max_itens_por_envio=2)
+    for i in range(3):
+        writer.enqueue(_mensagens(i), user_id="ana", agent_id="suporte")
+    writer.enqueue(_mensagens(9), user_id="bia")
+
+    while writer.flush_once():
+        pass
+
+    assert [(c["user_id"], c.get("agent_id"), len(c["messages"])) for c in cliente.chamadas] == [
+        ("ana", "suporte", 4), ("ana", "suporte", 2), ("bia", None, 2)]
+    assert [m["content"] for m in cliente.chamadas[0]["messages"]] == [
+        "pergunta 0", "resposta 0", "pergunta 1", "resposta 1"]
+    assert _linhas(writer) == []
+    assert writer.metrics()["enviados"] == 4
+
+
+def test_falha_repete_com_backoff(criar_writer):
+    cliente = ClienteFalso(falhas=2)
+    writer = criar_writer(cliente)
+    writer.enqueue(_mensagens(0), user_id="ana")
+
+    antes = time.time()
+    assert writer.flush_once()
+    (_, status, tentativas, proxima), = _linhas(writer)
+    assert (status, tentativas) == ("pending", 1)
+    assert proxima >= antes + 2
+    assert not writer.flush_once() # Ainda no backoff
+
+    _vencer_todos(writer)
+    writer.flush_once()
+    (_, status, tentativas, proxima), = _linhas(writer)
+    assert (status, tentativas) == ("pending", 2)
+    assert proxima >= antes + 4
+
+    _vencer_todos(writer)
+    writer.flush_once()
+    assert _linhas(writer) == []
+    assert len(cliente.chamadas) == 1
+
+
+def test_tentativas_contadas_por_item(criar_writer):
+    cliente = ClienteFalso(falhas=10)
+    writer = criar_writer(cliente, max_tentativas=3)
+    writer.enqueue(_mensagens(0), user_id="ana")
+    writer.flush_once()
+    _vencer_todos(writer)
+    writer.flush_once()
+    _vencer_todos(writer)
+    writer.enqueue(_mensagens(1), user_id="ana") # Entra no mesmo grupo do item que já falhou duas vezes
+
+    writer.flush_once()
+
+    antigo, novo = _linhas(writer)
+    assert antigo[1:3] == ("dead", 3)
+    assert novo[1:3] == ("pending", 1)
+    assert novo[3] < antigo[3] # Backoff do item novo é o da primeira falha
+
+
+def test_fila_morta_depois_do_maximo_de_tentativas(criar_writer):
+    writer = criar_writer(ClienteFalso(falhas=10), max_tentativas=2)
+    writer.enqueue(_mensagens(0), user_id="ana")
+    writer.flush_once()
+    _vencer_todos(writer)
+    writer.flush_once()
+    _vencer_todos(writer)
+
+    assert not writer.flush_once() # Itens mortos não são mais reservados
+    metricas = writer.metrics()
+    assert (metricas["pendentes"], metricas["mortos"], metricas["falhas"]) == (0, 1, 2)
+
+
+def test_listeners_avisados_so_depois_do_envio_confirmado(criar_writer):
+    cliente = ClienteFalso(falhas=1)
+    writer = criar_writer(cliente)
+    avisos = []
+    writer.add_listener(lambda user_id, agent_id: avisos.append((user_id, agent_id)))
+    writer.add_listener(lambda user_id, agent_id: 1 / 0) # Um listener com erro não impede os outros
+    writer.enqueue(_mensagens(0), user_id="ana", agent_id="suporte")
+
+    writer.flush_once()
+    assert avisos == []
+    _vencer_todos(writer)
+    writer.flush_once()
+    assert avisos == [("ana", "suporte")]
+
+
+def test_sem_cliente_o_worker_para_sem_gastar_tentativas(criar_writer):
+    writer = criar_writer(None)
+    writer.enqueue(_mensagens(0), user_id="ana")
+
+    assert not writer.flush_once()
+    assert writer.parado
+    (_, status, tentativas, _), = _linhas(writer)
+    assert (status, tentativas) == ("pending", 0)
+    assert writer.metrics()["falhas"] == 0
+
+
+def test_turno_sem_mem0_configurado_nao_enfileira(monkeypatch):
+    from src.core import chat_turn
+
+    class StoreFalso:
+        def add_message(self, session_id, role, content):
+            return True
+
+    class WriterFalso:
+        def enqueue(self, messages, user_id, agent_id=None):
+            enfileirados.append((user_id, agent_id))
+
+    enfileirados = []
+    monkeypatch.delenv("MEM0_API_KEY", raising=False)
+    monkeypatch.setattr(chat_turn, "get_session_store", StoreFalso)
+    monkeypatch.setattr(chat_turn, "get_memory_writer", WriterFalso)
+
+    chat_turn.persistir_turno_chat("s1", "pergunta", "resposta", "ana", "suporte")
+    assert enfileirados == []
+
+    monkeypatch.setenv("MEM0_API_KEY", "chave")
+    chat_turn.persistir_turno_chat("s1", "pergunta", "resposta", "ana", "suporte")
+    assert enfileirados == [("ana", "suporte")]
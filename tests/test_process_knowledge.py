@@ -0,0 +1,99 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from src.core import process_knowledge
+from src.core.process_knowledge import remove_chunk_ids
+from src.data_persistence.faiss import faiss_retriever, index_factory
+
+N, DIM = 5000, 32
+
+
+@pytest.fixture(scope="module")
+def vetores():
+    return np.random.default_rng(0).standard_normal((N, DIM)).astype("float32")
+
+
+@pytest.mark.parametrize("descricao", ["Flat", "IVF16,Flat", "HNSW32,Flat"])
+def test_ids_continuam_certos_depois_da_remocao(vetores, descricao):
+    index = index_factory.build_index(vetores, descricao, ids=np.arange(N))
+    index_factory.set_search_params(index, nprobe=16, ef_search=256) # nprobe = nlist: o IVF fica exato
+
+    index = remove_chunk_ids(index, range(100))
+
+    assert index.ntotal == N - 100
+    assert faiss.vector_to_array(index.id_map).tolist() == list(range(100, N))
+    _, ids = index.search(vetores[100:600], 1)
+    acertos = np.mean(ids[:, 0] == np.arange(100, 600))
+    assert acertos >= (0.98 if descricao.startswith("HNSW") else 1.0)
+    _, ids_removidos = index.search(vetores[:100], 1)
+    assert not np.isin(ids_removidos, np.arange(100)).any()
+
+
+@pytest.mark.parametrize("descricao", ["Flat", "IVF16,Flat"])
+def test_vetores_alinhados_ao_id_map_depois_da_remocao(vetores, descricao):
+    index = index_factory.build_index(vetores, descricao, ids=np.arange(N))
+    index = remove_chunk_ids(index, [0, 7, 4999, *range(2000, 2100)])
+
+    ids = faiss.vector_to_array(index.id_map)
+    np.testing.assert_allclose(index_factory.all_vectors(index), vetores[ids], rtol=1e-5, atol=1e-5)
+
+
+def test_migracao_depois_de_remover_no_ivf(vetores):
+    index = index_factory.build_index(vetores, "IVF16,Flat", ids=np.arange(N))
+    index = remove_chunk_ids(index, range(50))
+
+    migrado, meta = index_factory.upgrade_if_needed(index, {"limiar_ivf": 10, "limiar_compressao": 10})
+
+    assert meta["tipo_indice"].endswith("SQ8")
+    assert faiss.vector_to_array(migrado.id_map).tolist() == list(range(50, N))
+
+
+def _versao_da_base(vetores, n, descricao, nprobe):
+    index = index_factory.build_index(vetores[:n], descricao, ids=np.arange(n))
+    metadados = {str(i): {"fonte": "base.txt", "texto": f"trecho {i}"} for i in range(n)}
+    return index, {"versao": 1, "arquivos": {}}, metadados, {"tipo_indice": descricao, "nprobe": nprobe}
+
+
+def test_retriever_so_ve_versoes_completas(vetores, tmp_path):
+    index_dir = str(tmp_path)
+    process_knowledge.publish(*_versao_da_base(vetores, 1000, "Flat", 1), index_dir=index_dir)
+    retriever = faiss_retriever.KnowledgeRetriever(index_dir)
+    assert retriever.snapshot().index.ntotal == 1000
+
+    # Publicação interrompida antes do ponteiro: a pasta nova existe, mas ninguém a lê
+    pasta = os.path.dirname(faiss_retriever.published_file(process_knowledge.INDEX_FILE, "incompleta", index_dir))
+    os.makedirs(pasta)
+    faiss.write_index(index_factory.build_index(vetores, "Flat", ids=np.arange(N)), os.path.join(pasta, "knowledge.index"))
+    retriever.reload()
+    assert retriever.snapshot().index.ntotal == 1000
+
+    process_knowledge.publish(*_versao_da_base(vetores, N, "IVF16,Flat", 16), index_dir=index_dir)
+    retriever.reload()
+    retrato = retriever.snapshot()
+    assert retrato.index.ntotal == N
+    assert faiss.try_extract_index_ivf(retrato.index).nprobe == 16 # Meta da mesma versão do índice
+    acerto, = retriever.search(vetores[4321], k=1)
+    assert (acerto.id, acerto.texto) == (4321, "trecho 4321") # Id novo com o texto da mesma versão
+    # Fica a versão publicada e a anterior; a pasta incompleta é limpa
+    assert len(os.listdir(os.path.join(index_dir, faiss_retriever.PASTA_VERSOES))) == 2
+
+
+def test_publicar_migra_do_formato_sem_versoes(vetores, tmp_path):
+    index_dir = str(tmp_path)
+    index, _, metadados, meta = _versao_da_base(vetores, 100, "Flat", 1)
+    soltos = {p: faiss_retriever.published_file(p, None, index_dir)
+              for p in (process_knowledge.INDEX_FILE, faiss_retriever.METADATA_FILE, faiss_retriever.META_FILE)}
+    faiss.write_index(index, soltos[process_knowledge.INDEX_FILE])
+    process_knowledge._write_json_atomic(metadados, soltos[faiss_retriever.METADATA_FILE])
+    index_factory.save_index_meta(meta, soltos[faiss_retriever.META_FILE])
+    retriever = faiss_retriever.KnowledgeRetriever(index_dir)
+    assert retriever.snapshot().index.ntotal == 100
+
+    versao = process_knowledge.publish(*_versao_da_base(vetores, 200, "Flat", 1), index_dir=index_dir)
+    assert faiss_retriever.published_version(index_dir) == versao
+    assert not any(os.path.exists(p) for p in soltos.values())
+    retriever.reload()
+    assert retriever.snapshot().index.ntotal == 200
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from src.data_persistence.cache import response_cache
+from src.data_persistence.cache.response_cache import ResponseCache
+
+DIM = 8
+
+
+def _vetor(i: int) -> np.ndarray:
+    return np.eye(DIM, dtype=np.float32)[i] # Vetores ortogonais: cosseno 0 entre perguntas diferentes
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    agora = [1_000_000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: agora[0])
+    return agora
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / "responses.db")
+
+
+@pytest.fixture
+def cache(db_file, relogio):
+    return ResponseCache(db_file, limiar=0.97, ttl_s=3600, max_por_particao=3)
+
+
+def test_acerto_acima_do_limiar_e_falta_abaixo(cache):
+    cache.store("loja", "ana", "v1", "Qual o prazo?", _vetor(0), "Cinco dias.")
+
+    parecida = _vetor(0) + 0.1 * _vetor(1) # cosseno ~0.995
+    acerto = cache.lookup("loja", "ana", "v1", parecida * 3) # A escala não importa: os vetores são normalizados
+    assert acerto.resposta == "Cinco dias." and acerto.similaridade == pytest.approx(0.995, abs=1e-3)
+
+    assert cache.lookup("loja", "ana", "v1", _vetor(0) + 0.5 * _vetor(1)) is None # cosseno ~0.89
+    assert cache.lookup("loja", "ana", "v1", _vetor(2)) is None
+    assert (cache.hits["loja"], cache.misses["loja"]) == (1, 2)
+    assert cache.hit_rate("loja") == pytest.approx(1 / 3)
+
+
+def test_versao_e_usuario_fazem_parte_da_chave(cache):
+    cache.store("loja", "ana", "v1", "Qual o prazo?", _vetor(0), "Cinco dias.")
+
+    assert cache.lookup("loja", "ana", "v2", _vetor(0)) is None # Assistente salvo de novo: versão nova
+    assert cache.lookup("loja", "bia", "v1", _vetor(0)) is None
+    assert cache.lookup("outra", "ana", "v1", _vetor(0)) is None
+    assert cache.lookup("loja", "ana", "v1", _vetor(0)) is not None
+
+
+def test_entrada_vencida_nao_responde(cache, db_file, relogio):
+    cache.store("loja", "ana", "v1", "Qual o prazo?", _vetor(0), "Cinco dias.")
+    relogio[0] += 3601
+
+    assert cache.lookup("loja", "ana", "v1", _vetor(0)) is None # Já estava no índice em memória
+    assert ResponseCache(db_file, ttl_s=3600).lookup("loja", "ana", "v1", _vetor(0)) is None # Nem é carregada do disco
+
+
+def test_purge_expired_remove_do_disco(cache, relogio):
+    cache.store("loja", "ana", "v1", "antiga", _vetor(0), "a")
+    relogio[0] += 3000
+    cache.store("loja", "ana", "v1", "nova", _vetor(1), "b")
+    relogio[0] += 1000
+
+    assert cache.purge_expired() == 1
+    assert cache.lookup("loja", "ana", "v1", _vetor(1)).resposta == "b"
+
+
+def test_despeja_a_menos_acessada(cache, db_file, relogio):
+    for i in range(3):
+        cache.store("loja", "ana", "v1", f"pergunta {i}", _vetor(i), f"resposta {i}")
+        relogio[0] += 1
+    assert cache.lookup("loja", "ana", "v1", _vetor(0)) is not None # A mais antiga volta a ser a mais recente
+    relogio[0] += 1
+
+    cache.store("loja", "ana", "v1", "pergunta 3", _vetor(3), "resposta 3") # Passa do limite de 3: sai a 1
+
+    recarregado = ResponseCache(db_file, ttl_s=3600)
+    for leitor in (cache, recarregado): # Memória e disco concordam
+        assert leitor.lookup("loja", "ana", "v1", _vetor(1)) is None
+        assert [leitor.lookup("loja", "ana", "v1", _vetor(i)).resposta for i in (0, 2, 3)] == \
+            ["resposta 0", "resposta 2", "resposta 3"]
+
+
+def test_invalidate_descarta_so_o_assistente(cache):
+    cache.store("loja", "ana", "v1", "Qual o prazo?", _vetor(0), "Cinco dias.")
+    cache.store("outra", "ana", "v1", "Qual o prazo?", _vetor(0), "Dez dias.")
+
+    cache.invalidate("loja")
+
+    assert cache.lookup("loja", "ana", "v1", _vetor(0)) is None
+    assert cache.lookup("outra", "ana", "v1", _vetor(0)).resposta == "Dez dias."
+    cache.store("loja", "ana", "v1", "Qual o prazo?", _vetor(0), "Sete dias.") # Resposta nova depois de salvar
+    assert cache.lookup("loja", "ana", "v1", _vetor(0)).resposta == "Sete dias."
@@ -0,0 +1,71 @@
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.core import token_meter
+from src.core.token_meter import TokenMeter, usage_or_estimate
+
+THREADS, CHAMADAS = 8, 100
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / "token_usage.db")
+
+
+def _em_paralelo(medidores):
+    comecar = threading.Barrier(len(medidores))
+
+    def gastar(meter):
+        comecar.wait() # Todos os escritores disputam o banco ao mesmo tempo
+        for _ in range(CHAMADAS):
+            meter.record_usage("ana", 2, 1, origem="teste")
+
+    threads = [threading.Thread(target=gastar, args=(meter,)) for meter in medidores]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+@pytest.mark.parametrize("instancias", [1, THREADS], ids=["mesma_instancia", "uma_instancia_por_thread"])
+def test_incrementos_simultaneos_nao_se_perdem(db_file, instancias):
+    medidores = [TokenMeter(db_file) for _ in range(instancias)]
+    _em_paralelo([medidores[i % instancias] for i in range(THREADS)])
+
+    assert TokenMeter(db_file).balance("ana").usados == THREADS * CHAMADAS * 3
+    with sqlite3.connect(db_file) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM token_events WHERE user_id = 'ana'").fetchone()[0] == THREADS * CHAMADAS
+
+
+def test_cota_esgota_e_volta_com_add_quota(db_file):
+    meter = TokenMeter(db_file, total_padrao=10)
+    assert meter.has_quota("bia")
+    assert meter.record_usage("bia", 8, 2).esgotado
+    assert not meter.has_quota("bia")
+    assert meter.add_quota("bia", 5).restante == 5
+    assert meter.has_quota("bia")
+
+
+def test_saldo_de_outra_instancia_so_e_relido_depois_do_intervalo(db_file):
+    leitor = TokenMeter(db_file, total_padrao=10, revalidar_apos_s=60)
+    assert leitor.has_quota("caio")
+    TokenMeter(db_file, total_padrao=10).record_usage("caio", 10, 0)
+    assert leitor.has_quota("caio") # Saldo em memória ainda válido
+    leitor.revalidar_apos_s = 0
+    assert not leitor.has_quota("caio")
+
+
+def test_usage_da_api_tem_preferencia():
+    mensagens = [{"role": "user", "content": "Qual o prazo de entrega?"}]
+    usage = SimpleNamespace(prompt_tokens=120, completion_tokens=None)
+    assert usage_or_estimate(usage, mensagens, "Cinco dias úteis.", "gpt-4o-mini") == (120, 0, "api")
+
+
+@pytest.mark.parametrize("usage", [None, SimpleNamespace(prompt_tokens=None, completion_tokens=None)])
+def test_sem_usage_conta_pelo_tokenizer(usage, monkeypatch):
+    monkeypatch.setattr(token_meter, "count_message_tokens", lambda mensagens, model: 17)
+    monkeypatch.setattr(token_meter, "count_tokens", lambda texto, model: len(texto.split()))
+    assert usage_or_estimate(usage, [], "Cinco dias úteis.", "gpt-4o-mini") == (17, 3, "tokenizer")